@@ -9,6 +9,7 @@ Config --- Amber
 -------------------------------------------------------------------------------------
 '''
 import os
+import tempfile
 from time import strftime, localtime
 import re
 
@@ -51,6 +52,51 @@ class Config:
     # place to hold all submitted job id in current run
     # 
     JOB_ID_LOG_PATH = '' # default (job_obj.sub_dir/submitted_job_ids.log)
+    # -----------------------------
+    # persistent registry of all submitted jobs for reattaching after the driver restarts (core/job_registry.py)
+    # '' to disable
+    # The SQLite file must be on a node-local disk or be written by a single driver process at a time:
+    # file locks are unreliable on network file systems (NFS/Lustre). Point it to a local path (e.g.: /tmp/...)
+    # if ~ is on a shared file system and several drivers run on different nodes.
+    JOB_REGISTRY_PATH = '~/.cache/EnzyHTP/job_registry.db'
+    # -----------------------------
+    # token buckets of scheduler commands (sbatch/squeue/sacct...) shared by all EnzyHTP processes of the user (core/rate_limiter.py)
+    # '' to disable. (the file should be on a file system that support flock)
+    # 
+    SCHEDULER_RATE_LIMIT_PATH = '~/.cache/EnzyHTP/scheduler_rate_limit.json'
+    SCHEDULER_RATE_LIMIT = {'submit': (0.5, 5), 'query': (1.0, 10)} # kind: (commands per second, burst)
+    SCHEDULER_MAX_WAIT = {'submit': 43200, 'query': 86400} # give up retrying a failed command after this (s)
+    SCHEDULER_MAX_MISSING_POLLS = 10 # a job not found in the queue or the accounting for more polls is ('exception', 'UNKNOWN')
+    # -----------------------------
+    # trace file of the profiling layer (core/profiler.py): time, CPU, memory and I/O of PDB methods,
+    # external programs, scheduler commands and queue/run time of cluster jobs. '' to disable.
+    # (Chrome trace format. view in https://ui.perfetto.dev or summarize with `python -m core.profiler trace.json`)
+    PROFILE_TRACE_PATH = ''
+    # -----------------------------
+    # logging (core/log.py)
+    # LOG_LEVEL: None to follow debug (0: ERROR 1: INFO 2: DEBUG) or a level name (e.g.: 'WARNING')
+    # LOG_FORMAT: 'text' or 'json' (one JSON object per line for aggregation)
+    # LOG_FILE: also log to this file. '' for stderr only. (call core.log.setup_logging() after changing it)
+    # MUTANT_LOG_NAME: log file in the work dir of a mutant (core.log.mutant_log)
+    # the same warning is logged at most LOG_REPEAT_LIMIT times in LOG_REPEAT_WINDOW s
+    LOG_LEVEL = None
+    LOG_FORMAT = 'text'
+    LOG_FILE = ''
+    MUTANT_LOG_NAME = 'enzyhtp.log'
+    LOG_REPEAT_LIMIT = 5
+    LOG_REPEAT_WINDOW = 60
+    # -----------------------------
+    # file that memorize net charges of ligands (shared by all mutants and runs). '' for memory only (default)
+    # (e.g.: '~/.cache/EnzyHTP/ligand_net_charge.json')
+    LIGAND_CHARGE_CACHE_PATH = ''
+    # -----------------------------
+    # where per-call scratch dirs of external tools are made (wrapper.ScratchDir). '' for the system temp dir
+    # 
+    SCRATCH_DIR = ''
+    # -----------------------------
+    # python that runs the in-job task runner of job bundles on compute nodes (job_manager.ClusterJobBundle)
+    # 
+    BUNDLE_PY_EXE = 'python3'
 
     
     # >>>>>> Software <<<<<<
@@ -291,6 +337,12 @@ class Config:
             #
             MMPBSA_EXE = None
 
+            # -----------------------------
+            # Directory caching dry/radii-updated prmtops for MMPBSA (keyed by the source prmtop, ligand mask and radii).
+            # None for {PDB.dir}/cache/mmpbsa_prmtop/
+            #
+            PRMTOP_CACHE_DIR = None
+
             # -----------------------------
             # Default computational resources for amber mmpbsa job for job submission on a cluster
             # 
@@ -345,25 +397,27 @@ class Config:
             }
 
             @classmethod
-            def build_MMPBSA_in(cls, out_path='', use_sander=1):
+            def build_MMPBSA_in(cls, out_path='', use_sander=1, conf_in=None):
                 '''
-                build MMPBSA.in in out_path
+                build MMPBSA.in in out_path (default: a unique ./tmp/MMPBSA_*.in)
+                conf_in: use this dict instead of cls.conf_in (e.g.: a chunk of the frame range)
                 '''
+                if conf_in == None:
+                    conf_in = cls.conf_in
                 if out_path == '':
-                    if os.path.exists('./tmp'):
-                        pass
-                    else:
-                        os.makedirs('./tmp')
-                    out_path = './tmp/MMPBSA.in'
+                    # unique for each call
+                    os.makedirs('./tmp', exist_ok=True)
+                    fd, out_path = tempfile.mkstemp(prefix='MMPBSA_', suffix='.in', dir='./tmp')
+                    os.close(fd)
 
                 # make lines
                 frame_line = '  '
                 for i in ('startframe', 'endframe', 'interval'):
-                    if cls.conf_in[i] != None:
-                        frame_line = frame_line + i + '=' + str(cls.conf_in[i]) + ', '
-                output_line = '  verbose='+ str(cls.conf_in['verbose']) +', keep_files='+ str(cls.conf_in['keep_files']) +','
-                gb_line = '  igb='+str(cls.conf_in['igb']) + ', saltcon='+str(cls.conf_in['saltcon'])+','
-                pb_line = '  istrng='+str(cls.conf_in['istrng'])+', fillratio='+str(cls.conf_in['fillratio'])
+                    if conf_in[i] != None:
+                        frame_line = frame_line + i + '=' + str(conf_in[i]) + ', '
+                output_line = '  verbose='+ str(conf_in['verbose']) +', keep_files='+ str(conf_in['keep_files']) +','
+                gb_line = '  igb='+str(conf_in['igb']) + ', saltcon='+str(conf_in['saltcon'])+','
+                pb_line = '  istrng='+str(conf_in['istrng'])+', fillratio='+str(conf_in['fillratio'])
 
                 with open(out_path, 'w') as of:
                     print('GB and PB calculation' , end=os.linesep, file=of)
@@ -471,6 +525,32 @@ class Config:
         # Path of Multiwfn folder
         # 
         DIR = '$Multiwfnpath'
+
+    # >>>>>> Rosetta <<<<<<
+    class Rosetta:
+        # -----------------------------
+        # Default computational resources for a Rosetta cartesian_ddg job (per mutation group)
+        # (node_cores is multiplied by groups_per_job in PDB.get_rosetta_ddg)
+        # 
+        DDG_RES = {'core_type' : 'cpu',
+                    'nodes':'1',
+                    'node_cores' : '1',
+                    'job_name' : 'EnzyHTP_ddG',
+                    'partition' : 'production',
+                    'mem_per_core' : '2G',
+                    'walltime' : '1-00:00:00',
+                    'account' : 'xxx'}
+        # -----------------------------
+        # Default computational resources for a Rosetta relax job
+        # 
+        RELAX_RES = {'core_type' : 'cpu',
+                    'nodes':'1',
+                    'node_cores' : '24',
+                    'job_name' : 'EnzyHTP_r_relax',
+                    'partition' : 'production',
+                    'mem_per_core' : '2G',
+                    'walltime' : '1-00:00:00',
+                    'account' : 'xxx'}
         
 
 class Layer:
@@ -9,6 +9,7 @@ Usage:
     - frame.shift_line(shift_list) // shift_list is a list of (l1, l2): l1 is the moving line, l2 is the line before the target position. *l2 cannot be same as any l1 in the list.
 3. combine the coordinate with the template
     - write_to_template(template_path, frame_obj) // Use out_path and index to customize the output filename and path.
+    - Frame.write_frames_to_template(frames, template_path, n_cores=n) // parse the template once and write all frames (in a process pool if n > 1)
 -----------------
 4. select and write a visible file
     select:
@@ -26,6 +27,10 @@ from Class_Conf import Config
 from helper import line_feed, set_distance
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+from core.log import get_logger
+
+_LOGGER = get_logger(__name__)
 
 # In gjf: 
 #   pattern for determining the beginning of the coordinate (strip)
@@ -111,8 +116,7 @@ class Frame:
                             #the last line
                             break
                         if line == line_feed:
-                            if Config.debug >= 1:
-                                print("Frame.fromMDCrd: WARNING: unexpected empty line detected. Treat as EOF. exit reading")
+                            _LOGGER.warning('Frame.fromMDCrd: unexpected empty line detected. Treat as EOF. exit reading')
                             break
                         # do not skip if normal next line
 
@@ -214,73 +218,105 @@ class Frame:
                     self.coord.append(l1_coord)
 
 
-    def write_to_template(self, t_file_path, out_path=None, index : str = None, ifchk=1):
+    def write_to_template(self, t_file_path, out_path=None, index : str = None, ifchk=1, template=None):
         '''
-        1. find the beginning and ending of the coordinate section.
+        1. split the template into a header, the coordinate section and a trailer.
         2. replace coordinate based on the same atom sequence.
         ------
         write to out_path
+        template: result of Frame.split_template(t_file_path). parse t_file_path if not provided.
         '''
         if out_path == None:
             out_path = t_file_path[:-4]+'_newcoord.gjf'
         if index != None:
             out_path = out_path[:-4]+'_'+index+'.gjf'
         chk_path = out_path[:-3]+'chk'
-        
-        with open(t_file_path) as f:
-            with open(out_path,'w') as of:
-                coord_b_flag = 0
-                coord_e_flag = 0
-                coord_index = 0
-                for line in f:
-                    
-                    if re.search('chk_place_holder', line.strip()) != None:
-                        if ifchk:
-                            of.write(r'%chk='+chk_path + line_feed)
-                            continue
-                        else:
-                            continue
-
-                    if re.match(ChrgSpin_pattern, line.strip()) != None:
-                        coord_b_flag = 1
-                        of.write(line)
-                        continue
-                    
-                    # end when a space line appears
-                    if coord_b_flag:
-                        if line == line_feed:
-                            coord_e_flag = 1
 
-                    if coord_b_flag and not coord_e_flag:
-                        # line part
-                        lp = line.strip().split()
-                        line_coord = self.coord[coord_index]
-                        
-                        # potential *CHANGE* here about where coord is in a line
-                        label = '{:<20}'.format(lp[0])
-                        freeze_mark = '{:<3}'.format(lp[1])
-                        x = '{:>15.8f}'.format(line_coord[0])
-                        y = '{:>15.8f}'.format(line_coord[1])
-                        z = '{:>15.8f}'.format(line_coord[2])
-                        layer_mark = lp[5]
-
-                        new_line = ' '+label+' '+freeze_mark+x+y+z+' '+layer_mark
-
-                        if len(lp) > 6:
-                            new_line = new_line + ' ' + lp[6] + ' ' + lp[7]
-                        new_line = new_line + line_feed
-
-                        of.write(new_line)
-                        coord_index = coord_index+1
-                        continue
-                    
-                    of.write(line)
-                    
+        if template == None:
+            template = Frame.split_template(t_file_path)
+        header, coord_prefix, coord_suffix, trailer = template
+        if len(self.coord) < len(coord_prefix):
+            raise Exception('Frame.write_to_template: frame has less atoms than the template '+t_file_path)
+
+        out_lines = []
+        for line in header:
+            if 'chk_place_holder' in line:
+                if ifchk:
+                    out_lines.append(r'%chk='+chk_path + line_feed)
+                continue
+            out_lines.append(line)
+        # potential *CHANGE* here about where coord is in a line (see split_template)
+        for prefix, suffix, line_coord in zip(coord_prefix, coord_suffix, self.coord):
+            out_lines.append(f'{prefix}{line_coord[0]:>15.8f}{line_coord[1]:>15.8f}{line_coord[2]:>15.8f}{suffix}')
+        out_lines.extend(trailer)
+
+        with open(out_path,'w') as of:
+            of.write(''.join(out_lines))
+
         if ifchk:
             return out_path, chk_path
 
         return out_path
 
+    @classmethod
+    def write_frames_to_template(cls, frames, t_file_path, ifchk=1, n_cores=1):
+        '''
+        write each frame in frames to t_file_path. (see write_to_template)
+        the template is parsed only once and shared by all frames.
+        ------
+        n_cores : number of processes for writing files. use a process pool if > 1
+        return a list of out_path (or (out_path, chk_path) if ifchk) in the order of frames
+        '''
+        template = cls.split_template(t_file_path)
+        if n_cores <= 1 or len(frames) <= 1:
+            return [frame.write_to_template(t_file_path, index=str(i), ifchk=ifchk, template=template) for i, frame in enumerate(frames)]
+
+        n_workers = min(n_cores, len(frames))
+        tasks = [(frame, t_file_path, str(i), ifchk) for i, frame in enumerate(frames)]
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_template_worker, initargs=(template,)) as executor:
+            return list(executor.map(_write_frame_worker, tasks, chunksize=max(1, len(tasks)//(n_workers*4))))
+
+    @classmethod
+    def split_template(cls, t_file_path):
+        '''
+        split a ONIOM gjf template into parts that do not change between frames
+        ------
+        return (header, coord_prefix, coord_suffix, trailer)
+            header      : lines till the charge spin line (included)
+            coord_prefix: ' label freeze_mark' part of each coordinate line
+            coord_suffix: ' layer_mark [link atom info]' part of each coordinate line
+            trailer     : lines after the coordinate section (start from the blank line)
+        '''
+        header = []
+        coord_prefix = []
+        coord_suffix = []
+        trailer = []
+        with open(t_file_path) as f:
+            lines = f.readlines()
+
+        i = 0
+        # header
+        for i, line in enumerate(lines):
+            header.append(line)
+            if re.match(ChrgSpin_pattern, line.strip()) != None:
+                break
+        else:
+            raise Exception('Frame.split_template: cannot find charge spin line in '+t_file_path)
+        # coordinate (end when a space line appears)
+        for j in range(i+1, len(lines)):
+            line = lines[j]
+            if line == line_feed:
+                trailer = lines[j:]
+                break
+            lp = line.strip().split()
+            coord_prefix.append(' '+'{:<20}'.format(lp[0])+' '+'{:<3}'.format(lp[1]))
+            suffix = ' '+lp[5]
+            if len(lp) > 6:
+                suffix = suffix + ' ' + lp[6] + ' ' + lp[7]
+            coord_suffix.append(suffix + line_feed)
+
+        return header, coord_prefix, coord_suffix, trailer
+
 
     def write_sele_lines(self, sele_list,  g_route, g_cores, g_mem_cores, out_path = None, ff='gjf', chrgspin=None, ifchk=0):
         '''
@@ -426,6 +462,18 @@ class Frame:
 
 
 
+# template shared by process pool workers of Frame.write_frames_to_template
+_worker_template = None
+
+def _init_template_worker(template):
+    global _worker_template
+    _worker_template = template
+
+def _write_frame_worker(task):
+    frame, t_file_path, index, ifchk = task
+    return frame.write_to_template(t_file_path, index=index, ifchk=ifchk, template=_worker_template)
+
+
 def getFreq(g_out_file):
     '''
     Get frequencies from a gaussian output file.
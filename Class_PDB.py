@@ -1,12 +1,18 @@
 import copy
+import csv
+import glob
+import hashlib
+import logging
 from math import ceil
 import os
 import io
 import re
 import pandas as pd
 import shutil
+import tempfile
 from shutil import rmtree
 from subprocess import SubprocessError, run, CalledProcessError
+from concurrent.futures import ThreadPoolExecutor
 from random import choice
 from typing import Dict, Union, List
 from AmberMaps import *
@@ -15,10 +21,17 @@ from Class_Structure import *
 from Class_line import *
 from Class_Conf import Config, Layer
 from Class_ONIOM_Frame import *
-from core import job_manager
+from core import job_manager, rmsd, sasa, trajectory
 from core.clusters._interface import ClusterInterface
+from core.dispatcher import ClusterDispatcher, DispatchJob
+from core.ligand_charge import get_ligand_net_charge
+from core.log import get_logger
+from core.profiler import instrument_class, profile_tool
+from core.pymol_pool import PyMOLPool
+from core.traj_engine import TrajAnalysisEngine
 from helper import (
     Conformer_Gen_wRDKit, 
+    chunked, 
     delete_idx_line, 
     decode_atom_mask, 
     get_center, 
@@ -29,8 +42,7 @@ from helper import (
     AmberError,
     )
 try:
-    from pdb2pqr.main import main_driver as run_pdb2pqr
-    from pdb2pqr.main import build_main_parser as build_pdb2pqr_parser
+    from core.protonation import PDB2PQRService
 except ImportError:
     raise ImportError('PDB2PQR not installed.')
 
@@ -44,6 +56,11 @@ try:
 except ImportError:
     raise ImportError('OpenBabel not installed.')
 
+_LOGGER = get_logger(__name__)
+
+# external programs are timed in the profiling trace (if Config.PROFILE_TRACE_PATH is set)
+run = profile_tool(run)
+system = profile_tool(os.system)
 
 
 __doc__='''
@@ -109,6 +126,8 @@ class PDB():
         self.prepi_path = {}
         self.frcmod_path = {}
         self.disulfied_residue_pairs = []
+        self.pka_rows = []
+        self.pqr_result = None
         # default MD conf.
         self._init_MD_conf()
         # default ONIOM layer setting
@@ -174,22 +193,18 @@ class PDB():
             if self.stru.name != self.name:
                 get_flag = 1
                 # warn if possible wrong self.stru
-                if Config.debug >= 1:
-                    print('PDB.get_stru: WARNING: self.stru has a different name')
-                    print('     -self.name: '+self.name)
-                    print('     -self.stru.name: '+self.stru.name)
+                _LOGGER.warning('PDB.get_stru: self.stru has a different name. self.name: %s self.stru.name: %s', self.name, self.stru.name)
         else:
             get_flag = 1
 
         if get_flag or renew:
-            if Config.debug >= 1:
-                print('PDB.get_stru: Getting new stru')
+            _LOGGER.info('PDB.get_stru: Getting new stru')
             if self.path is not None:
                 self.stru = Structure.fromPDB(self.path, input_name=input_name, ligand_list=ligand_list)
             else:
                 self.stru = Structure.fromPDB(self.file_str, input_type='file_str', input_name=input_name, ligand_list=ligand_list)
-        elif Config.debug >= 1:
-            print('PDB.get_stru: Not getting new stru - have existing self.stru with the same name and renew == 0')
+        else:
+            _LOGGER.info('PDB.get_stru: Not getting new stru - have existing self.stru with the same name and renew == 0')
 
     def _get_file_str(self):
         '''
@@ -372,7 +387,7 @@ class PDB():
         self.if_ligand = 0
 
         if len(self.raw_sequence) == 0:
-            print("The self.raw_sequence should be obtained first")
+            _LOGGER.error('The self.raw_sequence should be obtained first')
             raise IndexError
 
         for chain in self.raw_sequence:
@@ -420,7 +435,7 @@ class PDB():
         save to self.sequence_one
         '''
         if len(self.sequence) == 0:
-            print("The self.sequence should be obtained first")
+            _LOGGER.error('The self.sequence should be obtained first')
             raise IndexError
 
         for chain in self.sequence:
@@ -446,7 +461,7 @@ class PDB():
             self.if_complete_chain - for each chain
         '''
         if len(self.sequence.keys()) == 0:
-            print('Please get the sequence first')
+            _LOGGER.error('Please get the sequence first')
             raise IndexError
         
         self.if_complete=1 # if not flow in then 1
@@ -488,7 +503,7 @@ class PDB():
     Protonation
     ========
     '''
-    def get_protonation(self, ph=7.0, keep_id=0, if_prt_ligand=1):
+    def get_protonation(self, ph=7.0, keep_id=0, if_prt_ligand=1, incremental=0, radius=6.0):
         '''
         Get protonation state based on PDB2PQR:
         1. Use PDB2PQR, save output to self.pqr_path
@@ -506,10 +521,16 @@ class PDB():
         ph: pH when determine the protonation state
         keep_id: if keep ids of original pdb file
         if_prt_ligand: if re-protonate ligand. (since sometime its already protonated)
+        incremental: only recompute pKa of residues within *radius* (A) of residues in self.MutaFlags and
+                     keep the rest from the last get_protonation of this object (e.g.: the wild type).
+                     (use a full run if there is no last result)
         '''
         out_path=self.path_name+'_aH.pdb'
         self._get_file_path()
-        disulfied_residue_pairs = self._get_protonation_pdb2pqr(ph=ph)
+        if incremental:
+            disulfied_residue_pairs = self._get_protonation_pdb2pqr(ph=ph, changed_residues=[(Flag[1], int(Flag[2])) for Flag in self.MutaFlags], radius=radius)
+        else:
+            disulfied_residue_pairs = self._get_protonation_pdb2pqr(ph=ph)
         self.disulfied_residue_pairs = disulfied_residue_pairs # TODO this is a temp solution. This requires runnning this function everytime after mutation which is also recommanded.
         self._protonation_Fix(out_path, ph=ph, keep_id=keep_id, if_prt_ligand=if_prt_ligand)
         self.path = out_path
@@ -517,13 +538,15 @@ class PDB():
         self.stru.name=self.name
 
 
-    def _get_protonation_pdb2pqr(self,ffout='AMBER',ph=7.0,out_path=''):
+    def _get_protonation_pdb2pqr(self,ffout='AMBER',ph=7.0,out_path='', changed_residues=None, radius=6.0):
         '''
         Use PDB2PQR to get the protonation state for current PDB. (self.path)
-        current implementation just use the outer layer of PDB2PQR. Update to inner one and get more infomation in the furture. 
+        Use the in-process PDB2PQRService that keeps the PDB2PQR/PROPKA parameters loaded and
+        caches results by the hash of the PDB file and pH. (see core/protonation.py)
             (TARGET: 1. what is deleted from the structure // metal, ligand)
         
-        save the result to self.pqr_path
+        save the result to self.pqr_path and the pqr content to self.pqr_str
+        changed_residues: [(chain_id, resi_id), ...] only recompute pKa within radius of them. (see get_protonation)
 
         Return:
             return disulfied_residue_pairs in a format of e.g.: [(('A', 496), ('A', 440)), ...]
@@ -534,28 +557,21 @@ class PDB():
         else:
             self.pqr_path = out_path
         
-        # input of PDB2PQR
-        pdb2pqr_parser = build_pdb2pqr_parser()
-        pdb2pqr_logging_level = 'INFO'
-        args = pdb2pqr_parser.parse_args(['--ff=PARSE',f'--log-level={pdb2pqr_logging_level}','--ffout='+ffout,'--with-ph='+str(ph),self.path,self.pqr_path])
         # use context manager to hide output
+        pqr_service = PDB2PQRService.get_service(ffout=ffout)
         with HiddenPrints(f'{self.dir}/._get_protonation_pdb2pqr.log'):
-            missed_residues, pka_df, biomolecule = run_pdb2pqr(args)
+            if changed_residues and self.pqr_result is not None:
+                pqr_result = pqr_service.protonate_incremental(self.path, self.pqr_result, changed_residues, ph=ph, radius=radius, out_path=self.pqr_path)
+            else:
+                pqr_result = pqr_service.protonate(self.path, ph=ph, out_path=self.pqr_path)
+        self.pqr_result = pqr_result
+        self.pqr_str = pqr_result.pqr_str
+        self.pka_rows = pqr_result.pka_rows
 
         # S-S bond
-        disulfied_residue_pairs = []
-        for res in biomolecule.residues:
-            if getattr(res, 'ss_bonded', None):
-                res_key = (res.chain_id, res.res_seq)
-                for exist_pair in disulfied_residue_pairs:
-                    if res_key in exist_pair:
-                        break
-                else:
-                    disulfied_residue_pairs.append(
-                        (res_key,
-                        (res.ss_bonded_partner.chain_id, res.ss_bonded_partner.res_seq)))
+        disulfied_residue_pairs = list(pqr_result.disulfied_residue_pairs)
         for ss_bond in disulfied_residue_pairs:
-            print(f'INFO: detected disulfied bond by PDB2PQR: {ss_bond[0]} - {ss_bond[1]}')
+            _LOGGER.info('detected disulfied bond by PDB2PQR: %s - %s', ss_bond[0], ss_bond[1])
 
         return disulfied_residue_pairs
 
@@ -570,7 +586,7 @@ class PDB():
         # Now metal and ligand
 
         old_stru = Structure.fromPDB(self.path)
-        new_stru = Structure.fromPDB(self.pqr_path)
+        new_stru = Structure.fromPDB(self.pqr_str, input_type='file_str')
 
         # find Metal center and combine with the pqr file
         metal_list = old_stru.get_metal_center()
@@ -616,8 +632,8 @@ class PDB():
         ph          : 7.0 by default 
         keep_name   : if keep original atom names of ligands (default: 1)
                         - check if there're duplicated names, add suffix if are.
+        the net charge is perceived in memory and memorized by the heavy atom graph and ph. (see core/ligand_charge.py)
         '''
-        outp1_path = path[:-4]+'_badname_aH.pdb'
         out_path = path[:-4]+'_aH.pdb'
         # outm2_path = path[:-4]+'_aH.mol2'
 
@@ -632,32 +648,28 @@ class PDB():
             obConversion.WriteFile(mol, out_path)
         if method == 'PYBEL':
             pybel.ob.obErrorLog.SetOutputLevel(0)
-            mol = next(pybel.readfile('pdb', path))
+            with open(path) as f:
+                lig_pdb_str = f.read()
+            mol = pybel.readstring('pdb', lig_pdb_str)
             mol.OBMol.AddHydrogens(False, True, ph)
-            mol.write('pdb', outp1_path, overwrite=True)
+            ob_pdb_str = mol.write('pdb')
             # fix atom label abd determing net charge
             if keep_name:
-                cls._fix_ob_output(outp1_path, out_path, ref_name_path=path)
+                cls._fix_ob_output(ob_pdb_str, out_path, ref_name_path=path, input_type='file_str')
             else:
-                cls._fix_ob_output(outp1_path, out_path)
-            # determine partial charge
-            # > METHOD 1<
-            net_charge = cls._ob_pdb_charge(outp1_path)
-            # > METHOD 2 <
-            # mol.write('mol2', outm2_path, overwrite=True)
-            # mol = next(pybel.readfile('mol2', outm2_path))
-            # net_charge=0
-            # for atom in mol:
-            #     net_charge=net_charge+atom.formalcharge
+                cls._fix_ob_output(ob_pdb_str, out_path, input_type='file_str')
+            # determine net charge (shared memo with Ligand.get_net_charge)
+            net_charge = get_ligand_net_charge(lig_pdb_str, ph=ph)
         if method == 'Dimorphite':
             pass
         return out_path, net_charge
 
 
     @classmethod
-    def _fix_ob_output(cls, pdb_path, out_path, ref_name_path=None):
+    def _fix_ob_output(cls, pdb_path, out_path, ref_name_path=None, input_type='path'):
         '''
         fix atom label in pdb_pat write to out_path
+        input_type: path (default) / file_str (pdb_path is the content of the pdb file)
         ---------
         ref_name_path: if use original atom names from pdb
         - default: None
@@ -675,50 +687,60 @@ class PDB():
                         # pybel use line order (not atom id) to assign new atom id
                         ref_a_names.append(pdb_l.atom_name)
 
-        with open(pdb_path) as f:
-            with open(out_path, 'w') as of:
-                # count element in a dict
-                ele_count={}
-                pdb_ls = PDB_line.fromlines(f.read())
-                line_count = 0
-                for pdb_l in pdb_ls:
-                    if pdb_l.line_type == 'HETATM' or pdb_l.line_type == 'ATOM':
-                        if ref_name_path == None:
-                            ele = pdb_l.get_element()
+        if input_type == 'path':
+            with open(pdb_path) as f:
+                pdb_str = f.read()
+        else:
+            pdb_str = pdb_path
+
+        with open(out_path, 'w') as of:
+            # count element in a dict
+            ele_count={}
+            pdb_ls = PDB_line.fromlines(pdb_str)
+            line_count = 0
+            for pdb_l in pdb_ls:
+                if pdb_l.line_type == 'HETATM' or pdb_l.line_type == 'ATOM':
+                    if ref_name_path == None:
+                        ele = pdb_l.get_element()
+                    else:
+                        if line_count < len(ref_a_names):    
+                            ele = ref_a_names[line_count]
                         else:
-                            if line_count < len(ref_a_names):    
-                                ele = ref_a_names[line_count]
-                            else:
-                                ele = pdb_l.get_element() # New atoms
-                            pdb_l.resi_name = ref_resi_name
-                            line_count += 1
-                        # determine the element count
-                        try:
-                            # rename if more than one (add count)
-                            ele_count[ele] += 1
-                            pdb_l.atom_name = ele+str(ele_count[ele])
-                        except KeyError:
-                            ele_count[ele] = 0
-                            pdb_l.atom_name = ele
-                        of.write(pdb_l.build())
-            
+                            ele = pdb_l.get_element() # New atoms
+                        pdb_l.resi_name = ref_resi_name
+                        line_count += 1
+                    # determine the element count
+                    try:
+                        # rename if more than one (add count)
+                        ele_count[ele] += 1
+                        pdb_l.atom_name = ele+str(ele_count[ele])
+                    except KeyError:
+                        ele_count[ele] = 0
+                        pdb_l.atom_name = ele
+                    of.write(pdb_l.build())
+        
 
     @classmethod
-    def _ob_pdb_charge(cls, pdb_path):
+    def _ob_pdb_charge(cls, pdb_path, input_type='path'):
         '''
         extract net charge from openbabel exported pdb file
+        input_type: path (default) / file_str (pdb_path is the content of the pdb file)
         '''
-        with open(pdb_path) as f:
-            net_charge=0
-            pdb_ls = PDB_line.fromlines(f.read())
-            for pdb_l in pdb_ls:
-                if pdb_l.line_type == 'HETATM' or pdb_l.line_type == 'ATOM':
-                    if len(pdb_l.get_charge()) != 0:
-                        charge = pdb_l.charge[::-1]
-                        if Config.debug > 1:
-                            print('Found formal charge: '+pdb_l.atom_name+' '+charge)
-                        net_charge = net_charge + int(charge)
-            return net_charge
+        if input_type == 'path':
+            with open(pdb_path) as f:
+                pdb_str = f.read()
+        else:
+            pdb_str = pdb_path
+
+        net_charge=0
+        pdb_ls = PDB_line.fromlines(pdb_str)
+        for pdb_l in pdb_ls:
+            if pdb_l.line_type == 'HETATM' or pdb_l.line_type == 'ATOM':
+                if len(pdb_l.get_charge()) != 0:
+                    charge = pdb_l.charge[::-1]
+                    _LOGGER.debug('Found formal charge: %s %s', pdb_l.atom_name, charge)
+                    net_charge = net_charge + int(charge)
+        return net_charge
 
 
     '''
@@ -825,8 +847,8 @@ class PDB():
                     pass
                 else:
                     if (self.MutaFlags[i][1], self.MutaFlags[i][2]) == (self.MutaFlags[j][1], self.MutaFlags[j][2]):
-                        if Config.debug >= 1:
-                            print("PDB2PDBwLeap: There are multiple mutations at the same index, only the first one will be used: "+self.MutaFlags[i][0]+self.MutaFlags[i][1]+self.MutaFlags[i][2])
+                        _LOGGER.warning('PDB2PDBwLeap: There are multiple mutations at the same index, only the first one will be used: %s%s%s',
+                                        self.MutaFlags[i][0], self.MutaFlags[i][1], self.MutaFlags[i][2])
 
         # Prepare a label for the filename
         tot_Flag_name=''
@@ -887,19 +909,18 @@ class PDB():
                         of.write(line)
 
 
-        # Run tLeap 
-        #make input
-        leapin_path = self.cache_path+'/leap_P2PwL.in'
-        leap_input=open(leapin_path,'w')
-        leap_input.write('source leaprc.protein.ff14SB\n')
-        leap_input.write('a = loadpdb '+out_PDB_path1+'\n')
-        leap_input.write('savepdb a '+out_PDB_path2+'\n')
-        leap_input.write('quit\n')
-        leap_input.close()
-        #run
-        os.system('tleap -s -f '+leapin_path+' > '+self.cache_path+'/leap_P2PwL.out')
-        if Config.debug <= 1:
-            os.system('rm leap.log')
+        # Run tLeap in a scratch dir (it writes leap.log in the CWD)
+        with ScratchDir('tleap') as scratch_dir:
+            #make input
+            leapin_path = scratch_dir+'leap_P2PwL.in'
+            leap_input=open(leapin_path,'w')
+            leap_input.write('source leaprc.protein.ff14SB\n')
+            leap_input.write('a = loadpdb '+os.path.abspath(out_PDB_path1)+'\n')
+            leap_input.write('savepdb a '+os.path.abspath(out_PDB_path2)+'\n')
+            leap_input.write('quit\n')
+            leap_input.close()
+            #run
+            run('tleap -s -f '+leapin_path+' > '+scratch_dir+'leap_P2PwL.out', text=True, shell=True, capture_output=True, cwd=scratch_dir)
 
         #Update the file
         self.path = out_PDB_path2
@@ -1003,8 +1024,7 @@ class PDB():
                 if resi.name in Resi_map2:
                     resi_1 = Resi_map2[resi.name]
                 else:
-                    if Config.debug >= 1:
-                        print('WARNING: pdb.Add_MutaFlag(): A non-canonical animo acid is being mutated! The MutaFlag will have a 3-letter code for the original residue .')
+                    _LOGGER.warning('pdb.Add_MutaFlag(): A non-canonical animo acid is being mutated! The MutaFlag will have a 3-letter code for the original residue .')
                     resi_1 = resi.name
                 # random over the residue list
                 if if_U:
@@ -1029,10 +1049,8 @@ class PDB():
                 MutaFlag = self._read_MutaFlag(i)
                 self.MutaFlags.append(MutaFlag)
 
-        if Config.debug >= 1:
-            print('Current MutaFlags:')
-            for flag in self.MutaFlags:
-                print(self._build_MutaName(flag))
+        if _LOGGER.isEnabledFor(logging.INFO):
+            _LOGGER.info('Current MutaFlags: %s', ' '.join(self._build_MutaName(flag) for flag in self.MutaFlags))
 
         label=''
         for flag in self.MutaFlags:
@@ -1073,8 +1091,7 @@ class PDB():
         # default
         if F_match.group(2) is None:
             chain_id = 'A'
-            if Config.debug >= 1:
-                print('_read_MutaFlag: No chain_id is provided! Mutate in the first chain by default. Input: ' + Flag)   
+            _LOGGER.warning('_read_MutaFlag: No chain_id is provided! Mutate in the first chain by default. Input: %s', Flag)
 
         # san check of the manual input
         self.get_stru()
@@ -1159,11 +1176,11 @@ class PDB():
                 env_settings = env_settings,
                 res_keywords = res_setting,
                 sub_dir = './', # because path are relative
-                sub_script_path = f'{min_dir}/submit_PDBMin_{core_type}.cmd'
+                sub_script_path = f'{min_dir}/submit_PDBMin_{core_type}.cmd',
+                stage = 'min'
             )
-            job.submit()
-            if Config.debug > 0:
-                print(f'''Running Min on {cluster.NAME}: job_id: {job.job_id} script: {job.sub_script_path} period: {period}''')
+            job.submit_or_reattach()
+            _LOGGER.info('Running Min on %s: job_id: %s script: %s period: %s', cluster.NAME, job.job_id, job.sub_script_path, period)
             job.wait_to_end(period=period)
             try:
                 PDB._detect_amber_error(job)
@@ -1174,15 +1191,14 @@ class PDB():
             if cluster_debug:
                 self.pdbmin_job = job
         else:
-            if Config.debug >= 1:
-                print(f'running: {cmd}')
-            os.system(cmd)
+            _LOGGER.info('running: %s', cmd)
+            system(cmd)
         
         # rst2pdb
         run('ambpdb -p '+self.prmtop_path+' -c '+minrst_path+' > '+out4_PDB_path, check=True, text=True, shell=True, capture_output=True)
         
         # clean
-        os.system('mv '+self.prmtop_path+' '+self.inpcrd_path+' '+min_dir)
+        system('mv '+self.prmtop_path+' '+self.inpcrd_path+' '+min_dir)
 
         # update
         self.path = out4_PDB_path
@@ -1270,7 +1286,8 @@ class PDB():
         PDB2FF(self, o_dir='')
         --------------------
         prm_out_path: output path of the prmtop file
-        o_dir contral where the leap.in and leap.log go: has to contain a / at the end (e.g.: ./dir/)
+        o_dir contral where the prmtop and inpcrd go: has to contain a / at the end (e.g.: ./dir/)
+              (tleap runs in a scratch dir with its leap.in and leap.log. see wrapper.ScratchDir)
         renew_lig: 0 use old ligand parm files if detected.
                    1 generate new ones. 
         local_lig: 0 export lig files to the workdir level in HTP jobs.
@@ -1317,7 +1334,7 @@ class PDB():
         renew   : 0:(default) use old parm files if exist. 1: renew parm files everytime
         TODO check if the ligand is having correct name. (isolate the renaming function and also use in the class structure)
         * WARN: The parm file for ligand will always be like xxx/ligand_1.frcmod. Remember to enable renew when different object is sharing a same path.
-        * BUG: Antechamber has a bug that if current dir has temp files from previous antechamber run (ANTECHAMBER_AC.AC, etc.) sqm will fail. Now remove them everytime.
+        * BUG: Antechamber has a bug that if current dir has temp files from previous antechamber run (ANTECHAMBER_AC.AC, etc.) sqm will fail. Now run it in a new scratch dir everytime.
         '''
         parm_paths = []
         self.prepi_path = {}
@@ -1326,16 +1343,13 @@ class PDB():
         lig_list = self.stru.get_all_ligands(ifunique=1)
         for lig in lig_list:
             lig: Ligand
-            if Config.debug >= 1:
-                print( 'Working on: '+'_'.join((lig.name, str(lig.id))) )            
+            _LOGGER.info('Working on: %s_%s', lig.name, lig.id)
             # target files
             out_prepi = lig_dir+'ligand_'+lig.name+'.prepin'
             out_frcmod = lig_dir+'ligand_'+lig.name+'.frcmod'
             # if renew
             if os.path.isfile(out_prepi) and os.path.isfile(out_frcmod) and not renew:
-                if Config.debug >= 1:
-                    print('Parm files exist: ' + out_prepi + ' ' + out_frcmod)
-                    print('Using old parm files.')
+                _LOGGER.info('Parm files exist: %s %s. Using old parm files.', out_prepi, out_frcmod)
             else:
                 # build ligand pdb file
                 lig_pdb_path = lig_dir+'ligand_'+lig.name+'.pdb'
@@ -1348,14 +1362,13 @@ class PDB():
                 # get parameters
                 if method == 'AM1BCC':
                     #gen prepi (net charge and correct protonation state is important)
-                    if Config.debug >= 1:
-                        print('running: '+Config.Amber.AmberHome+'/bin/antechamber -i '+lig_pdb_path+' -fi pdb -o '+out_prepi+' -fo prepi -c bcc -s 0 -nc '+str(net_charge))
-                    run(Config.Amber.AmberHome+'/bin/antechamber -i '+lig_pdb_path+' -fi pdb -o '+out_prepi+' -fo prepi -c bcc -s 0 -nc '+str(net_charge), check=True, text=True, shell=True, capture_output=True)
-                    if Config.debug <= 1:
-                        os.system('rm ANTECHAMBER* ATOMTYPE.INF NEWPDB.PDB PREP.INF sqm.pdb sqm.in sqm.out')
+                    # run in a scratch dir. (antechamber/sqm write temp files in the CWD)
+                    antechamber_cmd = f'{Config.Amber.AmberHome}/bin/antechamber -i {os.path.abspath(lig_pdb_path)} -fi pdb -o {os.path.abspath(out_prepi)} -fo prepi -c bcc -s 0 -nc {net_charge}'
+                    _LOGGER.info('running: %s', antechamber_cmd)
+                    with ScratchDir('antechamber') as scratch_dir:
+                        run(antechamber_cmd, check=True, text=True, shell=True, capture_output=True, cwd=scratch_dir)
                     #gen frcmod
-                    if Config.debug >= 1:
-                        print('running: '+Config.Amber.AmberHome+'/bin/parmchk2 -i '+out_prepi+' -f prepi -o '+out_frcmod)
+                    _LOGGER.info('running: %s/bin/parmchk2 -i %s -f prepi -o %s', Config.Amber.AmberHome, out_prepi, out_frcmod)
                     run(Config.Amber.AmberHome+'/bin/parmchk2 -i '+out_prepi+' -f prepi -o '+out_frcmod, check=True, text=True, shell=True, capture_output=True)                
             #record
             parm_paths.append((out_prepi, out_frcmod))
@@ -1376,79 +1389,76 @@ class PDB():
         if box_type == None:
             box_type = Config.Amber.box_type
             
-        leap_path= self.cache_path+'/leap.in'
         sol_path= self.path_name+'_ff.pdb'
-        with open(leap_path, 'w') as of:
-            of.write('source leaprc.protein.ff14SB'+line_feed)
-            of.write('source leaprc.gaff'+line_feed)
-            of.write('source leaprc.water.tip3p'+line_feed)
-            # ligands
-            for prepi, frcmod in lig_parms:
-                of.write('loadAmberParams '+frcmod+line_feed)
-                of.write('loadAmberPrep '+prepi+line_feed)
-            of.write('a = loadpdb '+self.path+line_feed)
-            if self.disulfied_residue_pairs:
-                for ss_bond_pairs in self.disulfied_residue_pairs:
-                    of.write(f'bond a.{ss_bond_pairs[0][1]}.SG a.{ss_bond_pairs[1][1]}.SG{line_feed}')
-            # igb Radii
-            if igb != None:
-                radii = radii_map[str(igb)]
-                of.write('set default PBRadii '+ radii +line_feed)
-            of.write('center a'+line_feed)
-            # solvation
-            if ifsolve:
-                of.write('addions a Na+ 0'+line_feed)
-                of.write('addions a Cl- 0'+line_feed)
-                if box_type == 'box':
-                    of.write('solvatebox a TIP3PBOX '+box_size+line_feed)
-                if box_type == 'oct':
-                    of.write('solvateOct a TIP3PBOX '+box_size+line_feed)
-                if box_type != 'box' and box_type != 'oct':
-                    raise Exception('PDB._combine_parm().box_type: Only support box and oct now!')
-            # save
-            if prm_out_path == '':
-                if o_dir == '':                        
-                    of.write('saveamberparm a '+self.path_name+'.prmtop '+self.path_name+'.inpcrd'+line_feed)
-                    self.prmtop_path=self.path_name+'.prmtop'
-                    self.inpcrd_path=self.path_name+'.inpcrd'
-                else:
-                    of.write('saveamberparm a '+o_dir+self.name+'.prmtop '+o_dir+self.name+'.inpcrd'+line_feed)
-                    self.prmtop_path=o_dir+self.name+'.prmtop'
-                    self.inpcrd_path=o_dir+self.name+'.inpcrd'
-            else:
-                if o_dir == '':
-                    if if_prm_only:
-                        temp_dir = f'{self.dir}/temp'
-                        mkdir(temp_dir)
-                        of.write('saveamberparm a '+prm_out_path+f' {temp_dir}/tmp.inpcrd'+line_feed)
-                        self.prmtop_path=prm_out_path
-                        self.inpcrd_path=None
-                    else:
-                        of.write('saveamberparm a '+prm_out_path+' '+self.path_name+'.inpcrd'+line_feed)
-                        self.prmtop_path=prm_out_path
+        # tleap writes leap.log in the CWD. Run in a scratch dir (paths in the input are absolute)
+        with ScratchDir('tleap') as scratch_dir:
+            leap_path = scratch_dir+'leap.in'
+            with open(leap_path, 'w') as of:
+                of.write('source leaprc.protein.ff14SB'+line_feed)
+                of.write('source leaprc.gaff'+line_feed)
+                of.write('source leaprc.water.tip3p'+line_feed)
+                # ligands
+                for prepi, frcmod in lig_parms:
+                    of.write('loadAmberParams '+os.path.abspath(frcmod)+line_feed)
+                    of.write('loadAmberPrep '+os.path.abspath(prepi)+line_feed)
+                of.write('a = loadpdb '+os.path.abspath(self.path)+line_feed)
+                if self.disulfied_residue_pairs:
+                    for ss_bond_pairs in self.disulfied_residue_pairs:
+                        of.write(f'bond a.{ss_bond_pairs[0][1]}.SG a.{ss_bond_pairs[1][1]}.SG{line_feed}')
+                # igb Radii
+                if igb != None:
+                    radii = radii_map[str(igb)]
+                    of.write('set default PBRadii '+ radii +line_feed)
+                of.write('center a'+line_feed)
+                # solvation
+                if ifsolve:
+                    of.write('addions a Na+ 0'+line_feed)
+                    of.write('addions a Cl- 0'+line_feed)
+                    if box_type == 'box':
+                        of.write('solvatebox a TIP3PBOX '+box_size+line_feed)
+                    if box_type == 'oct':
+                        of.write('solvateOct a TIP3PBOX '+box_size+line_feed)
+                    if box_type != 'box' and box_type != 'oct':
+                        raise Exception('PDB._combine_parm().box_type: Only support box and oct now!')
+                # save
+                if prm_out_path == '':
+                    if o_dir == '':                        
+                        of.write('saveamberparm a '+os.path.abspath(self.path_name+'.prmtop')+' '+os.path.abspath(self.path_name+'.inpcrd')+line_feed)
+                        self.prmtop_path=self.path_name+'.prmtop'
                         self.inpcrd_path=self.path_name+'.inpcrd'
-                else:
-                    if if_prm_only:
-                        temp_dir = f'{self.dir}/temp'
-                        mkdir(temp_dir)
-                        of.write('saveamberparm a '+prm_out_path+f' {temp_dir}/tmp.inpcrd'+line_feed)
-                        self.prmtop_path=prm_out_path
-                        self.inpcrd_path=None
                     else:
-                        of.write('saveamberparm a '+prm_out_path+' '+o_dir+self.name+'.inpcrd'+line_feed)
-                        self.prmtop_path=prm_out_path
+                        of.write('saveamberparm a '+os.path.abspath(o_dir+self.name+'.prmtop')+' '+os.path.abspath(o_dir+self.name+'.inpcrd')+line_feed)
+                        self.prmtop_path=o_dir+self.name+'.prmtop'
                         self.inpcrd_path=o_dir+self.name+'.inpcrd'
+                else:
+                    if o_dir == '':
+                        if if_prm_only:
+                            of.write('saveamberparm a '+os.path.abspath(prm_out_path)+f' {scratch_dir}tmp.inpcrd'+line_feed)
+                            self.prmtop_path=prm_out_path
+                            self.inpcrd_path=None
+                        else:
+                            of.write('saveamberparm a '+os.path.abspath(prm_out_path)+' '+os.path.abspath(self.path_name+'.inpcrd')+line_feed)
+                            self.prmtop_path=prm_out_path
+                            self.inpcrd_path=self.path_name+'.inpcrd'
+                    else:
+                        if if_prm_only:
+                            of.write('saveamberparm a '+os.path.abspath(prm_out_path)+f' {scratch_dir}tmp.inpcrd'+line_feed)
+                            self.prmtop_path=prm_out_path
+                            self.inpcrd_path=None
+                        else:
+                            of.write('saveamberparm a '+os.path.abspath(prm_out_path)+' '+os.path.abspath(o_dir+self.name+'.inpcrd')+line_feed)
+                            self.prmtop_path=prm_out_path
+                            self.inpcrd_path=o_dir+self.name+'.inpcrd'
 
-            if ifsavepdb:
-                of.write('savepdb a '+sol_path+line_feed)
-            of.write('quit'+line_feed)
+                if ifsavepdb:
+                    of.write('savepdb a '+os.path.abspath(sol_path)+line_feed)
+                of.write('quit'+line_feed)
 
-        try:
-            run('tleap -s -f '+leap_path+' > '+leap_path[:-2]+'out', check=True,  text=True, shell=True, capture_output=True)
-        except SubprocessError as e:
-            print(f'stderr: {str(e.stderr).strip()}')
-            print(f'stdout: {str(e.stdout).strip()}')
-            raise e
+            try:
+                run('tleap -s -f '+leap_path+' > '+leap_path[:-2]+'out', check=True,  text=True, shell=True, capture_output=True, cwd=scratch_dir)
+            except SubprocessError as e:
+                _LOGGER.error('tleap failed. stderr: %s stdout: %s', str(e.stderr).strip(), str(e.stdout).strip())
+                raise e
 
         return self.prmtop_path, self.inpcrd_path
 
@@ -1501,7 +1511,7 @@ class PDB():
                     ter_flag=0
 
                 if not change_flag:
-                    print('rm_wat(): No change.')
+                    _LOGGER.info('rm_wat(): No change.')
 
         self.path=out_path
         self._update_name()
@@ -1641,10 +1651,10 @@ class PDB():
                     env_settings = env_settings,
                     res_keywords = res_setting,
                     sub_dir = './', # because path are relative
-                    sub_script_path = f'{o_dir}/submit_PDBMD_1_{core_type}.cmd')
-                job_1.submit()
-                if Config.debug > 0:
-                    print(f'''Running MD on {cluster.NAME}: job_id: {job_1.job_id} script: {job_1.sub_script_path} period: {period}''')
+                    sub_script_path = f'{o_dir}/submit_PDBMD_1_{core_type}.cmd',
+                    stage = 'md')
+                job_1.submit_or_reattach()
+                _LOGGER.info('Running MD on %s: job_id: %s script: %s period: %s', cluster.NAME, job_1.job_id, job_1.sub_script_path, period)
                 job_1.wait_to_end(period)
                 type(self)._detect_amber_error(job_1)
 
@@ -1654,10 +1664,10 @@ class PDB():
                     env_settings = env_settings_equi_cpu,
                     res_keywords = res_setting_equi_cpu,
                     sub_dir = './', # because path are relative
-                    sub_script_path = f'{o_dir}/submit_PDBMD_2_CPU.cmd')
-                job_2.submit()
-                if Config.debug > 0:
-                    print(f'''Running MD on {cluster.NAME}: job_id: {job_2.job_id} script: {job_2.sub_script_path} period: {period}''')
+                    sub_script_path = f'{o_dir}/submit_PDBMD_2_CPU.cmd',
+                    stage = 'md')
+                job_2.submit_or_reattach()
+                _LOGGER.info('Running MD on %s: job_id: %s script: %s period: %s', cluster.NAME, job_2.job_id, job_2.sub_script_path, period)
                 job_2.wait_to_end(period)
                 type(self)._detect_amber_error(job_2)
 
@@ -1667,10 +1677,10 @@ class PDB():
                     env_settings = env_settings,
                     res_keywords = res_setting,
                     sub_dir = './', # because path are relative
-                    sub_script_path = f'{o_dir}/submit_PDBMD_3_{core_type}.cmd')
-                job_3.submit()
-                if Config.debug > 0:
-                    print(f'''Running MD on {cluster.NAME}: job_id: {job_3.job_id} script: {job_3.sub_script_path} period: {period}''')
+                    sub_script_path = f'{o_dir}/submit_PDBMD_3_{core_type}.cmd',
+                    stage = 'md')
+                job_3.submit_or_reattach()
+                _LOGGER.info('Running MD on %s: job_id: %s script: %s period: %s', cluster.NAME, job_3.job_id, job_3.sub_script_path, period)
                 job_3.wait_to_end(period)
                 type(self)._detect_amber_error(job_3)
                 md_jobs.extend([job_1, job_2, job_3])
@@ -1683,11 +1693,11 @@ class PDB():
                     env_settings = env_settings,
                     res_keywords = res_setting,
                     sub_dir = './', # because path are relative
-                    sub_script_path = f'{o_dir}/submit_PDBMD_{core_type}.cmd'
+                    sub_script_path = f'{o_dir}/submit_PDBMD_{core_type}.cmd',
+                    stage = 'md'
                 )
-                job.submit()
-                if Config.debug > 0:
-                    print(f'''Running MD on {cluster.NAME}: job_id: {job.job_id} script: {job.sub_script_path} period: {period}''')
+                job.submit_or_reattach()
+                _LOGGER.info('Running MD on %s: job_id: %s script: %s period: %s', cluster.NAME, job.job_id, job.sub_script_path, period)
                 job.wait_to_end(period=period)
                 type(self)._detect_amber_error(job)
                 md_jobs.append(job)
@@ -1696,18 +1706,14 @@ class PDB():
                 self.pdbmd_jobs = md_jobs
 
         else:
-            if Config.debug >= 1:
-                print(f'running: {cmd_min}')
-            os.system(cmd_min)
-            if Config.debug >= 1:
-                print(f'running: {cmd_heat}')
-            os.system(cmd_heat)
-            if Config.debug >= 1:
-                print(f'running: {cmd_equi}')
-            os.system(cmd_equi)
-            if Config.debug >= 1:
-                print(f'running: {cmd_prod}')
-            os.system(cmd_prod)
+            _LOGGER.info('running: %s', cmd_min)
+            system(cmd_min)
+            _LOGGER.info('running: %s', cmd_heat)
+            system(cmd_heat)
+            _LOGGER.info('running: %s', cmd_equi)
+            system(cmd_equi)
+            _LOGGER.info('running: %s', cmd_prod)
+            system(cmd_prod)
         if check_out_put and not PDB._is_normal_amber_output(f'{o_dir}/prod.out'):
             raise Exception("Amber production did not terminate normally")
 
@@ -2112,15 +2118,14 @@ class PDB():
         self.frames = frames
         gjf_paths = []
         chk_paths = []
-        if Config.debug >= 1:
-            print('Writing QMMM gjfs.')
-        for i, frame in enumerate(frames):
+        _LOGGER.info('Writing QMMM gjfs.')
+        frame_paths = Frame.write_frames_to_template(frames, g_temp_path, ifchk=ifchk, n_cores=Config.n_cores)
+        for frame_path in frame_paths:
             if ifchk:
-                frame_path = frame.write_to_template(g_temp_path, index = str(i), ifchk=1)
                 gjf_paths.append(frame_path[0])
                 chk_paths.append(frame_path[1])
             else:
-                gjf_paths.append(frame.write_to_template(g_temp_path, index = str(i), ifchk=0))
+                gjf_paths.append(frame_path)
         # run Gaussian job
         self.qmmm_out = PDB.Run_QM(gjf_paths)
 
@@ -2186,8 +2191,9 @@ class PDB():
         for j in range(len(self.layer)):
             self.layer_chrgspin.append(float(0))
         # add charge to layers
+        layer_sets = [set(layer) for layer in self.layer]
         for i, chrg in enumerate(self.chrg_list_all):
-            for j, layer in enumerate(self.layer):
+            for j, layer in enumerate(layer_sets):
                 if i+1 in layer:
                     self.layer_chrgspin[j] += chrg
 
@@ -2208,13 +2214,12 @@ class PDB():
         else:
             raise Exception('Only support 2 layers writing charge and spin. Update in the future')
 
-        if Config.debug >= 1:
-            print(chrgspin)
+        _LOGGER.info('ONIOM charge and spin: %s', chrgspin)
 
         return chrgspin
 
 
-    def _get_oniom_g16_coord(self):
+    def _get_oniom_g16_coord(self, prmtop_path=None):
         '''
         generate coordinate line. Base on *structure* and layer settings in the *config* module.
         Use element name as atom type for ligand atoms since they are mostly in QM regions.
@@ -2226,8 +2231,12 @@ class PDB():
         	- freeze part (general option / some presupposition) 
         	- xyz (from self.stru)
         	- layer (general option / some presupposition)
+        ---------------
+        prmtop_path: not used. charges are taken from self.chrg_list_all (see _get_oniom_chrgspin)
+        lines are collected in a list and joined once. high layer membership is checked with a set.
         '''
-        coord=''
+        coord_lines = []
+        h_layer = set(self.layer[0])
 
         # amber default hold the chain - ligand - metal - solvent order
         a_id = 0
@@ -2238,72 +2247,69 @@ class PDB():
                     # san check
                     if atom.id != a_id:
                         raise Exception('atom id error.')
-                    if atom.id in self.layer[0]:
-                        coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1])
+                    if atom.id in h_layer:
+                        coord_lines.append(atom.build_oniom('h', self.chrg_list_all[atom.id-1]))
                     else:
                         # consider connection
                         cnt_info = None
                         repeat_flag = 0
                         for cnt_atom in atom.connect:
-                            if cnt_atom.id in self.layer[0]:
+                            if cnt_atom.id in h_layer:
                                 if repeat_flag:
                                     raise Exception('A low layer atom is connecting 2 higher layer atoms')
                                 cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id] 
                                 repeat_flag = 1
                         # general low layer
-                        coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info)
+                        coord_lines.append(atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info))
         for lig in self.stru.ligands:
             for atom in lig:
                 a_id += 1
                 if atom.id != a_id:
                     raise Exception('atom id error.')
-                if atom.id in self.layer[0]:
-                    coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_lig=1)
+                if atom.id in h_layer:
+                    coord_lines.append(atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_lig=1))
                 else:
-                    if Config.debug >= 1:
-                        print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found ligand atom in low layer \033[0m')
+                    _LOGGER.warning('In PDB2QMMM in _get_oniom_g16_coord: Found ligand atom in low layer')
                     # consider connection
                     cnt_info = None
                     repeat_flag = 0 
                     for cnt_atom in atom.connect:
                         if repeat_flag:
                             raise Exception('A low layer atom is connecting 2 higher layer atoms')
-                        if cnt_atom.id in self.layer[0]:
-                            if Config.debug >= 1:
-                                print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found ligand atom'+str(atom.id)+' in seperate layers \033[0m')
+                        if cnt_atom.id in h_layer:
+                            _LOGGER.warning('In PDB2QMMM in _get_oniom_g16_coord: Found ligand atom %s in seperate layers', atom.id)
                             cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id]
                             repeat_flag = 1
-                    coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_lig=1)
+                    coord_lines.append(atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_lig=1))
         for atom in self.stru.metalatoms:
             a_id += 1
             if atom.id != a_id:
                 raise Exception('atom id error.')
-            if atom.id in self.layer[0]:
-                coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1])
+            if atom.id in h_layer:
+                coord_lines.append(atom.build_oniom('h', self.chrg_list_all[atom.id-1]))
             else:
-                coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1])
+                coord_lines.append(atom.build_oniom('l', self.chrg_list_all[atom.id-1]))
         for sol in self.stru.solvents:
             for atom in sol:
                 a_id += 1
                 if atom.id != a_id:
                     raise Exception('atom id error.')
-                if atom.id in self.layer[0]:
-                    coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_sol=1)
+                if atom.id in h_layer:
+                    coord_lines.append(atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_sol=1))
                 else:
                     # consider connection
                     cnt_info = None # for future update
                     repeat_flag = 0
                     for cnt_atom in atom.connect:
-                        if cnt_atom.id in self.layer[0]:
-                            if Config.debug >= 1:
-                                print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found solvent atom'+str(atom.id)+' in seperate layers \033[0m')
+                        if cnt_atom.id in h_layer:
+                            _LOGGER.warning('In PDB2QMMM in _get_oniom_g16_coord: Found solvent atom %s in seperate layers', atom.id)
                             if repeat_flag:
                                 raise Exception('A low layer atom is connecting 2 higher layer atoms')
                             cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id] 
                             repeat_flag = 1
-                    coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_sol=1)
+                    coord_lines.append(atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_sol=1))
 
-        return coord
+        return ''.join(coord_lines)
 
 
     def _get_oniom_g16_add_prm(self):
@@ -2367,6 +2373,26 @@ class PDB():
     MD Analysis 
     ========
     '''
+    @classmethod
+    def run_traj_analysis(cls, prmtop_path: str, traj_path: str, analyses: Dict[str, dict], image: bool = True) -> dict:
+        """
+        run analyses on the trajectory in a single pass (each frame is read and imaged once)
+        Args:
+            analyses: {name: kwargs} of analyses registered in core/traj_engine.py (rmsd, sasa_ratio, 
+                      field_strength, distance ...). Use {"analysis": registered_name} in kwargs to add
+                      the same analysis multiple times under different names.
+                      e.g.: {"sasa_ratio": {"mask_pro": ":1-253", "mask_pro_target": ":9,11", "mask_sub": ":254"},
+                             "e_ab": {"analysis": "field_strength", "atom_mask": ":1-253", "a1": 100, "a2": 101}}
+            image: image molecules in each frame of periodic systems (like cpptraj autoimage)
+        Return:
+            {name: result}
+        """
+        engine = TrajAnalysisEngine(prmtop_path, traj_path, image=image)
+        for name, kwargs in analyses.items():
+            kwargs = dict(kwargs)
+            engine.add(kwargs.pop("analysis", name), name=name, **kwargs)
+        return engine.run()
+
     def nc2mdcrd(self, o_path='', point=None, start=1, end=-1, step=1, engine='cpptraj'):
         '''
         convert self.nc to a mdcrd file to read and operate.(self.nc[:-2]+'.mdcrd' by default)
@@ -2406,7 +2432,7 @@ class PDB():
                     of.write('trajout '+o_path+line_feed)
                     of.write('run'+line_feed)
                     of.write('quit'+line_feed)
-                os.system('cpptraj -i '+cpp_in_path+' > '+cpp_out_path)
+                system('cpptraj -i '+cpp_in_path+' > '+cpp_out_path)
 
         self.mdcrd=o_path
         return o_path
@@ -2512,8 +2538,7 @@ class PDB():
         self.qm_cluster_map = sele_map
         # get chrgspin
         chrgspin = self._get_qmcluster_chrgspin(sele_lines, spin=spin)
-        if Config.debug >= 1:
-            print('Charge: '+str(chrgspin[0])+' Spin: '+str(chrgspin[1]))
+        _LOGGER.info('Charge: %s Spin: %s', chrgspin[0], chrgspin[1])
         # get res setting
         # overwrite those if cluster job is true
         if if_cluster_job:
@@ -2535,8 +2560,7 @@ class PDB():
         self.frames = frames
         if QM in ['g16','g09']:
             gjf_paths = []
-            if Config.debug >= 1:
-                print('Writing QMcluster gjfs.')
+            _LOGGER.info('Writing QMcluster gjfs.')
             for i, frame in enumerate(frames):
                 gjf_path = o_dir+'/qm_cluster_'+str(i)+'.gjf'
                 frame.write_sele_lines(sele_lines, out_path=gjf_path, g_route=g_route, g_cores=cpu_cores, g_mem_cores=cpu_mem, chrgspin=chrgspin, ifchk=ifchk)
@@ -2619,12 +2643,15 @@ class PDB():
         inp: list[str], 
         prog: str = 'g16', 
         if_cluster_job: bool = 1,
-        cluster: ClusterInterface = None,
+        cluster: Union[ClusterInterface, ClusterDispatcher] = None,
         job_array_size: int = 0,
         period: int = 600,
         res_setting: dict = None,
         clean_job_cluster_log: bool = True,
-        cluster_debug: bool = 0
+        cluster_debug: bool = 0,
+        native_array: bool = False,
+        tasks_per_bundle: int = 1,
+        bundle_slots: int = 1
     ):
         '''
         Run QM with {prog} for {inp} files and return paths of output files.
@@ -2637,6 +2664,8 @@ class PDB():
             if submit the QM calculation to a HPC (default: 1)
         cluster:
             The cluster used when if_cluster_job is 1.
+            A ClusterDispatcher spreads the QM jobs over its sites instead. (job_array_size, native_array
+            and bundles are not used. Limits are set per site. see core/dispatcher.py)
         job_array_size:
             how many jobs are allowed to submit simultaneously. (default: 0 means len(inp))
             (e.g. 5 for 100 jobs means run 20 groups. All groups will be submitted and 
@@ -2648,27 +2677,61 @@ class PDB():
         cluster_debug:
             1: return also the job objects
             0: return only the out file paths
+        native_array:
+            submit all QM jobs as one job array of the cluster (e.g.: sbatch --array) that keeps
+            {job_array_size} running. (see job_manager.ClusterJobArray)
+        tasks_per_bundle:
+            run this number of QM jobs in one allocation to save the scheduling time of short jobs.
+            (see job_manager.ClusterJobBundle. res_setting need to be a dict and
+            its walltime need to cover all jobs of a bundle)
+        bundle_slots:
+            number of QM jobs that run simultaneously in a bundle. The allocation request
+            node_cores x bundle_slots cores and each job is pinned to node_cores of them.
 
         TODO put this individually as part of the qm interface
              maybe introduct the current executor object to decouple this module with the job manager.
         '''
         if if_cluster_job:
             #san check
-            if not isinstance(cluster, ClusterInterface):
-                raise TypeError('cluster job need a cluster (ClusterInterface object) input')
+            if not isinstance(cluster, (ClusterInterface, ClusterDispatcher)):
+                raise TypeError('cluster job need a cluster (ClusterInterface or ClusterDispatcher object) input')
             
             if prog == 'g16':
                 outs = []
                 # config jobs
                 jobs = []
+                dispatch_jobs = []
                 for gjf_path in inp:
                     out_path = gjf_path.removesuffix('gjf')+'out'
-                    jobs.append(cls._make_single_g16_job(gjf_path, out_path, cluster, res_setting))
+                    if isinstance(cluster, ClusterDispatcher):
+                        dispatch_jobs.append(DispatchJob(
+                            lambda job_cluster, work_dir, gjf_path=gjf_path, out_path=out_path:
+                                cls._make_single_g16_job(gjf_path, out_path, job_cluster, res_setting, work_dir),
+                            input_files = [gjf_path],
+                            output_files = [out_path]))
+                    else:
+                        jobs.append(cls._make_single_g16_job(gjf_path, out_path, cluster, res_setting))
                     outs.append(out_path)
                 # submit and run in array
-                if Config.debug > 0:
-                    print(f'''Running QM array on {cluster.NAME}: number: {len(jobs)} size: {job_array_size} period: {period}''')
-                job_manager.ClusterJob.wait_to_array_end(jobs, period, job_array_size)
+                _LOGGER.info('Running QM array on %s: number: %s size: %s period: %s', cluster.NAME, len(inp), job_array_size, period)
+                if dispatch_jobs:
+                    cluster.run(dispatch_jobs, period)
+                    jobs = [dispatch_job.job for dispatch_job in dispatch_jobs]
+                elif tasks_per_bundle > 1:
+                    if not isinstance(res_setting, dict):
+                        raise TypeError('Run_QM: tasks_per_bundle > 1 requires res_setting as a dict')
+                    bundle_res_setting = copy.deepcopy(res_setting)
+                    bundle_res_setting['node_cores'] = str(int(res_setting['node_cores']) * bundle_slots)
+                    # task logs are in cluster_log/bundle_#/
+                    bundle_dir = f"{os.path.dirname(inp[0])}/cluster_log/" if clean_job_cluster_log else os.path.dirname(inp[0])
+                    bundles = job_manager.ClusterJobBundle.config_bundles(
+                        jobs, tasks_per_bundle, bundle_res_setting,
+                        cores_per_task = int(res_setting['node_cores']),
+                        sub_dir = bundle_dir or '.')
+                    job_manager.ClusterJobBundle.wait_to_bundles_end(bundles, period, job_array_size, native_array)
+                    clean_job_cluster_log = False
+                else:
+                    job_manager.ClusterJob.wait_to_array_end(jobs, period, job_array_size, native_array=native_array)
                 if clean_job_cluster_log:
                     target_dir = f"{os.path.dirname(inp[0])}/cluster_log/"          
                     mkdir(target_dir)
@@ -2685,9 +2748,8 @@ class PDB():
                 outs = []
                 for gjf in inp:
                     out = gjf[:-3]+'out'
-                    if Config.debug > 1:
-                        print('running: '+Config.Gaussian.g16_exe+' < '+gjf+' > '+out)
-                    os.system(Config.Gaussian.g16_exe+' < '+gjf+' > '+out)
+                    _LOGGER.debug('running: %s < %s > %s', Config.Gaussian.g16_exe, gjf, out)
+                    system(Config.Gaussian.g16_exe+' < '+gjf+' > '+out)
                     outs.append(out)
                 return outs
 
@@ -2695,9 +2757,8 @@ class PDB():
                 outs = []
                 for gjf in inp:
                     out = gjf[:-3]+'out'
-                    if Config.debug > 1:
-                        print('running: '+Config.Gaussian.g09_exe+' < '+gjf+' > '+out)
-                    os.system(Config.Gaussian.g09_exe+' < '+gjf+' > '+out)
+                    _LOGGER.debug('running: %s < %s > %s', Config.Gaussian.g09_exe, gjf, out)
+                    system(Config.Gaussian.g09_exe+' < '+gjf+' > '+out)
                     outs.append(out)
                 return outs
 
@@ -2707,10 +2768,12 @@ class PDB():
             gjf_path: str, 
             out_path: str, 
             cluster: ClusterInterface,
-            res_setting: dict
+            res_setting: dict,
+            sub_dir: str = './'
         ) -> job_manager.ClusterJob :
         '''
         job for submit g16 for gjf > out to cluster
+        sub_dir: the dir that paths of gjf and out are relative to
         return a ClusterJob object
         '''
         cmd = f'{Config.Gaussian.g16_exe} < {gjf_path} > {out_path}'
@@ -2722,8 +2785,10 @@ class PDB():
             cluster = cluster,
             env_settings = cluster.G16_ENV['CPU'],
             res_keywords = res_setting,
-            sub_dir = './', # because gjf path are relative
-            sub_script_path = gjf_path.removesuffix('gjf')+'cmd'
+            sub_dir = sub_dir, # because gjf path are relative
+            sub_script_path = os.path.normpath(os.path.join(sub_dir, gjf_path.removesuffix('gjf')+'cmd')),
+            stage = 'qm',
+            expected_outputs = [out_path]
         )
         return job
 
@@ -2741,14 +2806,12 @@ class PDB():
         fchk_paths = []
         for chk in self.qm_cluster_chk:
             fchk = chk[:-3]+'fchk'
-            if Config.debug > 1:
-                print('running: '+'formchk '+chk+' '+fchk)
+            _LOGGER.debug('running: formchk %s %s', chk, fchk)
             run('formchk '+chk+' '+fchk, check=True, text=True, shell=True, capture_output=True)
             fchk_paths.append(fchk)
             # keep chk
             if not keep_chk:
-                if Config.debug > 1:
-                    print('removing: '+chk)
+                _LOGGER.debug('removing: %s', chk)
                 os.remove(chk)
 
         self.qm_cluster_fchk = fchk_paths
@@ -2838,7 +2901,7 @@ class PDB():
             prog        : program for wfn analysis (default: multiwfn)
                           **Multiwfn workflow**
                             1. Multiwfn xxx.fchk < parameter_file > output
-                            the result will be in ./LMOdip.txt 
+                            the result will be in LMOdip.txt (of a scratch dir)
                             2. extract value and project to the bond accordingly
         Returns:
             Dipoles     : A list of dipole data in a form of [(dipole_norm_signed, dipole_vec), ...]
@@ -2897,11 +2960,12 @@ class PDB():
                 
                 # Run Multiwfn
                 mltwfn_out_path = fchk[:-len(fchk.split('.')[-1])]+'dip'
-                if Config.debug >= 2:
-                    print('Running: '+Config.Multiwfn.exe+' '+fchk+' < '+mltwfn_in_path)
-                run(Config.Multiwfn.exe+' '+fchk+' < '+mltwfn_in_path, check=True, text=True, shell=True, capture_output=True)
-                run('mv LMOdip.txt '+mltwfn_out_path, check=True, text=True, shell=True, capture_output=True)
-                run('rm LMOcen.txt new.fch', check=True, text=True, shell=True, capture_output=True)
+                _LOGGER.debug('Running: %s %s < %s', Config.Multiwfn.exe, fchk, mltwfn_in_path)
+                # run in a scratch dir. (Multiwfn write LMOdip.txt LMOcen.txt new.fch in the CWD)
+                with ScratchDir('multiwfn') as scratch_dir:
+                    run(f'{Config.Multiwfn.exe} {os.path.abspath(fchk)} < {os.path.abspath(mltwfn_in_path)}',
+                        check=True, text=True, shell=True, capture_output=True, cwd=scratch_dir)
+                    shutil.move(f'{scratch_dir}LMOdip.txt', mltwfn_out_path)
                 
                 # get dipole
                 with open(mltwfn_out_path) as f:
@@ -2936,8 +3000,7 @@ class PDB():
         # set nthreads
         if n_cores == None:
             n_cores = str(Config.n_cores)
-        if Config.debug >= 1:
-            print("Running: "+"sed -i 's/nthreads= *[0-9][0-9]*/nthreads=  "+n_cores+"/' "+Config.Multiwfn.DIR+"/settings.ini")
+        _LOGGER.info("Running: sed -i 's/nthreads= *[0-9][0-9]*/nthreads=  %s/' %s/settings.ini", n_cores, Config.Multiwfn.DIR)
         run("sed -i 's/nthreads= *[0-9][0-9]*/nthreads=  "+n_cores+"/' "+Config.Multiwfn.DIR+"/settings.ini", check=True, text=True, shell=True, capture_output=True)
 
     def get_rosetta_ddg(self, rosetta_home: str, muta_groups: List[tuple], relaxed_pdb: str,
@@ -2949,25 +3012,26 @@ class PDB():
                         period: int = 120,
                         job_array_size: int = 100,
                         res_setting: Union[dict, None] = None,
-                        cluster_debug: bool = 0 ) -> dict:
+                        cluster_debug: bool = 0,
+                        groups_per_job: int = 1,
+                        native_array: bool = False ) -> dict:
         '''
         MVP function to obtain Rosetta ddG stability score for current structure in PDB()
         ref: https://www.rosettacommons.org/docs/latest/cartesian-ddG
         due to the fact that cartesian_ddg can only benefit from 1 cpu core, we will parallel
         multi-mutants with ARMer job array to speed up.
-        '''
-        TEMP_ROSETTA_RES = {    'core_type' : 'cpu',
-                                'nodes':'1',
-                                'node_cores' : '1',
-                                'job_name' : 'EnzyHTP_ddG',
-                                'partition' : 'production',
-                                'mem_per_core' : '2G',
-                                'walltime' : '1-00:00:00',
-                                'account' : 'yang_lab_csb'}
+        groups_per_job: pack this number of mutation groups in one job that request the same number of
+                        cores (x node_cores) and run them concurrently. Each group still have its own
+                        group_{i}/ dir and .ddg file.
+        res_setting: resource settings that replace the default in Config.Rosetta.DDG_RES (per group)
+        native_array: submit all jobs as one job array of the cluster (e.g.: sbatch --array) from {ddg_dir}
+                      that keeps {job_array_size} running. (see job_manager.ClusterJobArray)
+        '''
+        res_keywords = type(self)._get_default_res_setting(Config.Rosetta.DDG_RES, res_setting)
         if ddg_dir is None:
             ddg_dir = f'{self.dir}/ddg/'
         mkdir(ddg_dir)
-        ddg_jobs = []
+        ddg_cmds = []
         ddg_result_files = {}
 
         for i, mut_group in enumerate(muta_groups):
@@ -2994,24 +3058,55 @@ class PDB():
                 of.write(f'{len(mut_group)}{line_feed}')
                 for r_mutaflag in mut_group:
                     of.write(f'{r_mutaflag}{line_feed}')
-            # make job
-            ddg_cmd = f'{rosetta_home}/source/bin/cartesian_ddg.static.linuxgccrelease @ ./{os.path.relpath(flag_file_path, group_dir)}'
-            ddg_job = job_manager.ClusterJob.config_job(
-                        commands = ddg_cmd,
-                        cluster = cluster,
-                        env_settings = '',
-                        res_keywords = TEMP_ROSETTA_RES,
-                        sub_dir = group_dir,
-                        sub_script_path = f'{group_dir}/submit_ddg.cmd')
-            ddg_jobs.append(ddg_job)
+            ddg_cmds.append((group_dir, f'{rosetta_home}/source/bin/cartesian_ddg.static.linuxgccrelease @ ./{os.path.relpath(flag_file_path, group_dir)}'))
             ddg_result_files[mut_group] = f'{group_dir}/mutation.ddg'
-        
-        job_manager.ClusterJob.wait_to_array_end(ddg_jobs, period, job_array_size)
-        # support multi groups?
+
+        # make jobs
+        ddg_jobs = []
+        if groups_per_job <= 1:
+            for group_dir, ddg_cmd in ddg_cmds:
+                ddg_job = job_manager.ClusterJob.config_job(
+                            commands = ddg_cmd,
+                            cluster = cluster,
+                            env_settings = '',
+                            res_keywords = res_keywords,
+                            sub_dir = group_dir,
+                            sub_script_path = f'{group_dir}/submit_ddg.cmd',
+                            stage = 'rosetta_ddg',
+                            expected_outputs = [f'{group_dir}/mutation.ddg'])
+                ddg_jobs.append(ddg_job)
+        else:
+            if not isinstance(res_keywords, dict):
+                raise TypeError('get_rosetta_ddg: groups_per_job > 1 requires res_setting as a dict')
+            for j, pack in enumerate(chunked(ddg_cmds, groups_per_job)):
+                pack_res_keywords = copy.deepcopy(res_keywords)
+                pack_res_keywords['node_cores'] = str(int(res_keywords['node_cores']) * len(pack))
+                # run groups in the pack concurrently in the allocation. The job fails if any group fails
+                commands = []
+                for k, (group_dir, ddg_cmd) in enumerate(pack):
+                    commands.append(f'(cd {os.path.abspath(group_dir)} && {ddg_cmd}) &')
+                    commands.append(f'pid_{k}=$!')
+                commands.append('rc=0')
+                commands.extend(f'wait $pid_{k} || rc=1' for k in range(len(pack)))
+                commands.append('exit $rc')
+                ddg_job = job_manager.ClusterJob.config_job(
+                            commands = commands,
+                            cluster = cluster,
+                            env_settings = '',
+                            res_keywords = pack_res_keywords,
+                            sub_dir = ddg_dir,
+                            sub_script_path = f'{ddg_dir}/submit_ddg_pack_{j}.cmd',
+                            stage = 'rosetta_ddg',
+                            expected_outputs = [f'{group_dir}/mutation.ddg' for group_dir, ddg_cmd in pack])
+                ddg_jobs.append(ddg_job)
+            _LOGGER.info('get_rosetta_ddg: packed %s groups into %s jobs', len(ddg_cmds), len(ddg_jobs))
+
+        job_manager.ClusterJob.wait_to_array_end(ddg_jobs, period, job_array_size, native_array=native_array)
+        # collect all groups at once
+        ddg_df = type(self).collect_rosetta_ddg_results(ddg_dir).set_index('ddg_file')
         result = {}
         for mutants, ddg_file in ddg_result_files.items():
-            ddg_value = type(self).get_rosetta_ddg_result(ddg_file, niter)
-            result[mutants] = ddg_value
+            result[mutants] = ddg_df.loc[os.path.abspath(ddg_file), 'ddg']
         return result
     
     def relax_with_rosetta(self, rosetta_home: str, nstruct_relax: int = 20,
@@ -3025,15 +3120,9 @@ class PDB():
         MVP function to relax the structure with Rosetta
         only can work with ddG calculation right now
         ref: https://www.rosettacommons.org/docs/latest/application_documentation/structure_prediction/relax
+        res_setting: resource settings that replace the default in Config.Rosetta.RELAX_RES
         '''
-        TEMP_ROSETTA_RES = {    'core_type' : 'cpu',
-                                'nodes':'1',
-                                'node_cores' : '24',
-                                'job_name' : 'EnzyHTP_r_relax',
-                                'partition' : 'production',
-                                'mem_per_core' : '2G',
-                                'walltime' : '1-00:00:00',
-                                'account' : 'yang_lab_csb'}
+        res_keywords = type(self)._get_default_res_setting(Config.Rosetta.RELAX_RES, res_setting)
 
         int_pdb_path_1 = f'{self.path.removesuffix(".pdb")}_rosetta.pdb'
         int_pdb_path_2 = f'{self.path.removesuffix(".pdb")}_relaxed.pdb'
@@ -3045,15 +3134,16 @@ class PDB():
         run(f'rm {self.path.split("/")[-1].removesuffix(".pdb")}_ignorechain.fasta',
             check=True, text=True, shell=True, capture_output=True)        
         # relax
-        relax_cmd = f'mpiexec -np {TEMP_ROSETTA_RES["node_cores"]} {rosetta_home}/source/bin/relax.mpi.linuxgccrelease -s {int_pdb_path_1} -use_input_sc -ignore_unrecognized_res -nstruct {nstruct_relax} -fa_max_dis 9.0'
+        relax_cmd = f'mpiexec -np {res_keywords["node_cores"]} {rosetta_home}/source/bin/relax.mpi.linuxgccrelease -s {int_pdb_path_1} -use_input_sc -ignore_unrecognized_res -nstruct {nstruct_relax} -fa_max_dis 9.0'
         relax_job = job_manager.ClusterJob.config_job(
                     commands = relax_cmd,
                     cluster = cluster,
                     env_settings = ['module load GCC/5.4.0-2.26', 'module load OpenMPI'],
-                    res_keywords = TEMP_ROSETTA_RES,
+                    res_keywords = res_keywords,
                     sub_dir = self.dir,
-                    sub_script_path = f'{self.dir}/submit_relax.cmd')
-        relax_job.submit()
+                    sub_script_path = f'{self.dir}/submit_relax.cmd',
+                    stage = 'rosetta_relax')
+        relax_job.submit_or_reattach()
         relax_job.wait_to_end(period=period)
         # get relaxed pdb
         # get the lowest score
@@ -3077,6 +3167,102 @@ class PDB():
         min_sc_idx = score_df['total_score'].idxmin() + 1
         return min_sc_idx
 
+    @classmethod
+    def collect_rosetta_ddg_results(cls, ddg_dir: str, n_workers: int = 16) -> pd.DataFrame:
+        '''
+        collect results of all {ddg_dir}/group_*/mutation.ddg files (from get_rosetta_ddg) reading
+        them concurrently in {n_workers} threads.
+        WT and mutant scores are distinguished by the round labels (WT_/MUT_) in the .ddg file.
+        Return:
+            a DataFrame with a row for each group (sorted by group index) and columns:
+            group, mutations (from mutation.txt), ddg_file, n_wt, n_mut, wt_mean, wt_sd, mut_mean, mut_sd, ddg,
+            wt_scores, mut_scores (score of each iteration as arrays)
+        '''
+        ddg_files = glob.glob(f'{ddg_dir}/group_*/mutation.ddg')
+        ddg_files.sort(key=lambda x: int(re.search(r'group_([0-9]+)', x).group(1)))
+        if not ddg_files:
+            raise Exception(f'collect_rosetta_ddg_results: no group_*/mutation.ddg in {ddg_dir}')
+        with ThreadPoolExecutor(max_workers=min(n_workers, len(ddg_files))) as executor:
+            records = list(executor.map(cls._read_rosetta_ddg_file, ddg_files))
+        return pd.DataFrame.from_records(records)
+
+    @staticmethod
+    def _read_rosetta_ddg_file(ddg_file: str) -> dict:
+        '''
+        read a .ddg file (and the mutation.txt aside) to a record of collect_rosetta_ddg_results
+        '''
+        group_dir = os.path.dirname(os.path.abspath(ddg_file))
+        wt_scores = []
+        mut_scores = []
+        with open(ddg_file) as f:
+            for line in f:
+                l_p = line.split()
+                if len(l_p) < 4:
+                    continue
+                if l_p[2].startswith('WT'):
+                    wt_scores.append(float(l_p[3]))
+                else:
+                    mut_scores.append(float(l_p[3]))
+        mutations = None
+        muta_file_path = f'{group_dir}/mutation.txt'
+        if os.path.isfile(muta_file_path):
+            with open(muta_file_path) as f:
+                mutations = tuple(line.strip() for line in f.readlines()[2:] if line.strip())
+        wt_scores = np.array(wt_scores)
+        mut_scores = np.array(mut_scores)
+        wt_mean = wt_scores.mean() if len(wt_scores) else np.nan
+        mut_mean = mut_scores.mean() if len(mut_scores) else np.nan
+        return {
+            'group': os.path.basename(group_dir),
+            'mutations': mutations,
+            'ddg_file': os.path.abspath(ddg_file),
+            'n_wt': len(wt_scores),
+            'n_mut': len(mut_scores),
+            'wt_mean': wt_mean,
+            'wt_sd': wt_scores.std(ddof=1) if len(wt_scores) > 1 else np.nan,
+            'mut_mean': mut_mean,
+            'mut_sd': mut_scores.std(ddof=1) if len(mut_scores) > 1 else np.nan,
+            'ddg': mut_mean - wt_mean,
+            'wt_scores': wt_scores,
+            'mut_scores': mut_scores,
+        }
+
+    @classmethod
+    def collect_rosetta_scores(cls, root_dir: str, n_workers: int = 16) -> pd.DataFrame:
+        '''
+        collect all score.sc files under {root_dir} (recursively) reading them concurrently in {n_workers} threads.
+        Return:
+            a DataFrame of all score lines with columns in the score.sc header and
+            score_file, idx (the structure index in the file start from 1 as get_rosetta_lowest_score),
+            is_lowest (the lowest total_score in the file)
+        '''
+        score_files = sorted(glob.glob(f'{root_dir}/**/score.sc', recursive=True))
+        if not score_files:
+            raise Exception(f'collect_rosetta_scores: no score.sc in {root_dir}')
+        with ThreadPoolExecutor(max_workers=min(n_workers, len(score_files))) as executor:
+            score_dfs = list(executor.map(cls._read_rosetta_score_file, score_files))
+        score_df = pd.concat(score_dfs, ignore_index=True)
+        lowest_idx = score_df.groupby('score_file')['total_score'].idxmin()
+        score_df['is_lowest'] = False
+        score_df.loc[lowest_idx, 'is_lowest'] = True
+        return score_df
+
+    @staticmethod
+    def _read_rosetta_score_file(score_file: str) -> pd.DataFrame:
+        '''
+        read a score.sc file (SEQUENCE: line, SCORE: header line, SCORE: lines)
+        '''
+        with open(score_file) as f:
+            rows = [line.split() for line in f if line.startswith('SCORE:')]
+        header = rows[0]
+        score_df = pd.DataFrame(rows[1:], columns=header)
+        for column in header:
+            if column not in ('SCORE:', 'description'):
+                score_df[column] = pd.to_numeric(score_df[column], errors='coerce')
+        score_df['score_file'] = os.path.abspath(score_file)
+        score_df['idx'] = np.arange(1, len(score_df)+1)
+        return score_df
+
     @classmethod
     def get_rosetta_ddg_result(cls, ddg_file: str, niter: int):
         '''
@@ -3088,34 +3274,34 @@ class PDB():
         return mut_sc_mean - wt_sc_mean
 
     @classmethod
-    def get_rmsd(cls, prmtop_path: str, traj_path: str, mask: str) -> float:
+    def get_rmsd(cls, prmtop_path: str, traj_path: str, mask: str,
+                 ref: Union[str, np.ndarray] = 'average', mass: bool = True,
+                 if_series: bool = False) -> Union[float, np.ndarray]:
         """
         mvp function for RMSD calculation
+        Args:
+            prmtop_path
+            traj_path: (imaged) trajectory. (e.g.: made by PDB.nc2mdcrd)
+            mask: Amber mask of atoms to calculate. (:ids, @ids, @names or :ids@names e.g.: ':1-253@CA'.
+                  see trajectory.Topology.select)
+            ref: reference of the RMSD. 
+                 first: the first frame
+                 average: the average structure after fitting to the first frame (default)
+                 or a (n_atoms_in_mask, 3) array
+            mass: mass weighted
+            if_series: return RMSD of each frame instead of the average
+        Return:
+            average RMSD (or per-frame RMSD)
+        Batched Kabsch alignment in NumPy. (see core/rmsd.py)
         """
-        tmp_rmsd_in = "./cpptraj_rmsd.in"
-        tmp_rmsd_out = "./rmsd.dat"
-
-        with open(tmp_rmsd_in, "w") as of:
-            of.write(f"""parm {prmtop_path}
-trajin {traj_path}
-autoimage
-rmsd {mask} first mass
-average crdset AVE {mask}
-run
-autoimage
-rmsd {mask} ref AVE * out {tmp_rmsd_out} mass
-run
-""")
-        try:
-            run(f"cpptraj -i {tmp_rmsd_in}",
-            check=True, text=True, shell=True, capture_output=True)
-        except CalledProcessError as e:
-            print(e.stdout, e.stderr, sep=os.linesep)
-            sys.exit(1)
-        result = cls.get_cpptraj_rmsd_result(tmp_rmsd_out)
-        os.remove(tmp_rmsd_in)
-        os.remove(tmp_rmsd_out)
-        return result
+        topology = trajectory.read_prmtop_topology(prmtop_path)
+        atom_idx = topology.select(mask)
+        coords = trajectory.read_traj(traj_path, topology.n_atoms)[:, atom_idx]
+        weights = topology.masses[atom_idx] if mass else None
+        rmsd_series = rmsd.get_rmsd_series(coords, ref, weights)
+        if if_series:
+            return rmsd_series
+        return rmsd_series.mean()
 
     @classmethod
     def get_cpptraj_rmsd_result(cls, result_path: str) -> float:
@@ -3129,43 +3315,39 @@ run
     def get_sasa_ratio(cls, 
                  prmtop_path: str, traj_path: str,
                  mask_pro: str, mask_pro_target: str, mask_sub: str,
-                 tmp_dir: str = '.') -> float:
+                 tmp_dir: str = '.', n_sphere_points: int = 960,
+                 n_cores: Union[int, None] = None) -> float:
         """
         mvp function for SASA calculation
         Args:
             prmtop_path
-            traj_path
+            traj_path: (imaged) trajectory. (e.g.: made by PDB.nc2mdcrd)
             mask_pro: mask selection for the protein
             mask_pro_target: mask selection for the subsection in the protein as the SASA target
             mask_sub: mask selection for the substrate
-            tmp_dir: temporary dir for divided traj files
+            tmp_dir: (not used. the trajectory is read in memory)
+            n_sphere_points: number of points on each atom sphere in the Shrake-Rupley algorithm
+            n_cores: number of processes that frames are split to (default: Config.n_cores)
         Return:
             (sasa_sub/sasa_pro).mean() average sasa ratio from each frame
-        # WARNING: @biopaul919 reported mt.load have a bug that make the result wrong.
+        Only the target residues (occluded by the rest of the protein) and the substrate 
+        are calculated. (see core/sasa.py)
         """
-        import mdtraj as mt
-        # divide traj
-        traj_parm_1, traj_parm_2 = cls.divide_traj(prmtop_path, traj_path, mask_pro, mask_sub, tmp_dir)
+        if n_cores is None:
+            n_cores = Config.n_cores
+        topology = trajectory.read_prmtop_topology(prmtop_path)
+        coords = trajectory.read_traj(traj_path, topology.n_atoms)
+        radii = sasa.get_atomic_radii(topology.elements)
+        pro_idx = topology.select(mask_pro)
+        sub_idx = topology.select(mask_sub)
+        # target atoms as indexes in the protein
+        target_idx = np.nonzero(np.isin(pro_idx, topology.select(mask_pro_target)))[0]
         # protein sasa
-        traj_1 = mt.load(traj_parm_1[0], top=traj_parm_1[1])
-        sasa_df_pro = mt.shrake_rupley(traj_1, n_sphere_points=5000, mode='residue')
-        target_resi_idx = map(lambda x: int(x.strip()), mask_pro_target[1:].split(','))
-        holder = np.zeros(len(sasa_df_pro)) # holder for sasa_pro of each frame
-        test = 0
-        for idx in target_resi_idx:
-            test +=  sasa_df_pro[0][idx-1]
-            holder += sasa_df_pro[:, idx-1]
-        sasa_pro_by_frame = holder*100
+        sasa_pro_by_frame = sasa.get_frames_sasa(
+            coords[:, pro_idx], radii[pro_idx], target_idx, n_sphere_points, n_cores=n_cores).sum(axis=1)
         # substrate sasa
-        traj_2 = mt.load(traj_parm_2[0], top=traj_parm_2[1])
-        sasa_df_sub = mt.shrake_rupley(traj_2, n_sphere_points=5000, mode='residue')
-        sasa_sub_by_frame = sasa_df_sub[:, 0]*100
-
-        # clean up
-        os.remove(traj_parm_1[0])
-        os.remove(traj_parm_1[1])
-        os.remove(traj_parm_2[0])
-        os.remove(traj_parm_2[1])
+        sasa_sub_by_frame = sasa.get_frames_sasa(
+            coords[:, sub_idx], radii[sub_idx], None, n_sphere_points, n_cores=n_cores).sum(axis=1)
 
         return (sasa_sub_by_frame/sasa_pro_by_frame).mean()
 
@@ -3175,46 +3357,35 @@ run
                  mask_pro: str, mask_pro_target: str, mask_sub: str, dynamic_sele: bool=False,
                  dot_solvent: int = 0, dot_density: int = 2,  
                  tmp_dir: str = '.', traj_start: str=None, traj_end: str=None,
-                 if_complete_data: bool=False) -> float:
+                 if_complete_data: bool=False, n_cores: Union[int, None] = None) -> float:
         """
         mvp function for SES calculation
         Args:
             prmtop_path
-            traj_path
+            traj_path: (imaged) trajectory. (e.g.: made by PDB.nc2mdcrd)
             mask_pro: mask selection for the protein
             mask_pro_target: mask selection for the subsection in the protein as the SASA target
+                             (an Amber residue mask or a PyMOL selection that can refer to the protein
+                             and the substrate as the object "pro" and "sub")
             mask_sub: mask selection for the substrate
             dynamic_sele: if update selection every frame, must use if distance based pattern is used
                           in mask_pro_target
             dot_solvent: surface type (0: ses 1: sasa)
             dot_density: surface qulity
-            tmp_dir: temporary dir for divided traj files
+            tmp_dir: (not used. the trajectory is read in memory)
+            n_cores: number of PyMOL worker processes that frames are split to (default: Config.n_cores)
         Return:
             avg(ses_sub)/avg(ses_pro)
+        The PyMOL sessions are kept for later calls. (see core/pymol_pool.py)
         """
-        import pymol2
-        if dynamic_sele:
-            # 1. split states frist
-            # 2. iterate using state names
-            # 3. use pattern like f"(br. (((({obj_name} & {mask}) around 4) and {obj_name}) and (not n. C+H+O+N) and (not elem H)) and (not resi 1449+1181)) & n. CA"
-            # ref https://github.com/shaoqx/CalcKit/tree/master/pymol_script/anchor_detect.py
-            sys.exit(1) # TODO place holder
-        # divide traj
-        traj_parm_1, traj_parm_2 = cls.divide_traj(
-            prmtop_path, traj_path, mask_pro, mask_sub, 
-            tmp_dir, traj_start, traj_end)
-        # protein ses
-        ## start pymol
-        p_session = pymol2.PyMOL()
-        p_session.start()
-        p_session.cmd.set("dot_solvent", dot_solvent)
-        p_session.cmd.set("dot_density", dot_density)
-        if Config.debug < 2:
-            p_session.cmd.feedback("disable","all","everything")
-        ## load traj protein
-        pro_traj_obj = p_session.cmd.get_unused_name("pro_traj")
-        p_session.cmd.load(traj_parm_1[1], pro_traj_obj)
-        p_session.cmd.load_traj(traj_parm_1[0], pro_traj_obj)
+        if n_cores is None:
+            n_cores = Config.n_cores
+        topology = trajectory.read_prmtop_topology(prmtop_path)
+        coords = trajectory.read_traj(traj_path, topology.n_atoms)
+        if traj_start and traj_end is not None:
+            coords = coords[int(traj_start)-1:int(traj_end)]
+        pro_idx = topology.select(mask_pro)
+        sub_idx = topology.select(mask_sub)
         ## define selection
         if mask_pro_target.startswith(":"):
             target_resi_idx = map(lambda x: str(x.strip()), mask_pro_target[1:].split(','))
@@ -3222,32 +3393,11 @@ run
         else:
             pymol_sele_pattern = mask_pro_target
         ## calculate SES
-        num_frames = p_session.cmd.count_states(pro_traj_obj)
-        ses_pro_by_frame = []
-        for i in range(num_frames):
-            ses_pro_by_frame.append(
-                p_session.cmd.get_area(selection=f"{pymol_sele_pattern} & {pro_traj_obj}", state=i+1)
-            )
-        p_session.cmd.delete(pro_traj_obj)
-        # substrate sasa
-        ## load traj substrate
-        sub_traj_obj = p_session.cmd.get_unused_name("sub_traj")
-        p_session.cmd.load(traj_parm_2[1], sub_traj_obj)
-        p_session.cmd.load_traj(traj_parm_2[0], sub_traj_obj)
-        ## calculate SES
-        num_frames = p_session.cmd.count_states(sub_traj_obj)
-        ses_sub_by_frame = []
-        for i in range(num_frames):
-            ses_sub_by_frame.append(
-                p_session.cmd.get_area(selection=sub_traj_obj, state=i+1)
-            )
-        p_session.cmd.delete(sub_traj_obj)
-        # clean up
-        os.remove(traj_parm_1[0])
-        os.remove(traj_parm_1[1])
-        os.remove(traj_parm_2[0])
-        os.remove(traj_parm_2[1])
-        p_session.stop()
+        ses_pro_by_frame, ses_sub_by_frame = PyMOLPool.get_pool(n_cores).get_area_by_frame(
+            topology.get_pdb_str(coords[0], pro_idx), coords[:, pro_idx],
+            topology.get_pdb_str(coords[0], sub_idx), coords[:, sub_idx],
+            pymol_sele_pattern, dynamic_sele, dot_solvent, dot_density)
+
         if if_complete_data:
             return np.array(ses_sub_by_frame).mean(), np.array(ses_pro_by_frame).mean()
         return (np.array(ses_sub_by_frame)/np.array(ses_pro_by_frame)).mean()
@@ -3258,13 +3408,16 @@ run
                     traj_start: str=None, traj_end: str=None) -> tuple:
         """
         divide traj into 2 trajs defined by mask1 and mask2
+        the files are in a unique dir in {tmp_dir} (the caller should remove the dir
+        e.g.: rmtree(os.path.dirname(traj_parm_1[0])))
         """
-        tmp_cpptraj_in = f'{tmp_dir}/cpptraj_divide.in'
-        tmp_traj_1 = f'{tmp_dir}/traj_1.nc'
-        tmp_traj_2 = f'{tmp_dir}/traj_2.nc'
+        out_dir = tempfile.mkdtemp(prefix='divide_traj_', dir=tmp_dir)
+        tmp_cpptraj_in = f'{out_dir}/cpptraj_divide.in'
+        tmp_traj_1 = f'{out_dir}/traj_1.nc'
+        tmp_traj_2 = f'{out_dir}/traj_2.nc'
         prmtop_name = prmtop_path.split('/')[-1]
-        tmp_prmtop_1 = f'{tmp_dir}/traj_1.{prmtop_name}'
-        tmp_prmtop_2 = f'{tmp_dir}/traj_2.{prmtop_name}'
+        tmp_prmtop_1 = f'{out_dir}/traj_1.{prmtop_name}'
+        tmp_prmtop_2 = f'{out_dir}/traj_2.{prmtop_name}'
         start_end_pattern = ''
         if traj_start and traj_end is not None:
             start_end_pattern = f' {traj_start} {traj_end}'
@@ -3273,18 +3426,19 @@ run
             of.write(f'''parm {prmtop_path}
 trajin {traj_path}{start_end_pattern}
 autoimage
-strip !({mask1}) nobox outprefix {tmp_dir}/traj_1
+strip !({mask1}) nobox outprefix {out_dir}/traj_1
 outtraj {tmp_traj_1}
 unstrip
-strip !({mask2}) nobox outprefix {tmp_dir}/traj_2
+strip !({mask2}) nobox outprefix {out_dir}/traj_2
 outtraj {tmp_traj_2}
 ''')
         try:
             run(f"cpptraj -i {tmp_cpptraj_in}",
-                check=True, text=True, shell=True, capture_output=True)
+                check=True, text=True, shell=True, capture_output=True, cwd=out_dir)
         except CalledProcessError as e:
-            print(e.stdout, e.stderr, sep=os.linesep)
-            sys.exit(1)
+            _LOGGER.error('cpptraj failed.%s%s%s%s', os.linesep, e.stdout, os.linesep, e.stderr)
+            rmtree(out_dir)
+            raise e
         os.remove(tmp_cpptraj_in)
         return (tmp_traj_1, tmp_prmtop_1), (tmp_traj_2, tmp_prmtop_2)
 
@@ -3338,30 +3492,91 @@ outtraj {tmp_traj_2}
         cluster: ClusterInterface = None,
         period: int = 30,
         res_setting: Union[dict, None] = None,
-        cluster_debug: bool = 0):
+        cluster_debug: bool = 0,
+        n_chunks: int = 1,
+        job_array_size: int = 0,
+        energy_out_path: str = None):
         """mvp function for getting the MMPBSA binding assessment for
-        {ligand_mask} from the trajectory"""
+        {ligand_mask} from the trajectory
+        n_chunks > 1 splits the frames into chunks that run in parallel and merges
+        the results (see run_mmpbsa_chunks)
+        energy_out_path: also write energy terms of each frame to this CSV file (MMPBSA.py -eo)
+                         use extract_mmpbsa_frame_out to read it"""
         traj_file = self.mdcrd
-        dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop = self.make_mmpbsa_prmtops(ligand_mask, igb)
-        mmpbsa_out_file = self.run_mmpbsa(
-            dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file,
-            in_file, overwrite_in, 
-            if_cluster_job, cluster, period, res_setting, cluster_debug
-            )
-        result = type(self).extract_mmpbsa_out(mmpbsa_out_file)
-
-        #clean
-        if Config.debug < 2:
-            os.remove(dr_prmtop)
-            os.remove(dl_prmtop)
-            os.remove(dc_prmtop)
-            os.remove(sc_prmtop)
-        if Config.debug < 1:    
-            os.remove(mmpbsa_out_file)
+        dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop = self.get_mmpbsa_prmtops(ligand_mask, igb)
+        if n_chunks > 1:
+            mmpbsa_out_files = self.run_mmpbsa_chunks(
+                dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file, n_chunks,
+                if_cluster_job, cluster, job_array_size, period, res_setting,
+                energy_out_path
+                )
+            result = type(self).merge_mmpbsa_out(mmpbsa_out_files)
+        else:
+            mmpbsa_out_files = [self.run_mmpbsa(
+                dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file,
+                in_file, overwrite_in, 
+                if_cluster_job, cluster, period, res_setting, cluster_debug,
+                energy_out_path
+                )]
+            result = type(self).extract_mmpbsa_out(mmpbsa_out_files[0])
+
+        #clean (prmtops are kept in the cache)
+        if Config.debug < 1:
+            for mmpbsa_out_file in mmpbsa_out_files:
+                os.remove(mmpbsa_out_file)
 
         return result
 
-    def make_mmpbsa_prmtops(self, ligand_mask: str, igb: int=5, use_ante_mmpbsa: bool=True):
+    def get_mmpbsa_prmtops(self, ligand_mask: str, igb: int=5, use_ante_mmpbsa: bool=True):
+        '''
+        Cached version of make_mmpbsa_prmtops.
+        The prmtop files are kept in {Config.Amber.MMPBSA.PRMTOP_CACHE_DIR}/{key}/ where key is made from the
+        sha256 of self.prmtop_path, ligand_mask, the radii set of igb and use_ante_mmpbsa. Re-running MMPBSA
+        on the same system (e.g.: different frames or gb model with the same radii) reuse them.
+        Returns:
+            dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop (in the cache. do not delete)
+        '''
+        cache_dir = Config.Amber.MMPBSA.PRMTOP_CACHE_DIR
+        if cache_dir is None:
+            cache_dir = f"{self.dir}/cache/mmpbsa_prmtop/"
+        mkdir(cache_dir)
+        key = type(self)._get_mmpbsa_prmtop_key(self.prmtop_path, ligand_mask, radii_map[str(igb)], use_ante_mmpbsa)
+        entry_dir = f"{cache_dir.rstrip('/')}/{key}/"
+        prmtop_paths = tuple(f"{entry_dir}{name}.prmtop" for name in ('dr', 'dl', 'dc', 'sc'))
+
+        if all(os.path.isfile(path) for path in prmtop_paths):
+            _LOGGER.info('get_mmpbsa_prmtops: found cached prmtops for %s in %s', ligand_mask, entry_dir)
+            return prmtop_paths
+
+        # make in a unique scratch dir and publish the whole dir at once
+        scratch_dir = tempfile.mkdtemp(prefix=f'{key}.', dir=cache_dir) + '/'
+        try:
+            self.make_mmpbsa_prmtops(ligand_mask, igb, use_ante_mmpbsa, out_dir=scratch_dir)
+            try:
+                os.rename(scratch_dir, entry_dir)
+            except OSError:
+                if not all(os.path.isfile(path) for path in prmtop_paths):
+                    raise
+                # made by another process at the same time
+        finally:
+            if os.path.isdir(scratch_dir):
+                rmtree(scratch_dir)
+
+        return prmtop_paths
+
+    @staticmethod
+    def _get_mmpbsa_prmtop_key(prmtop_path: str, ligand_mask: str, radii: str, use_ante_mmpbsa: bool) -> str:
+        '''
+        cache key of the MMPBSA prmtops
+        '''
+        sha = hashlib.sha256()
+        with open(prmtop_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        sha.update(f'|{ligand_mask.strip()}|{radii}|{int(bool(use_ante_mmpbsa))}'.encode())
+        return sha.hexdigest()[:24]
+
+    def make_mmpbsa_prmtops(self, ligand_mask: str, igb: int=5, use_ante_mmpbsa: bool=True, out_dir: str=None):
         '''
         Make prmtop files for the MMPB(GB)SA calculation
         1. make new pdbs
@@ -3371,32 +3586,53 @@ outtraj {tmp_traj_2}
                 A amber like str to define two fragments
             igb:
                 gb method used
+            out_dir:
+                dir for the prmtop files. (default: a unique {self.dir}/temp/mmpbsa_prmtop_*/ for each call)
+                intermediate files are made in a scratch dir and removed.
         Returns:
             dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop 
             for dry receptor, dry ligand, dry complex, and solvate complex, respectively
         '''
-        temp_dir = f"{self.dir}/temp/"
-        mkdir(temp_dir)
+        if out_dir:
+            temp_dir = out_dir
+            mkdir(temp_dir)
+        else:
+            # unique for each call so calls for other ligands/mutants in the same dir do not overwrite it
+            mkdir(f"{self.dir}/temp/")
+            temp_dir = tempfile.mkdtemp(prefix='mmpbsa_prmtop_', dir=f"{self.dir}/temp/") + '/'
+        with ScratchDir('mmpbsa_prep') as scratch_dir:
+            dr_prmtop, dl_prmtop, dc_prmtop = self._make_mmpbsa_dry_prmtops(ligand_mask, igb, use_ante_mmpbsa, temp_dir, scratch_dir)
+
+        sc_prmtop = type(self).update_radii(
+            self.prmtop_path,
+            out_path=f'{temp_dir}sc.prmtop', igb=igb)
+
+ 
+        return dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop
 
+    def _make_mmpbsa_dry_prmtops(self, ligand_mask: str, igb: int, use_ante_mmpbsa: bool, temp_dir: str, scratch_dir: str):
+        '''
+        make the dry receptor, ligand and complex prmtops in {temp_dir}. (intermediate files go to {scratch_dir})
+        '''
         if use_ante_mmpbsa:
             radii = radii_map[str(igb)]
             dr_prmtop = f"{temp_dir}dr.prmtop"
             dl_prmtop = f"{temp_dir}dl.prmtop"
             dc_prmtop = f"{temp_dir}dc.prmtop"
-            ante_cmd = f'ante-MMPBSA.py -p {self.prmtop_path} --radii {radii} -s ":WAT,Na+,Cl-" -c {dc_prmtop} -n "{ligand_mask}" -l {dl_prmtop} -r {dr_prmtop}'
+            ante_cmd = f'ante-MMPBSA.py -p {os.path.abspath(self.prmtop_path)} --radii {radii} -s ":WAT,Na+,Cl-" -c {os.path.abspath(dc_prmtop)} -n "{ligand_mask}" -l {os.path.abspath(dl_prmtop)} -r {os.path.abspath(dr_prmtop)}'
             try:
-                run(ante_cmd, check=0, text=True, shell=True, capture_output=True)
+                run(ante_cmd, check=0, text=True, shell=True, capture_output=True, cwd=scratch_dir)
             except CalledProcessError as err:
-                print(err.stdout, err.stderr)
+                _LOGGER.error('ante-MMPBSA.py failed. %s %s', err.stdout, err.stderr)
                 raise err
 
         else:
-            frag1_path = f"{temp_dir}frag1.pdb"
-            frag2_path = f"{temp_dir}frag2.pdb"
-            dc_path = f"{temp_dir}dry_complex.pdb"
+            frag1_path = f"{scratch_dir}frag1.pdb"
+            frag2_path = f"{scratch_dir}frag2.pdb"
+            dc_path = f"{scratch_dir}dry_complex.pdb"
             # decode ligand mask
             ligand_idx = int(ligand_mask.strip()[1:])
-            print(f'working on binding of {ligand_idx}')
+            _LOGGER.info('working on binding of %s', ligand_idx)
 
             # make new pdb files 
             stru1 = Structure.fromPDB(self.path).find_idx_residue(ligand_idx)
@@ -3424,16 +3660,8 @@ outtraj {tmp_traj_2}
                 local_lig = 0,
                 igb=igb, ifsolve=0, 
                 prm_out_path=f'{temp_dir}dc.prmtop', if_prm_only=1)[0]
-            # clean
-            if Config.debug < 2:
-                run('rm leap.log', check=0, text=True, shell=True, capture_output=True)
 
-        sc_prmtop = type(self).update_radii(
-            self.prmtop_path,
-            out_path=f'{temp_dir}sc.prmtop', igb=igb)
-
- 
-        return dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop
+        return dr_prmtop, dl_prmtop, dc_prmtop
 
     def run_mmpbsa(
         self,
@@ -3444,50 +3672,173 @@ outtraj {tmp_traj_2}
         cluster: ClusterInterface = None,
         period: int = 30,
         res_setting: Union[dict, None] = None,
-        cluster_debug: bool = 0):
-        """mvp function for running mmpbsa"""
+        cluster_debug: bool = 0,
+        energy_out_path: str = None,
+        out_path: str = None):
+        """mvp function for running mmpbsa
+        energy_out_path: also write energy terms of each frame to this CSV file (MMPBSA.py -eo)
+                         use extract_mmpbsa_frame_out to read it
+        out_path: where the result is copied to (default: a unique {self.dir}/temp/mmpbsa_*.dat for each call)"""
 
-        if not in_file:
-            in_file = Config.Amber.MMPBSA.build_MMPBSA_in()
-        else:
-            if os.path.exists(in_file):
-                if overwrite_in:
+        temp_dir = f'{self.dir}/temp/'
+        mkdir(temp_dir)
+        if out_path is None:
+            fd, out_path = tempfile.mkstemp(prefix='mmpbsa_', suffix='.dat', dir=temp_dir)
+            os.close(fd)
+        # MMPBSA.py write intermediate files (_MMPBSA_*, reference.frc) in the CWD.
+        # run in a unique dir on the shared file system and only copy back the results
+        with ScratchDir('mmpbsa', base_dir=temp_dir) as scratch_dir:
+            mmpbsa_out_path = f'{scratch_dir}mmpbsa.dat'
+            frame_out_path = f'{scratch_dir}mmpbsa_frames.csv'
+            if not in_file:
+                in_file = Config.Amber.MMPBSA.build_MMPBSA_in(f'{scratch_dir}MMPBSA.in')
+            else:
+                if os.path.exists(in_file):
+                    if overwrite_in:
+                        Config.Amber.MMPBSA.build_MMPBSA_in(in_file)
+                else:
                     Config.Amber.MMPBSA.build_MMPBSA_in(in_file)
+            prmtop_args = ' '.join(f'{flag} {os.path.abspath(path)}' for flag, path in (
+                ('-sp', sc_prmtop), ('-cp', dc_prmtop), ('-rp', dr_prmtop), ('-lp', dl_prmtop), ('-y', traj_file)))
+
+            if if_cluster_job:
+                res_keywords = type(self)._get_default_res_setting_mmpbsa(res_setting)
+                cmd = f'{Config.get_PC_cmd(res_keywords["node_cores"])} python2 {Config.Amber.MMPBSA.get_MMPBSA_engine()} -O -i {os.path.abspath(in_file)} -o {os.path.abspath(mmpbsa_out_path)} {prmtop_args}'
+                if energy_out_path:
+                    cmd = f'{cmd} -eo {frame_out_path}'
+                mmpbsa_job = job_manager.ClusterJob.config_job(
+                    commands = [f'cd {scratch_dir}', cmd],
+                    cluster = cluster,
+                    env_settings = cluster.AMBER_ENV['CPU'],
+                    res_keywords = res_keywords,
+                    sub_dir = './', # paths are absolute
+                    sub_script_path = f'{scratch_dir}submit_MMPBSA.cmd',
+                    stage = 'mmpbsa')
+                mmpbsa_job.submit()
+                mmpbsa_job.wait_to_end(period=period)
             else:
-                Config.Amber.MMPBSA.build_MMPBSA_in(in_file)
+                raise Exception("only support cluster job mode right now")
+            shutil.copyfile(mmpbsa_out_path, out_path)
+            if energy_out_path:
+                shutil.copyfile(frame_out_path, energy_out_path)
+
+        return out_path
+
+    def run_mmpbsa_chunks(
+        self,
+        dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file,
+        n_chunks: int,
+        if_cluster_job: bool = True,
+        cluster: ClusterInterface = None,
+        job_array_size: int = 0,
+        period: int = 30,
+        res_setting: Union[dict, None] = None,
+        energy_out_path: str = None):
+        """run MMPBSA.py on {n_chunks} chunks of the frame range in Config.Amber.MMPBSA.conf_in
+        (startframe/endframe/interval) in parallel. Each chunk runs in its own directory
+        in a scratch dir made for this call (under {self.dir}/temp/) as a job array on {cluster}
+        or as local processes. Use merge_mmpbsa_out to combine the results.
+        energy_out_path: also write energy terms of each frame of all chunks to this CSV file
+                         (MMPBSA.py -eo of each chunk merged in the frame order)
+        Returns:
+            a list of mmpbsa.dat paths of each chunk (copied to unique {self.dir}/temp/mmpbsa_chunk_*.dat)"""
         temp_dir = f'{self.dir}/temp/'
         mkdir(temp_dir)
-        mmpbsa_out_path = f'{temp_dir}mmpbsa.dat'
+        # a unique root so concurrent or earlier runs on the same PDB are not mixed in
+        with ScratchDir('mmpbsa_chunks', base_dir=temp_dir) as chunk_root:
+            chunk_out_paths = self._run_mmpbsa_chunks_in(
+                chunk_root, dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file, n_chunks,
+                if_cluster_job, cluster, job_array_size, period, res_setting)
+            out_paths = []
+            for i, chunk_out_path in enumerate(chunk_out_paths):
+                fd, out_path = tempfile.mkstemp(prefix=f'mmpbsa_chunk_{i}_', suffix='.dat', dir=temp_dir)
+                os.close(fd)
+                shutil.copyfile(chunk_out_path, out_path)
+                out_paths.append(out_path)
+            if energy_out_path:
+                type(self)._merge_mmpbsa_frame_out(
+                    [f'{os.path.dirname(chunk_out_path)}/mmpbsa_frames.csv' for chunk_out_path in chunk_out_paths],
+                    energy_out_path)
+        return out_paths
+
+    def _run_mmpbsa_chunks_in(
+        self, chunk_root,
+        dr_prmtop, dl_prmtop, dc_prmtop, sc_prmtop, traj_file,
+        n_chunks, if_cluster_job, cluster, job_array_size, period, res_setting):
+        """run the chunks of run_mmpbsa_chunks in {chunk_root}/mmpbsa_chunk_{i}/.
+        energy terms of each frame are written to mmpbsa_frames.csv in the chunk dir.
+        Returns:
+            a list of mmpbsa.dat paths of each chunk"""
+        frame_chunks = type(self)._get_mmpbsa_frame_chunks(n_chunks)
+        prmtop_args = ' '.join(f'{flag} {os.path.abspath(path)}' for flag, path in (
+            ('-sp', sc_prmtop), ('-cp', dc_prmtop), ('-rp', dr_prmtop), ('-lp', dl_prmtop), ('-y', traj_file)))
+
+        chunk_dirs = []
+        for i, (start, end) in enumerate(frame_chunks):
+            chunk_dir = f'{chunk_root}mmpbsa_chunk_{i}/'
+            mkdir(chunk_dir)
+            conf_in = copy.deepcopy(Config.Amber.MMPBSA.conf_in)
+            conf_in['startframe'] = start
+            conf_in['endframe'] = end
+            Config.Amber.MMPBSA.build_MMPBSA_in(f'{chunk_dir}mmpbsa.in', conf_in=conf_in)
+            chunk_dirs.append(chunk_dir)
 
         if if_cluster_job:
+            if not isinstance(cluster, ClusterInterface):
+                raise TypeError('cluster job need a cluster (ClusterInterface object) input')
             res_keywords = type(self)._get_default_res_setting_mmpbsa(res_setting)
-            cmd = f'{Config.get_PC_cmd(res_keywords["node_cores"])} python2 {Config.Amber.MMPBSA.get_MMPBSA_engine()} -O -i {in_file} -o {mmpbsa_out_path} -sp {sc_prmtop} -cp {dc_prmtop} -rp {dr_prmtop} -lp {dl_prmtop} -y {traj_file}'
-            mmpbsa_job = job_manager.ClusterJob.config_job(
-                commands = cmd,
-                cluster = cluster,
-                env_settings = cluster.AMBER_ENV['CPU'],
-                res_keywords = res_keywords,
-                sub_dir = './', # because path are relative
-                sub_script_path = f'{temp_dir}/submit_MMPBSA.cmd')
-            mmpbsa_job.submit()
-            mmpbsa_job.wait_to_end(period=period)
+            jobs = []
+            for chunk_dir in chunk_dirs:
+                # run in the chunk dir since MMPBSA.py writes intermediate files in the CWD
+                cmd = [f'cd {os.path.abspath(chunk_dir)}',
+                       f'{Config.get_PC_cmd(res_keywords["node_cores"])} python2 {Config.Amber.MMPBSA.get_MMPBSA_engine()} -O -i mmpbsa.in -o mmpbsa.dat -eo mmpbsa_frames.csv {prmtop_args}']
+                jobs.append(job_manager.ClusterJob.config_job(
+                    commands = cmd,
+                    cluster = cluster,
+                    env_settings = cluster.AMBER_ENV['CPU'],
+                    res_keywords = res_keywords,
+                    sub_dir = './',
+                    sub_script_path = f'{chunk_dir}submit_MMPBSA.cmd',
+                    stage = 'mmpbsa',
+                    expected_outputs = [f'{chunk_dir}mmpbsa.dat']))
+            _LOGGER.info('Running MMPBSA array on %s: number: %s size: %s period: %s', cluster.NAME, len(jobs), job_array_size, period)
+            failed_jobs = job_manager.ClusterJob.wait_to_array_end(jobs, period, job_array_size)
+            if failed_jobs:
+                raise Exception(f'run_mmpbsa_chunks: {len(failed_jobs)} MMPBSA jobs did not complete. ({[job.job_id for job in failed_jobs]})')
         else:
-            raise Exception("only support cluster job mode right now")
-        # clean
-        if Config.debug < 2:
-            run('rm reference.frc _MMPBSA_info', check=0, text=True, shell=True, capture_output=True)
-            os.remove("./tmp/MMPBSA.in")
-            os.remove(mmpbsa_job.sub_script_path)
+            # local processes. share Config.n_cores
+            n_workers = min(len(chunk_dirs), Config.n_cores)
+            n_cores = max(1, Config.n_cores // n_workers)
+            cmd = f'{Config.get_PC_cmd(n_cores)} python2 {Config.Amber.MMPBSA.get_MMPBSA_engine()} -O -i mmpbsa.in -o mmpbsa.dat -eo mmpbsa_frames.csv {prmtop_args}'
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(lambda chunk_dir: run(cmd, check=True, text=True, shell=True, capture_output=True, cwd=chunk_dir), chunk_dirs))
+
+        return [f'{chunk_dir}mmpbsa.dat' for chunk_dir in chunk_dirs]
 
-        return mmpbsa_out_path
+    @staticmethod
+    def _get_mmpbsa_frame_chunks(n_chunks: int) -> List[tuple]:
+        """split frames of Config.Amber.MMPBSA.conf_in into {n_chunks} (startframe, endframe)
+        that keep the same interval"""
+        conf_in = Config.Amber.MMPBSA.conf_in
+        if conf_in['endframe'] is None:
+            raise Exception('chunked MMPBSA requires Config.Amber.MMPBSA.conf_in["endframe"]')
+        frames = list(range(conf_in['startframe'], conf_in['endframe']+1, conf_in['interval']))
+        n_chunks = min(n_chunks, len(frames))
+        chunk_size = ceil(len(frames) / n_chunks)
+        return [(frames[i], frames[min(i+chunk_size, len(frames))-1]) for i in range(0, len(frames), chunk_size)]
 
     @staticmethod
     def _get_default_res_setting_mmpbsa(res_setting):
         """TODO combine those repeating functions"""
+        return PDB._get_default_res_setting(Config.Amber.MMPBSA.RES, res_setting)
+
+    @staticmethod
+    def _get_default_res_setting(default_res: dict, res_setting: Union[dict, None]) -> dict:
+        """a copy of {default_res} with keys assigned in {res_setting} replaced"""
         if res_setting is None:
             res_setting = dict()
         if isinstance(res_setting, dict):
-            res_setting_holder = copy.deepcopy(Config.Amber.MMPBSA.RES)
+            res_setting_holder = copy.deepcopy(default_res)
             # replace assigned key in default dict
             for k, v in res_setting.items():
                 res_setting_holder[k] = v
@@ -3508,6 +3859,103 @@ outtraj {tmp_traj_2}
             pb_result = PDB._extract_pb_gb_table(pb_result_tb)
         return {"pb":pb_result, "gb":gb_result}
     
+    @staticmethod
+    def extract_mmpbsa_frame_out(energy_out_file: str) -> Dict[str, Dict[str, Dict[str, np.ndarray]]]:
+        """extract the per-frame energy file of MMPBSA.py (the -eo CSV file. see run_mmpbsa)
+        Returns:
+            {"gb"/"pb": {"complex"/"receptor"/"ligand"/"delta": {term: array over frames}}}
+            the frame numbers are under the "Frame #" term.
+            e.g.: result["gb"]["delta"]["DELTA TOTAL"]
+        use helper.get_block_average/get_running_mean/get_converged_frame_number for the statistic"""
+        method_map = {"GENERALIZED BORN:": "gb", "POISSON BOLTZMANN:": "pb"}
+        result = {}
+        method = None
+        component = None
+        terms = None
+        with open(energy_out_file) as f:
+            for row in csv.reader(f):
+                if not row or not row[0].strip():
+                    continue
+                head = row[0].strip()
+                if head in method_map:
+                    method = method_map[head]
+                    result[method] = {}
+                elif head.endswith("Energy Terms"):
+                    component = head.split()[0].lower()
+                    terms = None
+                elif head == "Frame #":
+                    terms = [term.strip() for term in row]
+                    result[method][component] = {term: [] for term in terms}
+                elif terms is not None and method is not None:
+                    for term, value in zip(terms, row):
+                        result[method][component][term].append(float(value))
+        # to arrays
+        for method_data in result.values():
+            for component, component_data in method_data.items():
+                for term, values in component_data.items():
+                    component_data[term] = np.array(values, dtype=int if term == "Frame #" else float)
+        return result
+
+    @staticmethod
+    def _merge_mmpbsa_frame_out(energy_out_files: List[str], out_path: str) -> None:
+        """merge the -eo CSV files of frame chunks (see run_mmpbsa_chunks) into {out_path}.
+        The layout of the first file is kept and rows of each table ("Frame #" to the blank line)
+        are taken from all files in the order of {energy_out_files}"""
+        file_tables = []
+        for energy_out_file in energy_out_files:
+            with open(energy_out_file, newline='') as f:
+                file_tables.append(PDB._split_mmpbsa_frame_tables(list(csv.reader(f))))
+        with open(out_path, 'w', newline='') as of:
+            # same as MMPBSA.py (csv.writer with the default dialect)
+            writer = csv.writer(of)
+            for i, (rows, frame_rows) in enumerate(file_tables[0]):
+                writer.writerows(rows)
+                for tables in file_tables:
+                    writer.writerows(tables[i][1])
+
+    @staticmethod
+    def _split_mmpbsa_frame_tables(rows: List[list]) -> List[tuple]:
+        """split rows of a -eo CSV file into [(other rows, frame rows of the table after them), ...]"""
+        tables = [([], [])]
+        in_frames = False
+        for row in rows:
+            is_value = bool(row) and bool(row[0].strip())
+            if in_frames and is_value:
+                tables[-1][1].append(row)
+                continue
+            if in_frames:
+                # end of the table
+                tables.append(([], []))
+            in_frames = is_value and row[0].strip() == "Frame #"
+            tables[-1][0].append(row)
+        return tables
+
+    @staticmethod
+    def merge_mmpbsa_out(mmpbsa_out_files: List[str]) -> Dict[str, pd.DataFrame]:
+        """merge mmpbsa out files of frame chunks of the same system (see run_mmpbsa_chunks)
+        into the format of extract_mmpbsa_out. Combine the mean and (population) SD of each chunk
+        weighted by their frame numbers. SEM = SD/sqrt(N) as in MMPBSA.py"""
+        n_frames = []
+        results = []
+        for mmpbsa_out_file in mmpbsa_out_files:
+            with open(mmpbsa_out_file) as f:
+                n_frames.append(int(re.search(r"Calculations performed using ([0-9]+) complex frames", f.read()).group(1)))
+            results.append(PDB.extract_mmpbsa_out(mmpbsa_out_file))
+        n_frames = np.array(n_frames, dtype=float)
+        n_total = n_frames.sum()
+
+        merged_result = {}
+        for method in results[0]:
+            means = np.array([result[method]["mean"].to_numpy() for result in results])
+            sds = np.array([result[method]["sd"].to_numpy() for result in results])
+            mean = (n_frames[:, None] * means).sum(axis=0) / n_total
+            square_mean = (n_frames[:, None] * (sds**2 + means**2)).sum(axis=0) / n_total
+            sd = np.sqrt(np.abs(square_mean - mean**2))
+            merged_result[method] = pd.DataFrame(
+                {"mean": mean, "sd": sd, "sem": sd / np.sqrt(n_total)},
+                index=results[0][method].index)
+        return merged_result
+
     @staticmethod
     def _extract_pb_gb_table(table_str: str) -> pd.DataFrame:
         """the table looks like this:
@@ -3553,28 +4001,25 @@ outtraj {tmp_traj_2}
         # get radii
         radii = radii_map[str(igb)]
 
-        temp_dir = './parmed_tmp/'
-        mkdir(temp_dir)
-
-        new_prmtop_path = out_path
+        new_prmtop_path = os.path.abspath(out_path)
         # change Radii
-        with open(f'{temp_dir}/parmed.in','w') as of:
-            of.write('changeRadii '+radii+line_feed)
-            of.write('parmout '+new_prmtop_path+line_feed)
-        try:
-            run(f'parmed -O -p {prmtop_path} -i {temp_dir}/parmed.in', 
-                check=True, text=True, shell=True, capture_output=True)
-        except CalledProcessError as err:
-            print(err.stdout, err.stderr)
-            raise err
-
-        # clean
-        if Config.debug < 2:
-            rmtree(temp_dir)
+        with ScratchDir('parmed') as temp_dir:
+            with open(f'{temp_dir}parmed.in','w') as of:
+                of.write('changeRadii '+radii+line_feed)
+                of.write('parmout '+new_prmtop_path+line_feed)
+            try:
+                run(f'parmed -O -p {os.path.abspath(prmtop_path)} -i {temp_dir}parmed.in', 
+                    check=True, text=True, shell=True, capture_output=True, cwd=temp_dir)
+            except CalledProcessError as err:
+                _LOGGER.error('parmed failed. %s %s', err.stdout, err.stderr)
+                raise err
 
         return out_path
 
 
+instrument_class(PDB, 'PDB')
+
+
 def get_PDB(name):
     '''
     connect to the database
@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import os, re
 from math import ceil
@@ -5,11 +6,16 @@ from Class_line import PDB_line
 from Class_Conf import Config
 from helper import Child, get_center, get_distance, line_feed, mkdir
 from AmberMaps import *
+from core.ligand_charge import get_ligand_net_charge
+from core.log import get_logger
 try:
     import openbabel
     import openbabel.pybel as pybel
 except ImportError:
     raise ImportError('OpenBabel not installed.')
+
+_LOGGER = get_logger(__name__)
+
 __doc__='''
 This module extract and operate structural infomation from PDB
 # will replace some local function in PDB class in the future.
@@ -149,13 +155,13 @@ class Structure():
         raw_chains_woM_woL_woS, solvents = cls._get_solvents(raw_chains_woM_woL)
 
         ####### debug ##########
-        if Config.debug > 1:
+        if _LOGGER.isEnabledFor(logging.DEBUG):
             for chain in raw_chains_woM_woL_woS:
-                print('Structure.fromPDB: final chain sequence: '+chain.id, chain.get_chain_seq(Oneletter=1))
+                _LOGGER.debug('Structure.fromPDB: final chain sequence: %s %s', chain.id, chain.get_chain_seq(Oneletter=1))
             for metal in metalatoms:
-                print('Structure.fromPDB: final metal recorded '+metal.name)
+                _LOGGER.debug('Structure.fromPDB: final metal recorded %s', metal.name)
             for ligand in ligands:
-                print('Structure.fromPDB: final ligand recorded ' + ligand.name)
+                _LOGGER.debug('Structure.fromPDB: final ligand recorded %s', ligand.name)
 
         return cls(raw_chains_woM_woL_woS, metalatoms, ligands, solvents, input_name)
 
@@ -179,8 +185,7 @@ class Structure():
                     # operate in residue level
                     residue = chain[i]
                     if residue.name in Metal_map.keys():
-                        # add a logger in the future
-                        print('\033[1;34;40mStructure: found metal in raw: '+chain.id+' '+residue.name+' '+str(residue.id)+' \033[0m')
+                        _LOGGER.debug('Structure: found metal in raw: %s %s %s', chain.id, residue.name, residue.id)
                         metalatoms.append(residue)
                         del chain[i]
         if method == '2':
@@ -227,14 +232,13 @@ class Structure():
                     # User defined ligand
                     if ligand_list is not None:
                         if residue.name in ligand_list:
-                            # add a logger in the future
-                            print('\033[1;34;40mStructure: found user assigned ligand in raw: '+chain.id+' '+residue.name+' '+str(residue.id)+' \033[0m')
+                            _LOGGER.debug('Structure: found user assigned ligand in raw: %s %s %s', chain.id, residue.name, residue.id)
                             ligands.append(residue)
                             del chain[i]
                     else:
                         if residue.name not in rd_solvent_list:
                             if residue.name not in rd_non_ligand_list:
-                                print('\033[1;34;40mStructure: found ligand in raw: '+chain.id+' '+residue.name+' '+str(residue.id)+' \033[0m')
+                                _LOGGER.debug('Structure: found ligand in raw: %s %s %s', chain.id, residue.name, residue.id)
                                 ligands.append(residue)
                             del chain[i]
 
@@ -265,8 +269,7 @@ class Structure():
                 # operate in residue level
                 residue = chain[i]
                 if residue.name in rd_solvent_list:
-                    if Config.debug > 1:
-                        print('\033[1;34;40mStructure: found solvent in raw: '+residue.name+' '+str(residue.id)+' \033[0m')
+                    _LOGGER.debug('Structure: found solvent in raw: %s %s', residue.name, residue.id)
                     solvents.append(residue)
                     del chain[i]
 
@@ -713,8 +716,9 @@ class Structure():
         Use 1.0 for all connection.
             Amber force field in gaussian do not account in bond order. (Only UFF does.)
             Note that bond order less than 0.1 do not count in MM but only in opt redundant coordinate.
+        lines are collected in a list and joined once at the end.
         '''
-        connectivty_table = ''
+        connectivty_table = []
         # get connect for every atom in stru
         self.get_connect(metal_fix, ligand_fix, prepi_path)
 
@@ -725,51 +729,55 @@ class Structure():
             for res in chain:
                 for atom in res:
                     a_id += 1
-                    cnt_line = ' '+str(atom.id)
+                    cnt_line = [' '+str(atom.id)]
                     # san check
                     if atom.id != a_id:
                         raise Exception('atom id error.')
                     for cnt_atom in atom.connect:
                         if cnt_atom.id > atom.id:
-                            cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                    connectivty_table += cnt_line+line_feed
+                            cnt_line.append(' '+str(cnt_atom.id)+' 1.0')
+                    cnt_line.append(line_feed)
+                    connectivty_table.append(''.join(cnt_line))
                         
         for lig in self.ligands:
             for atom in lig:
                 a_id += 1
-                cnt_line = ' '+str(atom.id)
+                cnt_line = [' '+str(atom.id)]
                 # san check
                 if atom.id != a_id:
                     raise Exception('atom id error.')
                 for cnt_atom in atom.connect:
                     if cnt_atom.id > atom.id:
-                        cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                connectivty_table += cnt_line+line_feed
+                        cnt_line.append(' '+str(cnt_atom.id)+' 1.0')
+                cnt_line.append(line_feed)
+                connectivty_table.append(''.join(cnt_line))
 
         for atom in self.metalatoms:
             a_id += 1
-            cnt_line = ' '+str(atom.id)
+            cnt_line = [' '+str(atom.id)]
             # san check
             if atom.id != a_id:
                 raise Exception('atom id error.')
             for cnt_atom in atom.connect:
                 if cnt_atom.id > atom.id:
-                    cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-            connectivty_table += cnt_line+line_feed
+                    cnt_line.append(' '+str(cnt_atom.id)+' 1.0')
+            cnt_line.append(line_feed)
+            connectivty_table.append(''.join(cnt_line))
 
         for sol in self.solvents:
             for atom in sol:
                 a_id += 1
-                cnt_line = ' '+str(atom.id)
+                cnt_line = [' '+str(atom.id)]
                 # san check
                 if atom.id != a_id:
                     raise Exception('atom id error.')
                 for cnt_atom in atom.connect:
                     if cnt_atom.id > atom.id:
-                        cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                connectivty_table += cnt_line+line_feed
+                        cnt_line.append(' '+str(cnt_atom.id)+' 1.0')
+                cnt_line.append(line_feed)
+                connectivty_table.append(''.join(cnt_line))
 
-        return connectivty_table
+        return ''.join(connectivty_table)
 
 
     def protonation_metal_fix(self, Fix):
@@ -780,7 +788,7 @@ class Structure():
         if self.metal_centers == []:
             self.get_metal_center()
         if self.metal_centers == []:
-            print('No metal center is found. Exit Fix.')
+            _LOGGER.info('No metal center is found. Exit Fix.')
             return False
 
         # start fix
@@ -832,7 +840,7 @@ class Structure():
     def find_idx_residue(self, idx: int):
         result = list(filter(lambda x: x.id == idx, self.get_all_residue_unit()))
         if len(result) == 0:
-            print(f"No residue found with idx: {idx}")
+            _LOGGER.warning('No residue found with idx: %s', idx)
             return None
         if len(result) > 1:
             raise Exception(f"found more than one residue with idx: {idx}. check your structure")
@@ -1025,9 +1033,7 @@ class Structure():
                 key = key[:-1]
             sele_map[key] = i+1
 
-        if Config.debug >= 1:
-            print('Selected QM cluster atoms: ')
-            print(sele_lines)
+        _LOGGER.info('Selected QM cluster atoms: %s', sele_lines)
 
         return sele_lines, sele_map
 
@@ -1208,8 +1214,7 @@ class Chain(Child):
             last_resi = Residue.fromPDB(resi_lines, resi_lines[-1].resi_id)
             residues.append(last_resi)
         else:
-            if Config.debug >= 1:
-                print('Chain.fromPDB: find a empty chain: ' + chain_id)
+            _LOGGER.info('Chain.fromPDB: find a empty chain: %s', chain_id)
 
         return cls(residues, chain_id)
 
@@ -1313,8 +1318,7 @@ class Chain(Child):
         * Need to be update after mutation
         '''
         if self.ifsorted:
-            if Config.debug >= 1:
-                print('Chain.get_chain_seq: WARNING: missing sequence infomation is missing after sort().')
+            _LOGGER.warning('Chain.get_chain_seq: missing sequence infomation is missing after sort().')
 
         chain_seq = []
         for resi in self.residues:
@@ -1391,7 +1395,7 @@ class Chain(Child):
             if resi.id == id:
                 out_list.append(resi)
         if len(out_list) > 1:
-            print('\033[32;0mShould there be same residue id in chain +'+self.name+str(self.id)+'?+\033[0m')
+            _LOGGER.error('Should there be same residue id in chain %s%s?', self.name, self.id)
             raise Exception
         return out_list[0]
     
@@ -1549,8 +1553,7 @@ class Residue(Child):
         #clean lines
         for i in range(len(resi_lines)-1,-1,-1):
             if resi_lines[i].line_type != 'ATOM' and resi_lines[i].line_type != 'HETATM':
-                if Config.debug > 1:
-                    print('Residue.fromPDB: delete error line in input.')
+                _LOGGER.debug('Residue.fromPDB: delete error line in input.')
                 del resi_lines[i]
     
         # Default resi_id
@@ -1719,7 +1722,7 @@ class Residue(Child):
             if atom.name == name:
                 out_list.append(atom)
         if len(out_list) > 1:
-            print('\033[32;0mShould there be same atom name in residue +'+self.name+str(self.id)+'?+\033[0m')
+            _LOGGER.error('Should there be same atom name in residue %s%s?', self.name, self.id)
             raise Exception
         else:
             return out_list[0]
@@ -1958,10 +1961,7 @@ class Atom(Child):
                     cnt_atom = cnt_resi._find_atom_name('N')                
                 self.connect.append(cnt_atom)
             except IndexError:
-                if Config.debug >= 1:
-                    print('WARNING: '+self.resi.name+str(self.resi.id)+' should have atom: '+name)
-                else:
-                    pass
+                _LOGGER.warning('%s%s should have atom: %s', self.resi.name, self.resi.id, name)
 
     def get_type(self):
         if self.resi.name in rd_solvent_list:
@@ -2273,8 +2273,7 @@ class Metalatom(Atom):
                     
                     if dist <= (R_d + R_m):
                         self.donor_atoms.append(atom)
-                        if Config.debug > 1:
-                            print('Metalatom.get_donor_atom: '+self.name+' find donor atom:' + atom.resi.name +' '+ str(atom.resi.id) + ' ' + atom.name)                     
+                        _LOGGER.debug('Metalatom.get_donor_atom: %s find donor atom: %s %s %s', self.name, atom.resi.name, atom.resi.id, atom.name)
         
 
     def get_donor_residue(self, method='INC'):
@@ -2295,7 +2294,7 @@ class Metalatom(Atom):
             for index2 in range(len(self.donor_resi)):
                 if index2 > index:
                     if self.donor_resi[index2].id == self.donor_resi[index].id:
-                        print('\033[1;31;40m!WARNING! found more than 1 donor atom from residue: '+ self.donor_resi[index].name + str(self.donor_resi[index].id) +'\033[m')
+                        _LOGGER.warning('found more than 1 donor atom from residue: %s%s', self.donor_resi[index].name, self.donor_resi[index].id)
 
 
     def _metal_fix_1(self):
@@ -2308,7 +2307,7 @@ class Metalatom(Atom):
                 resi.deprotonate(resi.d_atom)
             else:
                 if resi.name not in NoProton_list:
-                    print('!WARNING!: uncommon donor residue -- '+resi.chain.id+' '+resi.name+str(resi.id))
+                    _LOGGER.warning('uncommon donor residue -- %s %s%s', resi.chain.id, resi.name, resi.id)
                     #resi.rot_proton(resi.d_atom)
 
 
@@ -2341,7 +2340,7 @@ class Metalatom(Atom):
         if r_id == None:
             r_id = self.resi.id
         if c_id == None:
-            print('WARNING: the metal atom may need a chain id in build()!')
+            _LOGGER.warning('the metal atom may need a chain id in build()!')
             c_id = ' '
         
         if ff == 'AMBER':
@@ -2394,9 +2393,8 @@ class Metalatom(Atom):
         if self.resi_name in G16_label_map.keys():
             G16_label = G16_label_map[self.resi_name][self.name]
         else:
-            if Config.debug >= 1:
-                print('Metal: '+self.name+ ' not in build-in atom type of ff96.')
-                print('Use parameters and atom types from TIP3P (frcmod.ionsjc_tip3p & frcmod.ions234lm_126_tip3p)')
+            _LOGGER.info('Metal: %s not in build-in atom type of ff96. '
+                         'Use parameters and atom types from TIP3P (frcmod.ionsjc_tip3p & frcmod.ions234lm_126_tip3p)', self.name)
             G16_label = self.resi_name.strip('+-')+'0'
             self.parm = tip3p_metal_map[self.resi_name][self.name]
             self.parm[0] = G16_label
@@ -2493,8 +2491,7 @@ class Ligand(Residue):
         #clean lines
         for i in range(len(resi_lines)-1,-1,-1):
             if resi_lines[i].line_type != 'ATOM' and resi_lines[i].line_type != 'HETATM':
-                if Config.debug > 1:
-                    print('Residue.fromPDB: delete error line in input.')
+                _LOGGER.debug('Residue.fromPDB: delete error line in input.')
                 del resi_lines[i]
     
         # Default resi_id
@@ -2521,46 +2518,32 @@ class Ligand(Residue):
         '''
         if ft == 'PDB':
             with open(out_path,'w') as of:
-                a_id = 0
-                for atom in self:
-                    a_id = a_id + 1
-                    line = atom.build(a_id = a_id, c_id=' ')
-                    of.write(line)
-                of.write('TER'+line_feed+'END'+line_feed)
+                of.write(self.build_pdb_str())
         else:
             raise Exception('Support only PDB output now.')
 
+    def build_pdb_str(self):
+        '''
+        return the PDB file content of the ligand
+        '''
+        lines = []
+        a_id = 0
+        for atom in self:
+            a_id = a_id + 1
+            lines.append(atom.build(a_id = a_id, c_id=' '))
+        lines.append('TER'+line_feed+'END'+line_feed)
+        return ''.join(lines)
+
 
     def get_net_charge(self, method='PYBEL', ph=7.0, o_dir='.'):
         '''
         get net charge for the ligand
         -------
         method   : PYBEL (default) use UNITY_ATOM_ATTR info from openbabel mol2
+        o_dir    : not used. (charge is determined in memory)
+        result is memorized by the heavy atom graph and ph. (see core/ligand_charge.py)
         '''
-        # build file
-        mkdir(o_dir+'/cache')
-        temp_path=o_dir+'/cache/ligand_temp.pdb'
-        temp_pdb2_path=o_dir+'/cache/ligand_temp2.pdb'
-        temp_pdb3_path=o_dir+'/cache/ligand_temp3.pdb'
-        temp_m2_path=o_dir+'/cache/ligand_temp.mol2'
-        self.build(temp_path)
-        # charge
-        if method == 'PYBEL':
-            pybel.ob.obErrorLog.SetOutputLevel(0)
-            # remove H (or the )
-            mol = next(pybel.readfile('pdb', temp_path))
-            mol.removeh()
-            mol.write('pdb', temp_pdb2_path, overwrite=True)
-            # clean connectivity
-            os.system('cat '+temp_pdb2_path+' |grep \'ATOM\' > '+temp_pdb3_path)
-            # add H and result net charge
-            mol = next(pybel.readfile('pdb', temp_pdb3_path))
-            mol.OBMol.AddHydrogens(False, True, ph)
-            mol.write('mol2', temp_m2_path, overwrite=True)
-            mol = next(pybel.readfile('mol2', temp_m2_path))
-            net_charge=0
-            for atom in mol:
-                net_charge=net_charge+atom.formalcharge
+        net_charge = get_ligand_net_charge(self.build_pdb_str(), ph=ph, method=method)
         self.net_charge=net_charge
         return net_charge
 
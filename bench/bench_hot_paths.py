@@ -0,0 +1,320 @@
+"""Benchmark of hot paths of the structure/QM/analysis code. Runs offline.
+Inputs are fixtures in test/testfile_Class_PDB/ and synthetic files made in a temp dir:
+    KE07R7.pdb, FAcD.pdb:        raw PDB files (Structure.fromPDB)
+    FAcD_RA124M_ff.pdb:          Amber format FAcD with solvent (36k atoms) for connectivity, masks and ONIOM
+    prmtop (synthetic):          POINTERS and CHARGE sections for all atoms of FAcD_RA124M_ff.pdb
+    mdcrd (synthetic):           --frames frames of FAcD_RA124M_ff.pdb with random displacements
+    enzy_htp data (synthetic):   --mutants records made by helper.write_data
+Each case is timed by timeit (number of calls by autorange, best-of --repeat). Times are compared to
+the baseline as ratios to a fixed pure python loop (calibration) so the baseline can be checked on other
+machines. A case regresses when (time/calibration) / (baseline time/baseline calibration) > its max_ratio.
+The calibration is stored with each case of the baseline, so updating only some cases (--cases) does not
+change the ratios of the others.
+
+Usage:
+    python bench/bench_hot_paths.py                               # print times and ratios to the baseline
+    python bench/bench_hot_paths.py --check                       # exit 1 if any case regress
+    python bench/bench_hot_paths.py --cases decode_atom_mask get_charge_list --repeat 10
+    python bench/bench_hot_paths.py --update-baseline             # after an intended change of performance
+    python bench/bench_hot_paths.py --json bench_hot_paths.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Class_Conf import Config
+from Class_ONIOM_Frame import Frame
+from Class_PDB import PDB
+from Class_Structure import Structure
+from helper import decode_atom_mask, extract_enzy_htp_data, line_feed, write_data
+from wrapper import HiddenPrints
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_FILE_DIR = f'{REPO_DIR}/test/testfile_Class_PDB'
+FF_PDB_PATH = f'{TEST_FILE_DIR}/QMCluster_test/FAcD_RA124M_ff.pdb'
+PREPI_PATH = {'FAH': f'{TEST_FILE_DIR}/ligands/ligand_FAH.prepin'}
+DEFAULT_BASELINE_PATH = f'{REPO_DIR}/bench/baseline_hot_paths.json'
+DEFAULT_MAX_RATIO = 1.5
+PROTEIN_MASK = ':1-297'
+LIGAND_ID = 298
+QM_MASK = ':100-110,298' # the high layer of ONIOM
+
+
+def calibrate() -> float:
+    '''
+    seconds of a fixed pure python loop (best of 5)
+    '''
+    return min(timeit.repeat(lambda: sum(i * i for i in range(200000)), number=1, repeat=5))
+
+
+def write_prmtop(charges: list, out_path: str) -> str:
+    '''
+    a prmtop with only the sections that PDB.get_charge_list read (charges in e)
+    '''
+    lines = ['%VERSION  VERSION_STAMP = V0001.000', '%FLAG TITLE', '%FORMAT(20a4)', 'BENCH',
+             '%FLAG POINTERS', '%FORMAT(10I8)', f'{len(charges):8d}' + f'{0:8d}' * 9,
+             '%FLAG CHARGE', '%FORMAT(5E16.8)']
+    for i in range(0, len(charges), 5):
+        lines.append(''.join(f'{c * 18.2223:16.8E}' for c in charges[i:i+5]))
+    lines.extend(['%FLAG ATOMIC_NUMBER', '%FORMAT(10I8)'])
+    with open(out_path, 'w') as of:
+        of.write(line_feed.join(lines) + line_feed)
+    return out_path
+
+
+def write_mdcrd(coords: list, n_frames: int, out_path: str, seed: int) -> str:
+    '''
+    a mdcrd (10F8.3 with a box line after each frame) of {n_frames} displaced copies of {coords}
+    '''
+    rng = random.Random(seed)
+    with open(out_path, 'w') as of:
+        of.write('BENCH' + line_feed)
+        for i in range(n_frames):
+            values = [x + rng.uniform(-0.5, 0.5) for coord in coords for x in coord]
+            for j in range(0, len(values), 10):
+                of.write(''.join(f'{x:8.3f}' for x in values[j:j+10]) + line_feed)
+            of.write(f'{80.0:8.3f}{80.0:8.3f}{80.0:8.3f}' + line_feed)
+    return out_path
+
+
+def write_enzy_htp_data(n_mutants: int, out_path: str, seed: int) -> str:
+    '''
+    {n_mutants} records of a typical run (MutaFlags, field strengths of frames, energies)
+    '''
+    rng = random.Random(seed)
+    for i in range(n_mutants):
+        tag = [('A', 'A', str(rng.randint(1, 297)), rng.choice('ACDEFGHIKLMNPQRSTVWY')) for _ in range(rng.randint(1, 3))]
+        data = {'E_field': [rng.gauss(-10.0, 5.0) for _ in range(100)],
+                'gb_binding': rng.gauss(-20.0, 3.0),
+                'rmsd': [rng.uniform(0.5, 3.0) for _ in range(100)]}
+        write_data(tag, data, out_path)
+    return out_path
+
+
+class Inputs():
+    '''
+    fixtures and synthetic inputs shared by cases (made when first used)
+    '''
+    def __init__(self, work_dir: str, n_frames: int, n_mutants: int, seed: int) -> None:
+        self.work_dir = work_dir
+        self.n_frames = n_frames
+        self.n_mutants = n_mutants
+        self.seed = seed
+        self._pdb = None
+
+    @property
+    def pdb(self) -> PDB:
+        '''
+        PDB object of FAcD_RA124M_ff.pdb with stru (connected), a synthetic prmtop, mdcrd and frames
+        '''
+        if self._pdb is None:
+            pdb = PDB(FF_PDB_PATH, wk_dir=self.work_dir)
+            pdb.get_stru()
+            pdb.stru.get_connect(prepi_path=PREPI_PATH)
+            coords = [atom.coord for atom in self._get_atoms_in_id_order(pdb.stru)]
+            rng = random.Random(self.seed)
+            charges = [round(rng.uniform(-0.8, 0.8), 4) for _ in coords]
+            pdb.prmtop_path = write_prmtop(charges, f'{self.work_dir}/bench.prmtop')
+            pdb.mdcrd = write_mdcrd(coords, self.n_frames, f'{self.work_dir}/bench.mdcrd', self.seed)
+            pdb.frames = Frame.fromMDCrd(pdb.mdcrd)
+            pdb.chrg_list_all = PDB.get_charge_list(pdb.prmtop_path)
+            pdb.layer = [decode_atom_mask(pdb.stru, QM_MASK)]
+            self._pdb = pdb
+        return self._pdb
+
+    @staticmethod
+    def _get_atoms_in_id_order(stru: Structure) -> list:
+        atoms = [atom for chain in stru.chains for res in chain for atom in res]
+        atoms.extend(atom for lig in stru.ligands for atom in lig)
+        atoms.extend(stru.metalatoms)
+        atoms.extend(atom for sol in stru.solvents for atom in sol)
+        return sorted(atoms, key=lambda atom: atom.id)
+
+    def get_data_path(self) -> str:
+        data_path = f'{self.work_dir}/bench_data.dat'
+        if not os.path.isfile(data_path):
+            write_enzy_htp_data(self.n_mutants, data_path, self.seed)
+        return data_path
+
+
+def _case_fromPDB(pdb_path: str):
+    def setup(inputs: Inputs):
+        return lambda: Structure.fromPDB(pdb_path)
+    return setup
+
+
+def _setup_get_connectivty_table(inputs: Inputs):
+    stru = inputs.pdb.stru
+    return lambda: stru.get_connectivty_table(prepi_path=PREPI_PATH)
+
+
+def _setup_decode_atom_mask(inputs: Inputs):
+    stru = inputs.pdb.stru
+    return lambda: decode_atom_mask(stru, f'{PROTEIN_MASK},{LIGAND_ID}')
+
+
+def _setup_fromMDCrd(inputs: Inputs):
+    mdcrd = inputs.pdb.mdcrd
+    return lambda: Frame.fromMDCrd(mdcrd)
+
+
+def _setup_get_field_strength(inputs: Inputs):
+    pdb = inputs.pdb
+    lig_atom_ids = decode_atom_mask(pdb.stru, f':{LIGAND_ID}')
+    return lambda: pdb.get_field_strength(PROTEIN_MASK, a1=lig_atom_ids[0], a2=lig_atom_ids[1])
+
+
+def _setup_get_charge_list(inputs: Inputs):
+    prmtop_path = inputs.pdb.prmtop_path
+    return lambda: PDB.get_charge_list(prmtop_path)
+
+
+def _setup_write_sele_lines(inputs: Inputs):
+    frame = inputs.pdb.frames[0]
+    sele_list = {str(atom_id): 'C' for atom_id in decode_atom_mask(inputs.pdb.stru, ':1-150')}
+    out_path = f'{inputs.work_dir}/sele_coord.gjf'
+    return lambda: frame.write_sele_lines(sele_list, '#p b3lyp/def2svp', 8, 2000, out_path=out_path)
+
+
+def _setup_get_oniom_g16_coord(inputs: Inputs):
+    pdb = inputs.pdb
+    return lambda: pdb._get_oniom_g16_coord()
+
+
+def _setup_extract_enzy_htp_data(inputs: Inputs):
+    data_path = inputs.get_data_path()
+    return lambda: extract_enzy_htp_data(data_path)
+
+
+# name: (setup (Inputs -> function to time), default max_ratio)
+CASES = {
+    'Structure.fromPDB:KE07R7': (_case_fromPDB(f'{TEST_FILE_DIR}/KE07R7.pdb'), DEFAULT_MAX_RATIO),
+    'Structure.fromPDB:FAcD': (_case_fromPDB(f'{TEST_FILE_DIR}/FAcD.pdb'), DEFAULT_MAX_RATIO),
+    'Structure.fromPDB:FAcD_ff_solvated': (_case_fromPDB(FF_PDB_PATH), DEFAULT_MAX_RATIO),
+    'get_connectivty_table': (_setup_get_connectivty_table, DEFAULT_MAX_RATIO),
+    'decode_atom_mask': (_setup_decode_atom_mask, DEFAULT_MAX_RATIO),
+    'Frame.fromMDCrd': (_setup_fromMDCrd, DEFAULT_MAX_RATIO),
+    'get_field_strength': (_setup_get_field_strength, DEFAULT_MAX_RATIO),
+    'get_charge_list': (_setup_get_charge_list, DEFAULT_MAX_RATIO),
+    # small file writes are noisy
+    'write_sele_lines': (_setup_write_sele_lines, 2.0),
+    '_get_oniom_g16_coord': (_setup_get_oniom_g16_coord, DEFAULT_MAX_RATIO),
+    'extract_enzy_htp_data': (_setup_extract_enzy_htp_data, DEFAULT_MAX_RATIO),
+}
+
+
+def time_case(func, repeat: int) -> dict:
+    '''
+    best and median seconds per call of {func} in {repeat} rounds (calls per round by timeit autorange)
+    '''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {'time': times[0], 'median': times[len(times) // 2], 'number': number, 'repeat': repeat}
+
+
+def compare_to_baseline(results: dict, baseline: dict) -> dict:
+    '''
+    {case: ratio of (time/calibration) to the same of the baseline}
+    '''
+    ratios = {}
+    for name, result in results['cases'].items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        ratios[name] = (result['time'] / results['calibration']) / (base['time'] / base['calibration'])
+    return ratios
+
+
+def make_baseline(results: dict, old_baseline: dict = None) -> dict:
+    '''
+    baseline from {results}. max_ratio of cases in {old_baseline} are kept.
+    Other cases of {old_baseline} are kept with their own calibration.
+    '''
+    old_cases = {} if old_baseline is None else old_baseline['cases']
+    return {
+        'machine': results['machine'],
+        'python': results['python'],
+        'inputs': results['inputs'],
+        'cases': {**old_cases,
+                  **{name: {'time': result['time'],
+                            'calibration': results['calibration'],
+                            'max_ratio': old_cases.get(name, {}).get('max_ratio', CASES[name][1])}
+                     for name, result in results['cases'].items()}},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='benchmark hot paths of structure/QM/analysis code')
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--frames', type=int, default=20, help='frames of the synthetic mdcrd')
+    parser.add_argument('--mutants', type=int, default=2000, help='records of the synthetic enzy_htp data file')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--check', action='store_true', help='exit 1 if any case exceed its max_ratio of the baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='write results of the cases to the baseline')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    Config.debug = 0
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline is not None and baseline['inputs'] != {'frames': args.frames, 'mutants': args.mutants, 'seed': args.seed}:
+        print(f'WARNING: inputs differ from the baseline {baseline["inputs"]}. ratios are not comparable')
+        if args.update_baseline and set(args.cases) != set(CASES):
+            print('ERROR: cannot update a part of cases with different inputs. run all cases to update the baseline')
+            return 2
+
+    results = {'calibration': calibrate(),
+               'machine': platform.machine(),
+               'python': platform.python_version(),
+               'inputs': {'frames': args.frames, 'mutants': args.mutants, 'seed': args.seed},
+               'cases': {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        inputs = Inputs(work_dir, args.frames, args.mutants, args.seed)
+        for name in args.cases:
+            with HiddenPrints():
+                func = CASES[name][0](inputs)
+                results['cases'][name] = time_case(func, args.repeat)
+
+    ratios = {} if baseline is None else compare_to_baseline(results, baseline)
+    regressed = []
+    print(f'calibration: {results["calibration"]*1000:.2f} ms')
+    print(f'{"case":<38}{"time(ms)":>12}{"median(ms)":>12}{"calls":>7}{"ratio":>8}{"max":>6}')
+    for name, result in results['cases'].items():
+        ratio = ratios.get(name)
+        max_ratio = baseline['cases'][name]['max_ratio'] if ratio is not None else None
+        flag = ''
+        if ratio is not None and ratio > max_ratio:
+            regressed.append(name)
+            flag = '  REGRESSED'
+        print(f'{name:<38}{result["time"]*1000:>12.2f}{result["median"]*1000:>12.2f}{result["number"]:>7}'
+              f'{"-" if ratio is None else f"{ratio:.2f}":>8}{"-" if max_ratio is None else f"{max_ratio:.1f}":>6}{flag}')
+
+    if args.json:
+        with open(args.json, 'w') as of:
+            json.dump({**results, 'ratios': ratios}, of, indent=2)
+    if args.update_baseline:
+        new_baseline = make_baseline(results, baseline)
+        with open(args.baseline, 'w') as of:
+            json.dump(new_baseline, of, indent=2)
+            of.write(line_feed)
+        print(f'baseline written to {args.baseline}')
+    if args.check and regressed:
+        print(f'regressed: {", ".join(regressed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Benchmark of the job submission paths of the job manager on the mock SLURM (core/clusters/mock_slurm.py)
+For each path, measure
+    - scheduler calls per job (by command)
+    - client CPU time (the python process that waits for jobs)
+    - wall time
+    - time-to-detect-completion (from the end of a job in the scheduler to the client seeing its end state)
+Paths:
+    client: ClusterJob.wait_to_array_end (one sbatch per job. array_size is kept by polling)
+    native: ClusterJobArray (one sbatch --array=...%array_size)
+    bundle: ClusterJobBundle (tasks_per_bundle jobs in one allocation. allocations go through wait_to_array_end)
+
+Usage:
+    python bench/bench_job_manager.py --n-jobs 200 --array-size 50 --period 2 --queue-delay 1 3 --runtime 0.5
+    python bench/bench_job_manager.py --paths native bundle --json bench_job_manager.json
+    python bench/bench_job_manager.py --scheduler-rate 2 5 --max-submit 50 --limit-backoff 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Class_Conf import Config
+from core import job_manager
+from core.clusters.accre import Accre
+from core.clusters.mock_slurm import MockSlurm
+from core.rate_limiter import SchedulerRateLimiter
+from core.job_manager import ClusterJob, ClusterJobArray, ClusterJobBundle
+
+RES_KEYWORDS = {'core_type': 'cpu',
+                'node_cores': '1',
+                'job_name': 'bench',
+                'partition': 'production',
+                'mem_per_core': '1G',
+                'walltime': '1:00:00',
+                'account': 'xxx'}
+END_STATES = ('complete', 'error', 'cancel', 'exception')
+
+
+class _DetectTime():
+    '''
+    stand-in of the time module for job_manager that records when the end state of each job is
+    first seen (checked every time the job manager sleeps between polls)
+    '''
+    def __init__(self, jobs: list) -> None:
+        self.jobs = jobs
+        self.detect_time = {}
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def record(self) -> None:
+        now = time.time()
+        for i, job in enumerate(self.jobs):
+            if i not in self.detect_time and job.state is not None and job.state[0][0] in END_STATES:
+                self.detect_time[i] = now
+
+    def sleep(self, seconds: float) -> None:
+        self.record()
+        time.sleep(seconds)
+
+
+def make_jobs(work_dir: str, n_jobs: int, task_time: float) -> list:
+    '''
+    jobs that sleep {task_time} s and write a file
+    '''
+    jobs = []
+    for i in range(n_jobs):
+        job_dir = f'{work_dir}/job_{i}'
+        os.makedirs(job_dir)
+        jobs.append(ClusterJob.config_job(
+            commands = f'sleep {task_time}; echo {i} > job.out',
+            cluster = Accre(),
+            env_settings = '',
+            res_keywords = RES_KEYWORDS,
+            sub_dir = job_dir,
+            sub_script_path = f'{job_dir}/submit.cmd'))
+    return jobs
+
+
+def run_path(path: str, args: argparse.Namespace) -> dict:
+    '''
+    run {args.n_jobs} jobs through {path} on a new mock SLURM and return the measurements
+    '''
+    with tempfile.TemporaryDirectory(prefix=f'bench_{path}_') as work_dir:
+        Config.JOB_REGISTRY_PATH = f'{work_dir}/job_registry.db'
+        if args.scheduler_rate:
+            Config.SCHEDULER_RATE_LIMIT_PATH = f'{work_dir}/scheduler_rate_limit.json'
+            Config.SCHEDULER_RATE_LIMIT = {'submit': (args.scheduler_rate[0], 5), 'query': (args.scheduler_rate[1], 10)}
+        else:
+            Config.SCHEDULER_RATE_LIMIT_PATH = ''
+        jobs = make_jobs(work_dir, args.n_jobs, args.task_time)
+        detect = _DetectTime(jobs)
+        job_manager.time = detect
+        slurm = MockSlurm(f'{work_dir}/slurm', queue_delay=tuple(args.queue_delay), runtime=args.runtime,
+                          failure_rate=args.failure_rate, max_running=args.max_running,
+                          max_submit=args.max_submit, seed=args.seed)
+        try:
+            with slurm:
+                cpu_start = time.process_time()
+                wall_start = time.time()
+                if path == 'client':
+                    ClusterJob.wait_to_array_end(jobs, args.period, args.array_size)
+                elif path == 'native':
+                    job_array = ClusterJobArray(jobs, f'{work_dir}', args.array_size)
+                    job_array.submit()
+                    job_array.wait_to_end(args.period)
+                elif path == 'bundle':
+                    bundles = ClusterJobBundle.config_bundles(jobs, args.tasks_per_bundle, RES_KEYWORDS,
+                                                              sub_dir=work_dir)
+                    ClusterJobBundle.wait_to_bundles_end(bundles, args.period, args.array_size)
+                detect.record()
+                wall_time = time.time() - wall_start
+                cpu_time = time.process_time() - cpu_start
+                calls = Counter(slurm.get_calls())
+                scheduler_jobs = slurm.get_jobs()
+        finally:
+            job_manager.time = time
+
+        latencies = []
+        for i, job in enumerate(jobs):
+            if path == 'bundle':
+                exit_path = job.job_cluster_log.removesuffix('.log') + '.exit'
+                end_time = os.path.getmtime(exit_path) if os.path.isfile(exit_path) else None
+            else:
+                end_time = scheduler_jobs.get(job.job_id, {}).get('end')
+            if end_time is not None and i in detect.detect_time:
+                latencies.append(detect.detect_time[i] - end_time)
+        states = Counter(job.state[0][0] for job in jobs)
+
+    n_calls = sum(calls.values())
+    return {
+        'path': path,
+        'n_jobs': args.n_jobs,
+        'wall_time': wall_time,
+        'client_cpu_time': cpu_time,
+        'scheduler_calls': n_calls,
+        'scheduler_calls_per_job': n_calls / args.n_jobs,
+        'calls_by_command': dict(calls),
+        'detect_latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'detect_latency_max': max(latencies) if latencies else None,
+        'states': dict(states),
+    }
+
+
+def main(argv=None) -> list:
+    parser = argparse.ArgumentParser(description='benchmark job submission paths on the mock SLURM')
+    parser.add_argument('--paths', nargs='+', default=['client', 'native', 'bundle'], choices=['client', 'native', 'bundle'])
+    parser.add_argument('--n-jobs', type=int, default=100)
+    parser.add_argument('--array-size', type=int, default=20, help='jobs/tasks run simultaneously')
+    parser.add_argument('--tasks-per-bundle', type=int, default=10)
+    parser.add_argument('--period', type=float, default=1.0, help='polling period of the client (s)')
+    parser.add_argument('--queue-delay', type=float, nargs=2, default=[0.5, 2.0], metavar=('MIN', 'MAX'))
+    parser.add_argument('--runtime', type=float, default=0.2, help='extra runtime of each scheduler job (s)')
+    parser.add_argument('--task-time', type=float, default=0.1, help='runtime of the command of each job (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--max-running', type=int, default=0)
+    parser.add_argument('--max-submit', type=int, default=0, help='queued jobs beyond it are rejected by sbatch')
+    parser.add_argument('--sacct-wait', type=float, default=Accre.SACCT_WAIT_TIME,
+                        help='Accre.SACCT_WAIT_TIME used by the client (s)')
+    parser.add_argument('--scheduler-rate', type=float, nargs=2, metavar=('SUBMIT', 'QUERY'),
+                        help='limit scheduler commands per second (core/rate_limiter.py). no limit by default')
+    parser.add_argument('--limit-backoff', type=float, default=SchedulerRateLimiter.LIMIT_BACKOFF,
+                        help='SchedulerRateLimiter.LIMIT_BACKOFF after a rejected sbatch (s)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    Config.debug = 0
+    Config.BUNDLE_PY_EXE = sys.executable
+    Accre.SACCT_WAIT_TIME = args.sacct_wait
+    SchedulerRateLimiter.LIMIT_BACKOFF = args.limit_backoff
+
+    results = []
+    print(f'{"path":<8}{"wall(s)":>10}{"cpu(s)":>10}{"calls":>8}{"calls/job":>11}{"detect(s)":>11}{"detect max":>12}  states')
+    for path in args.paths:
+        result = run_path(path, args)
+        results.append(result)
+        latency = result['detect_latency_mean']
+        latency_max = result['detect_latency_max']
+        print(f'{path:<8}{result["wall_time"]:>10.2f}{result["client_cpu_time"]:>10.2f}{result["scheduler_calls"]:>8}'
+              f'{result["scheduler_calls_per_job"]:>11.2f}'
+              f'{"-" if latency is None else f"{latency:.2f}":>11}{"-" if latency_max is None else f"{latency_max:.2f}":>12}'
+              f'  {result["states"]}')
+    if args.json:
+        with open(args.json, 'w') as of:
+            json.dump(results, of, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
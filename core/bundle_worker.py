@@ -0,0 +1,114 @@
+"""In-job task runner of job bundles (see job_manager.ClusterJobBundle).
+Run inside one cluster allocation. It consumes tasks in a manifest and keeps as many of them running
+as there are core slices in the allocation. Each task is pinned to its slice of cores. The exit code
+and the stdout/stderr of each task are written to files in the bundle dir so that the client can map
+them back to job states.
+This file only uses the standard library as it runs on the compute node as a script.
+
+Usage:
+    python3 bundle_worker.py manifest.txt bundle_dir/ cores_per_task
+    (manifest line: task_dir<TAB>task_script. Result: bundle_dir/task_#.log and bundle_dir/task_#.exit)
+"""
+import os
+import subprocess
+import sys
+import time
+
+
+def get_core_slices(cores_per_task: int) -> list:
+    '''
+    split cores of the allocation (the affinity of this process) to slices of {cores_per_task}.
+    (at least 1 slice)
+    '''
+    cores = sorted(os.sched_getaffinity(0))
+    slices = [cores[i:i+cores_per_task] for i in range(0, len(cores) - cores_per_task + 1, cores_per_task)]
+    return slices if slices else [cores]
+
+
+def read_manifest(manifest_path: str) -> list:
+    '''
+    read (task_dir, task_script) of each task
+    '''
+    tasks = []
+    with open(manifest_path) as f:
+        for line in f:
+            if line.strip():
+                task_dir, task_script = line.rstrip('\n').split('\t')
+                tasks.append((task_dir, task_script))
+    return tasks
+
+
+def start_task(task_id: int, task_dir: str, task_script: str, core_slice: list, bundle_dir: str) -> subprocess.Popen:
+    '''
+    start the task on its {core_slice}. Each task get its own TMPDIR so that scratch
+    dirs made from $TMPDIR/$SLURM_JOB_ID in task scripts do not collide.
+    '''
+    env = dict(os.environ)
+    env['OMP_NUM_THREADS'] = str(len(core_slice))
+    env['BUNDLE_TASK_ID'] = str(task_id)
+    env['BUNDLE_TASK_CORES'] = ','.join(str(core) for core in core_slice)
+    task_tmp_dir = os.path.join(os.environ.get('TMPDIR', '/tmp'), f'bundle_task_{task_id}')
+    os.makedirs(task_tmp_dir, exist_ok=True)
+    env['TMPDIR'] = task_tmp_dir
+    log_file = open(os.path.join(bundle_dir, f'task_{task_id}.log'), 'w')
+    try:
+        return subprocess.Popen(['bash', task_script], cwd=task_dir, env=env,
+                                stdout=log_file, stderr=subprocess.STDOUT,
+                                preexec_fn=lambda: os.sched_setaffinity(0, core_slice))
+    finally:
+        log_file.close()
+
+
+def write_exit_code(bundle_dir: str, task_id: int, exit_code: int) -> None:
+    '''
+    write the exit code of the task (the file is written at once so the client never read a partial file)
+    '''
+    exit_path = os.path.join(bundle_dir, f'task_{task_id}.exit')
+    with open(exit_path + '.tmp', 'w') as of:
+        of.write(f'{exit_code}\n')
+    os.replace(exit_path + '.tmp', exit_path)
+
+
+def run_bundle(manifest_path: str, bundle_dir: str, cores_per_task: int, poll_period: float = 1.0) -> int:
+    '''
+    run all tasks in the manifest. return the number of failed tasks
+    '''
+    tasks = read_manifest(manifest_path)
+    free_slices = get_core_slices(cores_per_task)
+    running = {} # task_id: (process, core_slice)
+    next_task = 0
+    n_failed = 0
+    while next_task < len(tasks) or running:
+        # fill free slices
+        while free_slices and next_task < len(tasks):
+            core_slice = free_slices.pop(0)
+            task_dir, task_script = tasks[next_task]
+            try:
+                process = start_task(next_task, task_dir, task_script, core_slice, bundle_dir)
+            except OSError as e:
+                print(f'bundle_worker: cannot start task {next_task}: {repr(e)}', file=sys.stderr)
+                write_exit_code(bundle_dir, next_task, 127)
+                n_failed += 1
+                free_slices.append(core_slice)
+            else:
+                running[next_task] = (process, core_slice)
+            next_task += 1
+        # collect ended tasks
+        for task_id in list(running):
+            process, core_slice = running[task_id]
+            exit_code = process.poll()
+            if exit_code is None:
+                continue
+            write_exit_code(bundle_dir, task_id, exit_code)
+            n_failed += exit_code != 0
+            free_slices.append(core_slice)
+            del running[task_id]
+        if running:
+            time.sleep(poll_period)
+    return n_failed
+
+
+if __name__ == '__main__':
+    manifest_path, bundle_dir, cores_per_task = sys.argv[1:4]
+    n_failed = run_bundle(manifest_path, bundle_dir, int(cores_per_task))
+    print(f'bundle_worker: {n_failed} tasks failed')
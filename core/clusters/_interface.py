@@ -7,6 +7,29 @@ from abc import ABC, abstractmethod
 from ctypes import Union
 from subprocess import CompletedProcess
 
+from Class_Conf import Config
+
+# state of a job that has not been found in the queue or the accounting for too long
+MISSING_STATE = ('exception', 'UNKNOWN')
+# {(cluster name, job id or {job id}_{task id}): consecutive polls that it was not found}
+_missing_polls = {}
+
+
+def is_missing_too_long(cluster_name: str, job_id: str, found: bool) -> bool:
+    '''
+    count consecutive polls that {job_id} is not {found} in the queue or the accounting.
+    A job just submitted can be missing for a poll or two, but one that the accounting purged or never
+    recorded (e.g.: a slurmdbd outage) is missing forever.
+    Return True if it has been missing for more than Config.SCHEDULER_MAX_MISSING_POLLS polls
+    (then its state should be MISSING_STATE so waiting for it ends)
+    '''
+    key = (cluster_name, job_id)
+    if found:
+        _missing_polls.pop(key, None)
+        return False
+    _missing_polls[key] = _missing_polls.get(key, 0) + 1
+    return _missing_polls[key] > Config.SCHEDULER_MAX_MISSING_POLLS
+
 class ClusterInterface(ABC):
     '''
     Defines the interface of a cluster
@@ -100,4 +123,51 @@ class ClusterInterface(ABC):
              the real keyword form the cluster)
         '''
         pass
-   
+
+    ### capability flags ###
+    # get_jobs_states query states of many jobs in one scheduler call
+    BATCH_QUERY = False
+    # native job arrays are supported (see below)
+    NATIVE_ARRAY = False
+
+    @classmethod
+    def get_jobs_states(cls, job_ids: list) -> dict[str, tuple[str, str]]:
+        '''
+        determine states of all {job_ids}.
+        Return:
+            {job_id: (pend or run or complete or canel or error, the real keyword form the cluster)}
+        (one call of get_job_state for each job by default. Clusters with BATCH_QUERY do it in one query)
+        '''
+        return {job_id: cls.get_job_state(job_id) for job_id in job_ids}
+
+    ### job array (optional) ###
+    # the environment variable of the task id in a job array. (None if native job arrays are not supported)
+    ARRAY_TASK_ID_VAR = None
+
+    @classmethod
+    def format_array_res_str(cls, res_str: str, n_tasks: int, array_size: int) -> str:
+        '''
+        add the job array setting to the resource section {res_str} for {n_tasks} tasks (id: 0 ~ n_tasks-1)
+        that at most {array_size} of them run simultaneously. (0 means no limit)
+        (optional. Only needed for ClusterJobArray)
+        '''
+        raise NotImplementedError(f'{cls.NAME} does not support native job arrays.')
+
+    @classmethod
+    def get_array_task_log(cls, sub_dir: str, job_id: str, task_id: int) -> str:
+        '''
+        the cluster log file path of the task {task_id} in the array job {job_id}
+        (optional. Only needed for ClusterJobArray)
+        '''
+        raise NotImplementedError(f'{cls.NAME} does not support native job arrays.')
+
+    @classmethod
+    def get_array_task_states(cls, job_id: str, n_tasks: int) -> list[tuple[str, str]]:
+        '''
+        determine states of all {n_tasks} tasks in the array job {job_id} in one query.
+        Return:
+            a list of (pend or run or complete or canel or error, the real keyword form the cluster)
+            indexed by the task id
+        (optional. Only needed for ClusterJobArray)
+        '''
+        raise NotImplementedError(f'{cls.NAME} does not support native job arrays.')
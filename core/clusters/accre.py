@@ -12,10 +12,15 @@ import re
 import os
 from subprocess import CompletedProcess, SubprocessError, run
 import time
+from typing import Union
 
 from Class_Conf import Config
-from helper import round_by, run_cmd
-from ._interface import ClusterInterface
+from helper import round_by
+from core.log import get_logger
+from core.rate_limiter import run_scheduler_cmd
+from ._interface import MISSING_STATE, ClusterInterface, is_missing_too_long
+
+_LOGGER = get_logger(__name__)
 
 
 class Accre(ClusterInterface):
@@ -56,6 +61,8 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
     HOLD_CMD = 'scontrol hold'
     RELEASE_CMD = 'scontrol release'
     INFO_CMD = ['squeue', 'sacct'] # will check by order if previous one has no info
+    # time (s) to wait for sacct to update after a job left squeue
+    SACCT_WAIT_TIME = 3
     # dict of job state
     JOB_STATE_MAP = {
         'pend' : ['CONFIGURING', 'PENDING', 'REQUEUE_FED', 'REQUEUE_HOLD', 'REQUEUED'],
@@ -153,7 +160,8 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
         Return:
             (job_id, slurm_log_file_path)
         Raise:
-            SubprocessError if sbatch wont work after 1440 retries (12hrs)
+            SubprocessError if sbatch wont work after Config.SCHEDULER_MAX_WAIT['submit'] (12hrs)
+            (retries are rate limited and back off for all processes. see core/rate_limiter.py)
 
         ACCRE sbatch rule:
             stdout: Submitted batch job ########
@@ -166,14 +174,8 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
             print(cmd)
             return (cmd, sub_dir, script_path), None
 
-        cwd = os.getcwd()
-        # cd to sub_path
-        os.chdir(sub_dir)
-        try:    
-            submit_cmd = run_cmd(cmd, try_time=1440, wait_time=60, timeout=120) # 12 hrs
-        finally:
-            # TODO(shaoqz) timeout condition is hard to test
-            os.chdir(cwd) # avoid messing up the dir
+        # run in sub_path
+        submit_cmd = run_scheduler_cmd(cmd, kind='submit', timeout=120, cwd=sub_dir)
         
         job_id = cls._get_job_id_from_submit(submit_cmd)
         slurm_log_path = cls._get_log_from_id(sub_dir, job_id)
@@ -211,33 +213,33 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
     @classmethod
     def kill_job(cls, job_id: str) -> CompletedProcess:
         cmd = f'{cls.KILL_CMD} {job_id}'
-        kill_cmd = run(cmd, timeout=20, check=True,  text=True, shell=True, capture_output=True)
+        kill_cmd = run_scheduler_cmd(cmd, max_wait=0, timeout=20)
         return kill_cmd
 
     @classmethod
     def hold_job(cls, job_id: str) -> CompletedProcess:
         cmd = f'{cls.HOLD_CMD} {job_id}'
-        hold_cmd = run(cmd, timeout=20, check=True,  text=True, shell=True, capture_output=True)
+        hold_cmd = run_scheduler_cmd(cmd, max_wait=0, timeout=20)
         return hold_cmd
 
     @classmethod
     def release_job(cls, job_id: str) -> CompletedProcess:
         cmd = f'{cls.RELEASE_CMD} {job_id}'
-        release_cmd = run(cmd, timeout=20, check=True,  text=True, shell=True, capture_output=True)
+        release_cmd = run_scheduler_cmd(cmd, max_wait=0, timeout=20)
         return release_cmd
 
     @classmethod
-    def get_job_info(cls, job_id: str, field: str, wait_time=3) -> str:
+    def get_job_info(cls, job_id: str, field: str, wait_time=None) -> str:
         '''
         get information about the job_id job by field keyword
         1. use squeue frist (fast) and
         if nothing is found (job finished)
         wait for wait time and 2. use sacct (slow)
-        * will try each command (if fail) up to 2880 times with a 30s gap (covers 1 day time span)
+        * will retry each command (if fail) with backoff up to Config.SCHEDULER_MAX_WAIT['query'] (1 day)
         Arg:
             job_id
             field: supported keywords can be found at https://slurm.schedmd.com/sacct.html *can only take one keyword at a time*
-            wait_time: for sacct run in second (default: 3s)
+            wait_time: for sacct run in second (default: SACCT_WAIT_TIME 3s)
             **The `sacct` command takes some time (1-5s) to update the information of the job**
         Return:
             The field value as a string
@@ -245,25 +247,23 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
         # get info
         # squeue
         cmd = f'{cls.INFO_CMD[0]} -u $USER -O JobID,{field}' # donot use the -j method to be more stable
-        info_run = run_cmd(cmd, try_time=2880, wait_time=120, timeout=120)
+        info_run = run_scheduler_cmd(cmd, timeout=120)
         # if exist
         info_out_lines = info_run.stdout.strip().splitlines()
         for info_line in info_out_lines: 
             info_line_parts = info_line.strip().split()
             if len(info_line_parts) < 2:
-                if Config.debug > 1:
-                    print(f"field: {field} is not supported in squeue. Switch to sacct.")
+                _LOGGER.debug('field: %s is not supported in squeue. Switch to sacct.', field)
                 break
             if job_id in info_line:
                 job_field_info = info_line_parts[1].strip().strip('+')
                 return job_field_info
         # use sacct if squeue do not have info
         # wait a update gap
-        if Config.debug > 1:
-            print('No info from squeue. Switch to sacct')
-        time.sleep(wait_time)
+        _LOGGER.debug('No info from squeue. Switch to sacct')
+        time.sleep(cls.SACCT_WAIT_TIME if wait_time is None else wait_time)
         cmd = f'{cls.INFO_CMD[1]} -j {job_id} -o {field}'
-        info_run = run_cmd(cmd, try_time=2880, wait_time=120, timeout=120)            
+        info_run = run_scheduler_cmd(cmd, timeout=120)            
         # if exist
         info_out = info_run.stdout.strip().splitlines()
         if len(info_out) >= 3:
@@ -282,7 +282,134 @@ export GAUSS_SCRDIR=$TMPDIR/$SLURM_JOB_ID''',
                 the real keyword form the cluster)
         '''
         state = cls.get_job_info(job_id, 'State')
+        return cls._get_general_state(state)
+
+    BATCH_QUERY = True
+
+    @classmethod
+    def get_jobs_states(cls, job_ids: list, wait_time=None) -> dict[str, tuple[str, str]]:
+        '''
+        determine states of all {job_ids}
+        1. use one squeue for all jobs in the queue and
+        if some jobs left the queue, wait for wait_time and 2. use one sacct for them.
+        Jobs that have no info yet (e.g.: just submitted) are treated as pend and as
+        ('exception', 'UNKNOWN') after Config.SCHEDULER_MAX_MISSING_POLLS polls.
+        Return:
+            {job_id: (general state, the real keyword form the cluster)}
+        '''
+        job_states = {}
+        cmd = f'{cls.INFO_CMD[0]} -u $USER -r -h -o "%i %T"'
+        info_run = run_scheduler_cmd(cmd, timeout=120)
+        for info_line in info_run.stdout.strip().splitlines():
+            info_line_parts = info_line.split()
+            if len(info_line_parts) >= 2 and info_line_parts[0] in job_ids:
+                job_states[info_line_parts[0]] = info_line_parts[1]
+        missing_ids = [job_id for job_id in job_ids if job_id not in job_states]
+        if missing_ids:
+            _LOGGER.debug('%s jobs are not in squeue. Switch to sacct', len(missing_ids))
+            time.sleep(cls.SACCT_WAIT_TIME if wait_time is None else wait_time)
+            cmd = f'{cls.INFO_CMD[1]} -j {",".join(missing_ids)} -X -n -P -o JobID,State'
+            info_run = run_scheduler_cmd(cmd, timeout=120)
+            for info_line in info_run.stdout.strip().splitlines():
+                info_line_parts = info_line.strip().split('|')
+                if len(info_line_parts) >= 2 and info_line_parts[0] in missing_ids:
+                    # e.g.: CANCELLED by 12345
+                    job_states[info_line_parts[0]] = info_line_parts[1].split()[0].strip('+')
+        return {job_id: cls._get_polled_state(job_id, job_states.get(job_id)) for job_id in job_ids}
+
+    @classmethod
+    def _get_polled_state(cls, job_id: str, state: Union[str, None]) -> tuple[str, str]:
+        '''
+        (general state, state) of a poll. {state} is None if {job_id} was not found (see is_missing_too_long)
+        '''
+        if is_missing_too_long(cls.NAME, job_id, state is not None):
+            _LOGGER.warning('%s is not found in squeue or sacct for %s polls. Treat as %s',
+                            job_id, Config.SCHEDULER_MAX_MISSING_POLLS, MISSING_STATE)
+            return MISSING_STATE
+        return cls._get_general_state('PENDING' if state is None else state)
+
+    @classmethod
+    def _get_general_state(cls, state: str) -> tuple[str, str]:
+        '''
+        map the slurm {state} to (general state, state)
+        '''
         for k, v in cls.JOB_STATE_MAP.items():
             if state in v:
                 return (k, state)
-        raise Exception(f'Do not regonize state: {state}')
\ No newline at end of file
+        raise Exception(f'Do not regonize state: {state}')
+
+    #################
+    ### Job Array ###
+    #################
+    NATIVE_ARRAY = True
+    ARRAY_TASK_ID_VAR = 'SLURM_ARRAY_TASK_ID'
+
+    @classmethod
+    def format_array_res_str(cls, res_str: str, n_tasks: int, array_size: int) -> str:
+        '''
+        add --array=0-{n_tasks-1}%{array_size} to the resource section.
+        the log of each task is slurm-{array job id}_{task id}.out in the *submission dir*
+        '''
+        array_value = f'0-{n_tasks-1}'
+        if 0 < array_size < n_tasks:
+            array_value += f'%{array_size}'
+        res_str = res_str.rstrip('\n') + '\n'
+        res_str += f'#SBATCH --array={array_value}\n'
+        res_str += '#SBATCH --output=slurm-%A_%a.out\n'
+        return res_str
+
+    @classmethod
+    def get_array_task_log(cls, sub_dir: str, job_id: str, task_id: int) -> str:
+        '''
+        file: slurm-#######_#.out will be generated in the *submission dir*
+        '''
+        return sub_dir + f'/slurm-{job_id}_{task_id}.out'
+
+    @classmethod
+    def get_array_task_states(cls, job_id: str, n_tasks: int, wait_time=None) -> list[tuple[str, str]]:
+        '''
+        determine states of all tasks in the array job {job_id}
+        1. use squeue -r (one line per task) for all tasks in the queue and
+        if some tasks left the queue, wait for wait_time and 2. use sacct for them.
+        Tasks that have no info yet (e.g.: just submitted) are treated as pend and as
+        ('exception', 'UNKNOWN') after Config.SCHEDULER_MAX_MISSING_POLLS polls.
+        Return:
+            a list of (general state, the real keyword form the cluster) indexed by the task id
+        '''
+        task_states = {}
+        # squeue
+        cmd = f'{cls.INFO_CMD[0]} -u $USER -r -h -o "%i %T"' # donot use the -j method to be more stable
+        info_run = run_scheduler_cmd(cmd, timeout=120)
+        task_states.update(cls._parse_array_task_states(info_run.stdout, job_id, None))
+        # sacct for tasks left the queue
+        if len(task_states) < n_tasks:
+            _LOGGER.debug('%s tasks of %s are not in squeue. Switch to sacct', n_tasks - len(task_states), job_id)
+            time.sleep(cls.SACCT_WAIT_TIME if wait_time is None else wait_time)
+            cmd = f'{cls.INFO_CMD[1]} -j {job_id} -X -n -P -o JobID,State'
+            info_run = run_scheduler_cmd(cmd, timeout=120)
+            for task_id, state in cls._parse_array_task_states(info_run.stdout, job_id, '|').items():
+                task_states.setdefault(task_id, state)
+        return [cls._get_polled_state(f'{job_id}_{task_id}', task_states.get(task_id)) for task_id in range(n_tasks)]
+
+    @staticmethod
+    def _parse_array_task_states(info_out: str, job_id: str, sep: Union[str, None]) -> dict[int, str]:
+        '''
+        parse lines of "{job_id}_{task ids} {state}" (task ids: 1 or [1-5,7%2]) from squeue/sacct
+        to {task_id: state}. sep: the field separator (None for whitespaces)
+        '''
+        task_states = {}
+        for info_line in info_out.strip().splitlines():
+            info_line_parts = info_line.strip().split(sep)
+            if len(info_line_parts) < 2 or not info_line_parts[0].startswith(f'{job_id}_'):
+                continue
+            # e.g.: CANCELLED by 12345
+            state = info_line_parts[1].split()[0].strip('+')
+            task_ids_str = info_line_parts[0].removeprefix(f'{job_id}_').strip('[]').split('%')[0]
+            for id_range in task_ids_str.split(','):
+                if '-' in id_range:
+                    r1, r2 = id_range.split('-')
+                    for task_id in range(int(r1), int(r2)+1):
+                        task_states[task_id] = state
+                else:
+                    task_states[int(id_range)] = state
+        return task_states
\ No newline at end of file
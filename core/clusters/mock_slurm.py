@@ -0,0 +1,365 @@
+"""A local stand-in of SLURM for testing and benchmarking the job manager without a cluster.
+It provides the sbatch/squeue/sacct/scancel/scontrol commands that Accre (and Expanse) parse.
+Jobs (and tasks of --array jobs with %throttle) run as local subprocesses after a configurable
+queue delay. A configurable extra runtime and failure rate can be added, as well as a limit on
+running jobs and a limit on queued jobs (sbatch is rejected with QOSMaxSubmitJobPerUserLimit). The state of the scheduler is kept in a dir under a file lock, so the commands are
+separate processes just like the real ones. Each call of a command is logged to count
+scheduler calls.
+
+The commands are made as shims in {state_dir}/bin. MockSlurm puts them in front of PATH.
+This file only uses the standard library as the shims run it as a script.
+
+Usage:
+    with MockSlurm('/tmp/mock_slurm/', queue_delay=(1, 5), runtime=0.5, failure_rate=0.05) as slurm:
+        ClusterJob.wait_to_array_end(jobs, period=1)
+        calls = slurm.get_calls() # e.g.: ['sbatch', 'squeue', 'sacct', ...]
+        jobs_info = slurm.get_jobs() # {job_id: {'state':.., 'submit':.., 'start':.., 'end':..}}
+"""
+import fcntl
+import json
+import os
+import random
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from typing import Tuple, Union
+
+_COMMANDS = ('sbatch', 'squeue', 'sacct', 'scancel', 'scontrol')
+_ACTIVE_STATES = ('PENDING', 'RUNNING')
+
+
+class MockSlurm():
+    '''
+    set up a mock SLURM in {state_dir} and use it in the with block.
+    ----------
+    queue_delay: seconds a submission wait before its jobs can start. a number or (min, max) for a random value
+    runtime: extra seconds a job stay RUNNING after its commands end. a number or (min, max)
+    failure_rate: the chance that a job end with FAILED even if its commands succeed
+    max_running: max number of running jobs (0 for no limit)
+    max_submit: max number of pending and running jobs. sbatch beyond it is rejected (0 for no limit)
+    seed: random seed
+    '''
+    def __init__(self, state_dir: str,
+                 queue_delay: Union[float, Tuple[float, float]] = 0.0,
+                 runtime: Union[float, Tuple[float, float]] = 0.0,
+                 failure_rate: float = 0.0,
+                 max_running: int = 0,
+                 max_submit: int = 0,
+                 seed: int = None) -> None:
+        self.state_dir = os.path.abspath(state_dir)
+        self.config = {
+            'queue_delay': queue_delay,
+            'runtime': runtime,
+            'failure_rate': failure_rate,
+            'max_running': max_running,
+            'max_submit': max_submit,
+            'seed': seed,
+            'python': sys.executable,
+        }
+        self._old_path = None
+
+    def __enter__(self) -> 'MockSlurm':
+        bin_dir = f'{self.state_dir}/bin'
+        os.makedirs(bin_dir, exist_ok=True)
+        with open(f'{self.state_dir}/config.json', 'w') as of:
+            json.dump(self.config, of)
+        for command in _COMMANDS:
+            shim_path = f'{bin_dir}/{command}'
+            with open(shim_path, 'w') as of:
+                of.write(f'#!/bin/bash\nexec {shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} '
+                         f'{shlex.quote(self.state_dir)} {command} "$@"\n')
+            os.chmod(shim_path, 0o755)
+        self._old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = f'{bin_dir}{os.pathsep}{self._old_path}'
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        os.environ['PATH'] = self._old_path
+        # stop jobs that are still running
+        with _SchedulerState(self.state_dir) as state:
+            for job in state.jobs.values():
+                if job['state'] in _ACTIVE_STATES:
+                    _cancel(job)
+
+    def get_calls(self) -> list:
+        '''
+        names of commands called in order
+        '''
+        calls_path = f'{self.state_dir}/calls.log'
+        if not os.path.isfile(calls_path):
+            return []
+        with open(calls_path) as f:
+            return [line.split()[1] for line in f if line.strip()]
+
+    def get_jobs(self) -> dict:
+        '''
+        records of all jobs {job_id: {'state', 'submit', 'start', 'end', ...}} (times in time.time())
+        '''
+        with _SchedulerState(self.state_dir) as state:
+            return state.jobs
+
+
+class _SchedulerState():
+    '''
+    the locked state of the scheduler. Jobs are advanced (started/ended) when it is loaded
+    and saved when the with block exit.
+    '''
+    def __init__(self, state_dir: str) -> None:
+        self.state_dir = state_dir
+
+    def __enter__(self) -> '_SchedulerState':
+        self._lock_file = open(f'{self.state_dir}/lock', 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        with open(f'{self.state_dir}/config.json') as f:
+            self.config = json.load(f)
+        jobs_path = f'{self.state_dir}/jobs.json'
+        self.data = {'next_id': 1000, 'jobs': {}}
+        if os.path.isfile(jobs_path):
+            with open(jobs_path) as f:
+                self.data = json.load(f)
+        self.jobs = self.data['jobs']
+        self.advance()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                jobs_path = f'{self.state_dir}/jobs.json'
+                with open(jobs_path + '.tmp', 'w') as of:
+                    json.dump(self.data, of)
+                os.replace(jobs_path + '.tmp', jobs_path)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+
+    def new_id(self) -> str:
+        self.data['next_id'] += 1
+        return str(self.data['next_id'])
+
+    def advance(self) -> None:
+        '''
+        end jobs whose commands finished and start pending jobs that are eligible
+        '''
+        now = time.time()
+        for job in self.jobs.values():
+            if job['state'] == 'RUNNING' and os.path.isfile(job['exit_path']):
+                with open(job['exit_path']) as f:
+                    exit_code = int(f.read().strip())
+                job['end'] = os.path.getmtime(job['exit_path'])
+                job['exit_code'] = exit_code
+                job['state'] = 'COMPLETED' if exit_code == 0 and not job['fail'] else 'FAILED'
+        # running jobs in total and by array
+        n_running = 0
+        n_task_running = {}
+        for job in self.jobs.values():
+            if job['state'] == 'RUNNING':
+                n_running += 1
+                n_task_running[job['array_id']] = n_task_running.get(job['array_id'], 0) + 1
+        max_running = self.config['max_running']
+        pending_jobs = [job for job in self.jobs.values()
+                        if job['state'] == 'PENDING' and not job['hold'] and job['eligible'] <= now]
+        for job in sorted(pending_jobs, key=lambda x: (x['eligible'], x['submit'])):
+            if max_running and n_running >= max_running:
+                break
+            if job['array_id'] is not None and job['throttle']:
+                if n_task_running.get(job['array_id'], 0) >= job['throttle']:
+                    continue
+            self._start(job, now)
+            n_running += 1
+            n_task_running[job['array_id']] = n_task_running.get(job['array_id'], 0) + 1
+
+    def _start(self, job: dict, now: float) -> None:
+        '''
+        run the job script in a detached local process. The exit code is written after the extra runtime
+        and the process call the scheduler to advance.
+        '''
+        env = dict(os.environ)
+        env['SLURM_JOB_ID'] = job['id'].replace('_', '')
+        if job['array_id'] is not None:
+            env['SLURM_ARRAY_JOB_ID'] = job['array_id']
+            env['SLURM_ARRAY_TASK_ID'] = str(job['task_id'])
+        runner = (f'bash {shlex.quote(job["script"])} > {shlex.quote(job["out"])} 2>&1; rc=$?; '
+                  f'sleep {job["runtime"]}; '
+                  f'echo $rc > {shlex.quote(job["exit_path"])}.tmp && mv {shlex.quote(job["exit_path"])}.tmp {shlex.quote(job["exit_path"])}; '
+                  f'{shlex.quote(self.config["python"])} {shlex.quote(os.path.abspath(__file__))} {shlex.quote(self.state_dir)} _advance')
+        process = subprocess.Popen(['bash', '-c', runner], cwd=job['cwd'], env=env, start_new_session=True,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        job['pid'] = process.pid
+        job['start'] = now
+        job['state'] = 'RUNNING'
+
+
+def _get_value(value: Union[float, list], rng: random.Random) -> float:
+    '''
+    a number or a random number in [min, max]
+    '''
+    if isinstance(value, (list, tuple)):
+        return rng.uniform(*value)
+    return value
+
+
+def _cancel(job: dict) -> None:
+    if job['state'] == 'RUNNING' and job['pid']:
+        try:
+            os.killpg(job['pid'], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    job['state'] = 'CANCELLED'
+    job['end'] = time.time()
+
+
+def _match_jobs(jobs: dict, job_ids: str) -> list:
+    '''
+    jobs of {job_ids} separated by ",". (a job, an array task (id_#) or all tasks of an array (id))
+    '''
+    matched_jobs = []
+    for job_id in job_ids.split(','):
+        if job_id in jobs:
+            matched_jobs.append(jobs[job_id])
+        else:
+            matched_jobs.extend(job for job in jobs.values() if job['array_id'] == job_id)
+    return matched_jobs
+
+
+class _Rejected(Exception):
+    '''
+    the scheduler refuse the command (printed as the error message)
+    '''
+
+
+def sbatch(state: _SchedulerState, args: list) -> str:
+    script_path = os.path.abspath(args[-1])
+    with open(script_path) as f:
+        script = f.read()
+    array_match = re.search(r'^#SBATCH --array=([0-9]+)-([0-9]+)(?:%([0-9]+))?', script, re.M)
+    output_match = re.search(r'^#SBATCH --output=(\S+)', script, re.M)
+    config = state.config
+    if config.get('max_submit'):
+        n_queued = len([job for job in state.jobs.values() if job['state'] in _ACTIVE_STATES])
+        if n_queued >= config['max_submit']:
+            raise _Rejected('QOSMaxSubmitJobPerUserLimit\nsbatch: error: Batch job submission failed: '
+                            'Job violates accounting/QOS policy (job submit limit, user\'s size and/or time limits)')
+    rng = random.Random(None if config['seed'] is None else config['seed'] + state.data['next_id'])
+    now = time.time()
+    eligible = now + _get_value(config['queue_delay'], rng)
+    job_id = state.new_id()
+    cwd = os.getcwd()
+    if array_match:
+        task_ids = range(int(array_match.group(1)), int(array_match.group(2))+1)
+        throttle = int(array_match.group(3)) if array_match.group(3) else 0
+        out_pattern = output_match.group(1) if output_match else 'slurm-%A_%a.out'
+    else:
+        task_ids = [None]
+        throttle = 0
+        out_pattern = output_match.group(1) if output_match else 'slurm-%j.out'
+    for task_id in task_ids:
+        key = job_id if task_id is None else f'{job_id}_{task_id}'
+        out = out_pattern.replace('%A', job_id).replace('%a', str(task_id)).replace('%j', key)
+        state.jobs[key] = {
+            'id': key, 'array_id': None if task_id is None else job_id, 'task_id': task_id,
+            'script': script_path, 'cwd': cwd, 'out': os.path.join(cwd, out),
+            'exit_path': f'{state.state_dir}/exit/{key}', 'throttle': throttle,
+            'submit': now, 'eligible': eligible, 'start': None, 'end': None, 'pid': None,
+            'runtime': _get_value(config['runtime'], rng), 'fail': rng.random() < config['failure_rate'],
+            'hold': False, 'state': 'PENDING', 'exit_code': None,
+        }
+    os.makedirs(f'{state.state_dir}/exit', exist_ok=True)
+    # wake up the scheduler when the submission become eligible
+    subprocess.Popen(['bash', '-c', f'sleep {eligible - now}; {shlex.quote(config["python"])} '
+                      f'{shlex.quote(os.path.abspath(__file__))} {shlex.quote(state.state_dir)} _advance'],
+                     start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return f'Submitted batch job {job_id}'
+
+
+def _group_pending_tasks(jobs: list) -> list:
+    '''
+    (id, state) lines of jobs where pending tasks of an array are in one line (id_[1-5%2]) as squeue without -r
+    '''
+    lines = []
+    pending_tasks = {}
+    for job in jobs:
+        if job['array_id'] is not None and job['state'] == 'PENDING':
+            pending_tasks.setdefault(job['array_id'], []).append(job)
+        else:
+            lines.append((job['id'], job['state']))
+    for array_id, tasks in pending_tasks.items():
+        task_ids = [task['task_id'] for task in tasks]
+        throttle = f'%{tasks[0]["throttle"]}' if tasks[0]['throttle'] else ''
+        lines.append((f'{array_id}_[{min(task_ids)}-{max(task_ids)}{throttle}]', 'PENDING'))
+    return lines
+
+
+def squeue(state: _SchedulerState, args: list) -> str:
+    '''
+    support -O JobID,State / -o "%i %T" / -h / -r / -j
+    '''
+    jobs = [job for job in state.jobs.values() if job['state'] in _ACTIVE_STATES]
+    if '-j' in args:
+        jobs = _match_jobs({job['id']: job for job in jobs}, args[args.index('-j')+1])
+    lines = [(job['id'], job['state']) for job in jobs] if '-r' in args else _group_pending_tasks(jobs)
+    if '-o' in args:
+        # format string. only %i %T is supported
+        out_lines = [] if '-h' in args else ['JOBID STATE']
+        out_lines.extend(f'{job_id} {job_state}' for job_id, job_state in lines)
+    else:
+        out_lines = [] if '-h' in args else ['JOBID               STATE']
+        out_lines.extend(f'{job_id:<20}{job_state}' for job_id, job_state in lines)
+    return '\n'.join(out_lines)
+
+
+def sacct(state: _SchedulerState, args: list) -> str:
+    '''
+    support -j -o State / JobID,State -n -P -X
+    '''
+    jobs = _match_jobs(state.jobs, args[args.index('-j')+1]) if '-j' in args else list(state.jobs.values())
+    fields = args[args.index('-o')+1].split(',') if '-o' in args else ['JobID', 'State']
+    sep = '|' if '-P' in args else ' '
+    out_lines = []
+    if '-n' not in args:
+        out_lines.append(sep.join(f'{field:<20}' for field in fields))
+        out_lines.append(sep.join('-' * 20 for field in fields))
+    for job in jobs:
+        values = {'jobid': job['id'], 'state': job['state']}
+        out_lines.append(sep.join(values.get(field.lower(), '') for field in fields))
+    return '\n'.join(out_lines)
+
+
+def scancel(state: _SchedulerState, args: list) -> str:
+    for job in _match_jobs(state.jobs, args[-1]):
+        if job['state'] in _ACTIVE_STATES:
+            _cancel(job)
+    return ''
+
+
+def scontrol(state: _SchedulerState, args: list) -> str:
+    action, job_id = args[0], args[-1]
+    if action not in ('hold', 'release'):
+        raise ValueError(f'mock scontrol only support hold and release. Got: {action}')
+    for job in _match_jobs(state.jobs, job_id):
+        job['hold'] = action == 'hold'
+    return ''
+
+
+def main(argv: list) -> int:
+    state_dir, command, args = argv[0], argv[1], argv[2:]
+    with _SchedulerState(state_dir) as state:
+        if command == '_advance':
+            return 0
+        with open(f'{state_dir}/calls.log', 'a') as of:
+            of.write(f'{time.time()} {command} {" ".join(args)}\n')
+        try:
+            out = globals()[command](state, args)
+        except (KeyError, ValueError, IndexError, _Rejected) as e:
+            print(f'{command}: error: {e}', file=sys.stderr)
+            return 1
+    if out:
+        print(out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,446 @@
+"""A data-driven cluster made from a site config file instead of a subclass of ClusterInterface.
+The config (JSON, or YAML if PyYAML is installed) starts from a preset of the scheduler
+(slurm/pbs/lsf in SITE_PRESETS) and overwrites any part of it:
+    name:           NAME of the cluster
+    scheduler:      the preset to start from
+    resource_map:   {general keyword: line template} or {general keyword: {core_type: line template}}
+                    (None/null for no line). Fields of the template:
+                    value, all keywords of the res_dict, total_mem (mem_per_core x node_cores in G),
+                    mem_per_core_mb, total_mem_mb, walltime_hm (hh:mm)
+    partition_map:  {general partition: {core_type: partition of the site}}
+    resource_head:  the first line(s) of the resource section (e.g.: #!/bin/bash)
+    resource_extra: lines added after the resource lines
+    commands:       templates of scheduler commands
+                    submit ({script}), kill/hold/release ({job_id}),
+                    query (all jobs of the user in the queue),
+                    query_ended ({job_ids} joined by ',' for jobs that left the queue. optional),
+                    and how to parse them:
+                    job_id_pattern (group 1 of the submit stdout), query_pattern/query_ended_pattern
+                    (regex with the groups id and state for each line), query_ended_wait (s),
+                    job_name_pattern (group 1 in the script, used by the log template)
+    log:            template of the cluster log ({sub_dir} {job_id} {job_id_num} {job_name} {script_name})
+    state_map:      {general state: [states of the scheduler]}
+    env:            {software: {core type: env block}} (e.g.: AMBER: {CPU: "module load amber"})
+                    become the <SOFTWARE>_ENV attributes (e.g.: AMBER_ENV) that jobs use
+    capabilities:   batch_query: query states of many jobs in one query
+                    array: native job arrays (see below)
+    array:          res_line ({last_task} {throttle}), throttle ({array_size}), task_id_var,
+                    task_log ({sub_dir} {job_id} {task_id}) and task_pattern ({job_id}: regex for the ids
+                    of tasks in the query with the group tasks. e.g.: 1 or [1-5,7%2])
+Literal braces in templates need to be doubled. ({{ }})
+
+Usage:
+    cluster = SiteCluster.from_file('my_site.json')
+    cluster = SiteCluster.from_site('expanse') # core/clusters/sites/expanse.json
+    job = ClusterJob.config_job(commands, cluster, cluster.AMBER_ENV['CPU'], res_keywords)
+"""
+import copy
+import json
+import os
+import re
+import time
+from typing import Union
+
+from Class_Conf import Config
+from helper import round_by
+from core.log import get_logger
+from core.rate_limiter import run_scheduler_cmd
+from ._interface import MISSING_STATE, ClusterInterface, is_missing_too_long
+
+_LOGGER = get_logger(__name__)
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites')
+
+SITE_PRESETS = {
+    'slurm': {
+        'resource_head': '#!/bin/bash',
+        'resource_map': {
+            'core_type': None,
+            'nodes': '#SBATCH --nodes={value}',
+            'node_cores': {'cpu': '#SBATCH --ntasks-per-node={value}', 'gpu': '#SBATCH --gpus={value}'},
+            'job_name': '#SBATCH --job-name={value}',
+            'partition': '#SBATCH --partition={value}',
+            'mem_per_core': {'cpu': '#SBATCH --mem-per-cpu={value}', 'gpu': '#SBATCH --mem={total_mem}'},
+            'walltime': '#SBATCH --time={value}',
+            'account': '#SBATCH --account={value}',
+        },
+        'partition_map': {},
+        'resource_extra': ['#SBATCH --export=NONE'],
+        'commands': {
+            'submit': 'sbatch {script}',
+            'job_id_pattern': r'Submitted batch job ([0-9]+)',
+            'kill': 'scancel {job_id}',
+            'hold': 'scontrol hold {job_id}',
+            'release': 'scontrol release {job_id}',
+            'query': 'squeue -u $USER -r -h -o "%i %T"',
+            'query_pattern': r'^(?P<id>\S+)\s+(?P<state>\S+)',
+            'query_ended': 'sacct -j {job_ids} -X -n -P -o JobID,State',
+            'query_ended_pattern': r'^(?P<id>[^|]+)\|(?P<state>\S+)',
+            'query_ended_wait': 3,
+            'job_name_pattern': None,
+        },
+        'log': '{sub_dir}/slurm-{job_id}.out',
+        'state_map': {
+            'pend': ['CONFIGURING', 'PENDING', 'REQUEUE_FED', 'REQUEUE_HOLD', 'REQUEUED'],
+            'run': ['COMPLETING', 'RUNNING', 'STAGE_OUT'],
+            'cancel': ['CANCELLED', 'DEADLINE', 'TIMEOUT'],
+            'complete': ['COMPLETED'],
+            'error': ['BOOT_FAIL', 'FAILED', 'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'REVOKED', 'STOPPED', 'SUSPENDED'],
+            'exception': ['RESIZING', 'SIGNALING', 'SPECIAL_EXIT', 'RESV_DEL_HOLD'],
+        },
+        'env': {},
+        'capabilities': {'batch_query': True, 'array': True},
+        'array': {
+            'res_line': '#SBATCH --array=0-{last_task}{throttle}\n#SBATCH --output=slurm-%A_%a.out',
+            'throttle': '%{array_size}',
+            'task_id_var': 'SLURM_ARRAY_TASK_ID',
+            'task_log': '{sub_dir}/slurm-{job_id}_{task_id}.out',
+            'task_pattern': r'^{job_id}_\[?(?P<tasks>[0-9,%-]+)\]?$',
+        },
+    },
+    'pbs': {
+        'resource_head': '#!/bin/bash',
+        'resource_map': {
+            'core_type': None,
+            'nodes': None,
+            'node_cores': {'cpu': '#PBS -l select=1:ncpus={value}:mem={total_mem}B',
+                           'gpu': '#PBS -l select=1:ngpus={value}:mem={total_mem}B'},
+            'job_name': '#PBS -N {value}',
+            'partition': '#PBS -q {value}',
+            'mem_per_core': None,
+            'walltime': '#PBS -l walltime={value}',
+            'account': '#PBS -A {value}',
+        },
+        'partition_map': {},
+        'resource_extra': ['#PBS -j oe', 'cd $PBS_O_WORKDIR'],
+        'commands': {
+            'submit': 'qsub {script}',
+            'job_id_pattern': r'^([0-9]+)',
+            'kill': 'qdel {job_id}',
+            'hold': 'qhold {job_id}',
+            'release': 'qrls {job_id}',
+            # PBS Pro: -x also lists finished jobs (F). exit codes are not in the list
+            'query': 'qstat -x -u $USER',
+            'query_pattern': r'^(?P<id>[0-9]+)\S*\s+(?:\S+\s+){8}(?P<state>[A-Z])\s',
+            'query_ended': None,
+            'query_ended_pattern': None,
+            'query_ended_wait': 0,
+            'job_name_pattern': r'^#PBS -N (\S+)',
+        },
+        'log': '{sub_dir}/{job_name}.o{job_id_num}',
+        'state_map': {
+            'pend': ['Q', 'H', 'W', 'T', 'M', 'B'],
+            'run': ['R', 'E', 'S', 'U'],
+            'cancel': [],
+            'complete': ['F', 'X'],
+            'error': [],
+            'exception': [],
+        },
+        'env': {},
+        'capabilities': {'batch_query': True, 'array': False},
+        'array': {},
+    },
+    'lsf': {
+        'resource_head': '#!/bin/bash',
+        'resource_map': {
+            'core_type': {'cpu': None, 'gpu': '#BSUB -gpu "num=1"'},
+            'nodes': None,
+            'node_cores': '#BSUB -n {value}',
+            'job_name': '#BSUB -J {value}',
+            'partition': '#BSUB -q {value}',
+            'mem_per_core': '#BSUB -R "rusage[mem={mem_per_core_mb}]"',
+            'walltime': '#BSUB -W {walltime_hm}',
+            'account': '#BSUB -P {value}',
+        },
+        'partition_map': {},
+        'resource_extra': ['#BSUB -o lsf-%J.out'],
+        'commands': {
+            'submit': 'bsub < {script}',
+            'job_id_pattern': r'Job <([0-9]+)>',
+            'kill': 'bkill {job_id}',
+            'hold': 'bstop {job_id}',
+            'release': 'bresume {job_id}',
+            # -a also lists recently finished jobs (DONE/EXIT)
+            'query': 'bjobs -a -noheader -o "jobid stat"',
+            'query_pattern': r'^(?P<id>[0-9]+)\s+(?P<state>\S+)',
+            'query_ended': None,
+            'query_ended_pattern': None,
+            'query_ended_wait': 0,
+            'job_name_pattern': None,
+        },
+        'log': '{sub_dir}/lsf-{job_id}.out',
+        'state_map': {
+            'pend': ['PEND', 'WAIT', 'PSUSP'],
+            'run': ['RUN', 'PROV', 'USUSP', 'SSUSP'],
+            'cancel': ['ZOMBI'],
+            'complete': ['DONE'],
+            'error': ['EXIT', 'UNKWN'],
+            'exception': [],
+        },
+        'env': {},
+        'capabilities': {'batch_query': True, 'array': False},
+        'array': {},
+    },
+}
+
+
+class SiteCluster(ClusterInterface):
+    '''
+    a cluster made from the {site_config} dict (see the module doc for keys)
+    '''
+    NAME = None # set by the site config
+
+    def __init__(self, site_config: dict) -> None:
+        if 'name' not in site_config:
+            raise Exception('SiteCluster: the site config need a name')
+        scheduler = site_config.get('scheduler', 'slurm')
+        if scheduler not in SITE_PRESETS:
+            raise Exception(f'SiteCluster: scheduler {scheduler} is not supported. (supported: {list(SITE_PRESETS)})')
+        self.config = _merge_dict(copy.deepcopy(SITE_PRESETS[scheduler]), site_config)
+        self.NAME = self.config['name']
+        self.commands = self.config['commands']
+        self.JOB_STATE_MAP = self.config['state_map']
+        # capability flags
+        self.BATCH_QUERY = bool(self.config['capabilities'].get('batch_query')) and bool(self.commands.get('query'))
+        self.NATIVE_ARRAY = bool(self.config['capabilities'].get('array')) and bool(self.config['array'])
+        self.ARRAY_TASK_ID_VAR = self.config['array'].get('task_id_var') if self.NATIVE_ARRAY else None
+        # env blocks
+        for software, env in self.config['env'].items():
+            setattr(self, f'{software.upper()}_ENV', env)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'SiteCluster':
+        '''
+        load the site config from a .json or .yaml/.yml file
+        '''
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError('PyYAML not installed. Use a .json site config instead.')
+                site_config = yaml.safe_load(f)
+            else:
+                site_config = json.load(f)
+        return cls(site_config)
+
+    @classmethod
+    def from_site(cls, site_name: str) -> 'SiteCluster':
+        '''
+        load the site config shipped in core/clusters/sites/{site_name}.json
+        '''
+        return cls.from_file(os.path.join(SITE_DIR, f'{site_name}.json'))
+
+    ##########################
+    ### Submission Related ###
+    ##########################
+    def parser_resource_str(self, res_dict: dict) -> str:
+        '''
+        format the resource section from the general keywords in {res_dict} by the resource_map
+        (see ClusterInterface.parser_resource_str for keywords)
+        '''
+        core_type = res_dict.get('core_type', 'cpu')
+        fields = self._get_res_fields(res_dict)
+        res_lines = [self.config['resource_head']] if self.config['resource_head'] else []
+        for k, v in res_dict.items():
+            if k not in self.config['resource_map']:
+                raise Exception(f'{self.NAME}: resource keyword {k} is not in the resource_map of the site')
+            template = self.config['resource_map'][k]
+            if isinstance(template, dict):
+                template = template.get(v if k == 'core_type' else core_type)
+            if template is None:
+                continue
+            if k == 'partition':
+                v = self.config['partition_map'].get(v, {}).get(core_type, v)
+            res_lines.append(template.format(**{**fields, 'value': v}))
+        res_lines.extend(self.config['resource_extra'])
+        return '\n'.join(res_lines) + '\n'
+
+    @staticmethod
+    def _get_res_fields(res_dict: dict) -> dict:
+        '''
+        fields that resource templates can use besides {value}
+        '''
+        fields = dict(res_dict)
+        if 'mem_per_core' in res_dict:
+            mem_per_core_gb = float(str(res_dict['mem_per_core']).rstrip('GB'))
+            n_cores = float(res_dict.get('node_cores', 1))
+            total_mem = round_by(mem_per_core_gb * n_cores, 0.1) # round up
+            fields['total_mem'] = f'{total_mem}G'
+            fields['mem_per_core_mb'] = int(mem_per_core_gb * 1024)
+            fields['total_mem_mb'] = int(total_mem * 1024)
+        if 'walltime' in res_dict:
+            fields['walltime_hm'] = ':'.join(str(res_dict['walltime']).split(':')[:2])
+        return fields
+
+    def submit_job(self, sub_dir: str, script_path: str, debug=0) -> tuple[str, str]:
+        '''
+        run the submit command in {sub_dir}
+        Return:
+            (job_id, cluster_log_file_path)
+        '''
+        cmd = self.commands['submit'].format(script=os.path.abspath(script_path))
+        if debug:
+            print(cmd)
+            return (cmd, sub_dir, script_path), None
+
+        submit_cmd = run_scheduler_cmd(cmd, kind='submit', timeout=120, cwd=sub_dir)
+        job_id_match = re.search(self.commands['job_id_pattern'], submit_cmd.stdout, re.M)
+        if job_id_match is None:
+            raise Exception(f'{self.NAME}: no job id in the output of `{cmd}`: {submit_cmd.stdout}')
+        job_id = job_id_match.group(1)
+        return (job_id, self._get_log_path(sub_dir, job_id, script_path))
+
+    def _get_log_path(self, sub_dir: str, job_id: str, script_path: str) -> str:
+        job_name = ''
+        if self.commands.get('job_name_pattern'):
+            with open(script_path) as f:
+                job_name_match = re.search(self.commands['job_name_pattern'], f.read(), re.M)
+            if job_name_match:
+                job_name = job_name_match.group(1)
+        return self.config['log'].format(sub_dir=sub_dir, job_id=job_id, job_id_num=re.match(r'[0-9]*', job_id).group(0),
+                                         job_name=job_name, script_name=os.path.basename(script_path))
+
+    ###############################
+    ### Post-submission Related ###
+    ###############################
+    def _run_job_cmd(self, action: str, job_id: str):
+        if not self.commands.get(action):
+            raise NotImplementedError(f'{self.NAME} has no {action} command.')
+        return run_scheduler_cmd(self.commands[action].format(job_id=job_id), max_wait=0, timeout=20)
+
+    def kill_job(self, job_id: str):
+        return self._run_job_cmd('kill', job_id)
+
+    def hold_job(self, job_id: str):
+        return self._run_job_cmd('hold', job_id)
+
+    def release_job(self, job_id: str):
+        return self._run_job_cmd('release', job_id)
+
+    def get_job_state(self, job_id: str) -> tuple[str, str]:
+        '''
+        determine if the job is pend, run, complete, cancel, error or exception
+        Return:
+            (general state, the real keyword form the cluster)
+        '''
+        return self.get_jobs_states([job_id])[job_id]
+
+    def get_jobs_states(self, job_ids: list) -> dict[str, tuple[str, str]]:
+        '''
+        states of {job_ids} from one query (and one more for jobs that left the queue)
+        Jobs that are not found are treated as pend (e.g.: just submitted) and as ('exception', 'UNKNOWN')
+        after Config.SCHEDULER_MAX_MISSING_POLLS polls.
+        Return:
+            {job_id: (general state, the real keyword form the cluster)}
+        '''
+        states = self._query_states(job_ids)
+        return {job_id: self._get_polled_state(job_id, states.get(job_id)) for job_id in job_ids}
+
+    def _get_polled_state(self, job_id: str, state: Union[str, None]) -> tuple[str, str]:
+        '''
+        (general state, state) of a poll. {state} is None if {job_id} was not found (see is_missing_too_long)
+        '''
+        if is_missing_too_long(self.NAME, job_id, state is not None):
+            _LOGGER.warning('%s is not found in the queue or the accounting of %s for %s polls. Treat as %s',
+                            job_id, self.NAME, Config.SCHEDULER_MAX_MISSING_POLLS, MISSING_STATE)
+            return MISSING_STATE
+        return self._get_general_state(self.JOB_STATE_MAP['pend'][0] if state is None else state)
+
+    def _query_states(self, job_ids: list, ended_ids: list = None) -> dict[str, str]:
+        '''
+        {id: state} of the query and of query_ended for {job_ids} that are not in the queue
+        ended_ids: ids for query_ended if they are not {job_ids} (e.g.: the array job id)
+        '''
+        states = self._parse_states(run_scheduler_cmd(self.commands['query'], timeout=120).stdout,
+                                    self.commands['query_pattern'])
+        missing_ids = [job_id for job_id in job_ids if job_id not in states]
+        if missing_ids and ended_ids is not None:
+            missing_ids = ended_ids
+        if missing_ids and self.commands.get('query_ended'):
+            _LOGGER.debug('%s jobs are not in the queue of %s. Query ended jobs.', len(missing_ids), self.NAME)
+            time.sleep(self.commands.get('query_ended_wait', 0))
+            cmd = self.commands['query_ended'].format(job_ids=','.join(missing_ids))
+            ended_states = self._parse_states(run_scheduler_cmd(cmd, timeout=120).stdout,
+                                              self.commands['query_ended_pattern'])
+            for job_id, state in ended_states.items():
+                states.setdefault(job_id, state)
+        return states
+
+    @staticmethod
+    def _parse_states(info_out: str, pattern: str) -> dict[str, str]:
+        states = {}
+        for info_line in info_out.strip().splitlines():
+            state_match = re.match(pattern, info_line.strip())
+            if state_match:
+                # e.g.: CANCELLED by 12345 / COMPLETED+
+                states[state_match.group('id')] = state_match.group('state').split()[0].strip('+')
+        return states
+
+    def _get_general_state(self, state: str) -> tuple[str, str]:
+        for k, v in self.JOB_STATE_MAP.items():
+            if state in v:
+                return (k, state)
+        raise Exception(f'Do not regonize state: {state}')
+
+    #################
+    ### Job Array ###
+    #################
+    def _require_array(self) -> None:
+        if not self.NATIVE_ARRAY:
+            raise NotImplementedError(f'{self.NAME} does not support native job arrays.')
+
+    def format_array_res_str(self, res_str: str, n_tasks: int, array_size: int) -> str:
+        self._require_array()
+        throttle = ''
+        if 0 < array_size < n_tasks:
+            throttle = self.config['array']['throttle'].format(array_size=array_size)
+        res_line = self.config['array']['res_line'].format(last_task=n_tasks-1, throttle=throttle)
+        return res_str.rstrip('\n') + '\n' + res_line + '\n'
+
+    def get_array_task_log(self, sub_dir: str, job_id: str, task_id: int) -> str:
+        self._require_array()
+        return self.config['array']['task_log'].format(sub_dir=sub_dir, job_id=job_id, task_id=task_id)
+
+    def get_array_task_states(self, job_id: str, n_tasks: int) -> list[tuple[str, str]]:
+        '''
+        states of all {n_tasks} tasks of the array job {job_id}. Tasks that have no info yet are treated as pend
+        (see get_jobs_states)
+        '''
+        self._require_array()
+        task_pattern = self.config['array']['task_pattern'].format(job_id=re.escape(job_id))
+        task_ids = [f'{job_id}_{task_id}' for task_id in range(n_tasks)]
+        states = self._query_states(task_ids, ended_ids=[job_id])
+        task_states = {}
+        for info_id, state in states.items():
+            task_match = re.match(task_pattern, info_id)
+            if task_match:
+                for task_id in _expand_task_ids(task_match.group('tasks')):
+                    task_states.setdefault(task_id, state)
+        return [self._get_polled_state(f'{job_id}_{task_id}', task_states.get(task_id)) for task_id in range(n_tasks)]
+
+
+def _expand_task_ids(task_ids_str: str) -> list[int]:
+    '''
+    1 / 1-5,7%2 -> the list of task ids
+    '''
+    task_ids = []
+    for id_range in task_ids_str.split('%')[0].split(','):
+        if '-' in id_range:
+            r1, r2 = id_range.split('-')
+            task_ids.extend(range(int(r1), int(r2)+1))
+        elif id_range:
+            task_ids.append(int(id_range))
+    return task_ids
+
+
+def _merge_dict(base: dict, update: dict) -> dict:
+    '''
+    recursively update {base} with {update}. (dicts are merged, other values are replaced)
+    '''
+    for k, v in update.items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict) and k not in ('state_map', 'partition_map', 'env'):
+            _merge_dict(base[k], v)
+        else:
+            base[k] = v
+    return base
@@ -0,0 +1,263 @@
+"""Dispatch jobs over several clusters.
+A ClusterDispatcher holds sites (a ClusterInterface object with a limit of active jobs and a file
+stager). Jobs are given as DispatchJob objects that make the ClusterJob for whichever cluster they
+are sent to. Each new submission goes to the site with the best expected start time, so jobs spill
+over to another site when one is full or its queue is slow.
+
+The expected start of a site is its measured queue wait (moving average of the time from submission
+to the first state that is not pend) or the age of its oldest pending job if that is longer. Sites
+without a measurement yet start at 0 so every site gets tried. Sites at their limit are skipped.
+
+File staging is pluggable:
+    SharedStager:    all sites share the file system (default). Jobs run where they are.
+    LocalCopyStager: copy inputs to {root}/{site NAME}/{job index}/ and outputs back.
+                     (a stand-in for transfers to a remote file system)
+
+Usage:
+    dispatcher = ClusterDispatcher([DispatchSite(Accre(), max_active=50),
+                                    DispatchSite(SiteCluster.from_site('expanse'), max_active=20)])
+    dispatch_jobs = [DispatchJob(lambda cluster, work_dir: ClusterJob.config_job(...sub_dir=work_dir),
+                                 input_files=['QM/qm_1.gjf'], output_files=['QM/qm_1.out'])]
+    failed_jobs = dispatcher.run(dispatch_jobs, period=60)
+    print(dispatcher.get_site_stats())
+"""
+import os
+import shutil
+import time
+from typing import Callable, List, Union
+
+from Class_Conf import Config
+from core.clusters._interface import ClusterInterface
+from core.job_manager import ClusterJob
+from core.log import get_logger
+
+_LOGGER = get_logger(__name__)
+
+_ACTIVE_STATES = ('pend', 'run')
+
+
+class SharedStager():
+    '''
+    all sites share the file system. Jobs run in their own sub_dir and nothing is copied.
+    '''
+    def stage_in(self, dispatch_job: 'DispatchJob', site: 'DispatchSite') -> str:
+        '''
+        prepare inputs of {dispatch_job} for {site} and return the work dir of the job there
+        '''
+        return dispatch_job.sub_dir
+
+    def stage_out(self, dispatch_job: 'DispatchJob', site: 'DispatchSite') -> None:
+        '''
+        bring outputs of the ended {dispatch_job} back from {site}
+        '''
+        return
+
+
+class LocalCopyStager(SharedStager):
+    '''
+    copy input files of a job to {root}/{site NAME}/{job index}/ with the same relative paths and
+    copy output files back after the job ends. (missing outputs are skipped)
+    '''
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def stage_in(self, dispatch_job: 'DispatchJob', site: 'DispatchSite') -> str:
+        work_dir = os.path.join(self.root, site.NAME, str(dispatch_job.index))
+        os.makedirs(work_dir, exist_ok=True)
+        for file_path in dispatch_job.input_files:
+            target_path = os.path.join(work_dir, _get_rel_path(file_path, dispatch_job.sub_dir))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            shutil.copy2(os.path.join(dispatch_job.sub_dir, file_path), target_path)
+        return work_dir
+
+    def stage_out(self, dispatch_job: 'DispatchJob', site: 'DispatchSite') -> None:
+        for file_path in dispatch_job.output_files:
+            staged_path = os.path.join(dispatch_job.work_dir, _get_rel_path(file_path, dispatch_job.sub_dir))
+            if not os.path.isfile(staged_path):
+                continue
+            target_path = os.path.join(dispatch_job.sub_dir, file_path)
+            os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+            shutil.copy2(staged_path, target_path)
+
+
+def _get_rel_path(file_path: str, sub_dir: str) -> str:
+    '''
+    path of {file_path} relative to {sub_dir} (file_path is relative to sub_dir if not absolute)
+    '''
+    if os.path.isabs(file_path):
+        return os.path.relpath(file_path, os.path.abspath(sub_dir))
+    return os.path.normpath(file_path)
+
+
+class DispatchSite():
+    '''
+    a cluster in the dispatcher
+    ----------
+    cluster:    the ClusterInterface object
+    max_active: max number of pend/run jobs from the dispatcher on this site (0 for no limit)
+    stager:     the file stager (default: SharedStager)
+    wait_alpha: weight of the newest queue wait in the moving average
+    '''
+    def __init__(self, cluster: ClusterInterface, max_active: int = 0, stager: SharedStager = None,
+                 wait_alpha: float = 0.3) -> None:
+        self.cluster = cluster
+        self.NAME = cluster.NAME
+        self.max_active = max_active
+        self.stager = SharedStager() if stager is None else stager
+        self.wait_alpha = wait_alpha
+        self.active_jobs: List['DispatchJob'] = []
+        self.queue_wait = None # moving average (s)
+        self.n_submitted = 0
+        self.n_started = 0
+
+    def is_full(self) -> bool:
+        return self.max_active > 0 and len(self.active_jobs) >= self.max_active
+
+    def get_expected_start(self, now: float = None) -> float:
+        '''
+        expected seconds from a new submission to its start on this site (inf if the site is full)
+        '''
+        if self.is_full():
+            return float('inf')
+        now = time.time() if now is None else now
+        expected_start = 0.0 if self.queue_wait is None else self.queue_wait
+        pending_ages = [now - dispatch_job.submit_time for dispatch_job in self.active_jobs
+                        if dispatch_job.start_time is None]
+        if pending_ages:
+            expected_start = max(expected_start, max(pending_ages))
+        return expected_start
+
+    def observe_start(self, dispatch_job: 'DispatchJob', start_time: float) -> None:
+        '''
+        record the queue wait of {dispatch_job} that is first seen started (or ended) at {start_time}
+        '''
+        dispatch_job.start_time = start_time
+        queue_wait = start_time - dispatch_job.submit_time
+        if self.queue_wait is None:
+            self.queue_wait = queue_wait
+        else:
+            self.queue_wait = self.wait_alpha * queue_wait + (1 - self.wait_alpha) * self.queue_wait
+        self.n_started += 1
+
+
+class DispatchJob():
+    '''
+    a job that can run on any site of the dispatcher
+    ----------
+    make_job:     function (cluster, work_dir) -> ClusterJob that configs the job for the cluster.
+                  commands should use paths relative to work_dir (the submission dir of the job)
+    input_files:  files the job read (relative to {sub_dir}) that a stager copy to the site
+    output_files: files the job write (relative to {sub_dir}) that a stager copy back
+    sub_dir:      the dir of the job when it runs on a shared file system (default: ./)
+    after submission:
+    job:          the ClusterJob object
+    site:         the DispatchSite it is sent to
+    work_dir:     the work dir on the site
+    submit_time / start_time (None before it is seen started)
+    '''
+    def __init__(self, make_job: Callable[[ClusterInterface, str], ClusterJob],
+                 input_files: list = None, output_files: list = None, sub_dir: str = './') -> None:
+        self.make_job = make_job
+        self.input_files = [] if input_files is None else input_files
+        self.output_files = [] if output_files is None else output_files
+        self.sub_dir = sub_dir
+        self.index = None
+        self.job: Union[ClusterJob, None] = None
+        self.site: Union[DispatchSite, None] = None
+        self.work_dir = None
+        self.submit_time = None
+        self.start_time = None
+
+
+class ClusterDispatcher():
+    '''
+    dispatch DispatchJob objects over {sites} (DispatchSite objects)
+    '''
+    def __init__(self, sites: List[DispatchSite]) -> None:
+        if not sites:
+            raise ValueError('ClusterDispatcher need at least one site')
+        self.sites = sites
+        self.NAME = '+'.join(site.NAME for site in sites)
+
+    def pick_site(self, now: float = None) -> Union[DispatchSite, None]:
+        '''
+        the site with the best expected start time for a new submission (None if all sites are full)
+        ties go to the site with fewer active jobs
+        '''
+        now = time.time() if now is None else now
+        best_site = min(self.sites, key=lambda site: (site.get_expected_start(now), len(site.active_jobs)))
+        if best_site.is_full():
+            return None
+        return best_site
+
+    def submit(self, dispatch_job: DispatchJob, site: DispatchSite) -> None:
+        '''
+        stage in and submit {dispatch_job} to {site}
+        '''
+        dispatch_job.site = site
+        dispatch_job.work_dir = site.stager.stage_in(dispatch_job, site)
+        dispatch_job.job = dispatch_job.make_job(site.cluster, dispatch_job.work_dir)
+        dispatch_job.job.submit()
+        dispatch_job.submit_time = time.time()
+        site.active_jobs.append(dispatch_job)
+        site.n_submitted += 1
+        _LOGGER.debug('Dispatched job %s to %s: job_id: %s expected start: %.0fs',
+                      dispatch_job.index, site.NAME, dispatch_job.job.job_id, site.get_expected_start())
+
+    def update(self) -> List[DispatchJob]:
+        '''
+        update states of active jobs of all sites (one batch query per site if supported),
+        measure queue waits and stage out ended jobs.
+        Return the ended DispatchJob objects
+        '''
+        ended_jobs = []
+        for site in self.sites:
+            if not site.active_jobs:
+                continue
+            ClusterJob.update_states([dispatch_job.job for dispatch_job in site.active_jobs])
+            for dispatch_job in list(site.active_jobs):
+                (general_state, _), state_time = dispatch_job.job.state
+                if general_state != 'pend' and dispatch_job.start_time is None:
+                    site.observe_start(dispatch_job, state_time)
+                if general_state not in _ACTIVE_STATES:
+                    site.active_jobs.remove(dispatch_job)
+                    site.stager.stage_out(dispatch_job, site)
+                    ended_jobs.append(dispatch_job)
+        return ended_jobs
+
+    def run(self, dispatch_jobs: List[DispatchJob], period: float) -> List[ClusterJob]:
+        '''
+        submit {dispatch_jobs} in order, each to the site picked when it is submitted, and wait
+        until all of them end. Check states every {period} s.
+        Return:
+            ClusterJob objects that did not complete (error + cancel)
+        '''
+        for i, dispatch_job in enumerate(dispatch_jobs):
+            dispatch_job.index = i
+        pending_jobs = list(dispatch_jobs)
+        n_ended = 0
+        while n_ended < len(dispatch_jobs):
+            # 1. fill sites with capacity in the order of expected start
+            while pending_jobs:
+                site = self.pick_site()
+                if site is None:
+                    break
+                self.submit(pending_jobs.pop(0), site)
+            # 2. wait and check
+            time.sleep(period)
+            n_ended += len(self.update())
+
+        failed_jobs = [dispatch_job.job for dispatch_job in dispatch_jobs if dispatch_job.job.state[0][0] != 'complete']
+        _LOGGER.info('Dispatched jobs finished: %s complete %s not complete (%s)', len(dispatch_jobs) - len(failed_jobs), len(failed_jobs),
+                     ', '.join(f'{site.NAME}: {site.n_submitted}' for site in self.sites))
+        return failed_jobs
+
+    def get_site_stats(self) -> dict:
+        '''
+        {site NAME: {'submitted', 'started', 'active', 'queue_wait'}}
+        '''
+        return {site.NAME: {'submitted': site.n_submitted,
+                            'started': site.n_started,
+                            'active': len(site.active_jobs),
+                            'queue_wait': site.queue_wait}
+                for site in self.sites}
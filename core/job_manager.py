@@ -21,9 +21,14 @@ from copy import deepcopy
 import os
 
 from core.clusters._interface import ClusterInterface
+from core.job_registry import JobRegistry
+from core.log import get_logger
+from core.profiler import record_cluster_job
 from helper import get_localtime, line_feed
 from Class_Conf import Config
 
+_LOGGER = get_logger(__name__)
+
 
 class ClusterJob():
     '''
@@ -39,8 +44,16 @@ class ClusterJob():
         job_cluster_log
         job_id
         state: ((general_state, detailed_state), time_stamp)
+        submit_time / start_time / end_time: when the job is submitted, first seen running and first seen ended
+            (start_time and end_time are accurate to the period of checking. None if not known)
+        stage: the workflow stage that owns the job (recorded in the job registry)
+        expected_outputs: output files the job is expected to make (recorded in the job registry)
     method:
         submit()
+        submit_or_reattach()
+        try_reattach()
+        reattach()
+        reattach_stage()
         kill()
         hold()
         release()
@@ -50,15 +63,22 @@ class ClusterJob():
         wait_to_array_end()
     '''
 
-    def __init__(self, cluster: ClusterInterface, sub_script_str: str, sub_dir=None, sub_script_path=None) -> None:
+    def __init__(self, cluster: ClusterInterface, sub_script_str: str, sub_dir=None, sub_script_path=None, res_str=None,
+                 stage=None, expected_outputs=None) -> None:
         self.cluster = cluster
         self.sub_script_str = sub_script_str
         self.sub_script_path = sub_script_path
         self.sub_dir = sub_dir
+        self.res_str = res_str # the resource section (used by ClusterJobArray)
+        self.stage = stage
+        self.expected_outputs = expected_outputs
 
         self.job_cluster_log: str = None
         self.job_id: str = None
         self.state: tuple = None # state and the update time in s
+        self.submit_time: float = None
+        self.start_time: float = None
+        self.end_time: float = None
 
     ### config (construct object) ###
     @classmethod
@@ -68,7 +88,9 @@ class ClusterJob():
                 env_settings: Union[list[str], str],
                 res_keywords: dict[str, str],
                 sub_dir: Union[str, None] = None,
-                sub_script_path: Union[str, None] = None
+                sub_script_path: Union[str, None] = None,
+                stage: Union[str, None] = None,
+                expected_outputs: Union[list[str], None] = None
                 ) -> 'ClusterJob':
         '''
         config job and generate a ClusterJob instance (cluster, sub_script_str)
@@ -90,6 +112,10 @@ class ClusterJob():
             resource settings. Can be a dictionary indicating each keywords or the string of the whole section.
             The name and value should be exactly the same as required by the cluster.
             **Use presets in ClusterInterface classes to save effort**
+        stage:
+            the workflow stage that owns the job (e.g.: md, qm). recorded in the job registry.
+        expected_outputs:
+            output files the job is expected to make. recorded in the job registry.
         
         Return:
         A ClusterJob object
@@ -133,7 +159,7 @@ class ClusterJob():
                             f'# {Config.WATERMARK}{line_feed}'
                             )
 
-        return cls(cluster, sub_script_str, sub_dir, sub_script_path)
+        return cls(cluster, sub_script_str, sub_dir, sub_script_path, res_str, stage, expected_outputs)
 
     # region (_get_command_str)
     @staticmethod
@@ -253,19 +279,126 @@ class ClusterJob():
             if self.state[0][0] in ['run', 'pend']:
                 raise Exception(f'attempt to submit a non-finished (pend, run) job.{line_feed} id: {self.job_id} state: {self.state[0][0]}::{self.state[0][1]} @{get_localtime(self.state[1])}')
             else: #finished job
-                if Config.debug > 0:
-                    print(f'WARNING: re-submitting a ended job. The job id will be renewed and the old job id will be lose tracked{line_feed} id: {self.job_id} state: {self.state[0][0]}::{self.state[0][1]} @{get_localtime(self.state[1])}')
+                _LOGGER.warning('re-submitting a ended job. The job id will be renewed and the old job id will be lose tracked. id: %s state: %s::%s @%s',
+                                self.job_id, self.state[0][0], self.state[0][1], get_localtime(self.state[1]))
 
         self.sub_script_path = self._deploy_sub_script(script_path)
-        if Config.debug > 1:
-            print(f'submitting {script_path} in {sub_dir}')
+        _LOGGER.debug('submitting %s in %s', script_path, sub_dir)
         self.job_id, self.job_cluster_log = self.cluster.submit_job(sub_dir, script_path, debug=debug)
         self.sub_dir = sub_dir
+        if debug:
+            return self.job_id
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._record_to_registry()
         if Config.debug > 0:
             self._record_job_id_to_file()
 
         return self.job_id
 
+    def _record_to_registry(self) -> None:
+        '''
+        record the submitted job in the job registry (Config.JOB_REGISTRY_PATH)
+        '''
+        registry = JobRegistry.get_default()
+        if registry is not None:
+            registry.record_submit([self])
+
+    def submit_or_reattach(self, sub_dir: Union[str, None] = None, script_path: Union[str, None] = None,
+                           include_complete: bool = False) -> str:
+        '''
+        reattach to the same job (see try_reattach) if it is still in the queue (e.g.: submitted by
+        a driver process that was killed). Otherwise submit the job.
+        Return:
+            self.job_id
+        '''
+        if self.try_reattach(include_complete, script_path):
+            _LOGGER.info('Reattached to job %s (%s) from %s', self.job_id, self.state[0][0], self.sub_script_path)
+            return self.job_id
+        return self.submit(sub_dir, script_path)
+
+    def try_reattach(self, include_complete: bool = False, script_path: Union[str, None] = None) -> bool:
+        '''
+        find the latest job in the registry submitted from the same script path ({script_path} or
+        self.sub_script_path) with the same script content and attach to it if it is
+        still pend or run (or complete with all expected outputs if {include_complete}).
+        Return:
+            if reattached. (job_id, job_cluster_log, sub_dir, state are set)
+        '''
+        script_path = self.sub_script_path if script_path is None else script_path
+        registry = JobRegistry.get_default()
+        if registry is None or script_path is None:
+            return False
+        record = registry.find_latest(script_path, self.sub_script_str)
+        if record is None or record['cluster'] != self.cluster.NAME:
+            return False
+        if record['general_state'] == 'complete':
+            if not (include_complete and self._has_outputs(record)):
+                return False
+            self._set_from_record(record)
+            self.state = ((record['general_state'], record['detailed_state']), record['update_time'])
+            self._registry_state = self.state[0]
+            return True
+        if record['general_state'] not in ('pend', 'run'):
+            return False
+        # the registry may be outdated. check the cluster
+        try:
+            state = self.cluster.get_job_state(record['job_id'])
+        except Exception as e:
+            _LOGGER.debug('cannot get the state of %s to reattach: %r', record['job_id'], e)
+            return False
+        self._set_from_record(record)
+        self.state = (state, time.time())
+        registry.record_states([self])
+        if state[0] in ('pend', 'run'):
+            return True
+        return state[0] == 'complete' and include_complete and self._has_outputs(record)
+
+    def _set_from_record(self, record: dict) -> None:
+        self.job_id = record['job_id']
+        self.sub_dir = record['sub_dir']
+        self.sub_script_path = record['sub_script_path']
+        self.stage = record['stage']
+        self.expected_outputs = record['expected_outputs']
+        self.job_cluster_log = record['cluster_log']
+        self._registry_state = (record['general_state'], record['detailed_state'])
+
+    @staticmethod
+    def _has_outputs(record: dict) -> bool:
+        return all(os.path.exists(p) for p in record['expected_outputs'])
+
+    @classmethod
+    def reattach(cls, job_id: str, cluster: ClusterInterface) -> 'ClusterJob':
+        '''
+        make a ClusterJob object of {job_id} on {cluster} from the job registry (e.g.: after the driver
+        process restarts). The state is updated from the cluster.
+        '''
+        registry = JobRegistry.get_default()
+        record = None if registry is None else registry.get_record(job_id, cluster.NAME)
+        if record is None:
+            raise Exception(f'ClusterJob.reattach: {job_id} on {cluster.NAME} is not in the job registry ({Config.JOB_REGISTRY_PATH})')
+        sub_script_str = None
+        if record['sub_script_path'] and os.path.isfile(record['sub_script_path']):
+            with open(record['sub_script_path']) as f:
+                sub_script_str = f.read()
+        job = cls(cluster, sub_script_str)
+        job._set_from_record(record)
+        job.get_state()
+        return job
+
+    @classmethod
+    def reattach_stage(cls, stage: str, cluster: ClusterInterface, active_only: bool = True) -> list['ClusterJob']:
+        '''
+        reattach all jobs of the workflow {stage} on {cluster} in the registry.
+        (default: only jobs recorded as pend or run)
+        '''
+        registry = JobRegistry.get_default()
+        if registry is None:
+            return []
+        records = registry.get_records(stage=stage, active=True if active_only else None)
+        return [cls.reattach(record['job_id'], cluster) for record in records if record['cluster'] == cluster.NAME]
+
     def _deploy_sub_script(self, out_path: str) -> None:
         '''
         deploy the submission scirpt for current job
@@ -295,8 +428,7 @@ class ClusterJob():
         '''
         self.require_job_id()
 
-        if Config.debug >= 1:
-            print(f'killing: {self.job_id}')
+        _LOGGER.info('killing: %s', self.job_id)
         self.cluster.kill_job(self.job_id)
 
     def hold(self):
@@ -305,8 +437,7 @@ class ClusterJob():
         '''
         self.require_job_id()
 
-        if Config.debug >= 1:
-            print(f'holding: {self.job_id}')
+        _LOGGER.info('holding: %s', self.job_id)
         self.cluster.hold_job(self.job_id)
 
     def release(self):
@@ -315,8 +446,7 @@ class ClusterJob():
         '''
         self.require_job_id()
 
-        if Config.debug >= 1:
-            print(f'releasing: {self.job_id}')
+        _LOGGER.info('releasing: %s', self.job_id)
         self.cluster.release_job(self.job_id)
 
     ### monitor ###
@@ -337,9 +467,50 @@ class ClusterJob():
         self.require_job_id()
 
         result = self.cluster.get_job_state(self.job_id)
-        self.state = (result, time.time())
+        self._set_state(result, time.time())
+        registry = JobRegistry.get_default()
+        if registry is not None:
+            registry.record_states([self])
         return result
 
+    @classmethod
+    def update_states(cls, jobs: list['ClusterJob']) -> None:
+        '''
+        update states of submitted {jobs} (of the same cluster).
+        Use one batch query if the cluster support it (cluster.BATCH_QUERY) and get_state of each job otherwise.
+        '''
+        if not jobs:
+            return
+        cluster = jobs[0].cluster
+        if not cluster.BATCH_QUERY or len(jobs) == 1:
+            for job in jobs:
+                job.get_state()
+            return
+        for job in jobs:
+            job.require_job_id()
+        states = cluster.get_jobs_states([job.job_id for job in jobs])
+        now = time.time()
+        for job in jobs:
+            job._set_state(states[job.job_id], now)
+        registry = JobRegistry.get_default()
+        if registry is not None:
+            registry.record_states(jobs)
+
+    def _set_state(self, state: tuple[str, str], update_time: float) -> None:
+        '''
+        set the state and the start/end time when the job is first seen running/ended.
+        The queue wait and the run time are recorded to the profiling trace when the job ends.
+        '''
+        self.state = (state, update_time)
+        general_state = state[0]
+        if general_state == 'pend' or self.end_time is not None:
+            return
+        if self.start_time is None:
+            self.start_time = update_time
+        if general_state != 'run':
+            self.end_time = update_time
+            record_cluster_job(self)
+
     def ifcomplete(self) -> bool:
         '''
         determine if the job is complete.
@@ -350,7 +521,7 @@ class ClusterJob():
         '''
         monitor the job in a specified frequency
         until it ends with 
-        complete, error, or cancel
+        complete, error, cancel, or exception (e.g.: lost by the cluster. see Config.SCHEDULER_MAX_MISSING_POLLS)
         NOTE: this wont treat it as an end if hold or requeue your job
               you should do that if other users in the cluster complain 
         Args:
@@ -361,30 +532,26 @@ class ClusterJob():
         # monitor job
         while True:
             # exit if job ended
-            if self.get_state()[0] in ('complete', 'error', 'cancel'):
+            if self.get_state()[0] in ('complete', 'error', 'cancel', 'exception'):
                 return type(self)._action_end_with(self)
             # check every {period} second 
-            if Config.debug >= 2:
-                local_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.state[1]))
-                print(f'Job {self.job_id} state: {self.state[0][0]} (at {local_time})')
+            _LOGGER.debug('Job %s state: %s (at %s)', self.job_id, self.state[0][0], get_localtime(self.state[1]))
             time.sleep(period)
 
     @staticmethod
     def _action_end_with(ended_job: 'ClusterJob') -> None:
         '''
         the action when job ends with the {end_state}
-        the end_state can only be one of ('complete', 'error', 'cancel')
+        the end_state can only be one of ('complete', 'error', 'cancel', 'exception')
         '''
         end_state = ended_job.state[0]
         general_state = end_state[0]
         detailed_state = end_state[1]
 
-        if general_state not in ('complete', 'error', 'cancel'):
-            raise TypeError("_action_end_with: only take state in ('complete', 'error', 'cancel')")
+        if general_state not in ('complete', 'error', 'cancel', 'exception'):
+            raise TypeError("_action_end_with: only take state in ('complete', 'error', 'cancel', 'exception')")
         # general action
-        if Config.debug > 0:
-            local_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ended_job.state[1]))
-            print(f'Job {ended_job.job_id} end with {general_state}::{detailed_state} at {local_time} !')
+        _LOGGER.info('Job %s end with %s::%s at %s !', ended_job.job_id, general_state, detailed_state, get_localtime(ended_job.state[1]))
         # state related action
         if general_state == 'complete':
             pass
@@ -392,6 +559,8 @@ class ClusterJob():
             pass
         if general_state == 'cancel':
             pass # may be support pass in callable to do like resubmit
+        if general_state == 'exception':
+            pass
 
     @classmethod
     def wait_to_array_end(
@@ -400,7 +569,10 @@ class ClusterJob():
             period: int, 
             array_size: int = 0, 
             sub_dir = None, 
-            sub_scirpt_path = None
+            sub_scirpt_path = None,
+            native_array: Union[bool, str] = False,
+            reattach: bool = True,
+            resume_complete: bool = False
         ) -> None:
         '''
         submit an array of jobs in a way that only {array_size} number of jobs is submitted simultaneously.
@@ -421,14 +593,34 @@ class ClusterJob():
         sub_scirpt_path: (default: self.sub_script_path)
             path of the submission script. Overwrite existing self.sub_script_path in the job obj
             * you can set the self value during config_job to make each job different
+        native_array:
+            submit all jobs as one job array of the cluster (e.g.: sbatch --array) with ClusterJobArray
+            instead of submitting them one by one. {array_size} is applied by the cluster.
+            (jobs need to have the same resource section. sub_scirpt_path is not used)
+            'auto': use it when the cluster support native arrays (cluster.NATIVE_ARRAY) and
+            all jobs have the same resource section.
+        reattach:
+            resume from the job registry: jobs that were submitted from the same script (e.g.: by a
+            driver process that was killed) and are still pend or run are waited instead of re-submitted.
+            (see ClusterJob.try_reattach)
+        resume_complete:
+            also take jobs that completed with all expected outputs in the registry as finished.
         
         Return:
-        return a list of not completed job. (error + canceled)
+        return a list of not completed job. (error + canceled + exception)
         '''
         # san check
         for job in jobs:
             if job.cluster.NAME != jobs[0].cluster.NAME:
                 raise TypeError(f'array job need to use the same cluster! while {job.cluster.NAME} and {jobs[0].cluster.NAME} are found.')
+        if native_array == 'auto':
+            native_array = (len(jobs) > 1 and jobs[0].cluster.NATIVE_ARRAY
+                            and all(job.res_str is not None and job.res_str == jobs[0].res_str for job in jobs))
+        if native_array:
+            job_array = ClusterJobArray(jobs, sub_dir, array_size)
+            if not (reattach and job_array.try_reattach(resume_complete)):
+                job_array.submit()
+            return job_array.wait_to_end(period)
         # default value
         if array_size == 0:
             array_size = len(jobs)
@@ -436,18 +628,31 @@ class ClusterJob():
         current_active_job = []
         total_job_num = len(jobs)
         finished_job = []
+        # resume jobs in the registry
+        jobs_to_submit = []
+        for job in jobs:
+            if reattach and job.try_reattach(resume_complete, sub_scirpt_path):
+                if job.state[0][0] in ['pend', 'run']:
+                    current_active_job.append(job)
+                else:
+                    finished_job.append(job)
+            else:
+                jobs_to_submit.append(job)
+        if len(jobs_to_submit) < total_job_num:
+            _LOGGER.info('Reattached to %s active and %s complete jobs in the job registry', len(current_active_job), len(finished_job))
         i = 0 # submitted job number
         while len(finished_job) < total_job_num:
             # before every job finishes, run
             # 1. make up the running chunk to the array size
-            while len(current_active_job) < array_size and i < len(jobs):
-                jobs[i].submit(sub_dir, sub_scirpt_path)
-                current_active_job.append(jobs[i])
+            while len(current_active_job) < array_size and i < len(jobs_to_submit):
+                jobs_to_submit[i].submit(sub_dir, sub_scirpt_path)
+                current_active_job.append(jobs_to_submit[i])
                 i += 1
             # 2. check every job in the array to detect completion of jobs and deal with some error
+            cls.update_states(current_active_job)
             for j in range(len(current_active_job)-1,-1,-1):
                 job = current_active_job[j]
-                if job.get_state()[0] not in ['pend', 'run']:
+                if job.state[0][0] not in ['pend', 'run']:
                     if Config.debug > 1:
                         cls._action_end_with(job)
                     finished_job.append(job)
@@ -459,10 +664,10 @@ class ClusterJob():
         n_complete = list(filter(lambda x: x.state[0][0] == 'complete', finished_job))
         n_error = list(filter(lambda x: x.state[0][0] == 'error', finished_job))
         n_cancel = list(filter(lambda x: x.state[0][0] == 'cancel', finished_job))
-        if Config.debug > 0:
-            print(f'Job array finished: {len(n_complete)} complete {len(n_error)} error {len(n_cancel)} cancel')
+        n_exception = list(filter(lambda x: x.state[0][0] == 'exception', finished_job))
+        _LOGGER.info('Job array finished: %s complete %s error %s cancel %s exception', len(n_complete), len(n_error), len(n_cancel), len(n_exception))
         
-        return n_error + n_cancel
+        return n_error + n_cancel + n_exception
 
     ### misc ###
     def require_job_id(self) -> None:
@@ -477,4 +682,405 @@ class ClusterJob():
         '''
         dummy method for dispatch
         '''
-        pass
\ No newline at end of file
+        pass
+
+
+class ClusterJobArray():
+    '''
+    A job array of the cluster (e.g.: sbatch --array) made of ClusterJob objects.
+    The submission script of each job becomes a task script listed in a manifest file. One array
+    submission script picks its task from the manifest by the array task id. The array is
+    submitted once and the cluster keeps at most {array_size} tasks running, so the client does not
+    need to stay alive to feed the queue. States of all tasks are queried from the one array job id.
+    API:
+    constructor:
+        ClusterJobArray(jobs, sub_dir, array_size)
+    property:
+        jobs:       the ClusterJob objects (job_id, job_cluster_log and state of each task are set to them)
+        cluster
+        sub_dir:    submission dir of the array (default: the common dir of jobs)
+        array_size: how many tasks run simultaneously (0 means no limit)
+        manifest_path
+        sub_script_str
+        sub_script_path
+        job_id:     the array job id
+    method:
+        submit()
+        kill()
+        get_task_states()
+        wait_to_end()
+    '''
+
+    def __init__(self, jobs: list[ClusterJob], sub_dir: Union[str, None] = None, array_size: int = 0) -> None:
+        if not jobs:
+            raise ValueError('ClusterJobArray: need at least 1 job')
+        for job in jobs:
+            if job.cluster.NAME != jobs[0].cluster.NAME:
+                raise TypeError(f'array job need to use the same cluster! while {job.cluster.NAME} and {jobs[0].cluster.NAME} are found.')
+        self.jobs = jobs
+        self.cluster = jobs[0].cluster
+        if sub_dir is None:
+            sub_dir = os.path.commonpath([os.path.abspath(job.sub_dir or './') for job in jobs])
+        self.sub_dir = sub_dir
+        self.array_size = array_size
+
+        self.manifest_path: str = None
+        self.sub_script_str: str = None
+        self.sub_script_path: str = None
+        self.job_id: str = None
+
+    def submit(self) -> str:
+        '''
+        deploy task scripts, the manifest and the array submission script and submit the array.
+        task scripts are the job.sub_script_path of each job (default: sub_dir/array_task_#.cmd)
+        and run under job.sub_dir (default: sub_dir)
+        Return:
+            self.job_id
+        '''
+        if self.job_id is not None:
+            raise Exception(f'attempt to re-submit a job array. id: {self.job_id}')
+        manifest_lines = []
+        for i, job in enumerate(self.jobs):
+            task_script_path = job.sub_script_path
+            if task_script_path is None:
+                task_script_path = f'{self.sub_dir}/array_task_{i}.cmd'
+            job.sub_script_path = job._deploy_sub_script(task_script_path)
+            task_dir = job.sub_dir if job.sub_dir is not None else self.sub_dir
+            manifest_lines.append(f'{os.path.abspath(task_dir)}\t{os.path.abspath(task_script_path)}')
+        self.manifest_path = self._get_unique_path(f'{self.sub_dir}/array_manifest.txt')
+        with open(self.manifest_path, 'w') as of:
+            of.write(line_feed.join(manifest_lines) + line_feed)
+
+        self.sub_script_str = self._get_array_sub_script_str()
+        self.sub_script_path = self._get_unique_path(f'{self.sub_dir}/submit_array.cmd')
+        with open(self.sub_script_path, 'w', encoding='utf-8') as of:
+            of.write(self.sub_script_str)
+        _LOGGER.debug('submitting job array of %s tasks: %s in %s', len(self.jobs), self.sub_script_path, self.sub_dir)
+        self.job_id = self.cluster.submit_job(self.sub_dir, self.sub_script_path)[0]
+        submit_time = time.time()
+        for i, job in enumerate(self.jobs):
+            job.job_id = f'{self.job_id}_{i}'
+            job.submit_time = submit_time
+            job.start_time = None
+            job.end_time = None
+            job.job_cluster_log = self.cluster.get_array_task_log(self.sub_dir, self.job_id, i)
+        registry = JobRegistry.get_default()
+        if registry is not None:
+            registry.record_submit(self.jobs)
+        if Config.debug > 0:
+            self._record_job_id_to_file()
+        return self.job_id
+
+    def try_reattach(self, include_complete: bool = False) -> bool:
+        '''
+        attach to a job array in the job registry whose tasks are all these jobs (same task scripts
+        in the same order) if it is not ended with error or cancel in any task.
+        (tasks are recorded as ClusterJob objects of id {array job id}_{task id})
+        Return:
+            if reattached
+        '''
+        registry = JobRegistry.get_default()
+        if registry is None:
+            return False
+        array_ids = set()
+        records = []
+        for i, job in enumerate(self.jobs):
+            if job.sub_script_path is None:
+                return False
+            record = registry.find_latest(job.sub_script_path, job.sub_script_str)
+            if record is None or record['cluster'] != self.cluster.NAME or not record['job_id'].endswith(f'_{i}'):
+                return False
+            array_ids.add(record['job_id'].rsplit('_', 1)[0])
+            records.append(record)
+        if len(array_ids) != 1:
+            return False
+        self.job_id = array_ids.pop()
+        for job, record in zip(self.jobs, records):
+            job._set_from_record(record)
+        try:
+            task_states = self.get_task_states()
+        except Exception as e:
+            _LOGGER.debug('cannot get states of the job array %s to reattach: %r', self.job_id, e)
+            self.job_id = None
+            return False
+        ended_states = set(state[0] for state in task_states) - {'pend', 'run'}
+        complete_records = [record for record, state in zip(records, task_states) if state[0] == 'complete']
+        if ended_states - {'complete'} or (ended_states and not include_complete) \
+            or not all(ClusterJob._has_outputs(record) for record in complete_records):
+            self.job_id = None
+            return False
+        _LOGGER.info('Reattached to the job array %s in the job registry', self.job_id)
+        return True
+
+    def _record_job_id_to_file(self):
+        '''
+        record the array job id to a file as ClusterJob._record_job_id_to_file
+        '''
+        if Config.JOB_ID_LOG_PATH == '':
+            job_id_log_path = f'{self.sub_dir}/submitted_job_ids.log'
+        else:
+            job_id_log_path = Config.JOB_ID_LOG_PATH
+        with open(job_id_log_path, 'a') as of:
+            of.write(f'{self.job_id} {self.sub_script_path}{line_feed}')
+
+    def _get_array_sub_script_str(self) -> str:
+        '''
+        the array submission script: the shared resource section with the array setting
+        and commands that run the task script in the manifest line of the task id
+        '''
+        res_strs = set(self._get_job_res_str(job) for job in self.jobs)
+        if len(res_strs) > 1:
+            raise Exception('ClusterJobArray: jobs in a job array need to have the same resource section.')
+        res_str = self.cluster.format_array_res_str(res_strs.pop(), len(self.jobs), self.array_size)
+        command_str = line_feed.join((
+            f'TASK_LINE=$(sed -n "$((${self.cluster.ARRAY_TASK_ID_VAR}+1))p" {os.path.abspath(self.manifest_path)})',
+            'TASK_DIR=$(echo "$TASK_LINE" | cut -f1)',
+            'TASK_SCRIPT=$(echo "$TASK_LINE" | cut -f2)',
+            'cd "$TASK_DIR"',
+            'bash "$TASK_SCRIPT"')) + line_feed
+        return line_feed.join((res_str, f'# {Config.WATERMARK}{line_feed}', command_str))
+
+    @staticmethod
+    def _get_job_res_str(job: ClusterJob) -> str:
+        '''
+        the resource section of {job}. (for jobs not made by config_job: lines before the first empty line)
+        '''
+        if job.res_str is not None:
+            return job.res_str
+        return job.sub_script_str.split(line_feed + line_feed)[0] + line_feed
+
+    @staticmethod
+    def _get_unique_path(path: str) -> str:
+        '''
+        add a growing index to {path} if the file exists. (e.g.: submit_array_1.cmd)
+        '''
+        root, ext = os.path.splitext(path)
+        i = 0
+        while os.path.isfile(path):
+            i += 1
+            path = f'{root}_{i}{ext}'
+        return path
+
+    ### control ###
+    def kill(self) -> None:
+        '''
+        kill all tasks in the job array
+        '''
+        if self.job_id is None:
+            raise AttributeError('Need to submit the job array and get an job id!')
+        _LOGGER.info('killing job array: %s', self.job_id)
+        self.cluster.kill_job(self.job_id)
+
+    ### monitor ###
+    def get_task_states(self) -> list[tuple[str, str]]:
+        '''
+        update states of all tasks from the array job id (also set to job.state of each job)
+        Return:
+            a list of (general state, the real keyword form the cluster) in the order of jobs
+        '''
+        if self.job_id is None:
+            raise AttributeError('Need to submit the job array and get an job id!')
+        task_states = self.cluster.get_array_task_states(self.job_id, len(self.jobs))
+        update_time = time.time()
+        for job, task_state in zip(self.jobs, task_states):
+            job._set_state(task_state, update_time)
+        registry = JobRegistry.get_default()
+        if registry is not None:
+            registry.record_states(self.jobs)
+        return task_states
+
+    def wait_to_end(self, period: int) -> list[ClusterJob]:
+        '''
+        monitor tasks every {period} s until all of them end.
+        Return:
+            a list of not completed jobs. (error + canceled + exception)
+        '''
+        while True:
+            task_states = self.get_task_states()
+            n_active = len([state for state in task_states if state[0] in ('pend', 'run')])
+            if n_active == 0:
+                break
+            _LOGGER.debug('Job array %s: %s/%s tasks pend or run', self.job_id, n_active, len(self.jobs))
+            time.sleep(period)
+
+        n_complete = [job for job in self.jobs if job.state[0][0] == 'complete']
+        n_error = [job for job in self.jobs if job.state[0][0] == 'error']
+        n_cancel = [job for job in self.jobs if job.state[0][0] == 'cancel']
+        n_exception = [job for job in self.jobs if job.state[0][0] == 'exception']
+        _LOGGER.info('Job array %s finished: %s complete %s error %s cancel %s exception',
+                     self.job_id, len(n_complete), len(n_error), len(n_cancel), len(n_exception))
+        return n_error + n_cancel + n_exception
+
+
+class ClusterJobBundle():
+    '''
+    A bundle of short ClusterJob objects that run in one allocation of the cluster.
+    The submission script of each job becomes a task script listed in a manifest. The allocation
+    runs core/bundle_worker.py that keeps tasks running on slices of {cores_per_task} cores and
+    writes the exit code and log of each task to the bundle dir. States of the original jobs are
+    mapped from these files so that the scheduling overhead is paid once per bundle.
+    API:
+    constructor:
+        ClusterJobBundle.config_bundles()
+    property:
+        jobs:       the ClusterJob objects in the bundle (job_id, job_cluster_log and state of each task are set to them)
+        bundle_dir: where the manifest, the submission script and task logs/exit codes are
+        cores_per_task
+        job:        the ClusterJob of the allocation
+    method:
+        submit()
+        get_task_states()
+        wait_to_bundles_end()
+    '''
+    WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bundle_worker.py')
+
+    def __init__(self, jobs: list[ClusterJob], job: ClusterJob, bundle_dir: str, cores_per_task: int) -> None:
+        self.jobs = jobs
+        self.job = job
+        self.bundle_dir = bundle_dir
+        self.cores_per_task = cores_per_task
+
+    @classmethod
+    def config_bundles(
+            cls,
+            jobs: list[ClusterJob],
+            tasks_per_bundle: int,
+            res_keywords: Union[dict[str, str], str],
+            cores_per_task: int = 1,
+            env_settings: Union[list[str], str] = '',
+            sub_dir: Union[str, None] = None
+        ) -> list['ClusterJobBundle']:
+        '''
+        pack {jobs} into bundles of {tasks_per_bundle} jobs.
+        Args:
+        res_keywords:
+            resource settings of each bundle allocation. (see ClusterJob.config_job)
+            The allocation run as many tasks simultaneously as its cores over {cores_per_task}.
+            The walltime need to cover tasks that run one after another.
+        cores_per_task:
+            the size of the core slice each task is pinned to
+        env_settings:
+            environment settings of the allocation (e.g.: to have python available)
+            * environment settings of each job are kept in its task script
+        sub_dir:
+            bundles are made in sub_dir/bundle_#/ (default: the common dir of jobs)
+        Return:
+            a list of ClusterJobBundle
+        '''
+        if not jobs:
+            raise ValueError('ClusterJobBundle: need at least 1 job')
+        for job in jobs:
+            if job.cluster.NAME != jobs[0].cluster.NAME:
+                raise TypeError(f'bundled jobs need to use the same cluster! while {job.cluster.NAME} and {jobs[0].cluster.NAME} are found.')
+        if sub_dir is None:
+            sub_dir = os.path.commonpath([os.path.abspath(job.sub_dir or './') for job in jobs])
+        bundles = []
+        for k, i in enumerate(range(0, len(jobs), tasks_per_bundle)):
+            bundle_jobs = jobs[i:i+tasks_per_bundle]
+            bundle_dir = os.path.abspath(f'{sub_dir}/bundle_{k}')
+            manifest_path = f'{bundle_dir}/manifest.txt'
+            bundle_job = ClusterJob.config_job(
+                commands = f'{Config.BUNDLE_PY_EXE} {cls.WORKER_PATH} {manifest_path} {bundle_dir} {cores_per_task}',
+                cluster = jobs[0].cluster,
+                env_settings = env_settings,
+                res_keywords = res_keywords,
+                sub_dir = bundle_dir,
+                sub_script_path = f'{bundle_dir}/submit_bundle.cmd')
+            bundles.append(cls(bundle_jobs, bundle_job, bundle_dir, cores_per_task))
+        return bundles
+
+    def submit(self) -> str:
+        '''
+        deploy task scripts and the manifest and submit the allocation.
+        Return:
+            the job id of the allocation
+        '''
+        self._deploy_tasks().submit()
+        self._set_task_ids()
+        return self.job.job_id
+
+    def _deploy_tasks(self) -> ClusterJob:
+        '''
+        deploy task scripts (job.sub_script_path of each job; default: bundle_dir/task_#.cmd) and the manifest.
+        Return:
+            the ClusterJob of the allocation
+        '''
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        manifest_lines = []
+        for i, job in enumerate(self.jobs):
+            task_script_path = job.sub_script_path
+            if task_script_path is None:
+                task_script_path = f'{self.bundle_dir}/task_{i}.cmd'
+            job.sub_script_path = job._deploy_sub_script(task_script_path)
+            task_dir = job.sub_dir if job.sub_dir is not None else self.bundle_dir
+            manifest_lines.append(f'{os.path.abspath(task_dir)}\t{os.path.abspath(task_script_path)}')
+            # clean results of a previous run
+            if os.path.isfile(self._get_task_exit_path(i)):
+                os.remove(self._get_task_exit_path(i))
+        with open(f'{self.bundle_dir}/manifest.txt', 'w') as of:
+            of.write(line_feed.join(manifest_lines) + line_feed)
+        return self.job
+
+    def _set_task_ids(self) -> None:
+        '''
+        task ids are {allocation job id}.{task index}. logs are bundle_dir/task_#.log
+        '''
+        for i, job in enumerate(self.jobs):
+            job.job_id = f'{self.job.job_id}.{i}'
+            job.job_cluster_log = self._get_task_log_path(i)
+            job.submit_time = self.job.submit_time
+            job.start_time = None
+            job.end_time = None
+
+    def _get_task_exit_path(self, task_id: int) -> str:
+        return f'{self.bundle_dir}/task_{task_id}.exit'
+
+    def _get_task_log_path(self, task_id: int) -> str:
+        return f'{self.bundle_dir}/task_{task_id}.log'
+
+    def get_task_states(self, bundle_state: Union[tuple[str, str], None] = None) -> list[tuple[str, str]]:
+        '''
+        map states of tasks from their exit codes (complete for 0 and error for others).
+        Tasks without an exit code take the state of the allocation {bundle_state} (default: query it)
+        or error (NOT_RUN) if the allocation completed. States are also set to job.state of each job
+        Return:
+            a list of (general state, detailed state) in the order of jobs
+        '''
+        if bundle_state is None:
+            bundle_state = self.job.get_state()
+        task_states = []
+        for i in range(len(self.jobs)):
+            exit_path = self._get_task_exit_path(i)
+            if os.path.isfile(exit_path):
+                with open(exit_path) as f:
+                    exit_code = int(f.read().strip())
+                task_states.append(('complete' if exit_code == 0 else 'error', f'EXIT_{exit_code}'))
+            elif bundle_state[0] == 'complete':
+                task_states.append(('error', 'NOT_RUN'))
+            else:
+                task_states.append(bundle_state)
+        update_time = time.time()
+        for job, task_state in zip(self.jobs, task_states):
+            job._set_state(task_state, update_time)
+        return task_states
+
+    @classmethod
+    def wait_to_bundles_end(cls, bundles: list['ClusterJobBundle'], period: int, array_size: int = 0,
+                            native_array: bool = False) -> list[ClusterJob]:
+        '''
+        run allocations of {bundles} with ClusterJob.wait_to_array_end and map task states back to jobs.
+        Return:
+            a list of not completed jobs (error + canceled + exception) in all bundles
+        '''
+        bundle_jobs = [bundle._deploy_tasks() for bundle in bundles]
+        _LOGGER.info('Running %s jobs in %s bundles', sum(len(bundle.jobs) for bundle in bundles), len(bundles))
+        ClusterJob.wait_to_array_end(bundle_jobs, period, array_size, native_array=native_array)
+        failed_jobs = []
+        for bundle in bundles:
+            bundle._set_task_ids()
+            for job, task_state in zip(bundle.jobs, bundle.get_task_states(bundle.job.state[0])):
+                if task_state[0] in ('error', 'cancel', 'exception'):
+                    failed_jobs.append(job)
+        n_jobs = sum(len(bundle.jobs) for bundle in bundles)
+        _LOGGER.info('Job bundles finished: %s complete %s error or cancel in %s bundles', n_jobs - len(failed_jobs), len(failed_jobs), len(bundles))
+        return failed_jobs
@@ -0,0 +1,206 @@
+"""Persistent registry of submitted cluster jobs.
+Every submitted ClusterJob is recorded in a SQLite database with its job id, cluster, submission
+dir and script, expected outputs, the workflow stage and the history of its states. Each change
+is committed with full sync so the registry survives a killed driver process. A restarted driver
+can then find jobs that are still in the queue and reattach to them instead of submitting
+duplicates. (see ClusterJob.try_reattach, ClusterJob.reattach and wait_to_array_end(reattach=True))
+The database uses the rollback journal (journal_mode=DELETE) and relies on the file locks of SQLite.
+It should be on a node-local disk, or only one driver process should write it at a time: file locks
+are unreliable on many network file systems (NFS/Lustre/GPFS) that hold home dirs of clusters.
+(WAL is not used since it needs shared memory between processes and does not work over a network.)
+
+Usage:
+    registry = JobRegistry.get_default() # at Config.JOB_REGISTRY_PATH
+    records = registry.get_records(stage='md', active=True)
+    history = registry.get_history(records[0]['job_id'], records[0]['cluster'])
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import List, Union
+
+from Class_Conf import Config
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    cluster TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    sub_dir TEXT,
+    sub_script_path TEXT,
+    cluster_log TEXT,
+    script_key TEXT,
+    stage TEXT,
+    expected_outputs TEXT,
+    general_state TEXT,
+    detailed_state TEXT,
+    submit_time REAL,
+    update_time REAL,
+    PRIMARY KEY (cluster, job_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_script ON jobs (sub_script_path, script_key);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage);
+CREATE TABLE IF NOT EXISTS state_history (
+    cluster TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    general_state TEXT,
+    detailed_state TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS history_job ON state_history (cluster, job_id);
+'''
+_ACTIVE_STATES = ('pend', 'run')
+
+
+class JobRegistry():
+    '''
+    a job registry in the SQLite database at {path}.
+    Records are dicts with keys: cluster, job_id, sub_dir, sub_script_path, cluster_log, script_key, stage,
+    expected_outputs (list), general_state, detailed_state, submit_time, update_time
+    '''
+    _registries = {}
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def get_default(cls) -> Union['JobRegistry', None]:
+        '''
+        the registry at Config.JOB_REGISTRY_PATH (None if it is '')
+        '''
+        if not Config.JOB_REGISTRY_PATH:
+            return None
+        registry = cls._registries.get(Config.JOB_REGISTRY_PATH)
+        if registry is None or not os.path.isfile(registry.path):
+            registry = cls(Config.JOB_REGISTRY_PATH)
+            cls._registries[Config.JOB_REGISTRY_PATH] = registry
+        return registry
+
+    def _connect(self) -> sqlite3.Connection:
+        '''
+        a connection that commit with full sync. (use as a context manager to commit a transaction)
+        The rollback journal is used instead of WAL that does not work on network file systems.
+        '''
+        db = sqlite3.connect(self.path, timeout=120)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=DELETE')
+        db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    @staticmethod
+    def get_script_key(sub_script_str: str) -> str:
+        '''
+        hash of the submission script without the watermark (that has the time of the run)
+        '''
+        watermark_head = Config.WATERMARK.split(' in ')[0]
+        script = re.sub(f'^# {re.escape(watermark_head)}.*$', '', sub_script_str, flags=re.M)
+        return hashlib.sha256(script.encode()).hexdigest()
+
+    ### record ###
+    def record_submit(self, jobs: list) -> None:
+        '''
+        record submitted {jobs} (ClusterJob objects) in one transaction
+        '''
+        now = time.time()
+        rows = []
+        for job in jobs:
+            rows.append((job.cluster.NAME, job.job_id,
+                         None if job.sub_dir is None else os.path.abspath(job.sub_dir),
+                         None if job.sub_script_path is None else os.path.abspath(job.sub_script_path),
+                         None if job.job_cluster_log is None else os.path.abspath(job.job_cluster_log),
+                         self.get_script_key(job.sub_script_str), job.stage,
+                         json.dumps([os.path.abspath(p) for p in job.expected_outputs or []]),
+                         'pend', 'SUBMITTED', now, now))
+            job._registry_state = ('pend', 'SUBMITTED')
+        with self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+            db.executemany('INSERT INTO state_history VALUES (?,?,?,?,?)',
+                           [(row[0], row[1], 'pend', 'SUBMITTED', now) for row in rows])
+        db.close()
+
+    def record_states(self, jobs: list) -> None:
+        '''
+        record states of {jobs} that changed since the last record in one transaction
+        (jobs that are not in the registry are skipped)
+        '''
+        changed_jobs = [job for job in jobs
+                        if job.job_id is not None and job.state is not None
+                        and getattr(job, '_registry_state', None) != job.state[0]]
+        if not changed_jobs:
+            return
+        with self._connect() as db:
+            for job in changed_jobs:
+                (general_state, detailed_state), update_time = job.state
+                cursor = db.execute('UPDATE jobs SET general_state=?, detailed_state=?, update_time=? WHERE cluster=? AND job_id=?',
+                                    (general_state, detailed_state, update_time, job.cluster.NAME, job.job_id))
+                if cursor.rowcount:
+                    db.execute('INSERT INTO state_history VALUES (?,?,?,?,?)',
+                               (job.cluster.NAME, job.job_id, general_state, detailed_state, update_time))
+                job._registry_state = job.state[0]
+        db.close()
+
+    ### query ###
+    def get_record(self, job_id: str, cluster: str = None) -> Union[dict, None]:
+        '''
+        the record of {job_id} (on the cluster of the NAME {cluster})
+        '''
+        query = 'SELECT * FROM jobs WHERE job_id=?'
+        params = [job_id]
+        if cluster is not None:
+            query += ' AND cluster=?'
+            params.append(cluster)
+        records = self._query(query + ' ORDER BY submit_time DESC', params)
+        return records[0] if records else None
+
+    def find_latest(self, sub_script_path: str, sub_script_str: str) -> Union[dict, None]:
+        '''
+        the latest record submitted from {sub_script_path} with the same script content
+        '''
+        records = self._query('SELECT * FROM jobs WHERE sub_script_path=? AND script_key=? ORDER BY submit_time DESC LIMIT 1',
+                              [os.path.abspath(sub_script_path), self.get_script_key(sub_script_str)])
+        return records[0] if records else None
+
+    def get_records(self, stage: str = None, active: bool = None) -> List[dict]:
+        '''
+        records of jobs in the {stage} (default: all). active: True for only pend/run jobs, False for only ended jobs
+        (states are the last recorded ones)
+        '''
+        query = 'SELECT * FROM jobs WHERE 1=1'
+        params = []
+        if stage is not None:
+            query += ' AND stage=?'
+            params.append(stage)
+        if active is not None:
+            query += f' AND general_state {"" if active else "NOT "}IN (?,?)'
+            params.extend(_ACTIVE_STATES)
+        return self._query(query + ' ORDER BY submit_time', params)
+
+    def get_history(self, job_id: str, cluster: str) -> List[tuple]:
+        '''
+        recorded (general_state, detailed_state, time) of the job in order
+        '''
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT general_state, detailed_state, time FROM state_history WHERE cluster=? AND job_id=? ORDER BY time',
+                              (cluster, job_id)).fetchall()
+        finally:
+            db.close()
+        return [tuple(row) for row in rows]
+
+    def _query(self, query: str, params: list) -> List[dict]:
+        db = self._connect()
+        try:
+            rows = db.execute(query, params).fetchall()
+        finally:
+            db.close()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['expected_outputs'] = json.loads(record['expected_outputs'] or '[]')
+            records.append(record)
+        return records
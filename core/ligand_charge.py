@@ -0,0 +1,120 @@
+"""Net charge perception of ligands with a memo shared by all structures (e.g. mutants) in a run.
+The net charge of a ligand depends only on its heavy atom graph and the pH. The result is memorized
+in memory keyed on the canonical SMILES of the heavy atom graph and the pH. Set
+Config.LIGAND_CHARGE_CACHE_PATH to also keep the memo in a JSON file shared by runs (off by default).
+Used by Ligand.get_net_charge and PDB.protonate_ligand.
+
+Usage:
+    net_charge = get_ligand_net_charge(ligand_pdb_str, ph=7.0)
+"""
+import json
+import os
+
+try:
+    import openbabel.pybel as pybel
+except ImportError:
+    raise ImportError('OpenBabel not installed.')
+
+from Class_Conf import Config
+from core.log import get_logger
+
+_LOGGER = get_logger(__name__)
+
+# in memory memo {(fingerprint, ph): net_charge}
+_charge_memo = {}
+# on-disk memo files already loaded to the memory
+_loaded_cache_paths = set()
+
+
+def get_ligand_net_charge(pdb_str: str, ph: float=7.0, method: str='PYBEL') -> int:
+    '''
+    get net charge of the ligand in pdb_str at ph.
+    -------
+    method   : PYBEL (default) protonate the heavy atom graph with openbabel and
+               sum the formal charges (UNITY_ATOM_ATTR info from openbabel mol2)
+    '''
+    if method != 'PYBEL':
+        raise Exception('get_ligand_net_charge: only support PYBEL now.')
+    pybel.ob.obErrorLog.SetOutputLevel(0)
+    heavy_pdb_str = _get_heavy_atom_pdb_str(pdb_str)
+    heavy_mol = pybel.readstring('pdb', heavy_pdb_str)
+    key = (get_ligand_fingerprint(heavy_mol), float(ph))
+
+    cache_path = _get_cache_path()
+    if cache_path and cache_path not in _loaded_cache_paths:
+        _load_cache(cache_path)
+    if key in _charge_memo:
+        _LOGGER.debug('get_ligand_net_charge: found memorized net charge for %s at pH %s', key[0], ph)
+        return _charge_memo[key]
+
+    # add H and result net charge
+    heavy_mol.OBMol.AddHydrogens(False, True, ph)
+    mol = pybel.readstring('mol2', heavy_mol.write('mol2'))
+    net_charge = 0
+    for atom in mol:
+        net_charge = net_charge + atom.formalcharge
+
+    _charge_memo[key] = net_charge
+    if cache_path:
+        _dump_cache(cache_path)
+    return net_charge
+
+
+def get_ligand_fingerprint(heavy_mol) -> str:
+    '''
+    canonical SMILES of a pybel molecule (without H)
+    '''
+    return heavy_mol.write('can').split()[0]
+
+
+def clear_ligand_charge_memo():
+    '''
+    clear the in memory memo (the on-disk memo will be loaded again on the next use)
+    '''
+    _charge_memo.clear()
+    _loaded_cache_paths.clear()
+
+
+def _get_heavy_atom_pdb_str(pdb_str: str) -> str:
+    '''
+    remove H and clean the connectivity.
+    (only keep the ATOM lines so the connectivity is determined from the coordinate again)
+    '''
+    mol = pybel.readstring('pdb', pdb_str)
+    mol.removeh()
+    return ''.join(line+os.linesep for line in mol.write('pdb').splitlines() if 'ATOM' in line)
+
+
+def _get_cache_path() -> str:
+    if not Config.LIGAND_CHARGE_CACHE_PATH:
+        return ''
+    return os.path.expanduser(Config.LIGAND_CHARGE_CACHE_PATH)
+
+
+def _load_cache(cache_path: str):
+    '''
+    load the on-disk memo to the memory
+    '''
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                for record in json.load(f):
+                    _charge_memo[(record['fingerprint'], float(record['ph']))] = int(record['net_charge'])
+        except (ValueError, KeyError, TypeError):
+            _LOGGER.warning('get_ligand_net_charge: ignore broken cache file %s', cache_path)
+    _loaded_cache_paths.add(cache_path)
+
+
+def _dump_cache(cache_path: str):
+    '''
+    write the memo to cache_path. merge with records from other processes and replace the file atomically.
+    '''
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    _load_cache(cache_path)
+    records = [{'fingerprint': fp, 'ph': ph, 'net_charge': charge} for (fp, ph), charge in _charge_memo.items()]
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as of:
+        json.dump(records, of, indent=1)
+    os.replace(temp_path, cache_path)
@@ -0,0 +1,204 @@
+"""Logging of EnzyHTP.
+Modules log to their own logger under "EnzyHTP" (get_logger(__name__)). Pass arguments %-style so a
+message is only formatted when it is emitted:
+    _LOGGER = get_logger(__name__)
+    _LOGGER.debug('found metal in raw: %s %s %s', chain.id, residue.name, residue.id)
+Level:
+    Config.LOG_LEVEL (e.g.: 'WARNING') or by Config.debug if it is None (0: ERROR, 1: INFO, 2+: DEBUG).
+    It is read at each call so changing Config.debug in a script works as before. A disabled call
+    costs one comparison. (a level set on a logger by setLevel take precedence)
+Output:
+    - stderr (Config.LOG_FORMAT: 'text' or 'json' (one JSON object per line for aggregation))
+    - Config.LOG_FILE if set (call setup_logging() after changing it)
+    - mutant_log(work_dir): also log to {work_dir}/{Config.MUTANT_LOG_NAME} while working on a mutant.
+      (records of threads started inside are not included)
+Repeated warnings:
+    a WARNING or above with the same logger and message template is emitted at most Config.LOG_REPEAT_LIMIT
+    times in Config.LOG_REPEAT_WINDOW s. The next one after the window report how many were suppressed.
+
+Usage:
+    Config.LOG_FORMAT = 'json'
+    for mut in mutants:
+        pdb_obj = PDB(wt_pdb, wk_dir=f"./mutation_{'_'.join(mut)}")
+        with mutant_log(pdb_obj.dir, mutant='_'.join(mut)):
+            ...
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from Class_Conf import Config
+
+ROOT_LOGGER_NAME = 'EnzyHTP'
+_DEBUG_LEVELS = {0: logging.ERROR, 1: logging.INFO}
+_TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_current_mutant = contextvars.ContextVar('enzyhtp_mutant', default=None)
+_create_lock = threading.Lock()
+_repeat_lock = threading.Lock()
+_repeat_state = {} # (logger name, level, msg template): [window start, count]
+_handlers = []
+
+
+def get_config_level() -> int:
+    '''
+    the level from Config.LOG_LEVEL or Config.debug
+    '''
+    if Config.LOG_LEVEL is not None:
+        return logging.getLevelName(Config.LOG_LEVEL.upper()) if isinstance(Config.LOG_LEVEL, str) else Config.LOG_LEVEL
+    return _DEBUG_LEVELS.get(Config.debug, logging.DEBUG)
+
+
+class _EnzyHTPLogger(logging.Logger):
+    '''
+    logger whose default level follow the Config and that suppress repeated warnings
+    '''
+    def getEffectiveLevel(self) -> int:
+        logger = self
+        while logger:
+            if logger.level:
+                return logger.level
+            if logger.name == ROOT_LOGGER_NAME:
+                return get_config_level()
+            logger = logger.parent
+        return logging.NOTSET
+
+    def isEnabledFor(self, level: int) -> bool:
+        # not cached like logging.Logger so the Config can change at any time
+        return not self.disabled and level >= self.getEffectiveLevel()
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if record.levelno >= logging.WARNING and not _check_repeat(record):
+            return
+        super().handle(record)
+
+
+def _check_repeat(record: logging.LogRecord) -> bool:
+    '''
+    whether {record} should be emitted. Add the number of suppressed ones to the message of the first
+    record after a window that had suppression.
+    '''
+    key = (record.name, record.levelno, str(record.msg))
+    now = time.time()
+    with _repeat_lock:
+        state = _repeat_state.get(key)
+        if state is None or now - state[0] > Config.LOG_REPEAT_WINDOW:
+            n_suppressed = 0 if state is None else max(0, state[1] - Config.LOG_REPEAT_LIMIT)
+            _repeat_state[key] = [now, 1]
+            if n_suppressed:
+                record.msg = f'{record.msg} ({n_suppressed} similar messages suppressed)'
+            return True
+        state[1] += 1
+        return state[1] <= Config.LOG_REPEAT_LIMIT
+
+
+def get_logger(name: str) -> logging.Logger:
+    '''
+    the logger of module {name} (EnzyHTP.{name})
+    '''
+    logger_name = name if name == ROOT_LOGGER_NAME or name.startswith(f'{ROOT_LOGGER_NAME}.') else f'{ROOT_LOGGER_NAME}.{name}'
+    manager = logging.Logger.manager
+    with _create_lock:
+        # loggers of other names are not made in between since logging hold its own lock in getLogger
+        logger_class = manager.loggerClass
+        manager.loggerClass = _EnzyHTPLogger
+        try:
+            root_logger = manager.getLogger(ROOT_LOGGER_NAME)
+            logger = manager.getLogger(logger_name)
+        finally:
+            manager.loggerClass = logger_class
+    if not _handlers:
+        setup_logging(root_logger)
+    return logger
+
+
+class JSONFormatter(logging.Formatter):
+    '''
+    one JSON object per record
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'pid': record.process,
+            'mutant': _current_mutant.get(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConfigFormatter(logging.Formatter):
+    '''
+    text or JSON by Config.LOG_FORMAT at the time of formatting
+    '''
+    def __init__(self) -> None:
+        super().__init__(_TEXT_FORMAT)
+        self._json_formatter = JSONFormatter()
+
+    def format(self, record: logging.LogRecord) -> str:
+        if Config.LOG_FORMAT == 'json':
+            return self._json_formatter.format(record)
+        return super().format(record)
+
+
+def setup_logging(root_logger: logging.Logger = None) -> None:
+    '''
+    (re)make the stderr handler and the Config.LOG_FILE handler of the EnzyHTP logger
+    '''
+    if root_logger is None:
+        root_logger = get_logger(ROOT_LOGGER_NAME)
+    for handler in _handlers:
+        root_logger.removeHandler(handler)
+        handler.close()
+    _handlers.clear()
+    _handlers.append(logging.StreamHandler())
+    if Config.LOG_FILE:
+        log_path = os.path.expanduser(Config.LOG_FILE)
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        _handlers.append(logging.FileHandler(log_path))
+    for handler in _handlers:
+        handler.setFormatter(ConfigFormatter())
+        root_logger.addHandler(handler)
+    # handled here. do not print again if the application configured the root logger
+    root_logger.propagate = False
+
+
+class _MutantFilter(logging.Filter):
+    def __init__(self, mutant: str) -> None:
+        super().__init__()
+        self.mutant = mutant
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return _current_mutant.get() == self.mutant
+
+
+@contextmanager
+def mutant_log(work_dir: str, mutant: str = None):
+    '''
+    also log records made in the with block to {work_dir}/{Config.MUTANT_LOG_NAME} (appended)
+    and tag them with {mutant} (default: name of work_dir) in the JSON format.
+    '''
+    if mutant is None:
+        mutant = os.path.basename(os.path.normpath(work_dir))
+    os.makedirs(work_dir, exist_ok=True)
+    root_logger = get_logger(ROOT_LOGGER_NAME)
+    handler = logging.FileHandler(os.path.join(work_dir, Config.MUTANT_LOG_NAME))
+    handler.setFormatter(ConfigFormatter())
+    handler.addFilter(_MutantFilter(mutant))
+    token = _current_mutant.set(mutant)
+    root_logger.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        root_logger.removeHandler(handler)
+        handler.close()
+        _current_mutant.reset(token)
@@ -0,0 +1,243 @@
+"""Timing instrumentation of the workflow.
+When Config.PROFILE_TRACE_PATH is set, spans are appended to that file as trace events in the
+Chrome trace format (open it in https://ui.perfetto.dev or chrome://tracing for a timeline/flame
+chart, or summarize it with `python -m core.profiler trace.json`). Each span records
+    wall time, CPU time of the process, CPU time of finished subprocesses (subprocess time),
+    peak RSS of the process, bytes read/written by the process and block I/O of subprocesses.
+Spans are made for
+    - public methods of PDB (instrument_class) [cat: PDB]
+    - external tools run by subprocess/os.system in Class_PDB (profile_tool) [cat: tool]
+    - scheduler commands (core/rate_limiter.py) [cat: scheduler]
+    - ClusterJob: queue wait (submit -> first seen running) and run time (-> first seen ended)
+      on their own track (record_cluster_job) [cat: cluster_job]
+Nothing is measured when the path is ''. (the default)
+
+Usage:
+    Config.PROFILE_TRACE_PATH = 'trace.json'
+    with trace_span('my analysis', 'analysis', mutant='A11L'):
+        ...
+    summary = summarize_trace('trace.json') # {(cat, name): {'count', 'wall', 'cpu', 'subprocess'}}
+"""
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from Class_Conf import Config
+
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+def is_enabled() -> bool:
+    return bool(Config.PROFILE_TRACE_PATH)
+
+
+def _get_io() -> tuple[int, int]:
+    '''
+    bytes read and written by the process (Linux /proc/self/io. (0, 0) if not available)
+    '''
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _get_usage() -> dict:
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = _get_io()
+    return {
+        'wall': time.time(),
+        'cpu': time.process_time(),
+        'child_cpu': child_usage.ru_utime + child_usage.ru_stime,
+        # KB on Linux and bytes on macOS
+        'peak_rss_mb': self_usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+        # in 512-byte blocks
+        'child_block_io': child_usage.ru_inblock + child_usage.ru_oublock,
+    }
+
+
+def _get_trace_path() -> str:
+    return os.path.abspath(os.path.expanduser(Config.PROFILE_TRACE_PATH))
+
+
+def write_event(event: dict, trace_path: str = None) -> None:
+    '''
+    append one trace event to {trace_path} (default: Config.PROFILE_TRACE_PATH).
+    The file is a JSON array without the closing bracket. (allowed by the format so a killed run still has a valid trace)
+    '''
+    if trace_path is None:
+        trace_path = _get_trace_path()
+    line = json.dumps(event, default=str) + ',\n'
+    with _write_lock:
+        if not os.path.isfile(trace_path):
+            os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+            line = '[\n' + line
+        with open(trace_path, 'a') as of:
+            of.write(line)
+
+
+@contextmanager
+def trace_span(name: str, category: str, **args):
+    '''
+    record the code in the with block as a span of {name} in {category} with {args}
+    '''
+    if not is_enabled():
+        yield
+        return
+    # the working dir may change in the span (e.g.: submission in sub_dir)
+    trace_path = _get_trace_path()
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start = _get_usage()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _local.depth = depth
+        end = _get_usage()
+        span_args = dict(args)
+        span_args.update({
+            'cpu_time': round(end['cpu'] - start['cpu'], 6),
+            'subprocess_time': round(end['child_cpu'] - start['child_cpu'], 6),
+            'peak_rss_mb': round(end['peak_rss_mb'], 1),
+            'read_bytes': end['read_bytes'] - start['read_bytes'],
+            'write_bytes': end['write_bytes'] - start['write_bytes'],
+            'subprocess_block_io_bytes': (end['child_block_io'] - start['child_block_io']) * 512,
+            'depth': depth,
+        })
+        if error is not None:
+            span_args['error'] = error
+        write_event({'name': name, 'cat': category, 'ph': 'X',
+                     'ts': int(start['wall'] * 1e6), 'dur': int((end['wall'] - start['wall']) * 1e6),
+                     'pid': os.getpid(), 'tid': threading.get_ident(), 'args': span_args}, trace_path)
+
+
+def profile_function(func: Callable, category: str, name: str = None) -> Callable:
+    '''
+    wrap {func} so each call is a span (named {name} or the qualified name of func)
+    For methods, the path of the PDB object (self.path) is recorded if it has one.
+    '''
+    span_name = func.__qualname__ if name is None else name
+
+    @functools.wraps(func)
+    def profiled(*args, **kwargs):
+        if not is_enabled():
+            return func(*args, **kwargs)
+        span_args = {}
+        if args and isinstance(getattr(args[0], 'path', None), str):
+            span_args['pdb'] = args[0].path
+        with trace_span(span_name, category, **span_args):
+            return func(*args, **kwargs)
+    return profiled
+
+
+def profile_tool(func: Callable, category: str = 'tool') -> Callable:
+    '''
+    wrap a function that run a shell command as its first argument (e.g.: subprocess.run, os.system).
+    The span is named by the program (e.g.: tleap) and records the command.
+    '''
+    @functools.wraps(func)
+    def profiled(cmd, *args, **kwargs):
+        if not is_enabled():
+            return func(cmd, *args, **kwargs)
+        cmd_str = cmd if isinstance(cmd, str) else ' '.join(map(str, cmd))
+        program = os.path.basename(cmd_str.split()[0]) if cmd_str.split() else 'shell'
+        with trace_span(program, category, cmd=cmd_str[:500], cwd=kwargs.get('cwd')):
+            return func(cmd, *args, **kwargs)
+    return profiled
+
+
+def instrument_class(cls: type, category: str) -> type:
+    '''
+    make spans for all public methods (including class and static methods) of {cls}
+    '''
+    for attr_name, attr in list(cls.__dict__.items()):
+        if attr_name.startswith('_'):
+            continue
+        if isinstance(attr, classmethod):
+            setattr(cls, attr_name, classmethod(profile_function(attr.__func__, category)))
+        elif isinstance(attr, staticmethod):
+            setattr(cls, attr_name, staticmethod(profile_function(attr.__func__, category)))
+        elif inspect.isfunction(attr):
+            setattr(cls, attr_name, profile_function(attr, category))
+    return cls
+
+
+def record_cluster_job(job) -> None:
+    '''
+    record the queue wait and the run time of the ended ClusterJob {job} on the track of the job
+    (times are when the states were first seen so they are accurate to the period of checking)
+    '''
+    if not is_enabled() or job.submit_time is None:
+        return
+    track = f'{job.cluster.NAME} {job.job_id}'
+    end_time = job.end_time if job.end_time is not None else time.time()
+    start_time = job.start_time if job.start_time is not None else end_time
+    args = {'job_id': job.job_id, 'cluster': job.cluster.NAME, 'stage': job.stage,
+            'state': job.state[0][1] if job.state else None, 'sub_dir': job.sub_dir}
+    for name, begin, end in (('queue', job.submit_time, start_time), ('run', start_time, end_time)):
+        if end <= begin and name == 'run':
+            continue
+        write_event({'name': name, 'cat': 'cluster_job', 'ph': 'X',
+                     'ts': int(begin * 1e6), 'dur': int((end - begin) * 1e6),
+                     'pid': f'cluster {job.cluster.NAME}', 'tid': track,
+                     'args': {**args, 'queue_wait': round(start_time - job.submit_time, 3),
+                              'run_time': round(end_time - start_time, 3)}})
+
+
+def load_trace(trace_path: str) -> list:
+    '''
+    events in the trace file (that may not have the closing bracket)
+    '''
+    with open(trace_path) as f:
+        content = f.read().strip().rstrip(',')
+    if not content.endswith(']'):
+        content += ']'
+    return json.loads(content)
+
+
+def summarize_trace(trace_path: str) -> dict:
+    '''
+    totals of spans by (category, name): {'count', 'wall', 'cpu', 'subprocess'} (s)
+    (a span includes spans nested in it. e.g.: the tleap call in PDB.PDB2FF)
+    '''
+    summary = {}
+    for event in load_trace(trace_path):
+        if event.get('ph') != 'X':
+            continue
+        args = event.get('args', {})
+        key = (event['cat'], event['name'])
+        if key not in summary:
+            summary[key] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'subprocess': 0.0}
+        summary[key]['count'] += 1
+        summary[key]['wall'] += event['dur'] / 1e6
+        summary[key]['cpu'] += args.get('cpu_time', 0.0)
+        summary[key]['subprocess'] += args.get('subprocess_time', 0.0)
+    return summary
+
+
+def main(argv: list = None) -> None:
+    trace_path = (sys.argv[1:] if argv is None else argv)[0]
+    summary = summarize_trace(trace_path)
+    print(f'{"category":<12}{"name":<45}{"count":>7}{"wall(s)":>12}{"cpu(s)":>10}{"subproc(s)":>12}')
+    for (category, name), total in sorted(summary.items(), key=lambda x: -x[1]['wall']):
+        print(f'{category:<12}{name[:44]:<45}{total["count"]:>7}{total["wall"]:>12.2f}{total["cpu"]:>10.2f}{total["subprocess"]:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
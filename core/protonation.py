@@ -0,0 +1,380 @@
+"""Protonation service based on PDB2PQR and PROPKA.
+Keep the PDB2PQR topology definitions, force fields and the PROPKA parameter table loaded in the
+process so that protonating many structures (e.g. the same scaffold after every minimization or
+mutation) do not pay the start up of the PDB2PQR driver every time.
+
+Results are cached in memory by the hash of the input PDB file and the pH.
+
+Usage:
+    service = PDB2PQRService.get_service()
+    result = service.protonate(pdb_path, ph=7.0, out_path=pqr_path)
+    result.pqr_str / result.pka_rows / result.disulfied_residue_pairs
+    # mutant: only recompute pKa near the mutated residues and reuse the rest from result
+    mut_result = service.protonate_incremental(mut_pdb_path, result, [('A', 101)], ph=7.0, radius=6.0)
+"""
+import hashlib
+from collections import OrderedDict
+from io import StringIO
+import numpy as np
+
+try:
+    from pdb2pqr import io as pqr_io
+    from pdb2pqr import forcefield, hydrogens, debump
+    from pdb2pqr import biomolecule as biomol
+    from pdb2pqr import pdb as pqr_pdb
+    from pdb2pqr.main import build_main_parser, is_repairable
+    from pdb2pqr.utilities import noninteger_charge
+except ImportError:
+    raise ImportError('PDB2PQR not installed.')
+try:
+    import propka.input as pk_in
+    from propka.parameters import Parameters
+    from propka.molecular_container import MolecularContainer
+except ImportError:
+    raise ImportError('PropKa not installed.')
+
+from Class_Conf import Config
+from core.log import get_logger
+
+_LOGGER = get_logger(__name__)
+
+# residues with titratable side chains in PROPKA
+TITRATABLE_RESIDUES = ('ASP', 'GLU', 'HIS', 'CYS', 'TYR', 'LYS', 'ARG')
+# AMBER names of protonation variants
+TITRATION_NAME_MAP = {'ASH': 'ASP', 'GLH': 'GLU', 'HID': 'HIS', 'HIE': 'HIS', 'HIP': 'HIS',
+                      'CYM': 'CYS', 'CYX': 'CYS', 'LYN': 'LYS'}
+
+
+class ProtonationResult():
+    '''
+    result of a PDB2PQR run
+    ----------
+    pqr_str: content of the pqr file (PDB format with AMBER names by default)
+    pka_rows: a list of dict of the PROPKA result for each titratable group.
+              (keys: res_num, ins_code, res_name, chain_id, group_label, pKa, ...)
+    disulfied_residue_pairs: e.g.: [(('A', 496), ('A', 440)), ...]
+    ph: pH used
+    ----------
+    the same object is shared by all hits of the cache. Do not modify it.
+    '''
+    def __init__(self, pqr_str: str, pka_rows: list, disulfied_residue_pairs: list, ph: float) -> None:
+        self.pqr_str = pqr_str
+        self.pka_rows = pka_rows
+        self.disulfied_residue_pairs = disulfied_residue_pairs
+        self.ph = ph
+
+    def write(self, out_path: str) -> str:
+        '''
+        write the pqr file to out_path
+        '''
+        with open(out_path, 'w') as of:
+            of.write(self.pqr_str)
+        return out_path
+
+    def get_pka_dict(self) -> dict:
+        '''
+        return pKa of titratable residues in the format used by PDB2PQR
+        {'RES_NAME RES_NUM CHAIN_ID' : pKa}
+        '''
+        return {f"{row['res_name']} {row['res_num']} {row['chain_id']}": row["pKa"]
+                for row in self.pka_rows
+                if row["group_label"].startswith(row["res_name"])}
+
+
+class PDB2PQRService():
+    '''
+    An in-process PDB2PQR/PROPKA runner with loaded parameters and a result cache.
+    Equivalent to: pdb2pqr --ff=PARSE --ffout=AMBER --titration-state-method=propka --with-ph=ph in.pdb out.pqr
+    ----------
+    ff: force field for the charge and radius (default: PARSE)
+    ffout: naming scheme of the output (default: AMBER)
+    cache_size: max number of results kept in memory (least recent used ones are dropped)
+    '''
+    _services = {}
+
+    def __init__(self, ff: str='PARSE', ffout: str='AMBER', cache_size: int=32) -> None:
+        self.ff = ff.lower()
+        self.ffout = ffout.lower()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # parameters loaded once
+        self.definition = pqr_io.get_definitions()
+        self.forcefield = forcefield.Forcefield(self.ff, self.definition, None, None)
+        if self.ffout != self.ff:
+            self.name_scheme = forcefield.Forcefield(self.ffout, self.definition, None)
+        else:
+            self.name_scheme = self.forcefield
+        self.hydrogen_handler = hydrogens.create_handler()
+        # options for PROPKA (the same as the defaults of the pdb2pqr command)
+        self.args = build_main_parser().parse_args([f'--ff={ff}', f'--ffout={ffout}', '--with-ph=7.0', 'in.pdb', 'out.pqr'])
+        self.propka_parameters = pk_in.read_parameter_file(self.args.parameters, Parameters())
+
+    @classmethod
+    def get_service(cls, ff: str='PARSE', ffout: str='AMBER'):
+        '''
+        get the shared service of the current process for ff and ffout
+        '''
+        key = (ff.upper(), ffout.upper())
+        if key not in cls._services:
+            cls._services[key] = cls(ff, ffout)
+        return cls._services[key]
+
+    def protonate(self, pdb_path: str, ph: float=7.0, out_path: str=None, pka_dict: dict=None) -> ProtonationResult:
+        '''
+        protonate the structure in pdb_path at ph. write the pqr to out_path if provided.
+        ----------
+        pka_dict: use these pKa values ({'RES_NAME RES_NUM CHAIN_ID' : pKa}) instead of running PROPKA.
+                  (results with pka_dict are not cached)
+        return a ProtonationResult (from the cache if the same file and pH is protonated before)
+        '''
+        with open(pdb_path) as f:
+            pdb_str = f.read()
+
+        if pka_dict is None:
+            key = (hashlib.sha256(pdb_str.encode()).hexdigest(), float(ph))
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                result = self._cache[key]
+                _LOGGER.debug('PDB2PQRService: found cached result for %s at pH %s', pdb_path, ph)
+            else:
+                result = self._run(pdb_str, ph)
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            result = self._run(pdb_str, ph, pka_dict=pka_dict)
+
+        if out_path is not None:
+            result.write(out_path)
+        return result
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def protonate_incremental(self, pdb_path: str, ref_result: ProtonationResult, changed_residues: list,
+                              ph: float=7.0, radius: float=6.0, context: float=None, out_path: str=None) -> ProtonationResult:
+        '''
+        protonate the structure in pdb_path (e.g.: a mutant) reusing the pKa in ref_result (e.g.: the wild type)
+        and only recompute pKa of residues within radius of the changed residues.
+        ----------
+        ref_result: a ProtonationResult of the reference structure (same residue numbering)
+        changed_residues: a list of (chain_id, res_seq) of the changed (e.g.: mutated) residues
+        radius: residues with any atom within radius (A) of any atom of the changed residues are recomputed
+        context: PROPKA is run only on residues within radius+context (A) of the changed residues.
+                 (default: desolv_cutoff of the PROPKA parameters)
+        * fall back to a full run if residues outside the radius do not match the reference.
+        return a ProtonationResult (not cached)
+        '''
+        if context is None:
+            context = self.propka_parameters.desolv_cutoff
+        with open(pdb_path) as f:
+            pdb_str = f.read()
+        biomolecule, debumper = self._prepare(pdb_str)
+        residues = biomolecule.residues
+
+        # spatial index of all atoms
+        atom_coords = []
+        atom_res_idx = []
+        for i, res in enumerate(residues):
+            for atom in res.atoms:
+                atom_coords.append(atom.coords)
+                atom_res_idx.append(i)
+        atom_res_idx = np.array(atom_res_idx)
+        grid = GridIndex(np.array(atom_coords, dtype=float), cell_size=radius+context)
+
+        changed_coords = []
+        changed_keys = set((str(c), int(r)) for c, r in changed_residues)
+        for res in residues:
+            if (str(res.chain_id), int(res.res_seq)) in changed_keys:
+                changed_keys.discard((str(res.chain_id), int(res.res_seq)))
+                changed_coords.extend(atom.coords for atom in res.atoms)
+        if len(changed_keys) != 0:
+            raise Exception(f'PDB2PQRService.protonate_incremental: cannot find changed residues {changed_keys} in {pdb_path}')
+        changed_coords = np.array(changed_coords, dtype=float)
+        shell_idx = set(atom_res_idx[grid.query(changed_coords, radius)])
+        context_idx = set(atom_res_idx[grid.query(changed_coords, radius+context)])
+
+        # titration states outside the shell from the reference
+        # (match by residue id and canonical name since the input could have AMBER names from the last protonation)
+        shell_res = set((residues[i].res_seq, residues[i].chain_id) for i in shell_idx)
+        ref_pka = {}
+        for key, pka in ref_result.get_pka_dict().items():
+            key_parts = key.split()
+            ref_pka[(TITRATION_NAME_MAP.get(key_parts[0], key_parts[0]), int(key_parts[1]), ''.join(key_parts[2:]))] = pka
+        pka_dict = {}
+        matched = set()
+        for i, res in enumerate(residues):
+            if i in shell_idx:
+                continue
+            res_id = (TITRATION_NAME_MAP.get(res.name, res.name), int(res.res_seq), res.chain_id.strip())
+            if res_id in ref_pka:
+                pka_dict[self._get_res_key(res)] = ref_pka[res_id]
+                matched.add(res_id)
+            elif res.name in TITRATABLE_RESIDUES:
+                matched = None
+                break
+        if matched is None or any((i[1], i[2]) not in shell_res and i not in matched for i in ref_pka):
+            _LOGGER.info('PDB2PQRService.protonate_incremental: residues in %s do not match the reference. Run a full protonation.', pdb_path)
+            return self.protonate(pdb_path, ph=ph, out_path=out_path)
+
+        # PROPKA on the neighborhood
+        context_atoms = [atom for i in sorted(context_idx) for atom in residues[i].atoms]
+        shell_rows = [row for row in self._run_propka(biomolecule, atoms=context_atoms)
+                      if (row['res_num'], row['chain_id']) in shell_res]
+        pka_rows = [row for row in ref_result.pka_rows if (row['res_num'], row['chain_id']) not in shell_res] + shell_rows
+        pka_dict.update(ProtonationResult('', shell_rows, [], ph).get_pka_dict())
+        _LOGGER.debug('PDB2PQRService.protonate_incremental: recomputed %s residues with PROPKA on %s residues', len(shell_idx), len(context_idx))
+
+        result = self._finish(biomolecule, debumper, ph, pka_dict, pka_rows)
+        if out_path is not None:
+            result.write(out_path)
+        return result
+
+    def _run(self, pdb_str: str, ph: float, pka_dict: dict=None) -> ProtonationResult:
+        '''
+        the non-trivial part of the PDB2PQR driver using loaded parameters
+        '''
+        biomolecule, debumper = self._prepare(pdb_str)
+        if pka_dict is None:
+            pka_rows = self._run_propka(biomolecule)
+            pka_dict = ProtonationResult('', pka_rows, [], ph).get_pka_dict()
+        else:
+            pka_rows = []
+        return self._finish(biomolecule, debumper, ph, pka_dict, pka_rows)
+
+    def _prepare(self, pdb_str: str):
+        '''
+        build the biomolecule and fix heavy atoms. (till before assigning titration states)
+        '''
+        pdblist, _ = pqr_pdb.read_pdb(StringIO(pdb_str))
+        biomolecule = biomol.Biomolecule(pdblist, self.definition)
+        biomolecule.set_termini(neutraln=False, neutralc=False)
+        biomolecule.update_bonds()
+
+        debumper = debump.Debump(biomolecule)
+        if is_repairable(biomolecule, False):
+            biomolecule.repair_heavy()
+        biomolecule.update_ss_bridges()
+        debumper.debump_biomolecule()
+        biomolecule.remove_hydrogens()
+        return biomolecule, debumper
+
+    def _finish(self, biomolecule, debumper, ph: float, pka_dict: dict, pka_rows: list) -> ProtonationResult:
+        '''
+        assign titration states with pka_dict, add hydrogens and apply the force field
+        '''
+        # apply_pka_values consumes the dict
+        biomolecule.apply_pka_values(self.forcefield.name, ph, dict(pka_dict))
+        # hydrogens
+        biomolecule.add_hydrogens()
+        debumper.debump_biomolecule()
+        hydrogen_routines = hydrogens.HydrogenRoutines(debumper, self.hydrogen_handler)
+        hydrogen_routines.set_optimizeable_hydrogens()
+        biomolecule.hold_residues(None)
+        hydrogen_routines.initialize_full_optimization()
+        hydrogen_routines.optimize_hydrogens()
+        hydrogen_routines.cleanup()
+        # force field
+        biomolecule.set_states()
+        matched_atoms, _ = biomolecule.apply_force_field(self.forcefield)
+        total_charge = 0
+        for residue in biomolecule.residues:
+            total_charge += residue.charge
+        charge_err = noninteger_charge(total_charge)
+        if charge_err:
+            raise ValueError(charge_err)
+        biomolecule.apply_name_scheme(self.name_scheme)
+        pqr_str = ''.join(pqr_io.print_biomolecule_atoms(matched_atoms, self.args.keep_chain))
+
+        return ProtonationResult(pqr_str, pka_rows, self._get_disulfied_residue_pairs(biomolecule), ph)
+
+    @classmethod
+    def _get_res_key(cls, residue) -> str:
+        '''
+        key of a residue used in the pKa dict of PDB2PQR
+        '''
+        return f'{residue.name} {residue.res_seq} {residue.chain_id}'.strip()
+
+    def _run_propka(self, biomolecule, atoms: list=None) -> list:
+        '''
+        run PROPKA on the biomolecule with the loaded parameters
+        atoms: only use these atoms of the biomolecule
+        '''
+        if atoms is None:
+            atoms = biomolecule.atoms
+        lines = pqr_io.print_biomolecule_atoms(atomlist=atoms, chainflag=self.args.keep_chain, pdbfile=True)
+        with StringIO() as fpdb:
+            fpdb.writelines(lines)
+            molecule = MolecularContainer(self.propka_parameters, self.args)
+            # needs a mock name with .pdb extension to work with stream data
+            molecule = pk_in.read_molecule_file('input.pdb', molecule, fpdb)
+        molecule.calculate_pka()
+
+        rows = []
+        for group in molecule.conformations['AVR'].groups:
+            atom = group.atom
+            rows.append({
+                'res_num': atom.res_num,
+                'ins_code': atom.icode,
+                'res_name': atom.res_name,
+                'chain_id': atom.chain_id,
+                'group_label': group.label,
+                'group_type': getattr(group, 'type', None),
+                'pKa': group.pka_value,
+                'model_pKa': group.model_pka,
+                'buried': group.buried,
+            })
+        return rows
+
+    @classmethod
+    def _get_disulfied_residue_pairs(cls, biomolecule) -> list:
+        '''
+        return disulfied_residue_pairs in a format of e.g.: [(('A', 496), ('A', 440)), ...]
+        '''
+        disulfied_residue_pairs = []
+        for res in biomolecule.residues:
+            if getattr(res, 'ss_bonded', None):
+                res_key = (res.chain_id, res.res_seq)
+                for exist_pair in disulfied_residue_pairs:
+                    if res_key in exist_pair:
+                        break
+                else:
+                    disulfied_residue_pairs.append(
+                        (res_key,
+                        (res.ss_bonded_partner.chain_id, res.ss_bonded_partner.res_seq)))
+        return disulfied_residue_pairs
+
+
+class GridIndex():
+    '''
+    A uniform grid (cell list) spatial index of points for neighbor search.
+    ----------
+    coords: (N, 3) array of points
+    cell_size: edge length of a cell. (queries with cutoff <= cell_size only check neighboring cells)
+    '''
+    def __init__(self, coords: np.ndarray, cell_size: float) -> None:
+        self.coords = coords
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, cell in enumerate(map(tuple, np.floor(coords / cell_size).astype(int))):
+            self.cells.setdefault(cell, []).append(i)
+
+    def query(self, points: np.ndarray, cutoff: float) -> np.ndarray:
+        '''
+        return sorted indexes of coords within cutoff of any of the points
+        '''
+        n_cell = int(np.ceil(cutoff / self.cell_size))
+        shifts = range(-n_cell, n_cell+1)
+        candidates = set()
+        for cell in set(map(tuple, np.floor(points / self.cell_size).astype(int))):
+            for dx in shifts:
+                for dy in shifts:
+                    for dz in shifts:
+                        candidates.update(self.cells.get((cell[0]+dx, cell[1]+dy, cell[2]+dz), ()))
+        if len(candidates) == 0:
+            return np.array([], dtype=int)
+        candidates = np.array(sorted(candidates))
+        hit = np.zeros(len(candidates), dtype=bool)
+        for point in points:
+            hit |= np.sum((self.coords[candidates] - point)**2, axis=1) <= cutoff**2
+        return candidates[hit]
@@ -0,0 +1,127 @@
+"""Reusable PyMOL sessions for surface calculations on in-memory frames.
+A PyMOL session is started once per process and kept for later calls. Structures are loaded from
+PDB strings and frames are added as states straight from coordinate arrays (no trajectory files).
+PyMOLPool splits the frames across worker processes that each keep their own session.
+
+Usage:
+    pool = PyMOLPool.get_pool(n_workers=4)
+    ses_pro, ses_sub = pool.get_area_by_frame(pro_pdb_str, pro_coords, sub_pdb_str, sub_coords, 'resi 101+102')
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from Class_Conf import Config
+
+# the session of the current process
+_session = None
+
+
+def get_session():
+    '''
+    get the PyMOL session of the current process. (start one for the first time)
+    '''
+    global _session
+    if _session is None:
+        try:
+            import pymol2
+        except ImportError:
+            raise ImportError('PyMOL not installed.')
+        _session = pymol2.PyMOL()
+        _session.start()
+        if Config.debug < 2:
+            _session.cmd.feedback("disable", "all", "everything")
+    return _session
+
+
+def load_frames(cmd, obj_name: str, pdb_str: str, coords: np.ndarray) -> None:
+    '''
+    load the structure in {pdb_str} as {obj_name} and use each frame in {coords} (n_frames, n_atoms, 3) as a state
+    '''
+    cmd.read_pdbstr(pdb_str, obj_name)
+    for i, coord in enumerate(coords):
+        cmd.load_coordset(coord.tolist(), obj_name, state=i+1)
+
+
+def get_area_by_frame(pro_pdb_str: str, pro_coords: np.ndarray,
+                      sub_pdb_str: str, sub_coords: np.ndarray,
+                      target_sele: str, dynamic_sele: bool = False,
+                      dot_solvent: int = 0, dot_density: int = 2) -> Tuple[List[float], List[float]]:
+    '''
+    surface area of {target_sele} in the protein and of the whole substrate of each frame in the session of this process.
+    The protein and the substrate are loaded as separate objects (the surface of one is not occluded by the other)
+    ----------
+    target_sele: PyMOL selection of the target. Can refer to the objects "pro" and "sub".
+    dynamic_sele: evaluate {target_sele} in each state (e.g.: "pro & br. (sub around 4)")
+                  otherwise it is evaluated only in the first state.
+    '''
+    cmd = get_session().cmd
+    cmd.set("dot_solvent", dot_solvent)
+    cmd.set("dot_density", dot_density)
+    load_frames(cmd, "pro", pro_pdb_str, pro_coords)
+    load_frames(cmd, "sub", sub_pdb_str, sub_coords)
+    try:
+        ses_pro_by_frame = []
+        ses_sub_by_frame = []
+        for i in range(len(pro_coords)):
+            if dynamic_sele or i == 0:
+                cmd.select("target", f"({target_sele}) & pro", state=i+1)
+            ses_pro_by_frame.append(cmd.get_area(selection="target", state=i+1))
+            ses_sub_by_frame.append(cmd.get_area(selection="sub", state=i+1))
+    finally:
+        cmd.delete("all")
+    return ses_pro_by_frame, ses_sub_by_frame
+
+
+class PyMOLPool():
+    '''
+    A pool of worker processes that each keep a PyMOL session.
+    Frames are split to the workers. (with n_workers = 1 the session of the current process is used)
+    '''
+    _pools = {}
+
+    def __init__(self, n_workers: int = 1) -> None:
+        self.n_workers = n_workers
+        self.executor = None
+        if n_workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=get_session)
+
+    @classmethod
+    def get_pool(cls, n_workers: int = 1) -> 'PyMOLPool':
+        '''
+        get the shared pool with {n_workers} workers
+        '''
+        if n_workers not in cls._pools:
+            cls._pools[n_workers] = cls(n_workers)
+        return cls._pools[n_workers]
+
+    def get_area_by_frame(self, pro_pdb_str: str, pro_coords: np.ndarray,
+                          sub_pdb_str: str, sub_coords: np.ndarray,
+                          target_sele: str, dynamic_sele: bool = False,
+                          dot_solvent: int = 0, dot_density: int = 2) -> Tuple[List[float], List[float]]:
+        '''
+        get_area_by_frame with frames split to the workers. Results are in the order of the frames.
+        '''
+        settings = (target_sele, dynamic_sele, dot_solvent, dot_density)
+        if self.executor is None or len(pro_coords) < 2:
+            return get_area_by_frame(pro_pdb_str, pro_coords, sub_pdb_str, sub_coords, *settings)
+        chunks = [chunk for chunk in np.array_split(np.arange(len(pro_coords)), self.n_workers) if len(chunk)]
+        futures = [self.executor.submit(get_area_by_frame, pro_pdb_str, pro_coords[chunk],
+                                        sub_pdb_str, sub_coords[chunk], *settings)
+                   for chunk in chunks]
+        ses_pro_by_frame = []
+        ses_sub_by_frame = []
+        for future in futures:
+            ses_pro, ses_sub = future.result()
+            ses_pro_by_frame.extend(ses_pro)
+            ses_sub_by_frame.extend(ses_sub)
+        return ses_pro_by_frame, ses_sub_by_frame
+
+    def shutdown(self) -> None:
+        '''
+        stop the workers
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+        type(self)._pools.pop(self.n_workers, None)
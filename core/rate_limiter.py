@@ -0,0 +1,213 @@
+"""Cross-process rate limiter of scheduler commands.
+All EnzyHTP processes of a user (e.g.: several campaigns on the same login node or on login nodes
+sharing the home dir) take tokens from the same token buckets before running sbatch/squeue/sacct/...
+The buckets are kept in a small JSON file and guarded by an flock on a lock file next to it.
+
+When the scheduler rejects a command (e.g.: QOSMaxSubmitJobPerUserLimit or a socket timeout of the
+controller), the bucket of that kind of command is blocked for an exponential backoff and its rate is
+halved for all processes. Each success restores a part of the rate. (AIMD)
+
+Usage:
+    info_run = run_scheduler_cmd('squeue -u $USER', kind='query')
+    submit_run = run_scheduler_cmd('sbatch submit.cmd', kind='submit')
+"""
+import fcntl
+import json
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from subprocess import CompletedProcess, SubprocessError, run
+from typing import Union
+
+from Class_Conf import Config
+from core.log import get_logger
+from core.profiler import profile_tool
+from helper import get_localtime
+
+_LOGGER = get_logger(__name__)
+
+# scheduler commands are timed in the profiling trace (if Config.PROFILE_TRACE_PATH is set)
+run = profile_tool(run, 'scheduler')
+
+# rejections that mean the user reach a limit of the scheduler. They will not clear soon.
+_LIMIT_PATTERNS = (
+    r'QOSMax\w*Limit',
+    r'AssocMax\w*Limit',
+    r'MaxSubmitJob\w*',
+    r'job submit limit',
+    r'Job violates accounting/QOS policy',
+)
+
+
+class SchedulerRateLimiter():
+    '''
+    token buckets in the JSON file at {path} shared by all processes.
+    {rates}: {kind: (commands per second, burst)} e.g.: {'submit': (0.5, 5), 'query': (1.0, 10)}
+    '''
+    # backoff (s) after the first rejection. doubled by each following rejection up to MAX_BACKOFF
+    LIMIT_BACKOFF = 60
+    ERROR_BACKOFF = 5
+    MAX_BACKOFF = 600
+    # rate will not go lower than this fraction of the configured rate
+    MIN_RATE_FRACTION = 0.05
+    # fraction of the configured rate restored by each success
+    RECOVER_FRACTION = 0.1
+
+    _limiters = {}
+
+    def __init__(self, path: str, rates: dict) -> None:
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.rates = rates
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    @classmethod
+    def get_default(cls) -> Union['SchedulerRateLimiter', None]:
+        '''
+        the limiter at Config.SCHEDULER_RATE_LIMIT_PATH (None if it is '')
+        '''
+        if not Config.SCHEDULER_RATE_LIMIT_PATH:
+            return None
+        key = (Config.SCHEDULER_RATE_LIMIT_PATH, json.dumps(Config.SCHEDULER_RATE_LIMIT, sort_keys=True))
+        if key not in cls._limiters:
+            cls._limiters[key] = cls(Config.SCHEDULER_RATE_LIMIT_PATH, Config.SCHEDULER_RATE_LIMIT)
+        return cls._limiters[key]
+
+    @contextmanager
+    def _locked_bucket(self, kind: str):
+        '''
+        the bucket of {kind} refilled to now. Other processes wait until the with block exit.
+        '''
+        rate, burst = self.rates[kind]
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                buckets = {}
+                if os.path.isfile(self.path):
+                    with open(self.path) as f:
+                        try:
+                            buckets = json.load(f)
+                        except json.JSONDecodeError: # a broken file only lose the bucket states
+                            buckets = {}
+                now = time.time()
+                bucket = buckets.setdefault(kind, {'tokens': burst, 'last': now, 'rate': rate,
+                                                   'block_until': 0.0, 'backoff': 0.0})
+                # the configured rate may change between runs
+                bucket['rate'] = min(bucket['rate'], rate)
+                bucket['tokens'] = min(burst, bucket['tokens'] + max(0.0, now - bucket['last']) * bucket['rate'])
+                bucket['last'] = now
+                yield bucket
+                with open(self.path + '.tmp', 'w') as of:
+                    json.dump(buckets, of)
+                os.replace(self.path + '.tmp', self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire(self, kind: str = 'query') -> float:
+        '''
+        wait until a token of {kind} is available and take it.
+        Return the time (s) waited
+        '''
+        start = time.time()
+        while True:
+            with self._locked_bucket(kind) as bucket:
+                now = bucket['last']
+                if now < bucket['block_until']:
+                    wait = bucket['block_until'] - now
+                elif bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return now - start
+                else:
+                    wait = (1 - bucket['tokens']) / bucket['rate']
+            _LOGGER.debug('scheduler rate limit: wait %.1fs for %s', wait, kind)
+            time.sleep(wait)
+
+    def report_success(self, kind: str = 'query') -> None:
+        '''
+        restore a part of the rate of {kind} and reset its backoff
+        '''
+        rate = self.rates[kind][0]
+        with self._locked_bucket(kind) as bucket:
+            if bucket['rate'] < rate or bucket['backoff']:
+                bucket['rate'] = min(rate, bucket['rate'] + rate * self.RECOVER_FRACTION)
+                bucket['backoff'] = 0.0
+
+    def report_rejection(self, kind: str, message: str) -> float:
+        '''
+        block {kind} commands of all processes for a backoff and halve its rate.
+        The backoff start from LIMIT_BACKOFF if {message} is a limit rejection of the scheduler
+        and from ERROR_BACKOFF otherwise.
+        Return the backoff (s)
+        '''
+        rate = self.rates[kind][0]
+        base_backoff = self.LIMIT_BACKOFF if is_limit_rejection(message) else self.ERROR_BACKOFF
+        with self._locked_bucket(kind) as bucket:
+            now = bucket['last']
+            # processes rejected in the same blocked period only count once
+            if now >= bucket['block_until']:
+                backoff = min(self.MAX_BACKOFF, max(base_backoff, bucket['backoff'] * 2))
+                bucket['backoff'] = backoff
+                bucket['block_until'] = now + backoff * random.uniform(1.0, 1.1)
+                bucket['rate'] = max(rate * self.MIN_RATE_FRACTION, bucket['rate'] / 2)
+                bucket['tokens'] = min(bucket['tokens'], 0.0)
+            return bucket['block_until'] - now
+
+    def get_state(self, kind: str) -> dict:
+        '''
+        the current bucket of {kind} (tokens, rate, block_until, backoff)
+        '''
+        with self._locked_bucket(kind) as bucket:
+            return dict(bucket)
+
+
+def is_limit_rejection(message: str) -> bool:
+    '''
+    if {message} (stderr of a scheduler command) says a limit of the user is reached
+    '''
+    return any(re.search(pattern, message) for pattern in _LIMIT_PATTERNS)
+
+
+def run_scheduler_cmd(cmd: str, kind: str = 'query', max_wait: float = None, timeout: int = 120, cwd: str = None) -> CompletedProcess:
+    '''
+    run the scheduler command {cmd} after taking a {kind} token of the default limiter and retry it
+    with backoff if it fails.
+    kind: 'submit' or 'query' (any key of Config.SCHEDULER_RATE_LIMIT)
+    max_wait: give up retrying after this time (s) (default: Config.SCHEDULER_MAX_WAIT[kind]. 0 for only one try)
+    cwd: run the command in this dir (the process does not change dir so relative paths in Config still work)
+    Raise:
+        SubprocessError if the command still fails after {max_wait}
+    '''
+    limiter = SchedulerRateLimiter.get_default()
+    if max_wait is None:
+        max_wait = Config.SCHEDULER_MAX_WAIT[kind]
+    start = time.time()
+    backoff = 0.0
+    n_tries = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(kind)
+        n_tries += 1
+        try:
+            this_run = run(cmd, timeout=timeout, check=True, text=True, shell=True, capture_output=True, cwd=cwd)
+        except SubprocessError as e:
+            if max_wait <= 0: # a single try does not back off other processes
+                raise
+            message = f'{getattr(e, "stderr", "") or ""}\n{getattr(e, "stdout", "") or ""}'
+            if limiter is not None:
+                backoff = limiter.report_rejection(kind, message)
+            else:
+                base_backoff = SchedulerRateLimiter.LIMIT_BACKOFF if is_limit_rejection(message) else SchedulerRateLimiter.ERROR_BACKOFF
+                backoff = min(SchedulerRateLimiter.MAX_BACKOFF, max(base_backoff, backoff * 2))
+            _LOGGER.warning('Error running %s: %r stderr: %s trying again in %.1fs... (%s tries)',
+                            cmd, e, str(getattr(e, 'stderr', '')).strip(), backoff, n_tries)
+            if time.time() + backoff - start > max_wait:
+                raise SubprocessError(f'Failed running `{cmd}` after {n_tries} tries @{get_localtime()}') from e
+            if limiter is None:
+                time.sleep(backoff)
+        else:
+            if limiter is not None:
+                limiter.report_success(kind)
+            if n_tries > 1:
+                _LOGGER.info('finished %s after %s tries', cmd, n_tries)
+            return this_run
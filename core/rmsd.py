@@ -0,0 +1,64 @@
+"""Batched RMSD with Kabsch alignment on frame arrays.
+All frames are aligned at once with a batched SVD of the (n_frames, 3, 3) covariance matrices.
+
+Usage:
+    rmsd_series = get_rmsd_series(coords[:, atom_idx], ref='average', weights=masses[atom_idx])
+"""
+from typing import Union
+
+import numpy as np
+
+
+def kabsch_fit(coords: np.ndarray, ref: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    '''
+    superimpose each frame of {coords} (n_frames, n_atoms, 3) on {ref} (n_atoms, 3)
+    with the (weighted) Kabsch algorithm. return the fitted coordinates
+    '''
+    coords = np.asarray(coords, dtype=float)
+    ref = np.asarray(ref, dtype=float)
+    w = _get_weights(weights, coords.shape[1])
+    coords_c = coords - np.einsum('n,fnd->fd', w, coords)[:, None, :]
+    ref_center = w @ ref
+    # covariance of each frame (n_frames, 3, 3)
+    cov = np.einsum('n,fni,nj->fij', w, coords_c, ref - ref_center)
+    u, s, vt = np.linalg.svd(cov)
+    # avoid reflection
+    d = np.sign(np.linalg.det(u @ vt))
+    u[:, :, 2] *= d[:, None]
+    rot = u @ vt
+    return coords_c @ rot + ref_center
+
+
+def get_rmsd_series(coords: np.ndarray, ref: Union[str, np.ndarray] = 'first',
+                    weights: np.ndarray = None, fit: bool = True) -> np.ndarray:
+    '''
+    RMSD of each frame in {coords} (n_frames, n_atoms, 3) to a reference
+    ----------
+    ref: 'first' the first frame
+         'average' the average structure of frames fitted to the first frame (as cpptraj "average" after "rmsd first")
+         or a (n_atoms, 3) array
+    weights: e.g.: masses for mass weighted RMSD (default: no weight)
+    fit: superimpose frames on the reference before calculating RMSD
+    '''
+    coords = np.asarray(coords, dtype=float)
+    if isinstance(ref, str):
+        if ref == 'first':
+            ref = coords[0]
+        elif ref == 'average':
+            ref = kabsch_fit(coords, coords[0], weights).mean(axis=0)
+        else:
+            raise Exception(f'get_rmsd_series: ref only support first, average or an array. Got: {ref}')
+    if fit:
+        coords = kabsch_fit(coords, ref, weights)
+    w = _get_weights(weights, coords.shape[1])
+    return np.sqrt(np.einsum('n,fn->f', w, np.sum((coords - ref)**2, axis=2)))
+
+
+def _get_weights(weights: Union[np.ndarray, None], n_atoms: int) -> np.ndarray:
+    '''
+    normalized weights
+    '''
+    if weights is None:
+        return np.full(n_atoms, 1.0 / n_atoms)
+    weights = np.asarray(weights, dtype=float)
+    return weights / weights.sum()
@@ -0,0 +1,106 @@
+"""Shrake-Rupley SASA of selected atoms on in-memory frames.
+Only the target atoms get sphere points. Other atoms of the system only occlude them, so the cost
+scales with the target size instead of the whole protein. Frames are split across processes.
+
+Usage:
+    sasa_by_frame = get_frames_sasa(coords, radii, target_idx, n_sphere_points=960, n_cores=4)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List
+
+import numpy as np
+
+# van der Waals radii in Angstrom (Bondi. the same as mdtraj.shrake_rupley)
+ATOMIC_RADII = {'H': 1.20, 'He': 1.40, 'Li': 1.82, 'Be': 1.53, 'B': 1.92, 'C': 1.70, 'N': 1.55,
+                'O': 1.52, 'F': 1.47, 'Ne': 1.54, 'Na': 2.27, 'Mg': 1.73, 'Al': 1.84, 'Si': 2.10,
+                'P': 1.80, 'S': 1.80, 'Cl': 1.75, 'Ar': 1.88, 'K': 2.75, 'Ca': 2.31, 'Ni': 1.63,
+                'Cu': 1.40, 'Zn': 1.39, 'Ga': 1.87, 'Ge': 2.11, 'As': 1.85, 'Se': 1.90, 'Br': 1.85,
+                'Kr': 2.02, 'Rb': 3.03, 'Sr': 2.49, 'Pd': 1.63, 'Ag': 1.72, 'Cd': 1.58, 'In': 1.93,
+                'Sn': 2.17, 'Sb': 2.06, 'Te': 2.06, 'I': 1.98, 'Xe': 2.16}
+DEFAULT_RADIUS = 1.80
+PROBE_RADIUS = 1.40
+_BLOCK_SIZE = 256
+
+
+def get_atomic_radii(elements: List[str]) -> np.ndarray:
+    '''
+    radii of elements (DEFAULT_RADIUS for elements not in ATOMIC_RADII)
+    '''
+    return np.array([ATOMIC_RADII.get(element, DEFAULT_RADIUS) for element in elements])
+
+
+def get_sphere_points(n_points: int) -> np.ndarray:
+    '''
+    evenly distributed points on a unit sphere (golden section spiral)
+    '''
+    idx = np.arange(n_points)
+    inc = np.pi * (3.0 - np.sqrt(5.0))
+    z = 1.0 - (2.0 * idx + 1.0) / n_points
+    r = np.sqrt(1.0 - z * z)
+    phi = idx * inc
+    return np.column_stack((np.cos(phi) * r, z, np.sin(phi) * r))
+
+
+def get_sasa(coord: np.ndarray, radii: np.ndarray, target_idx: np.ndarray = None,
+             sphere_points: np.ndarray = None, n_sphere_points: int = 960,
+             probe_radius: float = PROBE_RADIUS) -> np.ndarray:
+    '''
+    SASA (Angstrom^2) of each atom in {target_idx} of a frame.
+    ----------
+    coord: (n_atoms, 3) coordinates of all atoms that occlude the surface
+    radii: (n_atoms,) vdw radii
+    target_idx: indexes of atoms to calculate. (default: all)
+    '''
+    target_idx = np.arange(len(coord)) if target_idx is None else np.asarray(target_idx)
+    if sphere_points is None:
+        sphere_points = get_sphere_points(n_sphere_points)
+    ext_radii = radii + probe_radius
+    result = np.empty(len(target_idx))
+    # blocks of target atoms to bound the size of the distance matrix
+    for start in range(0, len(target_idx), _BLOCK_SIZE):
+        block_idx = target_idx[start:start+_BLOCK_SIZE]
+        block_coord = coord[block_idx]
+        block_radii = ext_radii[block_idx]
+        # neighbor atoms that can occlude each target atom
+        dist2 = np.sum((block_coord[:, None, :] - coord[None, :, :])**2, axis=2)
+        neighbor_mask = dist2 < (block_radii[:, None] + ext_radii[None, :])**2
+        neighbor_mask[np.arange(len(block_idx)), block_idx] = False
+
+        for i, center in enumerate(block_coord):
+            neighbors = np.nonzero(neighbor_mask[i])[0]
+            points = center + block_radii[i] * sphere_points
+            if len(neighbors):
+                point_dist2 = np.sum((points[:, None, :] - coord[neighbors][None, :, :])**2, axis=2)
+                n_accessible = np.count_nonzero(np.all(point_dist2 >= ext_radii[neighbors]**2, axis=1))
+            else:
+                n_accessible = len(sphere_points)
+            result[start+i] = 4.0 * np.pi * block_radii[i]**2 * n_accessible / len(sphere_points)
+    return result
+
+
+def get_frames_sasa(coords: np.ndarray, radii: np.ndarray, target_idx: np.ndarray = None,
+                    n_sphere_points: int = 960, probe_radius: float = PROBE_RADIUS,
+                    n_cores: int = 1) -> np.ndarray:
+    '''
+    SASA of target atoms of each frame. Split frames to {n_cores} processes.
+    ----------
+    coords: (n_frames, n_atoms, 3)
+    return (n_frames, n_target_atoms) array in Angstrom^2
+    '''
+    n_cores = max(1, min(n_cores, len(coords)))
+    if n_cores == 1:
+        return _get_frames_sasa(coords, radii, target_idx, n_sphere_points, probe_radius)
+    chunks = np.array_split(np.arange(len(coords)), n_cores)
+    with ProcessPoolExecutor(max_workers=n_cores) as executor:
+        results = executor.map(
+            partial(_get_frames_sasa, radii=radii, target_idx=target_idx,
+                    n_sphere_points=n_sphere_points, probe_radius=probe_radius),
+            [coords[chunk] for chunk in chunks])
+        return np.concatenate(list(results), axis=0)
+
+
+def _get_frames_sasa(coords, radii, target_idx, n_sphere_points, probe_radius) -> np.ndarray:
+    sphere_points = get_sphere_points(n_sphere_points)
+    return np.array([get_sasa(coord, radii, target_idx, sphere_points, probe_radius=probe_radius)
+                     for coord in coords])
@@ -0,0 +1,254 @@
+"""Single-pass trajectory analysis.
+TrajAnalysisEngine streams each frame of a trajectory once, images it once (periodic systems)
+and dispatches it to every added analysis. All results come back together.
+
+Analyses are registered by name with @register_analysis. An analysis is set up with the topology,
+processes frames one by one and returns its result in finish().
+
+Usage:
+    engine = TrajAnalysisEngine(prmtop_path, traj_path)
+    engine.add('rmsd', mask=':1-253@CA')
+    engine.add('sasa_ratio', mask_pro=':1-253', mask_pro_target=':9,11,48', mask_sub=':254')
+    engine.add('field_strength', atom_mask=':1-100,102-253', a1=3976, a2=3977, name='e_list')
+    engine.add('distance', atom_pairs=[(1604, 3976)])
+    results = engine.run() # {'rmsd': ..., 'sasa_ratio': ..., 'e_list': ..., 'distance': ...}
+"""
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from Class_Conf import Config
+from core import rmsd, sasa, trajectory
+from core.log import get_logger
+
+_LOGGER = get_logger(__name__)
+
+# registered analysis classes {name: class}
+ANALYSES = {}
+
+
+def register_analysis(name: str):
+    '''
+    decorator that register a TrajAnalysis subclass by {name} for TrajAnalysisEngine.add
+    '''
+    def decorator(cls):
+        ANALYSES[name] = cls
+        cls.analysis_name = name
+        return cls
+    return decorator
+
+
+class TrajAnalysis():
+    '''
+    base class of analyses that run in TrajAnalysisEngine
+    '''
+    analysis_name = None
+
+    def setup(self, topology: trajectory.Topology) -> None:
+        '''
+        prepare with the topology before the first frame (e.g.: decode masks)
+        '''
+        pass
+
+    def process(self, frame_idx: int, coord: np.ndarray) -> None:
+        '''
+        process a frame (imaged coordinate (n_atoms, 3)). frame_idx start from 0
+        '''
+        raise NotImplementedError
+
+    def finish(self):
+        '''
+        return the result after the last frame
+        '''
+        raise NotImplementedError
+
+
+class TrajAnalysisEngine():
+    '''
+    run analyses on a trajectory in a single pass.
+    ----------
+    prmtop_path: the topology
+    traj_path: ASCII Amber trajectory (.mdcrd) or NetCDF (.nc; need scipy). Both are streamed frame by frame
+    image: image molecules around the first molecule in each frame of periodic systems (like cpptraj autoimage)
+    '''
+    def __init__(self, prmtop_path: str, traj_path: str, image: bool = True) -> None:
+        self.prmtop_path = prmtop_path
+        self.traj_path = traj_path
+        self.image = image
+        self.analyses = {}
+
+    def add(self, analysis: Union[str, TrajAnalysis], name: str = None, **kwargs) -> str:
+        '''
+        add an analysis. Use a registered name with its keyword arguments or a TrajAnalysis object.
+        return the key of its result (name or the registered name by default)
+        '''
+        if isinstance(analysis, str):
+            if analysis not in ANALYSES:
+                raise Exception(f'TrajAnalysisEngine: unknown analysis {analysis}. Registered: {list(ANALYSES)}')
+            analysis = ANALYSES[analysis](**kwargs)
+        if name is None:
+            name = analysis.analysis_name
+        if name in self.analyses:
+            raise Exception(f'TrajAnalysisEngine: analysis {name} is already added. Use another name.')
+        self.analyses[name] = analysis
+        return name
+
+    def run(self) -> dict:
+        '''
+        stream the trajectory once and return {name: result} of all analyses
+        '''
+        topology = trajectory.read_prmtop_topology(self.prmtop_path)
+        for analysis in self.analyses.values():
+            analysis.setup(topology)
+        if_image = self.image and topology.molecule_sizes is not None
+
+        n_frames = 0
+        for coord, box in self._iter_frames(topology.n_atoms):
+            if if_image and box is not None:
+                coord = trajectory.image_molecules(coord, box, topology.box_angles, topology.molecule_sizes)
+            for analysis in self.analyses.values():
+                analysis.process(n_frames, coord)
+            n_frames += 1
+        _LOGGER.debug('TrajAnalysisEngine: processed %s frames of %s for %s', n_frames, self.traj_path, list(self.analyses))
+
+        return {name: analysis.finish() for name, analysis in self.analyses.items()}
+
+    def _iter_frames(self, n_atoms: int):
+        if self.traj_path.endswith('.nc'):
+            yield from trajectory.iter_nc(self.traj_path)
+        else:
+            yield from trajectory.iter_mdcrd(self.traj_path, n_atoms)
+
+
+@register_analysis('rmsd')
+class RMSDAnalysis(TrajAnalysis):
+    '''
+    RMSD of {mask} to {ref} (first/average/array. see core.rmsd.get_rmsd_series) as PDB.get_rmsd.
+    Return the average value or the per-frame series if {if_series}.
+    '''
+    def __init__(self, mask: str, ref: Union[str, np.ndarray] = 'average', mass: bool = True,
+                 if_series: bool = False) -> None:
+        self.mask = mask
+        self.ref = ref
+        self.mass = mass
+        self.if_series = if_series
+        self.coords = []
+
+    def setup(self, topology):
+        self.atom_idx = topology.select(self.mask)
+        self.weights = topology.masses[self.atom_idx] if self.mass else None
+
+    def process(self, frame_idx, coord):
+        self.coords.append(coord[self.atom_idx])
+
+    def finish(self) -> Union[float, np.ndarray]:
+        rmsd_series = rmsd.get_rmsd_series(np.array(self.coords), self.ref, self.weights)
+        if self.if_series:
+            return rmsd_series
+        return rmsd_series.mean()
+
+
+@register_analysis('sasa_ratio')
+class SASARatioAnalysis(TrajAnalysis):
+    '''
+    average ratio of the substrate SASA and the SASA of target residues in the protein as get_sasa_ratio.
+    Frames are split to {n_cores} processes at the end.
+    '''
+    def __init__(self, mask_pro: str, mask_pro_target: str, mask_sub: str,
+                 n_sphere_points: int = 960, n_cores: int = None) -> None:
+        self.mask_pro = mask_pro
+        self.mask_pro_target = mask_pro_target
+        self.mask_sub = mask_sub
+        self.n_sphere_points = n_sphere_points
+        self.n_cores = Config.n_cores if n_cores is None else n_cores
+        self.coords = []
+
+    def setup(self, topology):
+        self.pro_idx = topology.select(self.mask_pro)
+        self.sub_idx = topology.select(self.mask_sub)
+        self.target_idx = np.nonzero(np.isin(self.pro_idx, topology.select(self.mask_pro_target)))[0]
+        self.radii = sasa.get_atomic_radii(topology.elements)
+        self.atom_idx = np.concatenate((self.pro_idx, self.sub_idx))
+
+    def process(self, frame_idx, coord):
+        self.coords.append(coord[self.atom_idx])
+
+    def finish(self) -> float:
+        coords = np.array(self.coords)
+        n_pro = len(self.pro_idx)
+        sasa_pro_by_frame = sasa.get_frames_sasa(
+            coords[:, :n_pro], self.radii[self.pro_idx], self.target_idx,
+            self.n_sphere_points, n_cores=self.n_cores).sum(axis=1)
+        sasa_sub_by_frame = sasa.get_frames_sasa(
+            coords[:, n_pro:], self.radii[self.sub_idx], None,
+            self.n_sphere_points, n_cores=self.n_cores).sum(axis=1)
+        return (sasa_sub_by_frame/sasa_pro_by_frame).mean()
+
+
+@register_analysis('field_strength')
+class FieldStrengthAnalysis(TrajAnalysis):
+    '''
+    field strength of MM charges of {atom_mask} as PDB.get_field_strength. Return a list of each frame.
+    (a1/a2 are atom ids start from 1)
+    '''
+    def __init__(self, atom_mask: str, a1: int = None, a2: int = None, bond_p1: str = 'center',
+                 p1=None, p2=None, d1=None) -> None:
+        if a1 == None and p1 == None:
+            raise Exception('Please provide a 1nd atom (a1=...) or point (p1=...) where E is calculated ')
+        if a2 == None and p2 == None and d1 == None:
+            raise Exception('Please provide a 2nd atom (a2=...) or point (p2=...) or a direction (d1=...)')
+        if a1 == None and a2 == None and bond_p1 == 'center':
+            raise Exception('Please provide a both atom (a1=... a2=...) when bond_p1 = center; Or change bond_p1 to a1 to calculate E at a1')
+        if a1 != None and a2 != None and bond_p1 not in ['center', 'a1']:
+            raise Exception('Only support p1 selection in center or a1 now')
+        self.atom_mask = atom_mask
+        self.a1, self.a2, self.bond_p1 = a1, a2, bond_p1
+        self.p1, self.p2, self.d1 = p1, p2, d1
+        self.Es = []
+
+    def setup(self, topology):
+        self.atom_idx = topology.select(self.atom_mask)
+        self.charges = topology.charges[self.atom_idx]
+
+    def process(self, frame_idx, coord):
+        p1, p2, d1 = self.p1, self.p2, self.d1
+        if self.a2 != None:
+            p2 = coord[self.a2-1]
+        if self.a1 != None:
+            p1 = coord[self.a1-1] if self.bond_p1 == 'a1' else (coord[self.a1-1] + p2) / 2
+        self.Es.append(get_field_strength_sum(coord[self.atom_idx], self.charges, p1, p2=p2, d1=d1))
+
+    def finish(self) -> List[float]:
+        return self.Es
+
+
+@register_analysis('distance')
+class DistanceAnalysis(TrajAnalysis):
+    '''
+    distances between {atom_pairs} (atom ids start from 1) of each frame.
+    Return a (n_frames, n_pairs) array
+    '''
+    def __init__(self, atom_pairs: List[Tuple[int, int]]) -> None:
+        self.atom_pairs = np.array(atom_pairs) - 1
+        self.distances = []
+
+    def process(self, frame_idx, coord):
+        self.distances.append(np.linalg.norm(coord[self.atom_pairs[:, 0]] - coord[self.atom_pairs[:, 1]], axis=1))
+
+    def finish(self) -> np.ndarray:
+        return np.array(self.distances)
+
+
+def get_field_strength_sum(coords: np.ndarray, charges: np.ndarray, p1, p2=None, d1=None) -> float:
+    '''
+    vectorized sum of helper.get_field_strength_value over point charges {charges} at {coords}
+    (Unit: kcal/(mol*e*Ang))
+    '''
+    k = 332.4
+    p1 = np.array(p1)
+    d1 = np.array(p2) - p1 if d1 is None else np.array(d1)
+    d1 = d1/np.linalg.norm(d1)
+    r = p1 - coords
+    r_m = np.linalg.norm(r, axis=1)
+    return float(np.sum(k * charges / r_m**3 * (r @ d1)))
+
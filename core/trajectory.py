@@ -0,0 +1,298 @@
+"""In-memory access to Amber topologies and trajectories for trajectory analysis.
+Read the prmtop once and all frames of a trajectory into a (n_frames, n_atoms, 3) array
+so that analyses select atoms by index instead of writing stripped trajectories with cpptraj.
+
+Usage:
+    topology = read_prmtop_topology(prmtop_path)
+    coords = read_traj(traj_path, topology.n_atoms)
+    atom_idx = topology.select(':1-253@CA')
+"""
+import os
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+# symbols of atomic numbers
+ELEMENT_SYMBOLS = ['X',
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
+    'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+    'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr', 'Y', 'Zr',
+    'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
+    'Sb', 'Te', 'I', 'Xe']
+
+
+class Topology():
+    '''
+    atoms and residues of an Amber prmtop as arrays (indexes start from 0)
+    ----------
+    atom_names: atom names
+    elements: element symbols (from ATOMIC_NUMBER)
+    masses: atom masses
+    resi_idx: residue index (0-based) of each atom
+    resi_names: residue names
+    charges: atom charges in e
+    box_angles: box angles of a periodic system
+    molecule_sizes: number of atoms in each molecule of a periodic system
+    '''
+    def __init__(self, atom_names: List[str], elements: List[str], masses: np.ndarray,
+                 resi_idx: np.ndarray, resi_names: List[str]) -> None:
+        self.atom_names = atom_names
+        self.elements = elements
+        self.masses = masses
+        self.resi_idx = resi_idx
+        self.resi_names = resi_names
+        self.charges = None
+        # periodic box info (None for non-periodic)
+        self.box_angles = None
+        self.molecule_sizes = None
+
+    @property
+    def n_atoms(self) -> int:
+        return len(self.atom_names)
+
+    def select(self, mask: str) -> np.ndarray:
+        '''
+        decode an Amber mask to sorted atom indexes (0-based). Supported forms:
+            :1-3,5          residues by id
+            @1-10,12        atoms by id
+            @CA,C,N         atoms by name
+            :1-253@CA,C,N   atoms of the names in the residues
+        ===Other Amber mask syntax (residue names, wildcards, distances, logic operators) is not supported===
+        '''
+        mask = mask.strip()
+        resi_part, at_sign, atom_part = mask.partition('@')
+        bad_resi_part = resi_part and (resi_part[0] != ':' or not resi_part[1:].strip())
+        bad_atom_part = at_sign and not atom_part.strip()
+        if bad_resi_part or bad_atom_part or not (resi_part or at_sign):
+            raise Exception(f'Topology.select: only support :ids, @ids, @names or :ids@names masks. Got: {mask}')
+        selected = np.ones(self.n_atoms, dtype=bool)
+        if resi_part:
+            resi_ids = self._decode_ids(resi_part[1:], mask)
+            selected &= np.isin(self.resi_idx, resi_ids)
+        if atom_part:
+            items = [item.strip() for item in atom_part.split(',')]
+            if all(item.replace('-', '').isdigit() for item in items):
+                if resi_part:
+                    raise Exception(f'Topology.select: atom ids cannot be combined with residues. Got: {mask}')
+                atom_ids = self._decode_ids(atom_part, mask)
+                selected &= np.isin(np.arange(self.n_atoms), atom_ids)
+            else:
+                selected &= np.isin(self.atom_names, items)
+        return np.nonzero(selected)[0]
+
+    @staticmethod
+    def _decode_ids(id_str: str, mask: str) -> np.ndarray:
+        '''
+        0-based indexes of a 1-based id list like 1-3,5
+        '''
+        ids = []
+        try:
+            for id_range in id_str.split(','):
+                if '-' in id_range:
+                    r1, r2 = id_range.split('-')
+                    ids.extend(range(int(r1), int(r2)+1))
+                else:
+                    ids.append(int(id_range))
+        except ValueError:
+            raise Exception(f'Topology.select: cannot decode ids in {mask}')
+        return np.array(sorted(set(ids))) - 1
+
+    def get_pdb_str(self, coord: np.ndarray, atom_idx: np.ndarray = None) -> str:
+        '''
+        PDB string of atoms in {atom_idx} (default: all) with coordinates {coord} (n_atoms, 3)
+        (atom and residue ids are kept as in the topology)
+        '''
+        if atom_idx is None:
+            atom_idx = np.arange(self.n_atoms)
+        lines = []
+        for i in atom_idx:
+            name = self.atom_names[i]
+            # atom names shorter than 4 start from the 14th column
+            name = name if len(name) == 4 else f' {name:<3}'
+            x, y, z = coord[i]
+            lines.append(f'ATOM  {(i+1)%100000:>5} {name} {self.resi_names[self.resi_idx[i]]:>3} A{(self.resi_idx[i]+1)%10000:>4}    '
+                         f'{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00          {self.elements[i]:>2}')
+        lines.append('END')
+        return os.linesep.join(lines) + os.linesep
+
+
+def read_prmtop(prmtop_path: str, flags: List[str], required: bool = True) -> Dict[str, list]:
+    '''
+    read sections of {flags} in the prmtop file.
+    return {flag: list of values} (str for %FORMAT(20a4), int for I, float for E)
+    required: raise an exception if any flag is missing (otherwise missing flags are not in the result)
+    '''
+    result = {}
+    flag = None
+    with open(prmtop_path) as f:
+        for line in f:
+            if line.startswith('%FLAG'):
+                flag = line.split()[1]
+                if flag in flags:
+                    result[flag] = []
+                continue
+            if flag not in flags:
+                continue
+            if line.startswith('%FORMAT'):
+                fmt = line[line.index('(')+1:line.index(')')]
+                n_field, width = fmt.split('a') if 'a' in fmt else fmt.replace('I', 'E').split('E')
+                width = int(width.split('.')[0])
+                value_type = str if 'a' in fmt else (int if 'I' in fmt else float)
+                continue
+            line = line.rstrip('\n')
+            for i in range(0, len(line), width):
+                value = line[i:i+width]
+                result[flag].append(value.strip() if value_type == str else value_type(value))
+    for flag in flags:
+        if required and flag not in result:
+            raise Exception(f'read_prmtop: cannot find %FLAG {flag} in {prmtop_path}')
+    return result
+
+
+def read_prmtop_topology(prmtop_path: str) -> Topology:
+    '''
+    read the topology (atoms, elements, masses and residues) from an Amber prmtop file
+    '''
+    sections = read_prmtop(prmtop_path, ['ATOM_NAME', 'ATOMIC_NUMBER', 'MASS', 'CHARGE', 'RESIDUE_LABEL', 'RESIDUE_POINTER'])
+    sections.update(read_prmtop(prmtop_path, ['BOX_DIMENSIONS', 'ATOMS_PER_MOLECULE'], required=False))
+    n_atoms = len(sections['ATOM_NAME'])
+    resi_pointers = sections['RESIDUE_POINTER'] + [n_atoms+1]
+    resi_idx = np.empty(n_atoms, dtype=int)
+    for i in range(len(resi_pointers)-1):
+        resi_idx[resi_pointers[i]-1:resi_pointers[i+1]-1] = i
+    elements = [ELEMENT_SYMBOLS[n] if 0 < n < len(ELEMENT_SYMBOLS) else 'X' for n in sections['ATOMIC_NUMBER']]
+    topology = Topology(sections['ATOM_NAME'], elements, np.array(sections['MASS']),
+                        resi_idx, sections['RESIDUE_LABEL'])
+    # Amber charge unit (see PDB.get_charge_list)
+    topology.charges = np.array(sections['CHARGE']) / 18.2223
+    if 'BOX_DIMENSIONS' in sections:
+        beta = sections['BOX_DIMENSIONS'][0]
+        # Amber only support alpha = beta = gamma (box/oct)
+        topology.box_angles = np.array([beta, beta, beta])
+        topology.molecule_sizes = sections.get('ATOMS_PER_MOLECULE')
+    return topology
+
+
+def read_traj(traj_path: str, n_atoms: int) -> np.ndarray:
+    '''
+    read all frames of an Amber trajectory file into a (n_frames, n_atoms, 3) array.
+    support ASCII (.mdcrd/.crd/.trj) and NetCDF (.nc; need scipy) trajectories.
+    (coordinates are used as is. Make sure the trajectory is imaged. e.g.: made by PDB.nc2mdcrd)
+    '''
+    if os.path.splitext(traj_path)[1] == '.nc':
+        return read_nc(traj_path)
+    return read_mdcrd(traj_path, n_atoms)
+
+
+def read_mdcrd(mdcrd_path: str, n_atoms: int) -> np.ndarray:
+    '''
+    read an ASCII Amber trajectory (10F8.3 with an optional box line after each frame)
+    '''
+    return np.array([coord for coord, box in iter_mdcrd(mdcrd_path, n_atoms)]).reshape(-1, n_atoms, 3)
+
+
+def iter_mdcrd(mdcrd_path: str, n_atoms: int) -> Iterator[Tuple[np.ndarray, Union[np.ndarray, None]]]:
+    '''
+    stream frames of an ASCII Amber trajectory.
+    yield (coord (n_atoms, 3), box lengths (3,) or None) of each frame
+    '''
+    n_coord_lines = -(-3 * n_atoms // 10)
+    has_box = None
+    with open(mdcrd_path) as f:
+        f.readline() # title
+        while True:
+            coord_lines = [f.readline() for i in range(n_coord_lines)]
+            if not coord_lines[0].strip():
+                return
+            if not coord_lines[-1]:
+                raise Exception(f'read_mdcrd: {mdcrd_path} does not match {n_atoms} atoms')
+            coord = np.array([float(line[j:j+8]) for line in coord_lines for j in range(0, len(line.rstrip()), 8)])
+            if len(coord) != 3 * n_atoms:
+                raise Exception(f'read_mdcrd: {mdcrd_path} does not match {n_atoms} atoms')
+            box = None
+            if has_box is None:
+                # the box line only have 3 values. (the first line of the next frame is a full line)
+                pos = f.tell()
+                next_line = f.readline()
+                has_box = bool(next_line.strip()) and len(next_line.rstrip()) <= 24 and n_atoms > 3
+                f.seek(pos)
+            if has_box:
+                box_line = f.readline()
+                box = np.array([float(box_line[j:j+8]) for j in range(0, 24, 8)])
+            yield coord.reshape(n_atoms, 3), box
+
+
+def image_molecules(coord: np.ndarray, box: np.ndarray, box_angles: np.ndarray,
+                    molecule_sizes: List[int], anchor: int = 0) -> np.ndarray:
+    '''
+    move each molecule to the periodic image where its center is closest to the center of
+    the {anchor} molecule (like cpptraj autoimage). Molecules are kept whole.
+    ----------
+    box: box lengths. box_angles: (alpha, beta, gamma) in degree
+    molecule_sizes: number of atoms in each molecule (ATOMS_PER_MOLECULE)
+    '''
+    cell = get_cell_vectors(box, box_angles)
+    starts = np.concatenate(([0], np.cumsum(molecule_sizes)[:-1]))
+    centers = np.add.reduceat(coord, starts, axis=0) / np.array(molecule_sizes)[:, None]
+    shifts = get_minimum_image_shifts(centers - centers[anchor], cell)
+    return coord - np.repeat(shifts, molecule_sizes, axis=0)
+
+
+def get_minimum_image_shifts(vectors: np.ndarray, cell: np.ndarray) -> np.ndarray:
+    '''
+    lattice translations that move each of {vectors} (n, 3) to its shortest periodic image
+    (vectors - shifts is the minimum image).
+    Rounding in fractional coordinates alone is only exact for orthogonal cells. For a non-orthogonal
+    cell (e.g.: the truncated octahedron) the rounded image is then compared with its neighbors.
+    '''
+    shifts = np.round(vectors @ np.linalg.inv(cell)) @ cell
+    if np.allclose(cell, np.diag(np.diag(cell))):
+        return shifts
+    neighbors = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]) @ cell
+    candidates = (vectors - shifts)[:, None, :] - neighbors[None, :, :]
+    best = np.argmin(np.einsum('ijk,ijk->ij', candidates, candidates), axis=1)
+    return shifts + neighbors[best]
+
+
+def get_cell_vectors(box: np.ndarray, box_angles: np.ndarray) -> np.ndarray:
+    '''
+    cell vectors (as rows) from box lengths and angles (in degree)
+    '''
+    a, b, c = box
+    alpha, beta, gamma = np.radians(box_angles)
+    cx = c * np.cos(beta)
+    cy = c * (np.cos(alpha) - np.cos(beta) * np.cos(gamma)) / np.sin(gamma)
+    cz = np.sqrt(c**2 - cx**2 - cy**2)
+    return np.array([[a, 0.0, 0.0],
+                     [b * np.cos(gamma), b * np.sin(gamma), 0.0],
+                     [cx, cy, cz]])
+
+
+def read_nc(nc_path: str) -> np.ndarray:
+    '''
+    read an Amber NetCDF trajectory
+    '''
+    return np.array([coord for coord, box in iter_nc(nc_path)])
+
+
+def iter_nc(nc_path: str) -> Iterator[Tuple[np.ndarray, Union[np.ndarray, None]]]:
+    '''
+    stream frames of an Amber NetCDF trajectory (the file is memory-mapped and read frame by frame).
+    yield (coord (n_atoms, 3), box lengths (3,) or None) of each frame
+    '''
+    try:
+        from scipy.io import netcdf_file
+    except ImportError:
+        raise ImportError('scipy not installed.')
+    with netcdf_file(nc_path, 'r', mmap=True) as f:
+        coords = f.variables['coordinates']
+        cell_lengths = f.variables.get('cell_lengths')
+        try:
+            for i in range(coords.shape[0]):
+                # copied so no reference to the mapped file is left when it is closed
+                coord = np.array(coords[i], dtype=float)
+                box = None if cell_lengths is None else np.array(cell_lengths[i], dtype=float)
+                yield coord, box
+        finally:
+            del coords, cell_lengths
@@ -10,6 +10,13 @@ from typing import List
 import numpy as np
 
 from Class_Conf import Config
+from core.log import get_logger
+from core.profiler import profile_tool
+
+_LOGGER = get_logger(__name__)
+
+# timed in the profiling trace (if Config.PROFILE_TRACE_PATH is set)
+run = profile_tool(run)
 '''
 ====
 Tree
@@ -54,7 +61,7 @@ def is_empty_dir(dir_path):
         else:
             return 0
     else:
-        print(f"No such directory: {dir_path}")
+        _LOGGER.warning('No such directory: %s', dir_path)
         return 2
 
 '''
@@ -155,8 +162,7 @@ def Conformer_Gen_wRDKit(input_mol, out_path, numConfs=50):
     # [input_mol --> mol]
     # file or SMILES
     if not os.path.exists(input_mol):
-        if Config.debug > 1:
-            print('WARNING: Conformer_Gen_wRDKit: input is not a file. Using SMILES mode.')
+        _LOGGER.debug('Conformer_Gen_wRDKit: input is not a file. Using SMILES mode.')
         # SMILES
         mol = Chem.MolFromSmiles(input_mol)
         mol = Chem.AddHs(mol)
@@ -267,6 +273,37 @@ def chunked(iter_, size):
     '''
     return (iter_[position : position + size] for position in range(0, len(iter_), size))
 
+def get_running_mean(data) -> np.ndarray:
+    '''
+    running (cumulative) mean of a series. The i-th value is the mean of data[:i+1]
+    '''
+    data = np.asarray(data, dtype=float)
+    return np.cumsum(data) / np.arange(1, len(data)+1)
+
+def get_block_average(data, n_blocks: int=5) -> tuple:
+    '''
+    block averaging of a correlated series (e.g.: energies of MD frames)
+    split data to {n_blocks} continuous blocks (the tailing len(data) % n_blocks points are dropped)
+    return (mean, sem) where sem is the standard error of the block means.
+    '''
+    data = np.asarray(data, dtype=float)
+    block_size = len(data) // n_blocks
+    if n_blocks < 2 or block_size < 1:
+        raise Exception(f'get_block_average: cannot split {len(data)} points to {n_blocks} blocks')
+    block_means = data[:block_size*n_blocks].reshape(n_blocks, block_size).mean(axis=1)
+    return block_means.mean(), block_means.std(ddof=1) / math.sqrt(n_blocks)
+
+def get_converged_frame_number(data, tolerance: float) -> int:
+    '''
+    the least number of frames after which the running mean stays within
+    {tolerance} of the final mean. (i.e.: more frames do not change the result by more than {tolerance})
+    '''
+    running_mean = get_running_mean(data)
+    off_idx = np.nonzero(np.abs(running_mean - running_mean[-1]) > tolerance)[0]
+    if len(off_idx) == 0:
+        return 1
+    return int(off_idx[-1]) + 2
+
 def get_localtime(time_stamp=None):
     if time_stamp is None:
         return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -284,15 +321,11 @@ def run_cmd(cmd, try_time=1, wait_time=3, timeout=120) -> CompletedProcess:
         try:
             this_run = run(cmd, timeout=timeout, check=True,  text=True, shell=True, capture_output=True)
         except SubprocessError as e:
-            if Config.debug > 0:
-                print(f'Error running {cmd}: {repr(e)}')
-                print(f'    stderr: {str(e.stderr).strip()}')
-                print(f'    stdout: {str(e.stdout).strip()}')
-                print(f'trying again... ({i+1}/{try_time})')
+            _LOGGER.warning('Error running %s: %r stderr: %s stdout: %s trying again... (%s/%s)',
+                            cmd, e, str(e.stderr).strip(), str(e.stdout).strip(), i+1, try_time)
         else: # untill there's no error
-            if Config.debug > 0:
-                if i > 0:
-                    print(f'finished {cmd} after {i+1} tries @{get_localtime()}')
+            if i > 0:
+                _LOGGER.info('finished %s after %s tries', cmd, i+1)
             return this_run
         # wait before next try
         time.sleep(wait_time)
@@ -1,3 +1,7 @@
+from subprocess import CompletedProcess
+
+from Class_Conf import Config
+from core.clusters import _interface, accre
 from core.clusters.accre import Accre
 
 def test_parser_resource_str_gpu():
@@ -42,4 +46,30 @@ def test_parser_resource_str_gpu():
 #SBATCH --mem=21G
 #SBATCH --time=3-00:00:00
 #SBATCH --account=xxx
-'''
\ No newline at end of file
+'''
+
+def test_get_states_missing_jobs(monkeypatch):
+    '''
+    test jobs and tasks missing from both squeue and sacct are pend for SCHEDULER_MAX_MISSING_POLLS polls
+    and then ('exception', 'UNKNOWN'). The count restarts when it is found.
+    '''
+    outputs = {'squeue': '', 'sacct': ''}
+    def fake_run_scheduler_cmd(cmd, *args, **kwargs):
+        return CompletedProcess(cmd, 0, stdout=outputs[cmd.split()[0]], stderr='')
+    monkeypatch.setattr(accre, 'run_scheduler_cmd', fake_run_scheduler_cmd)
+    monkeypatch.setattr(_interface, '_missing_polls', {})
+    monkeypatch.setattr(Config, 'SCHEDULER_MAX_MISSING_POLLS', 2)
+
+    job_states = [Accre.get_jobs_states(['301', '302'], wait_time=0) for i in range(3)]
+    task_states = [Accre.get_array_task_states('303', 2, wait_time=0) for i in range(3)]
+    outputs['sacct'] = '301|PENDING\n'
+    found_state = Accre.get_jobs_states(['301'], wait_time=0)
+    outputs['sacct'] = ''
+    refound_state = Accre.get_jobs_states(['301'], wait_time=0)
+
+    assert job_states[:2] == [{'301': ('pend', 'PENDING'), '302': ('pend', 'PENDING')}] * 2
+    assert job_states[2] == {'301': ('exception', 'UNKNOWN'), '302': ('exception', 'UNKNOWN')}
+    assert task_states[:2] == [[('pend', 'PENDING')] * 2] * 2
+    assert task_states[2] == [('exception', 'UNKNOWN')] * 2
+    assert found_state == {'301': ('pend', 'PENDING')}
+    assert refound_state == {'301': ('pend', 'PENDING')}
@@ -0,0 +1,113 @@
+import os
+import shutil
+
+from Class_Conf import Config
+from core.clusters.accre import Accre
+from core.clusters.mock_slurm import MockSlurm
+from core.job_manager import ClusterJob, ClusterJobArray
+
+test_dir = './test/core/test_file/mock_slurm_test/'
+res_keywords = {'core_type' : 'cpu',
+                'node_cores' : '1',
+                'job_name' : 'mock_test',
+                'partition' : 'production',
+                'mem_per_core' : '1G',
+                'walltime' : '1:00:00',
+                'account' : 'xxx'}
+
+
+def make_jobs(n_jobs, failed_idx=()):
+    jobs = []
+    for i in range(n_jobs):
+        jobs.append(ClusterJob.config_job(
+            commands = f'echo job {i} > job_{i}.out; exit {1 if i in failed_idx else 0}',
+            cluster = Accre(),
+            env_settings = '',
+            res_keywords = res_keywords,
+            sub_dir = test_dir,
+            sub_script_path = f'{test_dir}submit_{i}.cmd'))
+    return jobs
+
+
+def test_mock_slurm_wait_to_array_end(monkeypatch):
+    '''
+    test Accre jobs run on the mock slurm through the client side array
+    '''
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', f'{test_dir}job_registry.db')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(test_dir)
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=0.1) as slurm:
+            jobs = make_jobs(3, failed_idx=(1,))
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1, array_size=2)
+            calls = slurm.get_calls()
+            scheduler_jobs = slurm.get_jobs()
+        with open(f'{test_dir}job_2.out') as f:
+            job_out = f.read()
+        has_log = os.path.isfile(jobs[0].job_cluster_log)
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == [jobs[1]]
+    assert [job.state[0][0] for job in jobs] == ['complete', 'error', 'complete']
+    assert calls.count('sbatch') == 3
+    assert scheduler_jobs[jobs[0].job_id]['start'] >= scheduler_jobs[jobs[0].job_id]['submit'] + 0.1
+    assert job_out == 'job 2\n'
+    assert has_log
+
+
+def test_mock_slurm_native_array(monkeypatch):
+    '''
+    test a native job array keep the throttle and tasks states come from one array id
+    '''
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', f'{test_dir}job_registry.db')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(test_dir)
+    try:
+        with MockSlurm(f'{test_dir}slurm', runtime=0.2) as slurm:
+            jobs = make_jobs(5, failed_idx=(3,))
+            job_array = ClusterJobArray(jobs, test_dir, array_size=2)
+            job_array.submit()
+            failed_jobs = job_array.wait_to_end(period=0.1)
+            calls = slurm.get_calls()
+            scheduler_jobs = slurm.get_jobs()
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == [jobs[3]]
+    assert calls.count('sbatch') == 1
+    # at most 2 tasks overlap
+    for job in jobs:
+        task = scheduler_jobs[job.job_id]
+        n_overlap = len([other for other in scheduler_jobs.values()
+                         if other['start'] <= task['start'] < other['end']])
+        assert n_overlap <= 2
+
+
+def test_mock_slurm_cancel(monkeypatch):
+    '''
+    test kill/hold/release on the mock slurm
+    '''
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', f'{test_dir}job_registry.db')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(test_dir)
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=10):
+            job = make_jobs(1)[0]
+            job.submit()
+            job.hold()
+            job.release()
+            pend_state = job.get_state()
+            job.kill()
+            cancel_state = job.get_state()
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert pend_state == ('pend', 'PENDING')
+    assert cancel_state == ('cancel', 'CANCELLED')
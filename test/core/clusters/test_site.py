@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+from subprocess import CompletedProcess
+
+import pytest
+
+from Class_Conf import Config
+from core.clusters import _interface, site
+from core.clusters.accre import Accre
+from core.clusters.expanse import Expanse
+from core.clusters.mock_slurm import MockSlurm
+from core.clusters.site import SiteCluster
+from core.job_manager import ClusterJob
+
+test_dir = './test/core/test_file/site_test/'
+res_dict_cpu = {
+    'core_type' : 'cpu',
+    'nodes':'1',
+    'node_cores' : '24',
+    'job_name' : 'EnzyHTP_QM',
+    'partition' : 'shared',
+    'mem_per_core' : '2G',
+    'walltime' : '24:00:00',
+    'account' : 'xxx'
+}
+res_dict_gpu = {
+    'core_type' : 'gpu',
+    'nodes':'1',
+    'node_cores' : '2',
+    'job_name' : 'EnzyHTP_MD',
+    'partition' : 'gpu-shared',
+    'mem_per_core' : '10.3G',
+    'walltime' : '3-00:00:00',
+    'account' : 'xxx'
+}
+
+
+def test_site_expanse_same_as_class():
+    '''
+    test the shipped expanse site config make the same resource section and env as the Expanse class
+    '''
+    cluster = SiteCluster.from_site('expanse')
+    assert cluster.NAME == 'EXPANSE'
+    assert cluster.parser_resource_str(res_dict_cpu) == Expanse.parser_resource_str(res_dict_cpu)
+    assert cluster.parser_resource_str(res_dict_gpu) == Expanse.parser_resource_str(res_dict_gpu)
+    assert cluster.AMBER_ENV == Expanse.AMBER_ENV
+    assert cluster.G16_ENV == Expanse.G16_ENV
+    assert cluster.BATCH_QUERY and cluster.NATIVE_ARRAY
+    assert cluster.ARRAY_TASK_ID_VAR == 'SLURM_ARRAY_TASK_ID'
+
+
+def test_site_accre_same_as_class():
+    cluster = SiteCluster.from_site('accre')
+    assert cluster.parser_resource_str(res_dict_cpu) == Accre.parser_resource_str(res_dict_cpu)
+    assert cluster.AMBER_ENV == Accre.AMBER_ENV
+    assert cluster.G16_ENV == Accre.G16_ENV
+    # general partition
+    assert '#SBATCH --partition={maxwell,pascal,turing}\n' in cluster.parser_resource_str({**res_dict_gpu, 'partition': 'production'})
+
+
+def test_site_pbs_lsf_resource_str():
+    pbs = SiteCluster({'name': 'PBS_SITE', 'scheduler': 'pbs', 'env': {'amber': {'CPU': 'module load amber'}}})
+    assert pbs.parser_resource_str(res_dict_cpu) == '''#!/bin/bash
+#PBS -l select=1:ncpus=24:mem=48GB
+#PBS -N EnzyHTP_QM
+#PBS -q shared
+#PBS -l walltime=24:00:00
+#PBS -A xxx
+#PBS -j oe
+cd $PBS_O_WORKDIR
+'''
+    assert pbs.AMBER_ENV == {'CPU': 'module load amber'}
+    assert not pbs.NATIVE_ARRAY
+    with pytest.raises(NotImplementedError):
+        pbs.format_array_res_str('', 2, 1)
+
+    lsf = SiteCluster({'name': 'LSF_SITE', 'scheduler': 'lsf', 'partition_map': {'shared': {'cpu': 'normal'}}})
+    assert lsf.parser_resource_str(res_dict_cpu) == '''#!/bin/bash
+#BSUB -n 24
+#BSUB -J EnzyHTP_QM
+#BSUB -q normal
+#BSUB -R "rusage[mem=2048]"
+#BSUB -W 24:00
+#BSUB -P xxx
+#BSUB -o lsf-%J.out
+'''
+    with pytest.raises(Exception) as e:
+        lsf.parser_resource_str({**res_dict_cpu, 'gpu_type': 'a100'})
+    assert 'gpu_type' in str(e.value)
+
+
+def test_site_get_jobs_states(monkeypatch):
+    '''
+    test states of many jobs come from one query and a job not found for too many polls is an exception
+    '''
+    outputs = {
+        'qstat': '''
+pbs01:
+                                                            Req'd  Req'd   Elap
+Job ID          Username Queue    Jobname    SessID NDS TSK Memory Time  S Time
+--------------- -------- -------- ---------- ------ --- --- ------ ----- - -----
+101.pbs01       user     workq    EnzyHTP_QM  12345   1  24   48gb 24:00 R 00:10
+102.pbs01       user     workq    EnzyHTP_QM    --    1  24   48gb 24:00 Q   --
+103.pbs01       user     workq    EnzyHTP_QM  12346   1  24   48gb 24:00 F 00:20
+''',
+        'bjobs': '''201 RUN
+202 PEND
+203 EXIT
+'''}
+    cmds = []
+    def fake_run_scheduler_cmd(cmd, *args, **kwargs):
+        cmds.append(cmd)
+        return CompletedProcess(cmd, 0, stdout=outputs[cmd.split()[0]], stderr='')
+    monkeypatch.setattr(site, 'run_scheduler_cmd', fake_run_scheduler_cmd)
+    monkeypatch.setattr(_interface, '_missing_polls', {})
+    monkeypatch.setattr(Config, 'SCHEDULER_MAX_MISSING_POLLS', 1)
+
+    pbs = SiteCluster({'name': 'PBS_SITE', 'scheduler': 'pbs'})
+    lsf = SiteCluster({'name': 'LSF_SITE', 'scheduler': 'lsf'})
+    pbs_states = pbs.get_jobs_states(['101', '102', '103', '104'])
+    lsf_states = lsf.get_jobs_states(['201', '202', '203'])
+    lost_state = pbs.get_jobs_states(['104'])
+
+    assert len(cmds) == 3
+    assert lost_state == {'104': ('exception', 'UNKNOWN')}
+    assert pbs_states == {'101': ('run', 'R'), '102': ('pend', 'Q'), '103': ('complete', 'F'), '104': ('pend', 'Q')}
+    assert lsf_states == {'201': ('run', 'RUN'), '202': ('pend', 'PEND'), '203': ('error', 'EXIT')}
+
+
+def test_site_slurm_on_mock_slurm(monkeypatch):
+    '''
+    test a site cluster run jobs on the mock slurm with batch queries and the native array picked by 'auto'
+    '''
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(test_dir)
+    with open(f'{test_dir}my_site.json', 'w') as of:
+        json.dump({'name': 'MY_SITE', 'scheduler': 'slurm', 'commands': {'query_ended_wait': 0}}, of)
+    cluster = SiteCluster.from_file(f'{test_dir}my_site.json')
+    def make_jobs(n_jobs):
+        return [ClusterJob.config_job(
+                    commands = f'echo {i}; exit {1 if i == 1 else 0}',
+                    cluster = cluster,
+                    env_settings = '',
+                    res_keywords = {'core_type': 'cpu', 'node_cores': '1', 'job_name': 'site_test', 'walltime': '1:00:00'},
+                    sub_dir = test_dir,
+                    sub_script_path = f'{test_dir}submit_{i}.cmd')
+                for i in range(n_jobs)]
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=0.2) as slurm:
+            jobs = make_jobs(3)
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1)
+            calls = slurm.get_calls()
+            array_jobs = make_jobs(3)
+            failed_array_jobs = ClusterJob.wait_to_array_end(array_jobs, period=0.1, array_size=2, native_array='auto')
+            array_calls = slurm.get_calls()[len(calls):]
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == [jobs[1]]
+    assert [job.state[0][0] for job in jobs] == ['complete', 'error', 'complete']
+    assert jobs[0].job_cluster_log.endswith(f'slurm-{jobs[0].job_id}.out')
+    # one squeue for all active jobs in each period
+    assert calls.count('squeue') < 3 * 10
+    assert failed_array_jobs == [array_jobs[1]]
+    assert array_calls.count('sbatch') == 1
@@ -0,0 +1,111 @@
+import os
+import shutil
+
+from Class_Conf import Config
+from core.clusters.mock_slurm import MockSlurm
+from core.clusters.site import SiteCluster
+from core.dispatcher import ClusterDispatcher, DispatchJob, DispatchSite, LocalCopyStager
+from core.job_manager import ClusterJob
+
+test_dir = './test/core/test_file/dispatcher_test/'
+res_keywords = {'core_type' : 'cpu',
+                'node_cores' : '1',
+                'job_name' : 'dispatch_test',
+                'walltime' : '1:00:00'}
+
+
+def make_site_cluster(name: str, slurm: MockSlurm) -> SiteCluster:
+    '''
+    a site that call the commands of {slurm} by their paths (so two mock slurms can be used together)
+    '''
+    bin_dir = f'{slurm.state_dir}/bin'
+    return SiteCluster({
+        'name': name,
+        'scheduler': 'slurm',
+        'commands': {
+            'submit': f'{bin_dir}/sbatch {{script}}',
+            'kill': f'{bin_dir}/scancel {{job_id}}',
+            'query': f'{bin_dir}/squeue -u $USER -r -h -o "%i %T"',
+            'query_ended': f'{bin_dir}/sacct -j {{job_ids}} -X -n -P -o JobID,State',
+            'query_ended_wait': 0,
+        }})
+
+
+def make_dispatch_job(i: int) -> DispatchJob:
+    return DispatchJob(
+        lambda cluster, work_dir: ClusterJob.config_job(
+            commands = f'cat inp/job_{i}.inp > out/job_{i}.out',
+            cluster = cluster,
+            env_settings = 'mkdir -p out',
+            res_keywords = res_keywords,
+            sub_dir = work_dir,
+            sub_script_path = f'{work_dir}/job_{i}.cmd'),
+        input_files = [f'inp/job_{i}.inp'],
+        output_files = [f'out/job_{i}.out'],
+        sub_dir = test_dir)
+
+
+def set_up(monkeypatch):
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(f'{test_dir}inp')
+    for i in range(8):
+        with open(f'{test_dir}inp/job_{i}.inp', 'w') as of:
+            of.write(f'job {i}\n')
+
+
+def test_dispatcher_spill_over(monkeypatch):
+    '''
+    test jobs spill over to the second site when the first is full and the site with
+    the shorter queue wait get more jobs. Files are staged by copying.
+    '''
+    set_up(monkeypatch)
+    try:
+        with MockSlurm(f'{test_dir}slurm_a', queue_delay=1.5) as slurm_a, \
+             MockSlurm(f'{test_dir}slurm_b', queue_delay=0.1) as slurm_b:
+            stager = LocalCopyStager(f'{test_dir}staged')
+            site_a = DispatchSite(make_site_cluster('SITE_A', slurm_a), max_active=2, stager=stager)
+            site_b = DispatchSite(make_site_cluster('SITE_B', slurm_b), max_active=2, stager=stager)
+            dispatcher = ClusterDispatcher([site_a, site_b])
+            dispatch_jobs = [make_dispatch_job(i) for i in range(8)]
+            failed_jobs = dispatcher.run(dispatch_jobs, period=0.1)
+            stats = dispatcher.get_site_stats()
+        outs = []
+        for i in range(8):
+            with open(f'{test_dir}out/job_{i}.out') as f:
+                outs.append(f.read())
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == []
+    assert outs == [f'job {i}\n' for i in range(8)]
+    # the first 4 fill both sites
+    assert [dispatch_job.site.NAME for dispatch_job in dispatch_jobs[:4]].count('SITE_A') == 2
+    assert dispatch_jobs[0].work_dir == os.path.join(f'{test_dir}staged', dispatch_jobs[0].site.NAME, '0')
+    assert stats['SITE_A']['queue_wait'] > stats['SITE_B']['queue_wait']
+    assert stats['SITE_B']['submitted'] > stats['SITE_A']['submitted']
+    assert stats['SITE_A']['submitted'] + stats['SITE_B']['submitted'] == 8
+
+
+def test_dispatch_site_expected_start():
+    '''
+    test the expected start follow the measured wait, pending jobs and the limit
+    '''
+    site = DispatchSite(SiteCluster({'name': 'SITE'}), max_active=2)
+    assert site.get_expected_start(100.0) == 0.0
+    job_1 = DispatchJob(None)
+    job_1.submit_time = 0.0
+    site.active_jobs.append(job_1)
+    site.observe_start(job_1, 10.0)
+    assert site.queue_wait == 10.0
+    job_2 = DispatchJob(None)
+    job_2.submit_time = 50.0
+    site.active_jobs.append(job_2)
+    # full
+    assert site.get_expected_start(100.0) == float('inf')
+    site.active_jobs.remove(job_1)
+    # job_2 is pending for 50s
+    assert site.get_expected_start(100.0) == 50.0
+    site.observe_start(job_2, 100.0)
+    assert site.queue_wait == 0.3 * 50.0 + 0.7 * 10.0
@@ -1,4 +1,7 @@
-from subprocess import run
+import os
+import shutil
+import sys
+from subprocess import CompletedProcess, run
 import re
 import pytest
 
@@ -308,6 +311,139 @@ def test_ClusterJob_wait_to_array_end_ACCRE():
         assert job.job_id is not None
         assert job.state[0][0] in ('complete', 'cancel', 'error')
 
+def test_ClusterJobArray_submit(monkeypatch):
+    '''
+    test the job array is submitted once with a manifest and the array script runs the task of the task id
+    (the sbatch call is replaced)
+    '''
+    array_dir = f'{test_sub_dir}array_test/'
+    submitted = []
+    def fake_submit_job(sub_dir, script_path, debug=0):
+        submitted.append(script_path)
+        return '123', None
+    monkeypatch.setattr(cluster, 'submit_job', fake_submit_job)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+
+    jobs = []
+    for i in range(5):
+        os.makedirs(f'{array_dir}task_{i}')
+        jobs.append(ClusterJob.config_job(
+            commands = f'echo task {i} > task.out',
+            cluster = cluster,
+            env_settings = '',
+            res_keywords = res_keywords_dict,
+            sub_dir = f'{array_dir}task_{i}/'))
+    try:
+        job_array = ClusterJobArray(jobs, array_size=2)
+        assert job_array.submit() == '123'
+        # run the task 3 as the cluster would do
+        run(f'bash {job_array.sub_script_path}', shell=True, check=True, cwd=job_array.sub_dir,
+            env={**os.environ, 'SLURM_ARRAY_TASK_ID': '3'})
+        with open(f'{array_dir}task_3/task.out') as f:
+            task_out = f.read()
+        with open(job_array.manifest_path) as f:
+            n_manifest_lines = len(f.readlines())
+    finally:
+        shutil.rmtree(array_dir)
+
+    assert len(submitted) == 1
+    assert '#SBATCH --array=0-4%2' in job_array.sub_script_str
+    assert '#SBATCH --tasks-per-node=24' in job_array.sub_script_str
+    assert n_manifest_lines == 5
+    assert task_out == 'task 3\n'
+    assert [job.job_id for job in jobs] == [f'123_{i}' for i in range(5)]
+    assert jobs[4].job_cluster_log.endswith('slurm-123_4.out')
+
+def test_ClusterJobArray_different_res():
+    '''
+    test jobs with different resource sections cannot be in one job array
+    '''
+    jobs = [ClusterJob.config_job('echo 1', cluster, '', res_keywords_dict),
+            ClusterJob.config_job('echo 2', cluster, '', res_keywords_dict_gpu)]
+    job_array = ClusterJobArray(jobs, sub_dir=test_sub_dir)
+    job_array.manifest_path = f'{test_sub_dir}array_manifest.txt'
+    with pytest.raises(Exception):
+        job_array._get_array_sub_script_str()
+
+def test_Accre_get_array_task_states(monkeypatch):
+    '''
+    test states of all tasks come from one squeue and one sacct call
+    '''
+    outputs = {
+        'squeue': '''122_1 RUNNING
+123_3 RUNNING
+123_[4-6%2] PENDING
+''',
+        'sacct': '''123_0|COMPLETED
+123_1|FAILED
+123_2|CANCELLED by 1001
+123_[4-6%2]|PENDING
+'''}
+    cmds = []
+    def fake_run_cmd(cmd, *args, **kwargs):
+        cmds.append(cmd)
+        return CompletedProcess(cmd, 0, stdout=outputs[cmd.split()[0]], stderr='')
+    monkeypatch.setattr(clusters.accre, 'run_scheduler_cmd', fake_run_cmd)
+    monkeypatch.setattr(clusters.accre.time, 'sleep', lambda x: None)
+
+    task_states = cluster.get_array_task_states('123', 8)
+    assert len(cmds) == 2
+    assert [state[0] for state in task_states] == ['complete', 'error', 'cancel', 'run', 'pend', 'pend', 'pend', 'pend']
+    assert task_states[2] == ('cancel', 'CANCELLED')
+
+def test_ClusterJobBundle_wait_to_bundles_end(monkeypatch):
+    '''
+    test jobs run in bundles by the in-job worker and exit codes are mapped back to the jobs
+    (the allocation is run locally when it is submitted)
+    '''
+    bundle_test_dir = f'{test_sub_dir}bundle_test/'
+    def fake_submit_job(sub_dir, script_path, debug=0):
+        run(f'bash {os.path.abspath(script_path)}', shell=True, check=True, cwd=sub_dir)
+        return str(len(os.listdir(bundle_test_dir))), None
+    monkeypatch.setattr(cluster, 'submit_job', fake_submit_job)
+    monkeypatch.setattr(cluster, 'get_job_state', lambda job_id: ('complete', 'COMPLETED'))
+    monkeypatch.setattr(cluster, 'get_jobs_states', lambda job_ids: {job_id: ('complete', 'COMPLETED') for job_id in job_ids})
+    monkeypatch.setattr(Config, 'BUNDLE_PY_EXE', sys.executable)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+
+    jobs = []
+    for i in range(5):
+        os.makedirs(f'{bundle_test_dir}task_{i}')
+        jobs.append(ClusterJob.config_job(
+            commands = f'echo task {i} $OMP_NUM_THREADS > task.out; exit {3 if i == 2 else 0}',
+            cluster = cluster,
+            env_settings = '',
+            res_keywords = res_keywords_dict,
+            sub_dir = f'{bundle_test_dir}task_{i}/'))
+    try:
+        bundles = ClusterJobBundle.config_bundles(jobs, 3, res_keywords_dict, cores_per_task=1, sub_dir=bundle_test_dir)
+        failed_jobs = ClusterJobBundle.wait_to_bundles_end(bundles, period=0)
+        with open(f'{bundle_test_dir}task_4/task.out') as f:
+            task_out = f.read()
+        with open(jobs[4].job_cluster_log) as f:
+            task_log = f.read()
+    finally:
+        shutil.rmtree(bundle_test_dir)
+
+    assert len(bundles) == 2
+    assert [len(bundle.jobs) for bundle in bundles] == [3, 2]
+    assert failed_jobs == [jobs[2]]
+    assert [job.state[0] for job in jobs] == [('complete', 'EXIT_0')] * 2 + [('error', 'EXIT_3')] + [('complete', 'EXIT_0')] * 2
+    assert jobs[4].job_cluster_log.endswith('bundle_1/task_1.log')
+    assert task_out == 'task 4 1\n'
+    assert task_log == ''
+
+def test_ClusterJobBundle_get_task_states():
+    '''
+    test tasks without exit codes follow the allocation state
+    '''
+    jobs = [ClusterJob.config_job(f'echo {i}', cluster, '', res_keywords_dict) for i in range(2)]
+    bundle = ClusterJobBundle.config_bundles(jobs, 2, res_keywords_dict, sub_dir=f'{test_sub_dir}no_bundle_test')[0]
+    assert bundle.get_task_states(('run', 'RUNNING')) == [('run', 'RUNNING')] * 2
+    assert bundle.get_task_states(('complete', 'COMPLETED')) == [('error', 'NOT_RUN')] * 2
+    assert jobs[0].state[0] == ('error', 'NOT_RUN')
+
 ### utilities ###
 @pytest.mark.clean
 def test_clean_files():
@@ -0,0 +1,119 @@
+import os
+import shutil
+
+from Class_Conf import Config
+from core.clusters.accre import Accre
+from core.clusters.mock_slurm import MockSlurm
+from core.job_manager import ClusterJob, ClusterJobArray
+from core.job_registry import JobRegistry
+
+test_dir = './test/core/test_file/job_registry_test/'
+res_keywords = {'core_type' : 'cpu',
+                'node_cores' : '1',
+                'job_name' : 'registry_test',
+                'partition' : 'production',
+                'mem_per_core' : '1G',
+                'walltime' : '1:00:00',
+                'account' : 'xxx'}
+
+
+def make_jobs(n_jobs):
+    return [ClusterJob.config_job(
+                commands = f'sleep 0.2; echo job {i} > job_{i}.out',
+                cluster = Accre(),
+                env_settings = '',
+                res_keywords = res_keywords,
+                sub_dir = test_dir,
+                sub_script_path = f'{test_dir}submit_{i}.cmd',
+                stage = 'test',
+                expected_outputs = [f'{test_dir}job_{i}.out'])
+            for i in range(n_jobs)]
+
+
+def set_up(monkeypatch):
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', f'{test_dir}job_registry.db')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    os.makedirs(test_dir)
+
+
+def test_job_registry_record(monkeypatch):
+    '''
+    test submitted jobs and their state changes are recorded without Config.debug
+    '''
+    set_up(monkeypatch)
+    try:
+        with MockSlurm(f'{test_dir}slurm'):
+            jobs = make_jobs(2)
+            ClusterJob.wait_to_array_end(jobs, period=0.1)
+        registry = JobRegistry.get_default()
+        records = registry.get_records(stage='test')
+        history = registry.get_history(jobs[0].job_id, 'ACCRE')
+        active_records = registry.get_records(active=True)
+        # the same script find the latest record
+        latest = registry.find_latest(jobs[1].sub_script_path, make_jobs(2)[1].sub_script_str)
+        journal_mode = registry._connect().execute('PRAGMA journal_mode').fetchone()[0]
+        db_files = os.listdir(test_dir)
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert [record['job_id'] for record in records] == [job.job_id for job in jobs]
+    assert records[0]['general_state'] == 'complete'
+    assert records[0]['expected_outputs'] == [os.path.abspath(f'{test_dir}job_0.out')]
+    assert [state[0] for state in history] == ['pend', 'run', 'complete'] or [state[0] for state in history] == ['pend', 'complete']
+    assert active_records == []
+    assert latest['job_id'] == jobs[1].job_id
+    # no WAL (and its shared memory file) that does not work on network file systems
+    assert journal_mode == 'delete'
+    assert not [name for name in db_files if name.endswith(('-wal', '-shm'))]
+
+
+def test_wait_to_array_end_reattach(monkeypatch):
+    '''
+    test a new driver reattach to jobs that are still in the queue instead of submitting them again
+    '''
+    set_up(monkeypatch)
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=0.5) as slurm:
+            # the killed driver submitted 2 of 3 jobs
+            for job in make_jobs(3)[:2]:
+                job.submit()
+            # new driver
+            jobs = make_jobs(3)
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1)
+            n_sbatch = slurm.get_calls().count('sbatch')
+            # completed jobs are not reattached by default but are with resume_complete
+            rerun_jobs = make_jobs(3)
+            ClusterJob.wait_to_array_end(rerun_jobs, period=0.1, resume_complete=True)
+            n_sbatch_rerun = slurm.get_calls().count('sbatch')
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == []
+    assert n_sbatch == 3
+    assert [job.state[0][0] for job in jobs] == ['complete'] * 3
+    assert n_sbatch_rerun == 3
+    assert [job.job_id for job in rerun_jobs] == [job.job_id for job in jobs]
+
+
+def test_reattach_native_array(monkeypatch):
+    '''
+    test reattach to a native job array and a job from its id
+    '''
+    set_up(monkeypatch)
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=0.5) as slurm:
+            ClusterJobArray(make_jobs(3), test_dir, array_size=2).submit()
+            jobs = make_jobs(3)
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1, native_array=True)
+            n_sbatch = slurm.get_calls().count('sbatch')
+            job = ClusterJob.reattach(jobs[1].job_id, Accre())
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == []
+    assert n_sbatch == 1
+    assert job.state[0] == ('complete', 'COMPLETED')
+    assert job.stage == 'test'
+    assert job.job_cluster_log == os.path.abspath(jobs[1].job_cluster_log)
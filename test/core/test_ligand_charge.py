@@ -0,0 +1,54 @@
+import os
+import json
+import shutil
+
+from Class_Conf import Config
+from Class_Structure import Structure
+from core import ligand_charge
+from core.ligand_charge import get_ligand_net_charge, clear_ligand_charge_memo
+
+
+def test_get_ligand_net_charge_memo():
+    '''test if the net charge is memorized in memory and on disk'''
+    cache_path = 'test/core/test_file/ligand_net_charge_test.json'
+    old_cache_path = Config.LIGAND_CHARGE_CACHE_PATH
+    Config.LIGAND_CHARGE_CACHE_PATH = cache_path
+    try:
+        clear_ligand_charge_memo()
+        lig = Structure.fromPDB('test/testfile_Class_PDB/FAcD.pdb').ligands[0]
+        assert lig.get_net_charge() == -1
+        with open(cache_path) as f:
+            records = json.load(f)
+        assert len(records) == 1 and records[0]['net_charge'] == -1
+
+        # load from disk
+        clear_ligand_charge_memo()
+        assert get_ligand_net_charge(lig.build_pdb_str(), ph=7.0) == -1
+        assert (records[0]['fingerprint'], 7.0) in ligand_charge._charge_memo
+    finally:
+        Config.LIGAND_CHARGE_CACHE_PATH = old_cache_path
+        clear_ligand_charge_memo()
+        if os.path.isfile(cache_path):
+            os.remove(cache_path)
+
+
+def test_protonate_ligand_memo(monkeypatch):
+    '''test if PDB.protonate_ligand share the in memory memo that is memory only by default'''
+    from Class_PDB import PDB
+    lig_dir = 'test/core/test_file/ligand_charge_test/'
+    assert Config.LIGAND_CHARGE_CACHE_PATH == ''
+    os.makedirs(lig_dir)
+    try:
+        clear_ligand_charge_memo()
+        stru = Structure.fromPDB('test/testfile_Class_PDB/FAcD.pdb')
+        lig_path = stru.build_ligands(lig_dir)[0][0]
+        out_path, net_charge = PDB.protonate_ligand(lig_path)
+        # found in the memo without perceiving again
+        monkeypatch.setattr(ligand_charge.pybel.ob.OBMol, 'AddHydrogens', None)
+        memo_net_charge = stru.ligands[0].get_net_charge()
+    finally:
+        clear_ligand_charge_memo()
+        shutil.rmtree(lig_dir)
+
+    assert out_path == lig_path[:-4] + '_aH.pdb'
+    assert net_charge == memo_net_charge == -1
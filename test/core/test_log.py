@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import shutil
+
+from Class_Conf import Config
+from core import log
+from core.log import get_logger, mutant_log
+
+test_dir = './test/core/test_file/log_test/'
+
+
+class CountStr():
+    def __init__(self):
+        self.n_str = 0
+
+    def __str__(self):
+        self.n_str += 1
+        return 'counted'
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_level_by_config(monkeypatch):
+    '''
+    test the level follows Config.debug (or Config.LOG_LEVEL) and a disabled call does not format its arguments
+    '''
+    monkeypatch.setattr(Config, 'LOG_LEVEL', None)
+    logger = get_logger('test_log_level')
+    handler = ListHandler()
+    logger.addHandler(handler)
+    arg = CountStr()
+    disabled_arg = CountStr()
+    try:
+        monkeypatch.setattr(Config, 'debug', 1)
+        logger.debug('debug %s', disabled_arg)
+        logger.info('info %s', arg)
+        monkeypatch.setattr(Config, 'debug', 0)
+        logger.info('info %s', disabled_arg)
+        monkeypatch.setattr(Config, 'debug', 2)
+        logger.debug('debug %s', arg)
+        monkeypatch.setattr(Config, 'LOG_LEVEL', 'warning')
+        logger.info('info %s', disabled_arg)
+    finally:
+        logger.removeHandler(handler)
+
+    assert logger.name == 'EnzyHTP.test_log_level'
+    assert handler.messages == ['info counted', 'debug counted']
+    assert arg.n_str > 0
+    assert disabled_arg.n_str == 0
+
+
+def test_mutant_log_json(monkeypatch):
+    '''
+    test records in mutant_log go to the log file of the mutant in JSON with the mutant tag
+    '''
+    monkeypatch.setattr(Config, 'LOG_LEVEL', 'INFO')
+    monkeypatch.setattr(Config, 'LOG_FORMAT', 'json')
+    logger = get_logger('test_log_mutant')
+    try:
+        with mutant_log(f'{test_dir}mutation_A11L'):
+            logger.info('working on %s', 'A11L')
+        logger.info('not in the mutant log')
+        with open(f'{test_dir}mutation_A11L/{Config.MUTANT_LOG_NAME}') as f:
+            lines = f.read().splitlines()
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'EnzyHTP.test_log_mutant'
+    assert entry['message'] == 'working on A11L'
+    assert entry['mutant'] == 'mutation_A11L'
+
+
+def test_repeated_warning(monkeypatch):
+    '''
+    test a repeated warning is suppressed after the limit and the count is reported after the window
+    '''
+    monkeypatch.setattr(Config, 'LOG_LEVEL', 'WARNING')
+    monkeypatch.setattr(Config, 'LOG_REPEAT_LIMIT', 2)
+    monkeypatch.setattr(Config, 'LOG_REPEAT_WINDOW', 60)
+    logger = get_logger('test_log_repeat')
+    handler = ListHandler()
+    logger.addHandler(handler)
+    log._repeat_state.clear()
+    try:
+        for i in range(5):
+            logger.warning('Error running squeue: %s', i)
+        logger.warning('another warning')
+        monkeypatch.setattr(Config, 'LOG_REPEAT_WINDOW', 0)
+        logger.warning('Error running squeue: %s', 5)
+    finally:
+        logger.removeHandler(handler)
+        log._repeat_state.clear()
+
+    assert handler.messages == ['Error running squeue: 0', 'Error running squeue: 1', 'another warning',
+                                'Error running squeue: 5 (3 similar messages suppressed)']
@@ -0,0 +1,121 @@
+import os
+import shutil
+import sys
+from subprocess import run
+
+import pytest
+
+from Class_Conf import Config
+from core import profiler
+from core.clusters.accre import Accre
+from core.clusters.mock_slurm import MockSlurm
+from core.job_manager import ClusterJob
+from core.profiler import instrument_class, load_trace, profile_tool, summarize_trace, trace_span
+
+test_dir = './test/core/test_file/profiler_test/'
+trace_path = f'{test_dir}trace.json'
+res_keywords = {'core_type' : 'cpu',
+                'node_cores' : '1',
+                'job_name' : 'profiler_test',
+                'partition' : 'production',
+                'mem_per_core' : '1G',
+                'walltime' : '1:00:00',
+                'account' : 'xxx'}
+
+
+class Dummy():
+    def __init__(self, path):
+        self.path = path
+
+    def outer(self):
+        return self.inner() + 1
+
+    def inner(self):
+        return 1
+
+    @classmethod
+    def make(cls):
+        return cls('made.pdb')
+
+    @staticmethod
+    def fail():
+        raise ValueError('failed')
+
+
+def test_trace_spans(monkeypatch):
+    '''
+    test nested method spans, tool spans with subprocess time and a span of an error
+    '''
+    monkeypatch.setattr(Config, 'PROFILE_TRACE_PATH', trace_path)
+    instrument_class(Dummy, 'Dummy')
+    tool_run = profile_tool(run)
+    os.makedirs(test_dir)
+    try:
+        assert Dummy.make().outer() == 2
+        with pytest.raises(ValueError):
+            Dummy.fail()
+        with trace_span('analysis', 'test', mutant='A11L'):
+            tool_run(f'{sys.executable} -c "sum(range(3000000))"', shell=True, check=True)
+        events = load_trace(trace_path)
+        summary = summarize_trace(trace_path)
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert [event['name'] for event in events] == ['Dummy.make', 'Dummy.inner', 'Dummy.outer', 'Dummy.fail', os.path.basename(sys.executable), 'analysis']
+    by_name = {event['name']: event for event in events}
+    assert by_name['Dummy.outer']['args']['pdb'] == 'made.pdb'
+    assert by_name['Dummy.inner']['args']['depth'] == 1
+    assert by_name['Dummy.fail']['args']['error'] == "ValueError('failed')"
+    tool_event = by_name[os.path.basename(sys.executable)]
+    assert tool_event['cat'] == 'tool'
+    assert tool_event['args']['subprocess_time'] > 0
+    assert by_name['analysis']['args']['mutant'] == 'A11L'
+    assert by_name['analysis']['dur'] >= tool_event['dur']
+    assert summary[('Dummy', 'Dummy.outer')]['count'] == 1
+    assert summary[('tool', os.path.basename(sys.executable))]['subprocess'] > 0
+
+
+def test_trace_disabled(monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILE_TRACE_PATH', '')
+    with trace_span('analysis', 'test'):
+        pass
+    assert profile_tool(lambda cmd: cmd)('echo 1') == 'echo 1'
+    assert not os.path.exists(trace_path)
+
+
+def test_trace_cluster_job(monkeypatch):
+    '''
+    test queue and run time of cluster jobs are traced on their own tracks
+    '''
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', '')
+    monkeypatch.setattr(Config, 'PROFILE_TRACE_PATH', trace_path)
+    os.makedirs(test_dir)
+    try:
+        with MockSlurm(f'{test_dir}slurm', queue_delay=0.5, runtime=0.5):
+            jobs = [ClusterJob.config_job(
+                        commands = f'echo {i}',
+                        cluster = Accre(),
+                        env_settings = '',
+                        res_keywords = res_keywords,
+                        sub_dir = test_dir,
+                        sub_script_path = f'{test_dir}submit_{i}.cmd',
+                        stage = 'md')
+                    for i in range(2)]
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1)
+        events = [event for event in load_trace(trace_path) if event['cat'] == 'cluster_job']
+        summary = summarize_trace(trace_path)
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == []
+    assert sorted((event['tid'], event['name']) for event in events) == sorted(
+        (f'ACCRE {job.job_id}', name) for job in jobs for name in ('queue', 'run'))
+    for job in jobs:
+        assert job.submit_time < job.start_time < job.end_time
+        assert job.start_time - job.submit_time >= 0.4
+    assert all(event['args']['stage'] == 'md' for event in events)
+    assert summary[('cluster_job', 'queue')]['count'] == 2
+    assert summary[('scheduler', 'sbatch')]['count'] == 2
@@ -0,0 +1,47 @@
+import os
+import pytest
+
+from core.protonation import PDB2PQRService
+
+test_dir = 'test/testfile_Class_PDB/protonation_test/'
+
+
+def test_protonate_cache():
+    '''test if the result is cached by file content and pH and the pqr is written'''
+    service = PDB2PQRService(cache_size=2)
+    pqr_path = f'{test_dir}AMY03_WT_rmH_service.pqr'
+
+    result = service.protonate(f'{test_dir}AMY03_WT_rmH.pdb', ph=7.0, out_path=pqr_path)
+    assert os.path.isfile(pqr_path)
+    with open(pqr_path) as f:
+        assert f.read() == result.pqr_str
+    os.remove(pqr_path)
+
+    assert len(result.disulfied_residue_pairs) == 3
+    assert len(result.pka_rows) > 0
+    assert service.protonate(f'{test_dir}AMY03_WT_rmH.pdb', ph=7.0) is result
+    assert service.protonate(f'{test_dir}AMY03_WT_rmH.pdb', ph=5.0) is not result
+
+
+def test_protonate_incremental():
+    '''test if the incremental protonation reuse the reference and give the same result for an unchanged structure'''
+    service = PDB2PQRService()
+    ref_result = service.protonate('test/testfile_Class_PDB/KE07R7.pdb', ph=7.0)
+    result = service.protonate_incremental('test/testfile_Class_PDB/KE07R7.pdb', ref_result, [('A', 101)], ph=7.0, radius=6.0)
+
+    assert result is not ref_result
+    assert result.pqr_str == ref_result.pqr_str
+    assert result.get_pka_dict().keys() == ref_result.get_pka_dict().keys()
+
+
+def test_grid_index():
+    '''test the neighbor search of GridIndex against brute force'''
+    from core.protonation import GridIndex
+    import numpy as np
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-20, 20, (500, 3))
+    points = rng.uniform(-5, 5, (3, 3))
+    grid = GridIndex(coords, cell_size=4.0)
+
+    answer = np.where(np.any(np.linalg.norm(coords[:, None, :] - points[None, :, :], axis=2) <= 6.0, axis=1))[0]
+    assert np.array_equal(grid.query(points, 6.0), answer)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol2')
+from core.pymol_pool import PyMOLPool
+
+PDB_STR = '''ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C
+ATOM      2  CA  GLY A   2       3.800   0.000   0.000  1.00  0.00           C
+END
+'''
+
+
+def test_get_area_by_frame_pool():
+    '''test frames split to workers give the same result as the in-process session'''
+    coords = np.array([[[0.0, 0.0, 0.0], [3.8, 0.0, 0.0]], [[0.0, 0.0, 0.0], [9.0, 0.0, 0.0]]])
+    single = PyMOLPool.get_pool(1).get_area_by_frame(PDB_STR, coords, PDB_STR, coords, 'resi 1', dot_solvent=1)
+    pool = PyMOLPool.get_pool(2)
+    try:
+        parallel = pool.get_area_by_frame(PDB_STR, coords, PDB_STR, coords, 'resi 1', dot_solvent=1)
+    finally:
+        pool.shutdown()
+    assert np.allclose(single, parallel)
+    # the 2nd residue moves away in frame 2
+    assert single[0][1] > single[0][0]
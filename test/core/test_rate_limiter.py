@@ -0,0 +1,137 @@
+import os
+import shutil
+import time
+from multiprocessing import Pool
+
+import pytest
+
+from Class_Conf import Config
+from core.clusters.accre import Accre
+from core.clusters.mock_slurm import MockSlurm
+from core.job_manager import ClusterJob
+from core.rate_limiter import SchedulerRateLimiter, is_limit_rejection, run_scheduler_cmd
+
+test_dir = './test/core/test_file/rate_limiter_test/'
+limit_path = f'{test_dir}scheduler_rate_limit.json'
+res_keywords = {'core_type' : 'cpu',
+                'node_cores' : '1',
+                'job_name' : 'rate_limit_test',
+                'partition' : 'production',
+                'mem_per_core' : '1G',
+                'walltime' : '1:00:00',
+                'account' : 'xxx'}
+
+
+def acquire_tokens(n_tokens):
+    limiter = SchedulerRateLimiter(limit_path, {'query': (20.0, 1)})
+    times = []
+    for i in range(n_tokens):
+        limiter.acquire('query')
+        times.append(time.time())
+    return times
+
+
+def test_rate_limiter_across_processes():
+    '''
+    test processes share one bucket
+    '''
+    os.makedirs(test_dir)
+    try:
+        with Pool(3) as pool:
+            times = sorted(sum(pool.map(acquire_tokens, [5, 5, 5]), []))
+    finally:
+        shutil.rmtree(test_dir)
+
+    # 1 token to start with and 14 more at 20/s
+    assert len(times) == 15
+    assert times[-1] - times[0] >= 14 / 20 - 0.05
+
+
+def test_rate_limiter_rejection(monkeypatch):
+    '''
+    test rejections block and slow down the bucket and successes restore the rate
+    '''
+    monkeypatch.setattr(SchedulerRateLimiter, 'LIMIT_BACKOFF', 0.2)
+    monkeypatch.setattr(SchedulerRateLimiter, 'MAX_BACKOFF', 0.3)
+    os.makedirs(test_dir)
+    try:
+        limiter = SchedulerRateLimiter(limit_path, {'submit': (10.0, 5)})
+        backoff = limiter.report_rejection('submit', 'sbatch: error: QOSMaxSubmitJobPerUserLimit')
+        # rejections during the block do not stack
+        limiter.report_rejection('submit', 'sbatch: error: QOSMaxSubmitJobPerUserLimit')
+        blocked_state = limiter.get_state('submit')
+        waited = limiter.acquire('submit')
+        # the next rejection doubles the backoff up to MAX_BACKOFF
+        second_backoff = limiter.report_rejection('submit', 'sbatch: error: QOSMaxSubmitJobPerUserLimit')
+        time.sleep(second_backoff)
+        limiter.report_success('submit')
+        recovered_state = limiter.get_state('submit')
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert 0.2 <= backoff <= 0.22
+    assert blocked_state['rate'] == 5.0
+    assert waited >= 0.15
+    assert 0.3 <= second_backoff <= 0.33
+    assert recovered_state['rate'] == 3.5
+    assert recovered_state['backoff'] == 0.0
+
+
+def test_is_limit_rejection():
+    assert is_limit_rejection('sbatch: error: QOSMaxSubmitJobPerUserLimit')
+    assert is_limit_rejection('sbatch: error: AssocMaxSubmitJobLimit')
+    assert not is_limit_rejection('sbatch: error: Batch job submission failed: Socket timed out on send/recv operation')
+
+
+def test_run_scheduler_cmd_max_wait(monkeypatch):
+    '''
+    test a failing command give up after max_wait
+    '''
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', limit_path)
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT', {'query': (100.0, 10)})
+    monkeypatch.setattr(SchedulerRateLimiter, 'ERROR_BACKOFF', 0.1)
+    os.makedirs(test_dir)
+    try:
+        with pytest.raises(Exception) as e:
+            run_scheduler_cmd(f'echo 1 >> {test_dir}tries; exit 1', max_wait=0.5)
+        with open(f'{test_dir}tries') as f:
+            n_tries = len(f.readlines())
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert 'Failed running' in str(e.value)
+    # backoffs of 0.1, 0.2 and then 0.4 is over max_wait
+    assert n_tries == 3
+
+
+def test_wait_to_array_end_submit_limit(monkeypatch):
+    '''
+    test sbatch rejected by QOSMaxSubmitJobPerUserLimit is retried after the backoff until all jobs finish
+    '''
+    monkeypatch.setattr(Accre, 'SACCT_WAIT_TIME', 0)
+    monkeypatch.setattr(Config, 'debug', 0)
+    monkeypatch.setattr(Config, 'JOB_REGISTRY_PATH', '')
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT_PATH', limit_path)
+    monkeypatch.setattr(Config, 'SCHEDULER_RATE_LIMIT', {'submit': (20.0, 5), 'query': (100.0, 10)})
+    monkeypatch.setattr(SchedulerRateLimiter, 'LIMIT_BACKOFF', 0.2)
+    os.makedirs(test_dir)
+    try:
+        with MockSlurm(f'{test_dir}slurm', runtime=0.3, max_submit=2) as slurm:
+            jobs = [ClusterJob.config_job(
+                        commands = f'echo {i}',
+                        cluster = Accre(),
+                        env_settings = '',
+                        res_keywords = res_keywords,
+                        sub_dir = test_dir,
+                        sub_script_path = f'{test_dir}submit_{i}.cmd')
+                    for i in range(4)]
+            failed_jobs = ClusterJob.wait_to_array_end(jobs, period=0.1, array_size=4)
+            n_sbatch = slurm.get_calls().count('sbatch')
+            scheduler_jobs = slurm.get_jobs()
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert failed_jobs == []
+    assert [job.state[0][0] for job in jobs] == ['complete'] * 4
+    assert len(scheduler_jobs) == 4
+    assert n_sbatch > 4
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from core import rmsd
+
+
+def _rotation(theta):
+    return np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+
+
+def test_kabsch_fit_rigid_motion():
+    '''test frames moved rigidly are fitted back to the reference'''
+    rng = np.random.default_rng(0)
+    ref = rng.normal(size=(10, 3))
+    coords = np.array([ref @ _rotation(t).T + shift for t, shift in ((0.3, 1.0), (2.0, -5.0), (-1.0, 0.0))])
+    fitted = rmsd.kabsch_fit(coords, ref, weights=rng.uniform(1, 16, size=10))
+    assert np.allclose(fitted, ref)
+    assert np.allclose(rmsd.get_rmsd_series(coords, ref), 0.0)
+
+
+def test_get_rmsd_series_references():
+    '''test first/average references and weights'''
+    rng = np.random.default_rng(1)
+    base = rng.normal(size=(8, 3))
+    noise = rng.normal(scale=0.1, size=(5, 8, 3))
+    coords = (base + noise) @ _rotation(0.5).T
+    weights = rng.uniform(1, 16, size=8)
+
+    first = rmsd.get_rmsd_series(coords, 'first', weights)
+    assert first.shape == (5,)
+    assert first[0] == pytest.approx(0.0, abs=1e-8)
+
+    average = rmsd.get_rmsd_series(coords, 'average', weights)
+    ref = rmsd.kabsch_fit(coords, coords[0], weights).mean(axis=0)
+    assert np.allclose(average, rmsd.get_rmsd_series(coords, ref, weights))
+    # the mass weighted RMSD of a single frame
+    fitted = rmsd.kabsch_fit(coords[2:3], ref, weights)[0]
+    answer = np.sqrt(np.sum(weights * np.sum((fitted - ref)**2, axis=1)) / weights.sum())
+    assert average[2] == pytest.approx(answer)
+
+    with pytest.raises(Exception):
+        rmsd.get_rmsd_series(coords, 'last')
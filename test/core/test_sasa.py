@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from core import sasa
+
+
+def test_get_sasa_isolated_and_overlap():
+    '''test against the analytic area of an isolated sphere and 2 overlapping spheres'''
+    ext_r = 1.7 + sasa.PROBE_RADIUS
+    result = sasa.get_sasa(np.zeros((1, 3)), np.array([1.7]))
+    assert result[0] == pytest.approx(4 * np.pi * ext_r**2)
+
+    d = 2.0
+    coord = np.array([[0.0, 0.0, 0.0], [d, 0.0, 0.0], [30.0, 0.0, 0.0]])
+    result = sasa.get_sasa(coord, np.array([1.7, 1.7, 1.7]), target_idx=[0])
+    answer = 4 * np.pi * ext_r**2 - 2 * np.pi * ext_r * (ext_r - d/2)
+    assert len(result) == 1
+    assert result[0] == pytest.approx(answer, rel=0.01)
+
+
+def test_get_frames_sasa_parallel():
+    '''test splitting frames to processes gives the same result'''
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 8, size=(4, 20, 3))
+    radii = np.full(20, 1.5)
+    serial = sasa.get_frames_sasa(coords, radii, [0, 5, 6], n_sphere_points=100)
+    parallel = sasa.get_frames_sasa(coords, radii, [0, 5, 6], n_sphere_points=100, n_cores=2)
+    assert serial.shape == (4, 3)
+    assert np.array_equal(serial, parallel)
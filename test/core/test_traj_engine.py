@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import pytest
+
+from core import traj_engine
+from core.traj_engine import TrajAnalysis, TrajAnalysisEngine, register_analysis
+from helper import get_field_strength_value
+
+test_dir = 'test/core/test_file/'
+
+# 2 molecules: 4 atoms (residue 1) + 1 atom (residue 2) in a 20 A box
+PRMTOP_STR = '''%VERSION  VERSION_STAMP = V0001.000
+%FLAG ATOM_NAME
+%FORMAT(20a4)
+N   CA  C   O   C1  
+%FLAG CHARGE
+%FORMAT(5E16.8)
+ -7.28897922E+00  3.09751320E-01  1.08296500E+01 -1.03105980E+01  1.82223000E+01
+%FLAG ATOMIC_NUMBER
+%FORMAT(10I8)
+       7       6       6       8       6
+%FLAG MASS
+%FORMAT(5E16.8)
+  1.40100000E+01  1.20100000E+01  1.20100000E+01  1.60000000E+01  1.20100000E+01
+%FLAG RESIDUE_LABEL
+%FORMAT(20a4)
+ALA LIG 
+%FLAG RESIDUE_POINTER
+%FORMAT(10I8)
+       1       5
+%FLAG ATOMS_PER_MOLECULE
+%FORMAT(10I8)
+       4       1
+%FLAG BOX_DIMENSIONS
+%FORMAT(5E16.8)
+  9.00000000E+01  2.00000000E+01  2.00000000E+01  2.00000000E+01
+'''
+
+COORD = np.array([[0.0, 0.0, 0.0], [1.5, 0.0, 0.0], [2.0, 1.4, 0.0], [3.2, 1.6, 0.3], [5.0, 1.0, 1.0]])
+
+
+@pytest.fixture
+def traj_files():
+    prmtop_path = f'{test_dir}traj_engine_test.prmtop'
+    mdcrd_path = f'{test_dir}traj_engine_test.mdcrd'
+    # frame 2: the ligand is in the next image. frame 3: the protein is rotated
+    theta = np.radians(30)
+    rot = np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+    frames = [COORD, COORD + np.array([0, 0, 0, 0, 1])[:, None] * [20.0, 0, 0], COORD @ rot.T]
+    with open(prmtop_path, 'w') as of:
+        of.write(PRMTOP_STR)
+    with open(mdcrd_path, 'w') as of:
+        of.write('title' + os.linesep)
+        for coord in frames:
+            values = coord.flatten()
+            for i in range(0, len(values), 10):
+                of.write(''.join(f'{v:8.3f}' for v in values[i:i+10]) + os.linesep)
+            of.write(''.join(f'{v:8.3f}' for v in (20.0, 20.0, 20.0)) + os.linesep)
+    yield prmtop_path, mdcrd_path
+    os.remove(prmtop_path)
+    os.remove(mdcrd_path)
+
+
+def test_traj_engine_single_pass(traj_files):
+    '''test all analyses get each (imaged) frame once and return together'''
+    @register_analysis('count_test')
+    class CountAnalysis(TrajAnalysis):
+        def __init__(self):
+            self.frame_idxs = []
+        def process(self, frame_idx, coord):
+            self.frame_idxs.append(frame_idx)
+        def finish(self):
+            return self.frame_idxs
+
+    engine = TrajAnalysisEngine(*traj_files)
+    engine.add('count_test')
+    engine.add('distance', atom_pairs=[(1, 5), (1, 2)])
+    engine.add('rmsd', mask=':1')
+    engine.add('rmsd', name='rmsd_backbone', mask=':1@N,CA,C', if_series=True)
+    engine.add('field_strength', name='e', atom_mask=':2', a1=1, a2=2, bond_p1='center')
+    results = engine.run()
+    traj_engine.ANALYSES.pop('count_test')
+
+    assert results['count_test'] == [0, 1, 2]
+    # the ligand is imaged back
+    assert np.allclose(results['distance'][:, 0], np.linalg.norm(COORD[4] - COORD[0]), atol=1e-3)
+    assert np.allclose(results['distance'][:, 1], 1.5, atol=1e-3)
+    # rigid motions only
+    assert results['rmsd'] == pytest.approx(0.0, abs=1e-3)
+    assert results['rmsd_backbone'].shape == (3,)
+    assert np.allclose(results['rmsd_backbone'], 0.0, atol=1e-3)
+    e_0 = get_field_strength_value(COORD[4], 1.0, (COORD[0] + COORD[1]) / 2, p2=COORD[1])
+    assert results['e'][0] == pytest.approx(e_0, rel=1e-3)
+    assert results['e'][1] == pytest.approx(e_0, rel=1e-3)
+
+
+def test_traj_engine_no_image(traj_files):
+    '''test frames are used as is with image=False'''
+    engine = TrajAnalysisEngine(*traj_files, image=False)
+    engine.add('distance', atom_pairs=[(1, 5)])
+    result = engine.run()['distance']
+    assert result[1, 0] > 20.0
+
+
+def test_traj_engine_nc(traj_files):
+    '''test a NetCDF trajectory is streamed with its box and imaged as the ASCII one'''
+    netcdf = pytest.importorskip('scipy.io')
+    prmtop_path, mdcrd_path = traj_files
+    nc_path = f'{test_dir}traj_engine_test.nc'
+    frames = [coord for coord, box in traj_engine.trajectory.iter_mdcrd(mdcrd_path, 5)]
+    f = netcdf.netcdf_file(nc_path, 'w', version=2)
+    f.createDimension('frame', None)
+    f.createDimension('atom', 5)
+    f.createDimension('spatial', 3)
+    f.createDimension('cell_spatial', 3)
+    f.createDimension('cell_angular', 3)
+    coordinates = f.createVariable('coordinates', 'f', ('frame', 'atom', 'spatial'))
+    cell_lengths = f.createVariable('cell_lengths', 'd', ('frame', 'cell_spatial'))
+    cell_angles = f.createVariable('cell_angles', 'd', ('frame', 'cell_angular'))
+    coordinates[:] = np.array(frames, dtype=np.float32)
+    cell_lengths[:] = np.full((len(frames), 3), 20.0)
+    cell_angles[:] = np.full((len(frames), 3), 90.0)
+    f.close()
+    try:
+        engine = TrajAnalysisEngine(prmtop_path, nc_path)
+        engine.add('distance', atom_pairs=[(1, 5)])
+        result = engine.run()['distance']
+    finally:
+        os.remove(nc_path)
+
+    assert len(result) == 3
+    assert np.allclose(result[:, 0], np.linalg.norm(COORD[4] - COORD[0]), atol=1e-3)
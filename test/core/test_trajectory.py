@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pytest
+
+from core import trajectory
+
+test_dir = 'test/core/test_file/'
+
+PRMTOP_STR = '''%VERSION  VERSION_STAMP = V0001.000
+%FLAG TITLE
+%FORMAT(20a4)
+test
+%FLAG ATOM_NAME
+%FORMAT(20a4)
+N   CA  C   O   C1  
+%FLAG MASS
+%FORMAT(5E16.8)
+  1.40100000E+01  1.20100000E+01  1.20100000E+01  1.60000000E+01  1.20100000E+01
+%FLAG CHARGE
+%FORMAT(5E16.8)
+ -7.28897922E+00  3.09751320E-01  1.08296500E+01 -1.03105980E+01  0.00000000E+00
+%FLAG ATOMIC_NUMBER
+%FORMAT(10I8)
+       7       6       6       8       6
+%FLAG RESIDUE_LABEL
+%FORMAT(20a4)
+ALA LIG 
+%FLAG RESIDUE_POINTER
+%FORMAT(10I8)
+       1       5
+'''
+
+
+def test_read_prmtop_topology_and_select():
+    '''test reading atoms/residues and decoding masks'''
+    prmtop_path = f'{test_dir}trajectory_test.prmtop'
+    with open(prmtop_path, 'w') as of:
+        of.write(PRMTOP_STR)
+    try:
+        topology = trajectory.read_prmtop_topology(prmtop_path)
+    finally:
+        os.remove(prmtop_path)
+
+    assert topology.n_atoms == 5
+    assert topology.elements == ['N', 'C', 'C', 'O', 'C']
+    assert topology.resi_names == ['ALA', 'LIG']
+    assert list(topology.select(':1')) == [0, 1, 2, 3]
+    assert list(topology.select(':2')) == [4]
+    assert list(topology.select('@2-3,5')) == [1, 2, 4]
+    assert list(topology.select(':1@CA')) == [1]
+    assert list(topology.select(':1-2@CA,C1')) == [1, 4]
+    assert list(topology.select('@C,O')) == [2, 3]
+    with pytest.raises(Exception):
+        topology.select(':ALA')
+    with pytest.raises(Exception):
+        topology.select(':1@')
+
+    pdb_lines = topology.get_pdb_str(np.zeros((5, 3)), topology.select(':2')).splitlines()
+    assert pdb_lines == [
+        'ATOM      5  C1  LIG A   2       0.000   0.000   0.000  1.00  0.00           C',
+        'END']
+
+
+def test_read_mdcrd():
+    '''test reading an ASCII trajectory with box lines'''
+    mdcrd_path = f'{test_dir}trajectory_test.mdcrd'
+    coords = np.arange(2 * 5 * 3, dtype=float).reshape(2, 5, 3) - 999.5
+    with open(mdcrd_path, 'w') as of:
+        of.write('title' + os.linesep)
+        for coord in coords:
+            values = coord.flatten()
+            for i in range(0, len(values), 10):
+                of.write(''.join(f'{v:8.3f}' for v in values[i:i+10]) + os.linesep)
+            of.write(''.join(f'{v:8.3f}' for v in (50.0, 50.0, 50.0)) + os.linesep)
+    try:
+        result = trajectory.read_mdcrd(mdcrd_path, 5)
+    finally:
+        os.remove(mdcrd_path)
+
+    assert np.allclose(result, coords)
+
+
+def test_image_molecules_oct():
+    '''test the minimum image in a truncated octahedron (Amber default box)'''
+    box = np.array([60.0, 60.0, 60.0])
+    angles = np.array([109.4712206] * 3)
+    cell = trajectory.get_cell_vectors(box, angles)
+    # both are closer than half of the box length so they are their own minimum image
+    # (rounding the fractional coordinates alone moves them)
+    expected = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 28.0], [16.0, 16.0, 16.0], [-16.0, 16.0, 16.0]])
+    coord = expected + np.array([[0, 0, 0], [0, 0, 0], [1, 1, 0], [0, -1, 2]]) @ cell
+    result = trajectory.image_molecules(coord, box, angles, [1, 1, 1, 1])
+    assert np.allclose(result, expected)
+
+    # compare with a search of all nearby images
+    vectors = np.random.default_rng(0).uniform(-120, 120, (500, 3))
+    lattice = np.array([[i, j, k] for i in range(-4, 5) for j in range(-4, 5) for k in range(-4, 5)]) @ cell
+    ref = np.min(np.linalg.norm(vectors[:, None, :] - lattice[None, :, :], axis=2), axis=1)
+    imaged = vectors - trajectory.get_minimum_image_shifts(vectors, cell)
+    assert np.allclose(np.linalg.norm(imaged, axis=1), ref)
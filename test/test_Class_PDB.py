@@ -1,9 +1,14 @@
 import copy
+import csv
 from glob import glob
+import io
 from random import choice
 import os
 import pytest
 import pickle
+import shutil
+from subprocess import run
+import numpy as np
 
 from Class_PDB import PDB
 from Class_Conf import Config
@@ -101,18 +106,49 @@ def test_Add_MutaFlag_good_random():
 # good PDB solvent
 # bad PDB
 
+def test_PDB2PDBwLeap_scratch_dir(monkeypatch):
+    '''
+    test tleap runs in a scratch dir so no leap.log is left in (or removed from) the CWD
+    (tleap is replaced by a script that copies the loaded PDB)
+    '''
+    test_dir = 'test/testfile_Class_PDB/leap_scratch_test/'
+    os.makedirs(f'{test_dir}bin')
+    shutil.copy('test/testfile_Class_PDB/KE07R7.pdb', test_dir)
+    with open(f'{test_dir}bin/tleap', 'w') as of:
+        of.write('''#!/bin/bash
+touch leap.log
+src=$(awk '/loadpdb/{print $4}' $3)
+dst=$(awk '/savepdb/{print $3}' $3)
+cp $src $dst
+pwd > $dst.cwd
+''')
+    os.chmod(f'{test_dir}bin/tleap', 0o755)
+    monkeypatch.setenv('PATH', f'{os.path.abspath(test_dir)}/bin:{os.environ["PATH"]}')
+    monkeypatch.setattr(Config, 'debug', 1)
+    had_leap_log = os.path.exists('leap.log')
+    try:
+        pdb_obj = PDB(f'{test_dir}KE07R7.pdb', wk_dir=test_dir)
+        pdb_obj.Add_MutaFlag('DA7I')
+        out_path = pdb_obj.PDB2PDBwLeap()
+        with open(f'{out_path}.cwd') as f:
+            tleap_cwd = f.read().strip()
+        assert os.path.isfile(out_path)
+        assert os.path.exists('leap.log') == had_leap_log
+        assert not os.path.exists(f'{test_dir}leap.log')
+        assert tleap_cwd != os.getcwd()
+        assert not os.path.exists(tleap_cwd)
+    finally:
+        shutil.rmtree(test_dir)
+
 @pytest.mark.md
 def test_PDB2FF_keep():
     pdb_obj = PDB('./test/testfile_Class_PDB/FAcD.pdb', wk_dir='./test/testfile_Class_PDB')
     prm_files = pdb_obj.PDB2FF(local_lig=1)
     test_file_paths.extend(prm_files) #clean up record
-    test_file_paths.extend([pdb_obj.cache_path+'/leap.in', 
-                            './tmp/tmp.inpcrd', 
-                            pdb_obj.cache_path+'/leap.out',
+    test_file_paths.extend(['./tmp/tmp.inpcrd', 
                             pdb_obj.lig_dir+'/cache/ligand_temp2.pdb',
                             pdb_obj.lig_dir+'/cache/ligand_temp3.pdb',
-                            pdb_obj.lig_dir+'/cache/ligand_temp.mol2',
-                            './leap.log'])
+                            pdb_obj.lig_dir+'/cache/ligand_temp.mol2'])
     test_file_dirs.extend([pdb_obj.lig_dir+'/cache'])
 
     for f in prm_files:
@@ -434,6 +470,141 @@ def test_get_rosetta_ddg():
         cluster=accre.Accre(),
         period=10)
 
+def test_get_rosetta_ddg_packed(monkeypatch):
+    '''
+    test groups_per_job packs groups into multi-core jobs that keep per-group dirs and results
+    (the cluster run is replaced by writing .ddg files)
+    '''
+    test_dir = 'test/testfile_Class_PDB/ddg_test/'
+    ddg_dir = f'{test_dir}ddg_pack/'
+    pdb_obj = PDB('test/testfile_Class_PDB/KE07R7.pdb', wk_dir=test_dir)
+    submitted_jobs = []
+
+    def fake_wait_to_array_end(jobs, period, array_size=0, *args, **kwargs):
+        submitted_jobs.extend(jobs)
+        for i in range(3):
+            with open(f'{ddg_dir}group_{i}/mutation.ddg', 'w') as of:
+                of.write(f'COMPLEX: Round1: WT_: -10.0{os.linesep}COMPLEX: Round1: MUT_: {-10.0+i}{os.linesep}')
+        return []
+    monkeypatch.setattr(PDB.__module__ + '.job_manager.ClusterJob.wait_to_array_end', fake_wait_to_array_end)
+
+    try:
+        ddg_results = pdb_obj.get_rosetta_ddg(
+            rosetta_home='rosetta/main/',
+            muta_groups=[('D 7 I', 'L 2 I'), ('D 7 A',), ('L 2 A',)],
+            relaxed_pdb=f'{test_dir}KE-07_relaxed.pdb',
+            niter=1,
+            ddg_dir=ddg_dir,
+            cluster=accre.Accre(),
+            res_setting={'account': 'test_account'},
+            groups_per_job=2)
+    finally:
+        shutil.rmtree(ddg_dir)
+
+    assert ddg_results == {('D 7 I', 'L 2 I'): 0.0, ('D 7 A',): 1.0, ('L 2 A',): 2.0}
+    assert len(submitted_jobs) == 2
+    assert '--tasks-per-node=2' in submitted_jobs[0].sub_script_str
+    assert '--tasks-per-node=1' in submitted_jobs[1].sub_script_str
+    assert submitted_jobs[0].sub_script_str.count('cartesian_ddg') == 2
+    assert 'test_account' in submitted_jobs[0].sub_script_str
+    assert submitted_jobs[1].sub_script_str.count('cartesian_ddg') == 1
+
+def test_get_rosetta_ddg_packed_exit_status(monkeypatch):
+    '''
+    test a packed job script exits with an error if any of its groups fails
+    (cartesian_ddg is replaced by a script that fails for the D 7 A group)
+    '''
+    test_dir = 'test/testfile_Class_PDB/ddg_test/'
+    ddg_dir = f'{test_dir}ddg_pack_fail/'
+    rosetta_home = f'{ddg_dir}rosetta/main/'
+    pdb_obj = PDB('test/testfile_Class_PDB/KE07R7.pdb', wk_dir=test_dir)
+    return_codes = []
+
+    def fake_wait_to_array_end(jobs, period, array_size=0, *args, **kwargs):
+        for i, job in enumerate(jobs):
+            with open(f'{ddg_dir}fake_submit_{i}.sh', 'w') as of:
+                of.write(job.sub_script_str)
+            return_codes.append(run(['bash', f'{ddg_dir}fake_submit_{i}.sh']).returncode)
+        with open(f'{ddg_dir}group_1/mutation.ddg', 'w') as of:
+            of.write(f'COMPLEX: Round1: WT_: -10.0{os.linesep}COMPLEX: Round1: MUT_: -10.0{os.linesep}')
+        return []
+    monkeypatch.setattr(PDB.__module__ + '.job_manager.ClusterJob.wait_to_array_end', fake_wait_to_array_end)
+
+    os.makedirs(f'{rosetta_home}source/bin/')
+    with open(f'{rosetta_home}source/bin/cartesian_ddg.static.linuxgccrelease', 'w') as of:
+        of.write('''#!/bin/bash
+if grep -q 'D 7 A' mutation.txt; then exit 3; fi
+echo 'COMPLEX: Round1: WT_: -10.0' > mutation.ddg
+echo 'COMPLEX: Round1: MUT_: -9.0' >> mutation.ddg
+''')
+    os.chmod(f'{rosetta_home}source/bin/cartesian_ddg.static.linuxgccrelease', 0o755)
+    try:
+        ddg_results = pdb_obj.get_rosetta_ddg(
+            rosetta_home=os.path.abspath(rosetta_home),
+            muta_groups=[('D 7 I', 'L 2 I'), ('D 7 A',), ('L 2 A',)],
+            relaxed_pdb=f'{test_dir}KE-07_relaxed.pdb',
+            niter=1,
+            ddg_dir=ddg_dir,
+            cluster=accre.Accre(),
+            res_setting={'account': 'test_account'},
+            groups_per_job=2)
+    finally:
+        shutil.rmtree(ddg_dir)
+
+    # the group after the failed one in the same pack still finishes
+    assert return_codes == [1, 0]
+    assert ddg_results[('D 7 I', 'L 2 I')] == 1.0
+    assert ddg_results[('L 2 A',)] == 1.0
+
+def test_collect_rosetta_ddg_results():
+    '''
+    test all group_*/mutation.ddg are collected into one DataFrame in the order of group index
+    '''
+    ddg_dir = 'test/testfile_Class_PDB/ddg_test/ddg_collect/'
+    try:
+        for i, mutations in enumerate([('D 7 I', 'L 2 I'), ('D 7 A',), ('L 2 A',)] * 4):
+            os.makedirs(f'{ddg_dir}group_{i}')
+            with open(f'{ddg_dir}group_{i}/mutation.txt', 'w') as of:
+                of.write(f'total {len(mutations)}{os.linesep}{len(mutations)}{os.linesep}')
+                of.write(os.linesep.join(mutations) + os.linesep)
+            with open(f'{ddg_dir}group_{i}/mutation.ddg', 'w') as of:
+                for j in range(2):
+                    of.write(f'COMPLEX:   Round{j+1}: WT_:  {-10.0-j:.3f}  fa_atr: -1.0{os.linesep}')
+                for j in range(2):
+                    of.write(f'COMPLEX:   Round{j+1}: MUT_D7I:  {-10.0+i+j:.3f}  fa_atr: -1.0{os.linesep}')
+        ddg_df = PDB.collect_rosetta_ddg_results(ddg_dir, n_workers=4)
+    finally:
+        shutil.rmtree(ddg_dir)
+
+    assert list(ddg_df['group']) == [f'group_{i}' for i in range(12)]
+    assert ddg_df.loc[10, 'mutations'] == ('D 7 A',)
+    assert list(ddg_df['n_wt']) == [2] * 12
+    assert np.allclose(ddg_df['wt_mean'], -10.5)
+    assert np.allclose(ddg_df['ddg'], np.arange(12) + 1.0)
+    assert np.allclose(ddg_df.loc[3, 'mut_scores'], [-7.0, -6.0])
+
+def test_collect_rosetta_scores():
+    '''
+    test score.sc files under a dir are collected and the lowest score of each file is marked
+    '''
+    score_dir = 'test/testfile_Class_PDB/ddg_test/score_collect/'
+    try:
+        for i in range(3):
+            os.makedirs(f'{score_dir}relax_{i}')
+            with open(f'{score_dir}relax_{i}/score.sc', 'w') as of:
+                of.write(f'SEQUENCE: {os.linesep}SCORE: total_score fa_atr description{os.linesep}')
+                for j, score in enumerate([-10.0, -12.0 - i, -11.0]):
+                    of.write(f'SCORE: {score:.3f} -1.000 KE07_000{j+1}{os.linesep}')
+        score_df = PDB.collect_rosetta_scores(score_dir)
+    finally:
+        shutil.rmtree(score_dir)
+
+    assert len(score_df) == 9
+    assert score_df['total_score'].dtype == float
+    lowest = score_df[score_df['is_lowest']]
+    assert list(lowest['idx']) == [2, 2, 2]
+    assert list(lowest['total_score']) == [-12.0, -13.0, -14.0]
+
 def test_get_rosetta_ddg_result():
     '''
     test function works without abort
@@ -488,12 +659,37 @@ def test_make_mmpbsa_prmtops_use_ante_mmpbsa():
     test_pdb.prmtop = f'{test_dir}/PuOrh_amber_aH_rmH_aH.prmtop'
     Config.debug = 1
 
-    assert test_pdb.make_mmpbsa_prmtops(ligand_mask) == (
+    assert test_pdb.make_mmpbsa_prmtops(ligand_mask, out_dir=f'{test_dir}temp/') == (
         'test/testfile_Class_PDB/mmpbsa_test/temp/dr.prmtop', 
         'test/testfile_Class_PDB/mmpbsa_test/temp/dl.prmtop', 
         'test/testfile_Class_PDB/mmpbsa_test/temp/dc.prmtop', 
         'test/testfile_Class_PDB/mmpbsa_test/temp/sc.prmtop')
 
+def test_get_mmpbsa_prmtops_cached():
+    '''test cached prmtops are used and the key depends on the prmtop, mask and radii'''
+    ligand_mask = ':902'
+    test_dir = 'test/testfile_Class_PDB/mmpbsa_test/'
+    test_pdb = PDB(f"{test_dir}PuOrh_amber_aH_rmH_aH_ff.pdb", wk_dir=test_dir)
+    test_pdb.prmtop_path = f'{test_dir}data/dl.prmtop'
+    Config.debug = 1
+
+    key = PDB._get_mmpbsa_prmtop_key(test_pdb.prmtop_path, ligand_mask, 'mbondi2', 1)
+    assert key == PDB._get_mmpbsa_prmtop_key(test_pdb.prmtop_path, f' {ligand_mask} ', 'mbondi2', 1)
+    assert key != PDB._get_mmpbsa_prmtop_key(test_pdb.prmtop_path, ':901', 'mbondi2', 1)
+    assert key != PDB._get_mmpbsa_prmtop_key(test_pdb.prmtop_path, ligand_mask, 'mbondi3', 1)
+
+    entry_dir = f'{test_dir}cache/mmpbsa_prmtop/{key}/'
+    os.makedirs(entry_dir)
+    try:
+        for name in ('dr', 'dl', 'dc', 'sc'):
+            open(f'{entry_dir}{name}.prmtop', 'w').close()
+        # igb 2 and 5 share the radii
+        for igb in (2, 5):
+            assert test_pdb.get_mmpbsa_prmtops(ligand_mask, igb) == tuple(
+                f'{entry_dir}{name}.prmtop' for name in ('dr', 'dl', 'dc', 'sc'))
+    finally:
+        shutil.rmtree(f'{test_dir}cache/')
+
 def test_make_mmpbsa_prmtops_no_ante_mmpbsa():
     '''test function works as expected'''
     ligand_mask = ':902'
@@ -506,7 +702,7 @@ def test_make_mmpbsa_prmtops_no_ante_mmpbsa():
     test_pdb.prmtop = f'{test_dir}/PuOrh_amber_aH_rmH_aH.prmtop'
     Config.debug = 1
 
-    assert test_pdb.make_mmpbsa_prmtops(ligand_mask, use_ante_mmpbsa=0) == (
+    assert test_pdb.make_mmpbsa_prmtops(ligand_mask, use_ante_mmpbsa=0, out_dir=f'{test_dir}temp/') == (
         'test/testfile_Class_PDB/mmpbsa_test/temp/dr.prmtop', 
         'test/testfile_Class_PDB/mmpbsa_test/temp/dl.prmtop', 
         'test/testfile_Class_PDB/mmpbsa_test/temp/dc.prmtop', 
@@ -555,6 +751,133 @@ def test_extract_mmpbsa_out():
     for k in mmpbsa_out_dict:
         assert mmpbsa_out_dict[k].equals(answer[k])
 
+def test_extract_mmpbsa_frame_out():
+    '''test function works as expected. testing using a -eo file of 3 frames (startframe=1, interval=10)
+    in the format of MMPBSA.py (csv module with CRLF)'''
+    test_dir = 'test/testfile_Class_PDB/mmpbsa_test/'
+    data_file = f'{test_dir}data/mmpbsa_frames.csv'
+
+    frame_out_dict = PDB.extract_mmpbsa_frame_out(data_file)
+
+    assert set(frame_out_dict) == {"gb", "pb"}
+    assert set(frame_out_dict["gb"]) == {"complex", "receptor", "ligand", "delta"}
+    assert list(frame_out_dict["gb"]["delta"]["Frame #"]) == [1, 11, 21]
+    assert list(frame_out_dict["gb"]["complex"]) == ["Frame #", "BOND", "ANGLE", "DIHED", "VDWAALS", "EEL", "1-4 VDW", "1-4 EEL",
+                                                     "EGB", "ESURF", "G gas", "G solv", "TOTAL"]
+    assert np.allclose(frame_out_dict["gb"]["delta"]["DELTA TOTAL"], [-35.9334, -20.5282, -22.9504])
+    for method in ("gb", "pb"):
+        result = frame_out_dict[method]
+        assert np.allclose(result["delta"]["DELTA TOTAL"],
+                           result["complex"]["TOTAL"] - result["receptor"]["TOTAL"] - result["ligand"]["TOTAL"])
+    assert {"EPB", "ENPOLAR", "EDISPER"} <= set(frame_out_dict["pb"]["complex"])
+
+def test_merge_mmpbsa_frame_out():
+    '''test -eo files of frame chunks are merged into the file of all frames. testing using chunks split from a -eo file'''
+    test_dir = 'test/testfile_Class_PDB/mmpbsa_test/'
+    data_file = f'{test_dir}data/mmpbsa_frames.csv'
+    with open(data_file, newline='') as f:
+        data_str = f.read()
+        rows = list(csv.reader(io.StringIO(data_str)))
+    chunk_files = [f'{test_dir}frames_chunk_{i}.csv' for i in range(2)]
+    merged_file = f'{test_dir}frames_merged.csv'
+    try:
+        for chunk_file, frames in zip(chunk_files, (['1'], ['11', '21'])):
+            with open(chunk_file, 'w', newline='') as of:
+                csv.writer(of).writerows(row for row in rows if not row or row[0] not in ('1', '11', '21') or row[0] in frames)
+        PDB._merge_mmpbsa_frame_out(chunk_files, merged_file)
+        with open(merged_file, newline='') as f:
+            merged_str = f.read()
+    finally:
+        for path in chunk_files + [merged_file]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    assert merged_str == data_str
+
+def _write_mmpbsa_dat(path, frame_rows):
+    '''write a mmpbsa.dat with the statistic of {frame_rows} {term: per-frame values} (as MMPBSA.py)'''
+    dash = '-' * 79
+    lines = [f'|Calculations performed using {len(next(iter(frame_rows.values())))} complex frames.', '']
+    for method in ('GENERALIZED BORN:', 'POISSON BOLTZMANN:'):
+        lines.extend([method, '', 'Differences (Complex - Receptor - Ligand):',
+                      'Energy Component            Average              Std. Dev.   Std. Err. of Mean', dash])
+        for term, values in frame_rows.items():
+            sd = np.std(values)
+            lines.append(f'{term:<21}{np.mean(values):>15.4f}{sd:>22.4f}{sd / np.sqrt(len(values)):>20.4f}')
+        lines.extend(['', dash, dash, ''])
+    with open(path, 'w') as of:
+        of.write(os.linesep.join(lines))
+
+def test_merge_mmpbsa_out():
+    '''test merging chunks gives the statistic of all frames. testing using chunks of different sizes made from known frames'''
+    test_dir = 'test/testfile_Class_PDB/mmpbsa_test/merge_test/'
+    rng = np.random.default_rng(0)
+    terms = ['VDWAALS', 'EEL', 'EGB', 'ESURF', 'DELTA TOTAL']
+    chunk_rows = [{term: rng.normal(-20.0, 5.0, n_frames) for term in terms} for n_frames in (3, 7, 5)]
+    os.makedirs(test_dir)
+    try:
+        chunk_files = []
+        for i, rows in enumerate(chunk_rows):
+            _write_mmpbsa_dat(f'{test_dir}chunk_{i}.dat', rows)
+            chunk_files.append(f'{test_dir}chunk_{i}.dat')
+        merged_dict = PDB.merge_mmpbsa_out(chunk_files)
+    finally:
+        shutil.rmtree(test_dir)
+
+    for term in terms:
+        all_frames = np.concatenate([rows[term] for rows in chunk_rows])
+        for k in ('gb', 'pb'):
+            assert merged_dict[k].loc[term, 'mean'] == pytest.approx(np.mean(all_frames), abs=1e-3)
+            assert merged_dict[k].loc[term, 'sd'] == pytest.approx(np.std(all_frames), abs=1e-3)
+            assert merged_dict[k].loc[term, 'sem'] == pytest.approx(np.std(all_frames) / np.sqrt(15), abs=1e-3)
+
+def test_run_mmpbsa_chunks_local(monkeypatch):
+    '''
+    test chunks run in a fresh dir for each call, only the results are kept and the -eo files are merged
+    (MMPBSA.py is replaced by a script that writes the frame range of its input)
+    '''
+    test_dir = 'test/testfile_Class_PDB/mmpbsa_test/chunk_test/'
+    os.makedirs(f'{test_dir}bin')
+    with open(f'{test_dir}bin/python2', 'w') as of:
+        of.write('''#!/bin/bash
+tr -d ' ' < mmpbsa.in | grep -oE '(start|end)frame=[0-9]+' | tr -d '\\n' > mmpbsa.dat
+printf 'GENERALIZED BORN:\\r\\nDELTA Energy Terms\\r\\nFrame #,DELTA TOTAL\\r\\n' > mmpbsa_frames.csv
+seq $(tr -d ' ' < mmpbsa.in | grep -oE '(start|end)frame=[0-9]+' | cut -d= -f2) | sed 's/$/,-1.0\\r/' >> mmpbsa_frames.csv
+touch _MMPBSA_intermediate.mdcrd
+''')
+    os.chmod(f'{test_dir}bin/python2', 0o755)
+    monkeypatch.setenv('PATH', f'{os.path.abspath(test_dir)}/bin:{os.environ["PATH"]}')
+    monkeypatch.setattr(Config, 'PC_cmd', 'env')
+    monkeypatch.setattr(Config, 'debug', 1)
+    monkeypatch.setattr(Config.Amber.MMPBSA, 'conf_in', {**Config.Amber.MMPBSA.conf_in, 'startframe': 1, 'endframe': 6, 'interval': 1})
+    try:
+        test_pdb = PDB('test/testfile_Class_PDB/KE07R7.pdb', wk_dir=test_dir)
+        first = test_pdb.run_mmpbsa_chunks('dr.prmtop', 'dl.prmtop', 'dc.prmtop', 'sc.prmtop', 'prod.mdcrd', 3, if_cluster_job=0)
+        second = test_pdb.run_mmpbsa_chunks('dr.prmtop', 'dl.prmtop', 'dc.prmtop', 'sc.prmtop', 'prod.mdcrd', 2, if_cluster_job=0,
+                                            energy_out_path=f'{test_dir}frames.csv')
+        frame_out_dict = PDB.extract_mmpbsa_frame_out(f'{test_dir}frames.csv')
+        first_results = [open(path).read() for path in first]
+        second_results = [open(path).read() for path in second]
+        left_in_temp = sorted(os.listdir(f'{test_dir}temp/'))
+    finally:
+        shutil.rmtree(test_dir)
+
+    assert first_results == ['startframe=1endframe=2', 'startframe=3endframe=4', 'startframe=5endframe=6']
+    assert second_results == ['startframe=1endframe=3', 'startframe=4endframe=6']
+    assert len(set(first) | set(second)) == 5
+    assert list(frame_out_dict['gb']['delta']['Frame #']) == [1, 2, 3, 4, 5, 6]
+    assert left_in_temp == sorted(os.path.basename(path) for path in first + second)
+
+def test_mmpbsa_frame_chunks():
+    '''test the frame range is split into chunks keeping the interval'''
+    conf_in = copy.deepcopy(Config.Amber.MMPBSA.conf_in)
+    Config.Amber.MMPBSA.conf_in.update({'startframe': 1, 'endframe': 10, 'interval': 2})
+    try:
+        assert PDB._get_mmpbsa_frame_chunks(2) == [(1, 5), (7, 9)]
+        assert PDB._get_mmpbsa_frame_chunks(10) == [(1, 1), (3, 3), (5, 5), (7, 7), (9, 9)]
+    finally:
+        Config.Amber.MMPBSA.conf_in = conf_in
+
 def test_get_mmpbsa_binding():
     '''test function works as expected'''
     ligand_mask = ':902'
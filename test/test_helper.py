@@ -1,6 +1,7 @@
 import os
 from subprocess import SubprocessError
 import pytest
+import numpy as np
 import helper
 
 DATA_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/data_dir/"
@@ -25,3 +26,11 @@ def test_check_complete_metric_run():
         ['EA323R', 'EB773R', 'GA171D', 'GB621D']]
     result = [helper.check_complete_metric_run(mutant, test_data_path) for mutant in test_mutants]
     assert result == [True, True, False, False]
+
+def test_block_average_and_convergence():
+    data = [1.0, 3.0, 1.0, 3.0, 2.0, 2.0, 2.0, 2.0]
+    assert np.allclose(helper.get_running_mean(data), [1.0, 2.0, 5/3, 2.0, 2.0, 2.0, 2.0, 2.0])
+    mean, sem = helper.get_block_average(data, n_blocks=4)
+    assert mean == 2.0
+    assert sem == 0.0
+    assert helper.get_converged_frame_number(data, tolerance=0.1) == 4
@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from Class_Conf import Config
+from wrapper import ScratchDir
+
+test_dir = 'test/testfile_Class_PDB/'
+
+
+def test_scratch_dir_unique_and_clean():
+    '''test each call get its own dir and it is removed on exit'''
+    Config.debug = 1
+
+    def use_scratch(i):
+        with ScratchDir('test', base_dir=test_dir) as scratch_dir:
+            with open(f'{scratch_dir}out.txt', 'w') as of:
+                of.write(str(i))
+            with open(f'{scratch_dir}out.txt') as f:
+                return scratch_dir, f.read()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(use_scratch, range(8)))
+
+    assert len(set(path for path, content in results)) == 8
+    assert [content for path, content in results] == [str(i) for i in range(8)]
+    assert not any(os.path.exists(path) for path, content in results)
+
+
+def test_scratch_dir_keep():
+    '''test the dir is kept with keep=True'''
+    with ScratchDir('test', base_dir=test_dir, keep=True) as scratch_dir:
+        pass
+    assert os.path.isdir(scratch_dir)
+    os.rmdir(scratch_dir)
@@ -2,6 +2,9 @@
 wappers and context manager defined for the program
 '''
 import os,sys
+import tempfile
+from shutil import rmtree
+from Class_Conf import Config
 
 
 # def blockprint(redirect=os.devnull):
@@ -39,3 +42,30 @@ class HiddenPrints:
         sys.stderr.close()
         sys.stdout = self._original_stdout
         sys.stderr = self._original_stderr
+
+class ScratchDir:
+    '''
+    ScratchDir(prefix='scratch', base_dir=None, keep=None)
+    -----
+    make a unique scratch dir for a call of an external tool and remove it on exit.
+    (so calls from parallel threads/processes in the same dir do not collide)
+    base_dir: where the dir is made (default: Config.SCRATCH_DIR or the system temp dir)
+              use a dir on the shared file system if a cluster job use it.
+    keep    : keep the dir on exit (default: Config.debug >= 2)
+    return the absolute path of the dir (ends with /)
+    '''
+    def __init__(self, prefix='scratch', base_dir=None, keep=None):
+        self.prefix=prefix
+        self.base_dir=base_dir if base_dir else (Config.SCRATCH_DIR or None)
+        self.keep=Config.debug >= 2 if keep is None else keep
+        self.path=None
+
+    def __enter__(self):
+        if self.base_dir:
+            os.makedirs(self.base_dir, exist_ok=True)
+        self.path = os.path.abspath(tempfile.mkdtemp(prefix=f'{self.prefix}_', dir=self.base_dir)) + '/'
+        return self.path
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.keep:
+            rmtree(self.path, ignore_errors=True)